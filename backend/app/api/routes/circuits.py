@@ -1,28 +1,1071 @@
-from fastapi import APIRouter
+import asyncio
+import importlib
+import json
+import math
+import uuid
+from collections.abc import AsyncIterator
+from datetime import datetime, timedelta, timezone
+from typing import Annotated, Any, Literal
 
-from app.models.circuit import CircuitGenerationResponse
+import anyio
+import yaml
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+from sqlmodel import Session, col, func, select
+
+from app import crud
+from app.api.deps import (
+    CurrentUser,
+    SessionDep,
+    get_current_active_superuser,
+    get_current_user,
+)
+from app.circuits.admission import (
+    AdmissionRejected,
+    admission_controller,
+    admission_controllers,
+)
+from app.circuits.analysis import CircuitAnalysisError, DCAnalysis
+from app.circuits.bom import BOM_MEDIA_TYPES, BOMCounter, write_csv, write_json
+from app.circuits.compiler import CompiledCircuit, compile_circuit
+from app.circuits.engines import EngineError, TextAIEngine
+from app.circuits.erc import Violation, erc_engine
+from app.circuits.formatters import (
+    FileFormatter,
+    SpiceFormatter,
+    SvgPreviewFormatter,
+)
+from app.circuits.formatters.svg import (
+    COORDINATE_QUANTUM,
+    MAX_QUANTUM,
+    MIN_QUANTUM,
+    THEMES,
+)
+from app.circuits.generation import GenerationError, StreamValidator, text_engines
+from app.circuits.hedging import generate_hedged
+from app.circuits.layout import (
+    PLACEMENTS,
+    Box,
+    Layout,
+    layout_cache,
+    layout_variant,
+)
+from app.circuits.live import CheckpointConflict, LiveSession, live_sessions
+from app.circuits.loader import CircuitYAMLError, load_circuit_yaml
+from app.circuits.preview import PreviewRenderer
+from app.circuits.render_cache import (
+    RenderedEntry,
+    layout_headers,
+    render_cache,
+    render_key,
+)
+from app.circuits.revisions import summarize_delta
+from app.circuits.similarity import similarity_index
+from app.circuits.timing import histograms, record_timings, span
+from app.circuits.usage import (
+    QuotaExceeded,
+    UsageKey,
+    attribute_usage,
+    usage_meter,
+)
+from app.core.db import engine
+from app.models import (
+    CircuitBOMRequest,
+    CircuitDefinition,
+    CircuitDefinitionCreate,
+    CircuitDefinitionCreated,
+    CircuitDefinitionDetail,
+    CircuitDefinitionsPublic,
+    CircuitDiff,
+    CircuitEngineStats,
+    CircuitEngineStatsPublic,
+    CircuitERCBatchRequest,
+    CircuitERCBatchResponse,
+    CircuitERCResult,
+    CircuitGenerationRequest,
+    CircuitGenerationResponse,
+    CircuitRevision,
+    CircuitRevisionDetail,
+    CircuitRevisionPublic,
+    CircuitRevisionsPublic,
+    CircuitSimilaritiesPublic,
+    CircuitSimilarity,
+    CircuitStageTiming,
+    CircuitStageTimingsPublic,
+    CircuitUsage,
+    CircuitUsagePublic,
+    CircuitValidationRequest,
+    CircuitValidationResponse,
+    DCNodeVoltage,
+    DCOperatingPoint,
+    DCSweep,
+    DCSweepPoint,
+    DCSweepRequest,
+    ERCViolation,
+    User,
+)
 
 router = APIRouter()
 
+RENDER_MEDIA_TYPES = {
+    "svg": "image/svg+xml",
+    "png": "image/png",
+    "pdf": "application/pdf",
+}
+
+EXPORT_FORMATTERS: dict[str, type[FileFormatter]] = {
+    "spice": SpiceFormatter,
+}
+
+
+def _compile_yaml(circuit_yaml: str) -> tuple[dict[str, Any], CompiledCircuit]:
+    try:
+        document = load_circuit_yaml(circuit_yaml)
+        return document, compile_circuit(document)
+    except CircuitYAMLError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+def _parse_viewport(viewport: str) -> Box:
+    try:
+        x, y, width, height = (float(v) for v in viewport.split(","))
+    except ValueError:
+        raise HTTPException(
+            status_code=400, detail="Invalid viewport: expected 'x,y,width,height'."
+        )
+    if not all(math.isfinite(v) for v in (x, y, width, height)):
+        raise HTTPException(
+            status_code=400, detail="Invalid viewport: values must be finite."
+        )
+    if width <= 0 or height <= 0:
+        raise HTTPException(
+            status_code=400, detail="Invalid viewport: width and height must be > 0."
+        )
+    return Box(x, y, x + width, y + height)
+
+
+def _convert_svg(svg: str, format: str, width: int | None, height: int | None) -> bytes:
+    # CairoSVG (と cairo) はオプションの依存関係
+    try:
+        cairosvg = importlib.import_module("cairosvg")
+    except (ImportError, OSError):
+        raise HTTPException(
+            status_code=501, detail=f"Rendering to '{format}' requires CairoSVG."
+        )
+    convert = cairosvg.svg2png if format == "png" else cairosvg.svg2pdf
+    with span("rasterize"):
+        data: bytes = convert(
+            bytestring=svg.encode("utf-8"), output_width=width, output_height=height
+        )
+    return data
+
+
+def _dc_analysis(definition: CircuitDefinition) -> DCAnalysis:
+    try:
+        return DCAnalysis(CompiledCircuit.from_dict(definition.compiled))
+    except CircuitAnalysisError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+def _layout(
+    session: Session,
+    definition: CircuitDefinition,
+    placement: str,
+    minimize_crossings: bool,
+) -> Layout:
+    """プロセス内のキャッシュ -> DBに保存したレイアウト -> 計算 の順に探す"""
+    return layout_cache.get_or_create(
+        (definition.definition_hash, layout_variant(placement, minimize_crossings)),
+        lambda: crud.get_or_create_circuit_layout(
+            session=session,
+            compiled=CompiledCircuit.from_dict(definition.compiled),
+            placement=placement,
+            minimize_crossings=minimize_crossings,
+        ),
+    )
+
+
+def _erc_violations(violations: list[Violation]) -> list[ERCViolation]:
+    return [ERCViolation.model_validate(v, from_attributes=True) for v in violations]
+
+
+def _erc_status(violations: list[ERCViolation]) -> str:
+    if any(v.severity == "error" for v in violations):
+        return "invalid"
+    return "valid"
+
+
+def _bom_response(counter: BOMCounter, format: str) -> StreamingResponse:
+    write = write_csv if format == "csv" else write_json
+    return StreamingResponse(write(counter.rows()), media_type=BOM_MEDIA_TYPES[format])
+
+
+def _check_bom_format(format: str) -> None:
+    if format not in BOM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: '{format}'.")
+
+
+def _get_definition(
+    session: Session, current_user: User, id: uuid.UUID
+) -> CircuitDefinition:
+    definition = session.get(CircuitDefinition, id)
+    if not definition:
+        raise HTTPException(status_code=404, detail="Circuit definition not found.")
+    if not current_user.is_superuser and (definition.owner_id != current_user.id):
+        raise HTTPException(status_code=400, detail="Not enough permissions")
+    return definition
+
+
+def _select_engines() -> tuple[TextAIEngine, TextAIEngine | None]:
+    """生成に使うエンジンと、ヘッジに使う2つ目のエンジン"""
+    engines = list(text_engines.values())
+    if not engines:
+        raise HTTPException(status_code=503, detail="No text AI engine is configured.")
+    return engines[0], (engines[1] if len(engines) > 1 else None)
+
+
+async def _admit_generation(
+    session: Session, user: User, engine: TextAIEngine
+) -> UsageKey:
+    """ユーザーの1日の上限を確かめて生成を1回数える (スーパーユーザーには上限なし)"""
+
+    def load(user_id: uuid.UUID, since: datetime) -> tuple[int, int]:
+        return crud.get_user_usage_since(session=session, user_id=user_id, since=since)
+
+    try:
+        return await run_in_threadpool(
+            usage_meter.admit, user.id, engine.name, load, not user.is_superuser
+        )
+    except QuotaExceeded as e:
+        raise _generation_error(e)
+
+
+def _failed_generation(e: Exception, admitted: UsageKey) -> HTTPException:
+    """
+    生成の失敗を HTTPException にする
+
+    エンジンが受け付けなかった (AdmissionRejected)・失敗した (EngineError) 生成は
+    1日の生成回数に数えない。
+    """
+    if isinstance(e, AdmissionRejected | EngineError):
+        usage_meter.refund(admitted)
+    return _generation_error(e)
+
+
+def _generation_error(e: Exception) -> HTTPException:
+    if isinstance(e, AdmissionRejected):
+        return HTTPException(
+            status_code=e.status_code, detail=str(e), headers=e.headers
+        )
+    if isinstance(e, GenerationError):
+        return HTTPException(status_code=e.status_code, detail=str(e))
+    return HTTPException(status_code=502, detail=str(e))
+
 
 @router.post("/generate", response_model=CircuitGenerationResponse)
-def generate_circuit() -> CircuitGenerationResponse:
+async def generate_circuit(
+    session: SessionDep,
+    current_user: CurrentUser,
+    body: CircuitGenerationRequest,
+    response: Response,
+) -> CircuitGenerationResponse:
     """
     ユーザーからの文章(prompt)を受け取り、回路データを生成するエンドポイント
+
+    保存済み回路のうち文章に近いものを例としてエンジンに渡す。
+    2つ目のエンジンが設定されていれば、1つ目が遅いときにヘッジする。
+    処理段階ごとの所要時間を `Server-Timing` ヘッダーで返す。
     """
+    engine, secondary = _select_engines()
+    admitted = await _admit_generation(session, current_user, engine)
+    owner_id = None if current_user.is_superuser else current_user.id
+    examples = await run_in_threadpool(engine.examples, session, body.prompt, owner_id)
+    with record_timings() as timings, attribute_usage(current_user.id):
+        try:
+            generated = await generate_hedged(engine, secondary, body.prompt, examples)
+        except (AdmissionRejected, EngineError, GenerationError) as e:
+            raise _failed_generation(e, admitted)
+    if timings.durations:
+        response.headers["Server-Timing"] = timings.server_timing()
+    return CircuitGenerationResponse(
+        message="回路データを生成しました",
+        yaml_data=generated.circuit_yaml,
+        repairs=generated.repairs,
+        timings=timings.milliseconds() if body.timings else None,
+    )
 
-    # TODO: ここで実際にAIを呼び出し、YAMLを生成する処理を実装する
 
-    # 今は、受け取った文章をそのまま返すダミーの応答を作成
-    dummy_yaml = """
-components:
-  - id: sample
-    type: Resistor
-connections:
-  - from: nodeA
-    to: nodeB
-"""
-    return CircuitGenerationResponse(
-        message="回路データの生成に成功しました（これはダミーです）",
-        yaml_data=dummy_yaml,
+@router.post("/generate/stream")
+async def generate_circuit_stream(
+    session: SessionDep, current_user: CurrentUser, body: CircuitGenerationRequest
+) -> StreamingResponse:
+    """
+    回路を生成しながら、届いた部品と接続の仮の回路図を送るエンドポイント
+
+    応答は1行に1つのJSON (NDJSON) で、仮の回路図のフレーム (最初は "snapshot"、
+    以降は変わった要素だけの "patch") を送り、最後に完成した回路図のフレームと
+    `/generate` と同じ内容の "result" を送る。生成に失敗した場合は最後に
+    `{"type": "error", "status_code", "detail"}` を送る。
+    """
+    engine, secondary = _select_engines()
+    admitted = await _admit_generation(session, current_user, engine)
+    owner_id = None if current_user.is_superuser else current_user.id
+    examples = await run_in_threadpool(engine.examples, session, body.prompt, owner_id)
+    renderer = PreviewRenderer()
+    frames: asyncio.Queue[dict[str, Any] | None] = asyncio.Queue()
+
+    def on_progress(validator: StreamValidator) -> None:
+        # 描画はスレッドで行い、前のフレームを描いている間は間引く
+        renderer.submit(validator, frames.put_nowait)
+
+    async def generate() -> None:
+        try:
+            with record_timings() as timings, attribute_usage(current_user.id):
+                generated = await generate_hedged(
+                    engine, secondary, body.prompt, examples, on_progress=on_progress
+                )
+                await renderer.drain()
+                frame = await run_in_threadpool(renderer.finish, generated.compiled)
+            frames.put_nowait(frame)
+            response = CircuitGenerationResponse(
+                message="回路データを生成しました",
+                yaml_data=generated.circuit_yaml,
+                repairs=generated.repairs,
+                timings=timings.milliseconds() if body.timings else None,
+            )
+            frames.put_nowait({"type": "result", **response.model_dump()})
+        except (AdmissionRejected, EngineError, GenerationError) as e:
+            await renderer.drain()
+            error = _failed_generation(e, admitted)
+            frames.put_nowait(
+                {
+                    "type": "error",
+                    "status_code": error.status_code,
+                    "detail": error.detail,
+                }
+            )
+        finally:
+            frames.put_nowait(None)
+
+    async def stream() -> AsyncIterator[str]:
+        task = asyncio.create_task(generate())
+        try:
+            while (frame := await frames.get()) is not None:
+                yield json.dumps(frame, ensure_ascii=False) + "\n"
+        finally:
+            # クライアントが切断したら生成も取り消す
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@router.get(
+    "/engines",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=CircuitEngineStatsPublic,
+)
+def read_engine_stats() -> CircuitEngineStatsPublic:
+    """
+    AIエンジンごとの受け付けの状況 (実行中・待ち行列の件数、待ち時間)
+
+    値はこのワーカープロセスのもの。
+    """
+    return CircuitEngineStatsPublic(
+        data=[
+            CircuitEngineStats(name=name, **admission_controller(name).metrics())
+            for name in dict.fromkeys([*text_engines, *admission_controllers])
+        ]
+    )
+
+
+@router.get(
+    "/usage",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=CircuitUsagePublic,
+)
+def read_engine_usage(
+    session: SessionDep,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    window: Literal["minute", "hour", "day"] = "hour",
+    user_id: uuid.UUID | None = None,
+    engine: str | None = None,
+) -> CircuitUsagePublic:
+    """
+    AIエンジンの使用量を、区間 (`window`)・ユーザー・エンジンごとに集計して返す
+
+    期間は `start` から `end` まで (既定は直近24時間)。このワーカーでまだ書き出して
+    いない使用量を先に書き出すが、ほかのワーカーの分は次の書き出しまで反映されない。
+    """
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(days=1)
+    usage_meter.flush(session)
+    rows = crud.get_circuit_engine_usage(
+        session=session,
+        start=start,
+        end=end,
+        window=window,
+        user_id=user_id,
+        engine=engine,
+    )
+    data = [
+        CircuitUsage(
+            **{k: v for k, v in row.items() if k != "latency_total"},
+            latency_avg=row["latency_total"] / row["calls"] if row["calls"] else 0.0,
+        )
+        for row in rows
+    ]
+    return CircuitUsagePublic(data=data, count=len(data))
+
+
+@router.get(
+    "/timings",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=CircuitStageTimingsPublic,
+)
+def read_stage_timings() -> CircuitStageTimingsPublic:
+    """
+    回路の処理段階ごとの所要時間の分布 (件数、合計、分位数 [秒])
+
+    入れ子になった段階の時間は含めない。値はこのワーカープロセスのもの。
+    """
+    return CircuitStageTimingsPublic(
+        data=[CircuitStageTiming(**metrics) for metrics in histograms.metrics()]
+    )
+
+
+@router.post("/validate", response_model=CircuitValidationResponse)
+def validate_circuit(body: CircuitValidationRequest) -> CircuitValidationResponse:
+    """
+    回路定義YAMLを検証するエンドポイント
+    """
+    _, compiled = _compile_yaml(body.circuit_yaml)
+    if not body.erc:
+        return CircuitValidationResponse(
+            status="valid", message="Circuit YAML is valid."
+        )
+    violations = _erc_violations(erc_engine.check(compiled))
+    if _erc_status(violations) == "invalid":
+        return CircuitValidationResponse(
+            status="invalid",
+            message="Circuit violates electrical rules.",
+            violations=violations,
+        )
+    return CircuitValidationResponse(
+        status="valid", message="Circuit YAML is valid.", violations=violations
+    )
+
+
+@router.post("/validate/batch", response_model=CircuitERCBatchResponse)
+def validate_circuit_definitions(
+    session: SessionDep,
+    current_user: CurrentUser,
+    body: CircuitERCBatchRequest,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+) -> Any:
+    """
+    保存済みの回路定義に電気的ルールチェックを一括で行うエンドポイント
+
+    保存済みのコンパイル結果を使うためYAMLは再パースせず、キャッシュにない回路は
+    まとめて1回で評価する。`circuit_ids` を省略した場合は、参照できる回路を
+    新しい順に `skip` と `limit` で区切って評価し、`count` は全体の件数を返す。
+    """
+    statement = select(CircuitDefinition)
+    if not current_user.is_superuser:
+        statement = statement.where(CircuitDefinition.owner_id == current_user.id)
+    if body.circuit_ids is not None:
+        statement = statement.where(col(CircuitDefinition.id).in_(body.circuit_ids))
+        definitions = session.exec(statement).all()
+        found = {d.id for d in definitions}
+        missing = [str(i) for i in body.circuit_ids if i not in found]
+        if missing:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Circuit definition not found: {', '.join(missing)}",
+            )
+        count = len(definitions)
+    else:
+        count_statement = select(func.count()).select_from(statement.subquery())
+        count = session.exec(count_statement).one()
+        definitions = session.exec(
+            statement.order_by(col(CircuitDefinition.created_at).desc())
+            .offset(skip)
+            .limit(limit)
+        ).all()
+
+    results = erc_engine.check_many(
+        [CompiledCircuit.from_dict(d.compiled) for d in definitions]
+    )
+    data = []
+    for definition, result in zip(definitions, results, strict=True):
+        violations = _erc_violations(result)
+        data.append(
+            CircuitERCResult(
+                circuit_id=definition.id,
+                status=_erc_status(violations),
+                violations=violations,
+            )
+        )
+    return CircuitERCBatchResponse(data=data, count=count)
+
+
+@router.post("/definitions", response_model=CircuitDefinitionCreated, status_code=201)
+def create_circuit_definition(
+    *,
+    session: SessionDep,
+    current_user: CurrentUser,
+    definition_in: CircuitDefinitionCreate,
+) -> Any:
+    """
+    回路定義を保存し、`circuit_id` を返すエンドポイント
+    """
+    document, compiled = _compile_yaml(definition_in.circuit_yaml)
+    definition = crud.create_circuit_definition(
+        session=session,
+        circuit_yaml=definition_in.circuit_yaml,
+        document=document,
+        compiled=compiled,
+        owner_id=current_user.id,
+    )
+    return CircuitDefinitionCreated(circuit_id=definition.id)
+
+
+@router.get("/definitions", response_model=CircuitDefinitionsPublic)
+def read_circuit_definitions(
+    session: SessionDep,
+    current_user: CurrentUser,
+    component_type: str | None = None,
+    min_components: int | None = None,
+    max_components: int | None = None,
+    skip: int = 0,
+    limit: int = 100,
+) -> Any:
+    """
+    保存済みの回路定義を検索するエンドポイント
+
+    部品の種類と部品数による絞り込みは、JSONBの生成列とGINインデックスを使って
+    Postgres内で完結する。
+    """
+    statement = select(CircuitDefinition)
+    if not current_user.is_superuser:
+        statement = statement.where(CircuitDefinition.owner_id == current_user.id)
+    if component_type is not None:
+        statement = statement.where(
+            col(CircuitDefinition.component_types).contains([component_type])
+        )
+    if min_components is not None:
+        statement = statement.where(
+            col(CircuitDefinition.component_count) >= min_components
+        )
+    if max_components is not None:
+        statement = statement.where(
+            col(CircuitDefinition.component_count) <= max_components
+        )
+
+    count_statement = select(func.count()).select_from(statement.subquery())
+    count = session.exec(count_statement).one()
+    definitions = session.exec(
+        statement.order_by(col(CircuitDefinition.created_at).desc())
+        .offset(skip)
+        .limit(limit)
+    ).all()
+    return CircuitDefinitionsPublic(data=definitions, count=count)
+
+
+@router.get("/definitions/{id}", response_model=CircuitDefinitionDetail)
+def read_circuit_definition(
+    session: SessionDep, current_user: CurrentUser, id: uuid.UUID
+) -> Any:
+    """
+    回路定義を取得するエンドポイント
+    """
+    return _get_definition(session, current_user, id)
+
+
+@router.put("/definitions/{id}", response_model=CircuitDefinitionDetail)
+def update_circuit_definition(
+    *,
+    session: SessionDep,
+    current_user: CurrentUser,
+    id: uuid.UUID,
+    definition_in: CircuitDefinitionCreate,
+) -> Any:
+    """
+    回路定義を更新し、新しいリビジョンとして差分を記録するエンドポイント
+    """
+    definition = _get_definition(session, current_user, id)
+    document, compiled = _compile_yaml(definition_in.circuit_yaml)
+    return crud.update_circuit_definition(
+        session=session,
+        db_definition=definition,
+        circuit_yaml=definition_in.circuit_yaml,
+        document=document,
+        compiled=compiled,
+    )
+
+
+@router.get("/definitions/{id}/revisions", response_model=CircuitRevisionsPublic)
+def read_circuit_revisions(
+    session: SessionDep, current_user: CurrentUser, id: uuid.UUID
+) -> Any:
+    """
+    回路定義のリビジョン一覧を新しい順に返すエンドポイント
+    """
+    _get_definition(session, current_user, id)
+    revisions = session.exec(
+        select(CircuitRevision)
+        .where(CircuitRevision.definition_id == id)
+        .order_by(col(CircuitRevision.number).desc())
+    ).all()
+    data = [
+        CircuitRevisionPublic(
+            number=r.number,
+            definition_hash=r.definition_hash,
+            is_snapshot=r.snapshot is not None,
+            created_at=r.created_at,
+        )
+        for r in revisions
+    ]
+    return CircuitRevisionsPublic(data=data, count=len(data))
+
+
+@router.get(
+    "/definitions/{id}/revisions/{number}", response_model=CircuitRevisionDetail
+)
+def read_circuit_revision(
+    session: SessionDep, current_user: CurrentUser, id: uuid.UUID, number: int
+) -> Any:
+    """
+    指定リビジョンの回路定義を、直前のスナップショットと差分から復元して返す
+    """
+    definition = _get_definition(session, current_user, id)
+    if number == definition.revision:
+        return CircuitRevisionDetail(
+            number=number,
+            definition_hash=definition.definition_hash,
+            circuit_yaml=definition.circuit_yaml,
+        )
+    revision = session.exec(
+        select(CircuitRevision).where(
+            CircuitRevision.definition_id == id, CircuitRevision.number == number
+        )
+    ).first()
+    document = crud.get_circuit_revision_document(
+        session=session, definition_id=id, number=number
+    )
+    if revision is None or document is None:
+        raise HTTPException(status_code=404, detail="Circuit revision not found.")
+    return CircuitRevisionDetail(
+        number=number,
+        definition_hash=revision.definition_hash,
+        circuit_yaml=yaml.safe_dump(document, sort_keys=False, allow_unicode=True),
+    )
+
+
+@router.get("/definitions/{id}/diff", response_model=CircuitDiff)
+def read_circuit_diff(
+    session: SessionDep,
+    current_user: CurrentUser,
+    id: uuid.UUID,
+    from_revision: int,
+    to_revision: int | None = None,
+) -> Any:
+    """
+    2つのリビジョン間の構造的な差分 (部品・接続の追加/削除/変更) を返すエンドポイント
+
+    `to_revision` を省略すると最新リビジョンとの差分になる。保存済みの差分を
+    合成するだけなので、回路全体を再パースしない。
+    """
+    definition = _get_definition(session, current_user, id)
+    if to_revision is None:
+        to_revision = definition.revision
+    for number in (from_revision, to_revision):
+        if not 1 <= number <= definition.revision:
+            raise HTTPException(status_code=404, detail="Circuit revision not found.")
+    delta = crud.get_circuit_revision_delta(
+        session=session,
+        definition_id=id,
+        from_revision=from_revision,
+        to_revision=to_revision,
+    )
+    return CircuitDiff(
+        from_revision=from_revision, to_revision=to_revision, **summarize_delta(delta)
+    )
+
+
+@router.get("/definitions/{id}/similar", response_model=CircuitSimilaritiesPublic)
+def read_similar_circuit_definitions(
+    session: SessionDep,
+    current_user: CurrentUser,
+    id: uuid.UUID,
+    k: int = Query(5, ge=1, le=100),
+) -> Any:
+    """
+    構造が似ている保存済み回路を返すエンドポイント
+
+    ネットリストのWLハッシュから作ったMinHashシグネチャをLSHで引くため、
+    保存件数が増えても全件比較にはならない。
+    """
+    definition = _get_definition(session, current_user, id)
+    owner_id = None if current_user.is_superuser else current_user.id
+    matches = similarity_index.similar(session, definition, k, owner_id=owner_id)
+
+    data = []
+    for circuit_id, similarity in matches:
+        match = session.get(CircuitDefinition, circuit_id)
+        if match is None:
+            similarity_index.discard(circuit_id)
+            continue
+        data.append(
+            CircuitSimilarity(
+                circuit_id=circuit_id, name=match.name, similarity=similarity
+            )
+        )
+    return CircuitSimilaritiesPublic(data=data)
+
+
+@router.get("/{circuit_id}/render")
+def render_circuit(
+    session: SessionDep,
+    current_user: CurrentUser,
+    circuit_id: uuid.UUID,
+    format: str = "svg",
+    width: int | None = None,
+    height: int | None = None,
+    viewport: str | None = None,
+    zoom: float = 1.0,
+    placement: str = "grid",
+    minimize_crossings: bool = False,
+    theme: str = "light",
+    quantum: float = Query(COORDINATE_QUANTUM, ge=MIN_QUANTUM, le=MAX_QUANTUM),
+    accept_encoding: Annotated[str | None, Header()] = None,
+) -> Response:
+    """
+    保存済みの回路定義から回路図を生成するエンドポイント
+
+    `viewport` ("x,y,width,height") を指定すると、その範囲に掛かる要素だけを返す。
+    `zoom` が小さいときはモジュールを枠だけにし、ラベルを省略する。
+    位置未指定の部品は格子に詰めて配置し、`placement=force` のときだけ
+    力指向レイアウトを使う。`minimize_crossings` を指定すると配線の交差を減らし、
+    前後の交差数を `X-Layout-Crossings-Before`/`-After` ヘッダーで返す。
+    レイアウトは定義ハッシュごとに保存して使い回し、`theme` は描画時にだけ適用する。
+    座標は `quantum` の倍数に丸めて出力する。
+    描画結果は gzip/brotli で圧縮した版と共にキャッシュし、`Accept-Encoding` に
+    合わせて圧縮済みの版をそのまま返す。
+    このリクエストで計算した処理段階の所要時間を `Server-Timing` ヘッダーで返す。
+    """
+    if format not in RENDER_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: '{format}'.")
+    if not (math.isfinite(zoom) and zoom > 0):
+        raise HTTPException(
+            status_code=400, detail="zoom must be a finite number greater than 0."
+        )
+    if placement not in PLACEMENTS:
+        raise HTTPException(
+            status_code=400, detail=f"Unsupported placement: '{placement}'."
+        )
+    if theme not in THEMES:
+        raise HTTPException(status_code=400, detail=f"Unsupported theme: '{theme}'.")
+    view = _parse_viewport(viewport) if viewport is not None else None
+    formatter = SvgPreviewFormatter(
+        viewport=view, zoom=zoom, theme=theme, quantum=quantum
+    )
+    definition = _get_definition(session, current_user, circuit_id)
+
+    def render() -> RenderedEntry:
+        layout = _layout(session, definition, placement, minimize_crossings)
+        headers = layout_headers(layout)
+        with span("svg"):
+            svg = "".join(formatter.render(layout))
+        body = (
+            svg.encode("utf-8")
+            if format == "svg"
+            else _convert_svg(svg, format, width, height)
+        )
+        return RenderedEntry.create(RENDER_MEDIA_TYPES[format], body, headers)
+
+    key = render_key(
+        definition.definition_hash,
+        layout_variant(placement, minimize_crossings),
+        format,
+        width,
+        height,
+        view.as_tuple() if view is not None else None,
+        zoom,
+        theme,
+        quantum,
+    )
+    with record_timings() as timings:
+        entry = render_cache.get_or_create(key, render)
+    encoding, body = entry.negotiate(accept_encoding)
+    headers = {**entry.headers, "Vary": "Accept-Encoding"}
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    if timings.durations:
+        headers["Server-Timing"] = timings.server_timing()
+    return Response(body, media_type=entry.media_type, headers=headers)
+
+
+def _live_document(circuit_id: uuid.UUID, token: str) -> tuple[dict[str, Any], int]:
+    with Session(engine) as session:
+        user = get_current_user(session, token)
+        definition = _get_definition(session, user, circuit_id)
+        return load_circuit_yaml(definition.circuit_yaml), definition.revision
+
+
+def _save_live_document(
+    circuit_id: uuid.UUID,
+    circuit_yaml: str,
+    document: dict[str, Any],
+    compiled: CompiledCircuit,
+    revision: int,
+) -> int:
+    with Session(engine) as session:
+        definition = session.exec(
+            select(CircuitDefinition)
+            .where(CircuitDefinition.id == circuit_id)
+            .with_for_update()
+        ).first()
+        if definition is None:
+            return revision
+        if definition.revision != revision:
+            # セッションが読み込んだ後に REST や別のワーカーで保存された
+            raise CheckpointConflict(
+                load_circuit_yaml(definition.circuit_yaml), definition.revision
+            )
+        return crud.update_circuit_definition(
+            session=session,
+            db_definition=definition,
+            circuit_yaml=circuit_yaml,
+            document=document,
+            compiled=compiled,
+        ).revision
+
+
+async def _live_session(
+    circuit_id: uuid.UUID, document: dict[str, Any], revision: int
+) -> LiveSession:
+    """回路のライブ編集のセッションを返す。無い (閉じている) 場合は開く"""
+    live = live_sessions.get(circuit_id)
+    if live is None or live.closed:
+
+        async def checkpoint(
+            circuit_yaml: str,
+            document: dict[str, Any],
+            compiled: CompiledCircuit,
+            revision: int,
+        ) -> int:
+            return await run_in_threadpool(
+                _save_live_document,
+                circuit_id,
+                circuit_yaml,
+                document,
+                compiled,
+                revision,
+            )
+
+        created = await run_in_threadpool(
+            LiveSession, document, checkpoint, None, revision
+        )
+        # 構築を待つ間に同じ回路のセッションができていれば、そちらを使う
+        live = live_sessions.get(circuit_id)
+        if live is None or live.closed:
+            live = live_sessions[circuit_id] = created
+    # 開いていたセッションより新しいリビジョンが保存されていれば読み込み直す
+    await live.sync(document, revision)
+    return live
+
+
+@router.websocket("/{circuit_id}/live")
+async def live_edit_circuit(
+    websocket: WebSocket, circuit_id: uuid.UUID, token: str = ""
+) -> None:
+    """
+    回路をライブ編集するWebSocketエンドポイント
+
+    ブラウザのWebSocketはヘッダーを付けられないので、アクセストークンは
+    `token` クエリパラメータで受け取る。接続すると回路図全体 (snapshot) を送り、
+    以降は誰かの編集操作ごとに、変わった要素だけのパッチを全員に送る。
+    回路定義はまとめて保存し、リビジョンとして記録する。保存の前に読み込んだ
+    リビジョンと比べ、その間に別の所で更新されていれば未保存の編集を捨てて
+    読み込み直す (全員にエラーと回路図全体を送る)。
+    """
+    accepted = False
+    while True:
+        try:
+            document, revision = await run_in_threadpool(
+                _live_document, circuit_id, token
+            )
+            live = await _live_session(circuit_id, document, revision)
+        except HTTPException as e:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=e.detail)
+            return
+        except CircuitYAMLError as e:
+            await websocket.close(code=status.WS_1011_INTERNAL_ERROR, reason=str(e))
+            return
+        if not accepted:
+            await websocket.accept()
+            accepted = True
+        # 読み込む間に最後のクライアントが抜けて閉じたセッションには参加できないので、
+        # 保存された定義を読み直して開き直す
+        if await live.join(websocket):
+            break
+    try:
+        while True:
+            try:
+                operation = json.loads(await websocket.receive_text())
+            except json.JSONDecodeError:
+                operation = None
+            if not isinstance(operation, dict):
+                await websocket.send_json(
+                    {"type": "error", "message": "Expected a JSON object."}
+                )
+                continue
+            await live.edit(websocket, operation)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # サーバーの停止などで取り消されても、最後の保存は行う
+        with anyio.CancelScope(shield=True):
+            try:
+                await live.leave(websocket)
+            finally:
+                if live.closed and live_sessions.get(circuit_id) is live:
+                    del live_sessions[circuit_id]
+
+
+@router.get("/{circuit_id}/export")
+def export_circuit(
+    session: SessionDep,
+    current_user: CurrentUser,
+    circuit_id: uuid.UUID,
+    format: str = "spice",
+) -> StreamingResponse:
+    """
+    保存済みの回路定義を他のツール向けのファイル形式で出力するエンドポイント
+    """
+    formatter_class = EXPORT_FORMATTERS.get(format)
+    if formatter_class is None:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: '{format}'.")
+    formatter = formatter_class()
+    definition = _get_definition(session, current_user, circuit_id)
+    return StreamingResponse(
+        formatter.format(CompiledCircuit.from_dict(definition.compiled)),
+        media_type=formatter.media_type,
+        headers={
+            "Content-Disposition": (
+                f'attachment; filename="{circuit_id}.{formatter.extension}"'
+            )
+        },
+    )
+
+
+@router.post("/bom")
+def read_bulk_bill_of_materials(
+    session: SessionDep,
+    current_user: CurrentUser,
+    body: CircuitBOMRequest,
+    format: str = "csv",
+) -> StreamingResponse:
+    """
+    複数の回路 (基板ごとの枚数付き) の部品表をまとめて返すエンドポイント
+
+    回路のコンパイル結果は1つずつ読み込んで集計し、保持するのは行ごとの個数だけにする。
+    """
+    _check_bom_format(format)
+    counter = BOMCounter()
+    for item in body.items:
+        definition = _get_definition(session, current_user, item.circuit_id)
+        counter.add(definition.compiled, item.quantity)
+        session.expunge(definition)
+    return _bom_response(counter, format)
+
+
+@router.get("/{circuit_id}/bom")
+def read_bill_of_materials(
+    session: SessionDep,
+    current_user: CurrentUser,
+    circuit_id: uuid.UUID,
+    format: str = "csv",
+) -> StreamingResponse:
+    """
+    回路の部品表を (種類, 値, パッケージ) ごとの個数として返すエンドポイント
+    """
+    _check_bom_format(format)
+    counter = BOMCounter()
+    counter.add(_get_definition(session, current_user, circuit_id).compiled)
+    return _bom_response(counter, format)
+
+
+@router.get("/{circuit_id}/dc", response_model=DCOperatingPoint)
+def read_dc_operating_point(
+    session: SessionDep, current_user: CurrentUser, circuit_id: uuid.UUID
+) -> Any:
+    """
+    回路のDC動作点 (各ネットの電圧と各素子の電流) を求めるエンドポイント
+    """
+    definition = _get_definition(session, current_user, circuit_id)
+    analysis = _dc_analysis(definition)
+    try:
+        point = analysis.solve()
+    except CircuitAnalysisError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return DCOperatingPoint(
+        ground_net=point.ground_net,
+        node_voltages=[
+            DCNodeVoltage(
+                net=net.id,
+                pins=[f"{p.component_id}.{p.name}" for p in net.pins],
+                voltage=point.node_voltages[net.id],
+            )
+            for net in analysis.circuit.nets
+        ],
+        branch_currents=point.branch_currents,
+        warnings=point.warnings,
+    )
+
+
+@router.post("/{circuit_id}/dc/sweep", response_model=DCSweep)
+def sweep_dc_operating_point(
+    session: SessionDep,
+    current_user: CurrentUser,
+    circuit_id: uuid.UUID,
+    body: DCSweepRequest,
+) -> Any:
+    """
+    1つの部品の値を変えながらDC動作点を求めるエンドポイント
+
+    電源の値のスイープは同じLU分解を使い回し、抵抗値のスイープは分解済みの
+    行列への低ランク更新で解くため、点ごとに行列を分解し直さない。
+    """
+    definition = _get_definition(session, current_user, circuit_id)
+    analysis = _dc_analysis(definition)
+    try:
+        points = analysis.sweep(body.component_id, body.values)
+    except CircuitAnalysisError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return DCSweep(
+        component_id=body.component_id,
+        ground_net=analysis.ground_net,
+        points=[
+            DCSweepPoint(
+                value=value,
+                node_voltages=point.node_voltages,
+                branch_currents=point.branch_currents,
+            )
+            for value, point in zip(body.values, points, strict=True)
+        ],
+        warnings=analysis.warnings,
     )
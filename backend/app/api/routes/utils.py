@@ -1,8 +1,9 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Response
 from pydantic.networks import EmailStr
 
 from app.api.deps import get_current_active_superuser
-from app.models import Message
+from app.circuits.warmup import warmup
+from app.models import CircuitWarmupStatus, Message
 from app.utils import generate_test_email, send_email
 
 router = APIRouter(prefix="/utils", tags=["utils"])
@@ -29,3 +30,19 @@ def test_email(email_to: EmailStr) -> Message:
 @router.get("/health-check/")
 async def health_check() -> bool:
     return True
+
+
+@router.get("/ready/", responses={503: {"model": CircuitWarmupStatus}})
+async def readiness(response: Response) -> CircuitWarmupStatus:
+    """
+    Readiness: 503 until the start-up warm-up of example circuits has finished.
+    """
+    if not warmup.ready:
+        response.status_code = 503
+    return CircuitWarmupStatus(
+        ready=warmup.ready,
+        total=warmup.total,
+        done=warmup.done,
+        failed=warmup.failed,
+        seconds=warmup.seconds,
+    )
@@ -0,0 +1,200 @@
+"""
+AIエンジン呼び出しの流量制御
+
+エンジンごとに同時実行数の上限、上限の待ち行列 (待ち時間の上限つき)、
+トークンバケットによるリクエストレートの上限を設ける。余裕が無いときは
+プロバイダーのレート制限に当たってリトライが殺到する前に、`Retry-After`
+つきの 429 (レート超過) か 503 (待ち行列が一杯・待ち時間切れ) ですぐに断る。
+状態はプロセスごとのメモリ上にあるので、上限はワーカーごとの値になる。
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Any
+
+from app.core.config import settings
+
+# 待ち時間の分位数を計算する直近の件数
+WAIT_SAMPLES = 1024
+# 1件の処理時間の指数移動平均の重み (Retry-After の見積もりに使う)
+SERVICE_TIME_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """エンジンに余裕が無く、リクエストを受け付けない場合の例外"""
+
+    def __init__(self, message: str, status_code: int, retry_after: float) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> dict[str, str]:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+class TokenBucket:
+    """`rate` 個/秒で補充され、最大 `burst` 個まで貯まるトークンバケット"""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate must be positive and burst at least 1")
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def take(self, now: float | None = None) -> float:
+        """トークンを1つ取る。取れなければ次のトークンまでの秒数を返す (取れたら0)"""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """
+    1つのエンジンへの呼び出しの受け付け
+
+    空きが無ければ到着順に待たせ、空いた枠は待っている先頭のリクエストに
+    そのまま渡す。イベントループ1つから使う前提で、ロックは使わない。
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_queue: int,
+        queue_timeout: float,
+        rate: float,
+        burst: int,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.bucket = TokenBucket(rate, burst)
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.service_time = 0.0
+        self._waiters: deque[asyncio.Future[None]] = deque()
+        self._waits: deque[float] = deque(maxlen=WAIT_SAMPLES)
+
+    @classmethod
+    def from_settings(cls) -> "AdmissionController":
+        return cls(
+            max_concurrency=settings.CIRCUIT_ENGINE_MAX_CONCURRENCY,
+            max_queue=settings.CIRCUIT_ENGINE_MAX_QUEUE,
+            queue_timeout=settings.CIRCUIT_ENGINE_QUEUE_TIMEOUT,
+            rate=settings.CIRCUIT_ENGINE_RATE,
+            burst=settings.CIRCUIT_ENGINE_BURST,
+        )
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _retry_after(self) -> float:
+        # 待ち行列が捌けるまでのおおよその時間
+        rounds = (self.queued + 1) / self.max_concurrency
+        return max(1.0, self.service_time * rounds)
+
+    def _reject(self, message: str, status_code: int, retry_after: float) -> None:
+        self.rejected += 1
+        raise AdmissionRejected(message, status_code, retry_after)
+
+    async def acquire(self, wait: bool = True) -> None:
+        """
+        実行枠を1つ取る。空きが無ければ待つ (`wait` が False ならすぐに断る)
+
+        断る場合は `AdmissionRejected` を送出する。
+        """
+        if self.active >= self.max_concurrency and (
+            not wait or self.queued >= self.max_queue
+        ):
+            self._reject("AI engine is busy.", 503, self._retry_after())
+        retry_after = self.bucket.take()
+        if retry_after:
+            self._reject("AI engine rate limit exceeded.", 429, retry_after)
+
+        started = time.monotonic()
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, self.queue_timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if waiter.done() and not waiter.cancelled():
+                    # 枠を渡された直後に諦めたので、次に回す
+                    self.release()
+                else:
+                    self._waiters.remove(waiter)
+                if isinstance(e, asyncio.TimeoutError):
+                    self.timed_out += 1
+                    self._reject(
+                        "Timed out waiting for the AI engine.",
+                        503,
+                        self._retry_after(),
+                    )
+                raise
+        self.admitted += 1
+        self._waits.append(time.monotonic() - started)
+
+    def release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # 枠は数え直さずにそのまま渡す
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def admit(self, wait: bool = True) -> AsyncIterator[None]:
+        await self.acquire(wait)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self.service_time += SERVICE_TIME_ALPHA * (elapsed - self.service_time)
+            self.release()
+
+    def metrics(self) -> dict[str, Any]:
+        waits = sorted(self._waits)
+
+        def quantile(q: float) -> float:
+            return waits[min(len(waits) - 1, int(q * len(waits)))] if waits else 0.0
+
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_p50": quantile(0.5),
+            "wait_p95": quantile(0.95),
+            "wait_max": waits[-1] if waits else 0.0,
+        }
+
+
+# エンジン名 -> 受け付け (最初に使うときに設定から作る)
+admission_controllers: dict[str, AdmissionController] = {}
+
+
+def admission_controller(name: str) -> AdmissionController:
+    controller = admission_controllers.get(name)
+    if controller is None:
+        controller = admission_controllers[name] = AdmissionController.from_settings()
+    return controller
@@ -0,0 +1,384 @@
+"""
+DC動作点解析 (修正節点解析, MNA)
+
+ネットを節点、電圧源とインダクタを枝電流の未知数とした疎行列を組み立て、
+SciPy の SuperLU で解く。ダイオード/LEDは「順方向電圧 + オン抵抗」と
+「オフ (微小コンダクタンス)」の区分線形モデルで表し、状態が収束するまで解き直す。
+
+LU分解は (回路のハッシュ, ダイオードの状態) ごとにキャッシュする。
+電源の値だけを変えるスイープは右辺が変わるだけなので分解をそのまま再利用し、
+抵抗値のスイープは元の分解に対する低ランク更新 (Woodbury の公式) で解くため、
+スイープの点ごとに行列を分解し直すことはない。
+"""
+
+import math
+from collections.abc import Hashable, Iterable
+from dataclasses import dataclass, field
+from typing import Any
+
+import numpy as np
+from scipy.sparse import csc_matrix
+from scipy.sparse.linalg import SuperLU, splu
+
+from app.circuits.cache import LRUCache
+from app.circuits.compiler import CompiledCircuit, PinRef
+from app.circuits.units import parse_quantity
+
+# 全節点からグラウンドへの微小コンダクタンス (浮いた節点でも行列を正則に保つ)
+GMIN = 1e-12
+DIODE_ON_RESISTANCE = 1.0
+DIODE_OFF_CONDUCTANCE = 1e-9
+DEFAULT_FORWARD_VOLTAGE = {"led": 2.0, "diode": 0.7}
+MAX_DIODE_ITERATIONS = 50
+FACTORIZATION_CACHE_SIZE = 64
+
+# 端子の向き (正側/負側) の判定に使う端子名
+POSITIVE_TERMINALS = frozenset({"vcc", "v+", "+", "positive", "pos", "anode", "a", "p"})
+NEGATIVE_TERMINALS = frozenset(
+    {"gnd", "ground", "v-", "-", "negative", "neg", "cathode", "k", "n"}
+)
+
+VOLTAGE_SOURCE_TYPES = frozenset({"battery", "power_supply", "voltage_source"})
+
+
+class CircuitAnalysisError(ValueError):
+    status_code = 400
+
+
+@dataclass
+class _Element:
+    id: str
+    kind: str
+    pos: int
+    neg: int
+    value: float
+    # 電圧源・インダクタの枝電流の未知数の位置
+    branch: int | None = None
+
+
+@dataclass
+class OperatingPoint:
+    ground_net: int
+    # ネットID -> 電圧 [V]
+    node_voltages: dict[int, float]
+    # 部品ID -> 正側端子から素子を通って負側端子へ流れる電流 [A]
+    branch_currents: dict[str, float]
+    warnings: list[str] = field(default_factory=list)
+
+
+class FactorizationCache(LRUCache[Hashable, SuperLU]):
+    """LU分解のLRUキャッシュ"""
+
+    def __init__(self, maxsize: int = FACTORIZATION_CACHE_SIZE) -> None:
+        super().__init__(maxsize)
+
+
+factorization_cache = FactorizationCache()
+
+
+def oriented_pins(pins: list[PinRef]) -> list[PinRef]:
+    """端子を 正側, その他, 負側 の順に並べる"""
+
+    def rank(pin: PinRef) -> int:
+        name = pin.name.lower()
+        return (
+            0 if name in POSITIVE_TERMINALS else 2 if name in NEGATIVE_TERMINALS else 1
+        )
+
+    return sorted(pins, key=rank)
+
+
+class DCAnalysis:
+    """1つの回路に対するDC解析。部品の値を差し替えて何度でも解ける"""
+
+    def __init__(
+        self, circuit: CompiledCircuit, cache: FactorizationCache = factorization_cache
+    ) -> None:
+        self.circuit = circuit
+        self.cache = cache
+        self.warnings: list[str] = []
+        self.elements: dict[str, _Element] = {}
+
+        pins_of: dict[str, list[PinRef]] = {}
+        for pin in circuit.net_of:
+            pins_of.setdefault(pin.component_id, []).append(pin)
+
+        grounds = [
+            circuit.net_of[pin]
+            for c in circuit.components.values()
+            if c.type.lower() == "ground"
+            for pin in pins_of.get(c.id, [])
+        ]
+        pending = []
+        for component in circuit.components.values():
+            kind = component.type.lower()
+            if component.is_virtual or kind == "ground":
+                continue
+            pins = oriented_pins(pins_of.get(component.id, []))
+            if len(pins) < 2:
+                continue
+            pos, neg = circuit.net_of[pins[0]], circuit.net_of[pins[-1]]
+            if pos == neg:
+                self.warnings.append(f"Component '{component.id}' is shorted.")
+                continue
+            value = self._value(component.id, kind, component.properties)
+            if value is None:
+                continue
+            pending.append(_Element(component.id, kind, pos, neg, value))
+            if kind in VOLTAGE_SOURCE_TYPES and not grounds:
+                grounds.append(neg)
+
+        if not grounds:
+            raise CircuitAnalysisError(
+                "Analysis error: The circuit has no ground reference "
+                "(add a ground or a voltage source)."
+            )
+        self.ground_net = grounds[0]
+        self.ground_nets = set(grounds)
+        # グラウンド以外のネットに行列の行を割り当てる
+        self.node_index = {
+            net.id: i
+            for i, net in enumerate(
+                n for n in circuit.nets if n.id not in self.ground_nets
+            )
+        }
+        size = len(self.node_index)
+        for element in pending:
+            if element.kind in VOLTAGE_SOURCE_TYPES or element.kind == "inductor":
+                element.branch = size
+                size += 1
+            self.elements[element.id] = element
+        self.size = size
+        self.diodes = [e for e in self.elements.values() if e.kind in ("led", "diode")]
+
+    def _value(self, id: str, kind: str, properties: dict[str, Any]) -> float | None:
+        if kind in VOLTAGE_SOURCE_TYPES:
+            key, unit = "voltage", "V"
+        elif kind == "current_source":
+            key, unit = "current", "A"
+        elif kind == "resistor":
+            key, unit = "resistance", "ohm"
+        elif kind in DEFAULT_FORWARD_VOLTAGE:
+            raw = properties.get("forward_voltage", DEFAULT_FORWARD_VOLTAGE[kind])
+            return self._parse(id, "forward_voltage", raw, "V")
+        elif kind == "inductor":
+            return 0.0
+        else:
+            if kind != "capacitor":
+                self.warnings.append(
+                    f"Component '{id}' of type '{kind}' is not modeled and is "
+                    "treated as open."
+                )
+            return None
+        if key not in properties:
+            raise CircuitAnalysisError(
+                f"Analysis error: Component '{id}' has no '{key}'."
+            )
+        value = self._parse(id, key, properties[key], unit)
+        if kind == "resistor" and value <= 0:
+            raise CircuitAnalysisError(
+                f"Analysis error: Component '{id}' must have a positive resistance."
+            )
+        return value
+
+    @staticmethod
+    def _parse(id: str, key: str, raw: Any, unit: str) -> float:
+        try:
+            value = parse_quantity(raw, unit)
+        except ValueError:
+            value = math.nan
+        if not math.isfinite(value):
+            raise CircuitAnalysisError(
+                f"Analysis error: Component '{id}' has invalid {key} {str(raw)!r}."
+            )
+        return value
+
+    def _row(self, net: int) -> int | None:
+        return self.node_index.get(net)
+
+    def _incidence(self, element: _Element) -> np.ndarray:
+        u = np.zeros(self.size)
+        if (i := self._row(element.pos)) is not None:
+            u[i] = 1.0
+        if (j := self._row(element.neg)) is not None:
+            u[j] = -1.0
+        return u
+
+    def _matrix(self, states: tuple[bool, ...]) -> csc_matrix:
+        rows: list[int] = []
+        cols: list[int] = []
+        data: list[float] = []
+
+        def stamp(a: int | None, b: int | None, value: float) -> None:
+            if a is not None and b is not None:
+                rows.append(a)
+                cols.append(b)
+                data.append(value)
+
+        def conductance(e: _Element, g: float) -> None:
+            i, j = self._row(e.pos), self._row(e.neg)
+            stamp(i, i, g)
+            stamp(j, j, g)
+            stamp(i, j, -g)
+            stamp(j, i, -g)
+
+        for row in range(len(self.node_index)):
+            stamp(row, row, GMIN)
+        on = dict(zip((d.id for d in self.diodes), states, strict=True))
+        for e in self.elements.values():
+            if e.kind == "resistor":
+                conductance(e, 1.0 / e.value)
+            elif e.kind in DEFAULT_FORWARD_VOLTAGE:
+                conductance(
+                    e, 1.0 / DIODE_ON_RESISTANCE if on[e.id] else DIODE_OFF_CONDUCTANCE
+                )
+            elif e.branch is not None:
+                i, j = self._row(e.pos), self._row(e.neg)
+                stamp(i, e.branch, 1.0)
+                stamp(j, e.branch, -1.0)
+                stamp(e.branch, i, 1.0)
+                stamp(e.branch, j, -1.0)
+        return csc_matrix((data, (rows, cols)), shape=(self.size, self.size))
+
+    def _factorize(self, states: tuple[bool, ...]) -> SuperLU:
+        key = (self.circuit.definition_hash, states)
+
+        def build() -> SuperLU:
+            try:
+                return splu(self._matrix(states))
+            except RuntimeError:
+                raise CircuitAnalysisError(
+                    "Analysis error: The circuit has no unique DC solution "
+                    "(e.g. a loop of voltage sources)."
+                )
+
+        return self.cache.get_or_create(key, build)
+
+    def _rhs(self, values: dict[str, float], states: tuple[bool, ...]) -> np.ndarray:
+        b = np.zeros(self.size)
+        on = dict(zip((d.id for d in self.diodes), states, strict=True))
+        for e in self.elements.values():
+            value = values.get(e.id, e.value)
+            if e.branch is not None:
+                b[e.branch] = value if e.kind != "inductor" else 0.0
+            elif e.kind == "current_source" or (
+                e.kind in DEFAULT_FORWARD_VOLTAGE and on[e.id]
+            ):
+                # 電流源は正側端子から回路へ電流を押し出す。オン状態のダイオードは
+                # オン抵抗と、正側へ Vf/Ron を押し出す電流源の並列 (ノートン等価)
+                if e.kind != "current_source":
+                    value /= DIODE_ON_RESISTANCE
+                if (i := self._row(e.pos)) is not None:
+                    b[i] += value
+                if (j := self._row(e.neg)) is not None:
+                    b[j] -= value
+        return b
+
+    def _linear_solve(
+        self, states: tuple[bool, ...], values: dict[str, float]
+    ) -> np.ndarray:
+        lu = self._factorize(states)
+        x = lu.solve(self._rhs(values, states))
+        # 元の値から変わった抵抗は、分解済みの行列に対する低ランク更新で反映する
+        changed = [
+            e
+            for e in self.elements.values()
+            if e.kind == "resistor" and e.id in values and values[e.id] != e.value
+        ]
+        if not changed:
+            return np.asarray(x)
+        u = np.column_stack([self._incidence(e) for e in changed])
+        dg = np.array([1.0 / values[e.id] - 1.0 / e.value for e in changed])
+        z = lu.solve(u)
+        capacitance = np.diag(1.0 / dg) + u.T @ z
+        try:
+            return np.asarray(x - z @ np.linalg.solve(capacitance, u.T @ x))
+        except np.linalg.LinAlgError:
+            raise CircuitAnalysisError(
+                "Analysis error: The circuit has no unique DC solution "
+                "with the given values."
+            )
+
+    def _voltage(self, x: np.ndarray, net: int) -> float:
+        i = self._row(net)
+        return float(x[i]) if i is not None else 0.0
+
+    def solve(self, values: dict[str, float] | None = None) -> OperatingPoint:
+        """
+        DC動作点を求める。`values` で部品の値 (V, A, Ω, Vf) を一時的に差し替えられる
+        """
+        values = dict(values or {})
+        for id, value in values.items():
+            element = self.elements.get(id)
+            if element is None or element.kind == "inductor":
+                raise CircuitAnalysisError(
+                    f"Analysis error: Component '{id}' has no value to analyze."
+                )
+            if not math.isfinite(value):
+                raise CircuitAnalysisError(
+                    f"Analysis error: Component '{id}' must have a finite value."
+                )
+            if element.kind == "resistor" and value <= 0:
+                raise CircuitAnalysisError(
+                    f"Analysis error: Component '{id}' must have a positive resistance."
+                )
+
+        states = tuple(True for _ in self.diodes)
+        seen = {states}
+        for _ in range(MAX_DIODE_ITERATIONS):
+            x = self._linear_solve(states, values)
+            next_states = tuple(
+                self._diode_current(x, d, values, on) > 0
+                if on
+                else self._voltage(x, d.pos) - self._voltage(x, d.neg)
+                > values.get(d.id, d.value)
+                for d, on in zip(self.diodes, states, strict=True)
+            )
+            if next_states == states or next_states in seen:
+                break
+            seen.add(next_states)
+            states = next_states
+        return self._operating_point(x, states, values)
+
+    def _diode_current(
+        self, x: np.ndarray, d: _Element, values: dict[str, float], on: bool
+    ) -> float:
+        vd = self._voltage(x, d.pos) - self._voltage(x, d.neg)
+        if on:
+            return (vd - values.get(d.id, d.value)) / DIODE_ON_RESISTANCE
+        return vd * DIODE_OFF_CONDUCTANCE
+
+    def _operating_point(
+        self, x: np.ndarray, states: tuple[bool, ...], values: dict[str, float]
+    ) -> OperatingPoint:
+        on = dict(zip((d.id for d in self.diodes), states, strict=True))
+        currents = {}
+        for e in self.elements.values():
+            value = values.get(e.id, e.value)
+            if e.branch is not None:
+                # MNAの枝電流は正側端子から素子に流れ込む向き
+                currents[e.id] = float(x[e.branch])
+            elif e.kind == "resistor":
+                currents[e.id] = (
+                    self._voltage(x, e.pos) - self._voltage(x, e.neg)
+                ) / value
+            elif e.kind == "current_source":
+                currents[e.id] = -value
+            else:
+                currents[e.id] = self._diode_current(x, e, values, on[e.id])
+        voltages = {net.id: self._voltage(x, net.id) for net in self.circuit.nets}
+        if not all(map(math.isfinite, [*voltages.values(), *currents.values()])):
+            # 値が大きすぎると解が桁あふれする (JSONで返せない)
+            raise CircuitAnalysisError(
+                "Analysis error: The circuit has no finite DC solution."
+            )
+        return OperatingPoint(
+            ground_net=self.ground_net,
+            node_voltages=voltages,
+            branch_currents=currents,
+            warnings=list(self.warnings),
+        )
+
+    def sweep(self, component_id: str, values: Iterable[float]) -> list[OperatingPoint]:
+        """1つの部品の値を変えながら動作点を求める"""
+        return [self.solve({component_id: value}) for value in values]
@@ -0,0 +1,111 @@
+"""
+部品表 (BOM) の集計
+
+コンパイル済み回路 (`compiled` 列のJSON) の部品を (種類, 正規化した値, パッケージ) ごとに
+数える。コンパイル結果ではモジュールは展開済みなので、モジュールの各インスタンスの
+内部部品はインスタンスの数だけ数えられる。集計に必要なのはキーごとの個数だけなので、
+多数の回路をまとめても、メモリ使用量は部品数ではなく行の種類数に比例する。
+"""
+
+import csv
+import io
+import json
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from typing import Any
+
+from app.circuits.analysis import VOLTAGE_SOURCE_TYPES
+from app.circuits.compiler import VIRTUAL_TYPES
+from app.circuits.formatters.base import chunked
+from app.circuits.units import format_quantity, parse_quantity
+
+BOM_COLUMNS = ("type", "value", "package", "quantity")
+BOM_MEDIA_TYPES = {"csv": "text/csv", "json": "application/json"}
+ROWS_PER_CHUNK = 256
+
+# 部品の種類 -> (値のプロパティ, 単位)。単位が None のプロパティは文字列のまま使う
+VALUE_PROPERTIES: dict[str, tuple[str, str | None]] = {
+    "resistor": ("resistance", "ohm"),
+    "capacitor": ("capacitance", "F"),
+    "inductor": ("inductance", "H"),
+    "current_source": ("current", "A"),
+    "led": ("color", None),
+    **{kind: ("voltage", "V") for kind in VOLTAGE_SOURCE_TYPES},
+}
+# 上の表にない部品で、値として使うプロパティ (先にあるものを優先)
+GENERIC_VALUE_PROPERTIES = ("value", "part_number")
+PACKAGE_PROPERTIES = ("package", "footprint")
+
+BOMKey = tuple[str, str, str]
+
+
+def _first(properties: dict[str, Any], keys: Iterable[str]) -> str:
+    for key in keys:
+        if properties.get(key) is not None:
+            return str(properties[key]).strip()
+    return ""
+
+
+def bom_key(type: str, properties: dict[str, Any]) -> BOMKey:
+    """部品の (種類, 正規化した値, パッケージ)。`"4.7k"` と `"4700ohm"` は同じ値になる"""
+    kind = type.lower()
+    value = ""
+    if kind in VALUE_PROPERTIES:
+        key, unit = VALUE_PROPERTIES[kind]
+        raw = properties.get(key)
+        if raw is not None and unit is not None:
+            try:
+                value = format_quantity(parse_quantity(raw, unit), unit)
+            except ValueError:
+                value = str(raw).strip()
+        elif raw is not None:
+            value = str(raw).strip()
+    else:
+        value = _first(properties, GENERIC_VALUE_PROPERTIES)
+    return kind, value, _first(properties, PACKAGE_PROPERTIES)
+
+
+class BOMCounter:
+    """1つ以上の回路の部品を数える"""
+
+    def __init__(self) -> None:
+        self.counts: Counter[BOMKey] = Counter()
+
+    def add(self, compiled: dict[str, Any], multiplicity: int = 1) -> None:
+        """`CompiledCircuit.to_dict()` の形の回路を `multiplicity` 枚分だけ加える"""
+        for component in compiled["components"]:
+            if component["type"].lower() in VIRTUAL_TYPES:
+                continue
+            key = bom_key(component["type"], component["properties"])
+            self.counts[key] += multiplicity
+
+    def rows(self) -> list[tuple[str, str, str, int]]:
+        return sorted((*key, count) for key, count in self.counts.items())
+
+
+def write_csv(rows: Iterable[tuple[str, str, str, int]]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(BOM_COLUMNS)
+    for i, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if i % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def write_json(rows: Iterable[tuple[str, str, str, int]]) -> Iterator[str]:
+    return chunked(_json_parts(rows), ROWS_PER_CHUNK)
+
+
+def _json_parts(rows: Iterable[tuple[str, str, str, int]]) -> Iterator[str]:
+    yield '{"data": ['
+    count = 0
+    for count, row in enumerate(rows, start=1):
+        prefix = ", " if count > 1 else ""
+        yield prefix + json.dumps(
+            dict(zip(BOM_COLUMNS, row, strict=True)), ensure_ascii=False
+        )
+    yield f'], "count": {count}}}'
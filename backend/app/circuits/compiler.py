@@ -0,0 +1,412 @@
+"""
+回路定義のコンパイラ
+
+`load_circuit_yaml` で読み込んだ辞書を検証し、レンダリングや解析で扱いやすい
+中間表現 (`CompiledCircuit`) に変換する。モジュールは展開してフラットにし、
+端子同士の接続は Union-Find でネットにまとめる。
+"""
+
+import hashlib
+import json
+import math
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from typing import Any
+
+from app.circuits.loader import CircuitYAMLError
+from app.circuits.timing import span
+
+# 端子名が省略された接続はこの名前の端子として扱う
+ANY_TERMINAL = "any"
+# 部品数に数えない仮想的なコンポーネント
+VIRTUAL_TYPES = frozenset({"junction", "module"})
+# モジュール内部のコンポーネントIDは "module_id/internal_id" のように表す
+PATH_SEPARATOR = "/"
+# 座標 (の絶対値) と回転角 [度] の上限。配置・描画で桁あふれしないように抑える
+MAX_COORDINATE = 1e6
+MAX_ROTATION = 360.0
+
+
+@dataclass(frozen=True, order=True)
+class PinRef:
+    """コンポーネントの端子またはポートへの参照"""
+
+    component_id: str
+    name: str = ANY_TERMINAL
+
+
+@dataclass
+class Port:
+    name: str
+    direction: str | None = None
+
+
+@dataclass
+class Component:
+    id: str
+    type: str
+    properties: dict[str, Any] = field(default_factory=dict)
+    position: tuple[float, float] | None = None
+    rotation: float = 0.0
+    ports: list[Port] = field(default_factory=list)
+    parent: str | None = None
+
+    @property
+    def is_virtual(self) -> bool:
+        return self.type.lower() in VIRTUAL_TYPES
+
+
+@dataclass
+class Connection:
+    source: PinRef
+    target: PinRef
+    parent: str | None = None
+
+
+@dataclass
+class Net:
+    id: int
+    pins: list[PinRef]
+
+
+@dataclass
+class CompiledCircuit:
+    name: str
+    description: str
+    definition_hash: str
+    components: dict[str, Component]
+    connections: list[Connection]
+    nets: list[Net]
+    net_of: dict[PinRef, int]
+
+    @property
+    def component_count(self) -> int:
+        return sum(1 for c in self.components.values() if not c.is_virtual)
+
+    @property
+    def component_types(self) -> list[str]:
+        return sorted({c.type for c in self.components.values()})
+
+    def to_dict(self) -> dict[str, Any]:
+        """JSON (Postgres JSONB) に保存できる形に変換する"""
+        return {
+            "name": self.name,
+            "description": self.description,
+            "definition_hash": self.definition_hash,
+            "component_count": self.component_count,
+            "component_types": self.component_types,
+            "components": [
+                {
+                    "id": c.id,
+                    "type": c.type,
+                    "properties": c.properties,
+                    "position": list(c.position) if c.position else None,
+                    "rotation": c.rotation,
+                    "ports": [
+                        {"name": p.name, "direction": p.direction} for p in c.ports
+                    ],
+                    "parent": c.parent,
+                }
+                for c in self.components.values()
+            ],
+            "connections": [
+                {
+                    "from": [conn.source.component_id, conn.source.name],
+                    "to": [conn.target.component_id, conn.target.name],
+                    "parent": conn.parent,
+                }
+                for conn in self.connections
+            ],
+            "nets": [
+                {"id": net.id, "pins": [[p.component_id, p.name] for p in net.pins]}
+                for net in self.nets
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "CompiledCircuit":
+        """`to_dict` の出力から復元する (YAMLの再パースを避けるため)"""
+        components = {
+            c["id"]: Component(
+                id=c["id"],
+                type=c["type"],
+                properties=c["properties"],
+                position=tuple(c["position"]) if c["position"] else None,
+                rotation=c["rotation"],
+                ports=[Port(**p) for p in c["ports"]],
+                parent=c["parent"],
+            )
+            for c in data["components"]
+        }
+        connections = [
+            Connection(PinRef(*conn["from"]), PinRef(*conn["to"]), conn["parent"])
+            for conn in data["connections"]
+        ]
+        nets = [
+            Net(id=n["id"], pins=[PinRef(*p) for p in n["pins"]]) for n in data["nets"]
+        ]
+        return cls(
+            name=data["name"],
+            description=data["description"],
+            definition_hash=data["definition_hash"],
+            components=components,
+            connections=connections,
+            nets=nets,
+            net_of={pin: net.id for net in nets for pin in net.pins},
+        )
+
+
+class _UnionFind:
+    def __init__(self) -> None:
+        self.parent: dict[PinRef, PinRef] = {}
+
+    def add(self, x: PinRef) -> None:
+        self.parent.setdefault(x, x)
+
+    def find(self, x: PinRef) -> PinRef:
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a: PinRef, b: PinRef) -> None:
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[rb] = ra
+
+
+def definition_hash(data: dict[str, Any]) -> str:
+    """書式の違いに影響されない回路定義のハッシュ"""
+    canonical = json.dumps(
+        data, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def build_nets(
+    pins: Iterable[PinRef], connections: Iterable[Connection]
+) -> tuple[list[Net], dict[PinRef, int]]:
+    """端子と接続からネットを構築する。ネットIDは端子の出現順で決まる"""
+    uf = _UnionFind()
+    for pin in pins:
+        uf.add(pin)
+    for conn in connections:
+        uf.add(conn.source)
+        uf.add(conn.target)
+        uf.union(conn.source, conn.target)
+
+    nets: list[Net] = []
+    root_to_net: dict[PinRef, Net] = {}
+    net_of: dict[PinRef, int] = {}
+    for pin in uf.parent:
+        root = uf.find(pin)
+        net = root_to_net.get(root)
+        if net is None:
+            net = Net(id=len(nets), pins=[])
+            root_to_net[root] = net
+            nets.append(net)
+        net.pins.append(pin)
+        net_of[pin] = net.id
+    return nets, net_of
+
+
+def _require_mapping(value: Any, where: str) -> dict[str, Any]:
+    if not isinstance(value, dict):
+        raise CircuitYAMLError(f"Validation error: '{where}' must be a mapping.")
+    return value
+
+
+def _require_list(value: Any, where: str) -> list[Any]:
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise CircuitYAMLError(f"Validation error: '{where}' must be a list.")
+    return value
+
+
+def _parse_position(value: Any, where: str) -> tuple[float, float] | None:
+    if value is None:
+        return None
+    pos = _require_mapping(value, f"{where}.position")
+    try:
+        x, y = float(pos["x"]), float(pos["y"])
+    except (KeyError, TypeError, ValueError):
+        raise CircuitYAMLError(
+            f"Validation error: '{where}.position' must have numeric 'x' and 'y'."
+        )
+    if not all(math.isfinite(v) and abs(v) <= MAX_COORDINATE for v in (x, y)):
+        raise CircuitYAMLError(
+            f"Validation error: '{where}.position' must be within "
+            f"±{MAX_COORDINATE:g}."
+        )
+    return x, y
+
+
+def _to_absolute(
+    position: tuple[float, float] | None,
+    origin: tuple[float, float] | None,
+    rotation: float,
+) -> tuple[float, float] | None:
+    if position is None or origin is None:
+        return position
+    rad = math.radians(rotation)
+    x, y = position
+    return (
+        origin[0] + x * math.cos(rad) - y * math.sin(rad),
+        origin[1] + x * math.sin(rad) + y * math.cos(rad),
+    )
+
+
+class _Compiler:
+    def __init__(self) -> None:
+        self.components: dict[str, Component] = {}
+        self.connections: list[Connection] = []
+
+    def component(
+        self,
+        raw: Any,
+        where: str,
+        parent: Component | None,
+    ) -> None:
+        raw = _require_mapping(raw, where)
+        local_id = raw.get("id")
+        comp_type = raw.get("type")
+        if not isinstance(local_id, str) or not local_id:
+            raise CircuitYAMLError(f"Validation error: '{where}.id' is required.")
+        if not isinstance(comp_type, str) or not comp_type:
+            raise CircuitYAMLError(
+                f"Validation error: Component '{local_id}' has no 'type'."
+            )
+        comp_id = (
+            f"{parent.id}{PATH_SEPARATOR}{local_id}" if parent is not None else local_id
+        )
+        if comp_id in self.components:
+            raise CircuitYAMLError(
+                f"Validation error: Duplicate component id '{comp_id}'."
+            )
+
+        properties = dict(
+            _require_mapping(raw.get("properties") or {}, f"{where}.properties")
+        )
+        position = _parse_position(properties.pop("position", None), where)
+        try:
+            rotation = float(properties.pop("rotation", 0) or 0)
+        except (TypeError, ValueError):
+            raise CircuitYAMLError(
+                f"Validation error: Component '{local_id}' has invalid 'rotation'."
+            )
+        if not (math.isfinite(rotation) and abs(rotation) <= MAX_ROTATION):
+            raise CircuitYAMLError(
+                f"Validation error: Component '{local_id}' has 'rotation' outside "
+                f"±{MAX_ROTATION:g} degrees."
+            )
+        ports = []
+        for i, raw_port in enumerate(
+            _require_list(properties.pop("ports", None), f"{where}.ports")
+        ):
+            port = _require_mapping(raw_port, f"{where}.ports[{i}]")
+            if not isinstance(port.get("name"), str):
+                raise CircuitYAMLError(
+                    f"Validation error: '{where}.ports[{i}].name' is required."
+                )
+            ports.append(Port(name=port["name"], direction=port.get("direction")))
+
+        if parent is not None:
+            position = _to_absolute(position, parent.position, parent.rotation)
+            rotation = (rotation + parent.rotation) % 360
+
+        component = Component(
+            id=comp_id,
+            type=comp_type,
+            properties=properties,
+            position=position,
+            rotation=rotation,
+            ports=ports,
+            parent=parent.id if parent is not None else None,
+        )
+        self.components[comp_id] = component
+
+        if component.type.lower() == "module":
+            for i, child in enumerate(
+                _require_list(
+                    raw.get("internal_components"), f"{where}.internal_components"
+                )
+            ):
+                self.component(child, f"{where}.internal_components[{i}]", component)
+            self.connection_list(
+                raw.get("internal_connections"),
+                f"{where}.internal_connections",
+                component,
+            )
+
+    def endpoint(self, raw: Any, where: str, scope: Component | None) -> PinRef:
+        end = _require_mapping(raw, where)
+        local_id = end.get("component_id")
+        if not isinstance(local_id, str):
+            raise CircuitYAMLError(
+                f"Validation error: '{where}.component_id' is required."
+            )
+        # モジュール内部の接続では、モジュール自身のIDはポートを指す
+        if scope is not None and local_id != scope.id.rsplit(PATH_SEPARATOR, 1)[-1]:
+            comp_id = f"{scope.id}{PATH_SEPARATOR}{local_id}"
+        elif scope is not None:
+            comp_id = scope.id
+        else:
+            comp_id = local_id
+        component = self.components.get(comp_id)
+        if component is None:
+            raise CircuitYAMLError(
+                f"Validation error: Connection references unknown component '{local_id}'."
+            )
+        if component.type.lower() == "junction":
+            return PinRef(comp_id)
+        name = end.get("port") or end.get("terminal") or ANY_TERMINAL
+        return PinRef(comp_id, str(name))
+
+    def connection_list(self, raw: Any, where: str, scope: Component | None) -> None:
+        for i, raw_conn in enumerate(_require_list(raw, where)):
+            conn = _require_mapping(raw_conn, f"{where}[{i}]")
+            if "from" not in conn or "to" not in conn:
+                raise CircuitYAMLError(
+                    f"Validation error: '{where}[{i}]' needs 'from' and 'to'."
+                )
+            self.connections.append(
+                Connection(
+                    source=self.endpoint(conn["from"], f"{where}[{i}].from", scope),
+                    target=self.endpoint(conn["to"], f"{where}[{i}].to", scope),
+                    parent=scope.id if scope is not None else None,
+                )
+            )
+
+
+def compile_circuit(data: dict[str, Any]) -> CompiledCircuit:
+    """
+    読み込んだ回路定義を検証し、`CompiledCircuit` に変換する
+    """
+    with span("validate"):
+        circuit = _require_mapping(data.get("circuit"), "circuit")
+        compiler = _Compiler()
+        for i, raw in enumerate(
+            _require_list(circuit.get("components"), "circuit.components")
+        ):
+            compiler.component(raw, f"circuit.components[{i}]", None)
+        compiler.connection_list(
+            circuit.get("connections"), "circuit.connections", None
+        )
+
+        # ポートは接続されていなくても端子として存在する
+        pins = [
+            PinRef(c.id, p.name) for c in compiler.components.values() for p in c.ports
+        ]
+        nets, net_of = build_nets(pins, compiler.connections)
+        return CompiledCircuit(
+            name=str(circuit.get("name") or ""),
+            description=str(circuit.get("description") or ""),
+            definition_hash=definition_hash(data),
+            components=compiler.components,
+            connections=compiler.connections,
+            nets=nets,
+            net_of=net_of,
+        )
@@ -0,0 +1,81 @@
+"""
+配線の交差数
+
+配線は水平・垂直の線分だけからなるので、水平線分と垂直線分の交差だけを数える。
+x方向の走査線で水平線分のy座標を Fenwick 木に出し入れし、垂直線分ごとに
+範囲内の個数を数えるため、O((線分数) log (線分数)) で済む。
+同じネットの線分同士は繋がっているので交差に数えない (全体から、ネットごとに
+数えた交差を引く)。端点で接するだけのもの (T字の接続など) も数えない。
+"""
+
+from bisect import bisect_left, bisect_right
+from collections.abc import Hashable, Iterable
+
+Point = tuple[float, float]
+
+# 同じx座標のイベントの処理順 (端点での接触を交差に数えないため)
+_REMOVE, _QUERY, _INSERT = 0, 1, 2
+
+
+class _Fenwick:
+    def __init__(self, size: int) -> None:
+        self.tree = [0] * (size + 1)
+
+    def add(self, i: int, delta: int) -> None:
+        i += 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i: int) -> int:
+        """[0, i) の合計"""
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+
+Horizontal = tuple[float, float, float]  # (y, x0, x1)
+Vertical = tuple[float, float, float]  # (x, y0, y1)
+
+
+def _count(horizontal: list[Horizontal], vertical: list[Vertical]) -> int:
+    if not horizontal or not vertical:
+        return 0
+    ys = sorted({y for y, _, _ in horizontal})
+    events: list[tuple[float, int, float, float]] = []
+    for y, x0, x1 in horizontal:
+        events.append((x0, _INSERT, y, y))
+        events.append((x1, _REMOVE, y, y))
+    for x, y0, y1 in vertical:
+        events.append((x, _QUERY, y0, y1))
+    events.sort(key=lambda e: (e[0], e[1]))
+
+    tree = _Fenwick(len(ys))
+    total = 0
+    for _, kind, a, b in events:
+        if kind == _QUERY:
+            total += tree.prefix(bisect_left(ys, b)) - tree.prefix(bisect_right(ys, a))
+        else:
+            tree.add(bisect_left(ys, a), 1 if kind == _INSERT else -1)
+    return total
+
+
+def count_crossings(segments: Iterable[tuple[Hashable, Point, Point]]) -> int:
+    """(ネット, 始点, 終点) の線分のうち、異なるネット同士の交差の数"""
+    horizontal: dict[Hashable, list[Horizontal]] = {}
+    vertical: dict[Hashable, list[Vertical]] = {}
+    for net, (ax, ay), (bx, by) in segments:
+        if ay == by and ax != bx:
+            horizontal.setdefault(net, []).append((ay, min(ax, bx), max(ax, bx)))
+        elif ax == bx and ay != by:
+            vertical.setdefault(net, []).append((ax, min(ay, by), max(ay, by)))
+
+    total = _count(
+        [h for hs in horizontal.values() for h in hs],
+        [v for vs in vertical.values() for v in vs],
+    )
+    for net, hs in horizontal.items():
+        total -= _count(hs, vertical.get(net, []))
+    return total
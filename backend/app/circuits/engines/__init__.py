@@ -0,0 +1,10 @@
+from .base import AIEngine, CircuitExample, EngineError, TextAIEngine
+from .openai import OpenAIEngine
+
+__all__ = [
+    "AIEngine",
+    "CircuitExample",
+    "EngineError",
+    "OpenAIEngine",
+    "TextAIEngine",
+]
@@ -0,0 +1,119 @@
+import uuid
+from abc import ABC, abstractmethod
+from collections.abc import AsyncIterator, Sequence
+from dataclasses import dataclass
+from typing import Any
+
+from sqlmodel import Session
+
+from app.circuits.retrieval import retrieval_index
+from app.circuits.usage import usage_meter
+from app.models import CircuitDefinition
+
+# プロンプトに含める例の数と、例にする回路の条件
+NUM_EXAMPLES = 3
+MIN_EXAMPLE_SIMILARITY = 0.1
+# 長い回路定義はトークンを食うわりに例としての効果が薄いので使わない
+MAX_EXAMPLE_LENGTH = 4000
+
+INSTRUCTIONS = """\
+You design electronic circuits. Answer with a single circuit definition in YAML \
+with a top-level `circuit` mapping (`name`, `description`, `components`, \
+`connections`), following the format of the examples. Output only the YAML."""
+
+
+class EngineError(Exception):
+    """AIエンジンの呼び出しに失敗した場合の例外 (ネットワークやプロバイダーのエラー)"""
+
+
+@dataclass(frozen=True)
+class CircuitExample:
+    name: str
+    circuit_yaml: str
+
+
+class AIEngine(ABC):
+    """
+    回路を生成するAIエンジンの共通インターフェース
+
+    入力 (文章や画像) から回路定義のYAMLを生成する。
+    """
+
+    name: str
+
+    @abstractmethod
+    async def process(self, input: Any) -> str: ...
+
+
+class TextAIEngine(AIEngine):
+    """
+    文章から回路を生成するエンジン
+
+    実装するのはプロンプトへの応答を断片ごとに返す `complete` だけでよい。
+    応答にトークン数が含まれていれば `report_usage` で報告する (無ければ文字数から見積もる)。
+    プロンプトには、保存済み回路のうち指示文に近いものを数件、例として含める。
+    """
+
+    num_examples = NUM_EXAMPLES
+
+    @abstractmethod
+    def complete(self, prompt: str) -> AsyncIterator[str]:
+        """プロンプトへの応答を、生成された順に断片ごとに返す"""
+
+    async def process(self, text: str, examples: Sequence[CircuitExample] = ()) -> str:
+        prompt = self.prompt(text, examples)
+        chunks = []
+        with usage_meter.call(self.name, prompt) as call:
+            async for chunk in self.complete(prompt):
+                call.received(chunk)
+                chunks.append(chunk)
+        return "".join(chunks)
+
+    def examples(
+        self, session: Session, text: str, owner_id: uuid.UUID | None = None
+    ) -> list[CircuitExample]:
+        """指示文に近い保存済み回路を、プロンプトの例として最大 `num_examples` 件選ぶ"""
+        examples: list[CircuitExample] = []
+        # 長すぎて使えない回路があっても件数が足りるよう、多めに引いておく
+        matches = retrieval_index.search(
+            session, text, 2 * self.num_examples, owner_id=owner_id
+        )
+        for circuit_id, similarity in matches:
+            if similarity < MIN_EXAMPLE_SIMILARITY:
+                break
+            definition = session.get(CircuitDefinition, circuit_id)
+            if definition is None:
+                retrieval_index.discard(circuit_id)
+                continue
+            if len(definition.circuit_yaml) > MAX_EXAMPLE_LENGTH:
+                continue
+            examples.append(CircuitExample(definition.name, definition.circuit_yaml))
+            if len(examples) >= self.num_examples:
+                break
+        return examples
+
+    def prompt(self, text: str, examples: Sequence[CircuitExample] = ()) -> str:
+        parts = [INSTRUCTIONS]
+        for example in examples:
+            parts.append(
+                f"Example: {example.name}\n```yaml\n{example.circuit_yaml.strip()}\n```"
+            )
+        parts.append(f"Request: {text}")
+        return "\n\n".join(parts)
+
+    def repair_prompt(
+        self, text: str, circuit_yaml: str, sections: Sequence[str], error: str
+    ) -> str:
+        """
+        生成した回路のうち、壊れたセクションだけを生成し直させるプロンプト
+
+        `circuit_yaml` には壊れたセクションを除いた回路を渡す。
+        """
+        keys = ", ".join(f"`{section}`" for section in sections)
+        return (
+            f"{INSTRUCTIONS}\n\nRequest: {text}\n\n"
+            f"The circuit below was generated for this request, but is invalid: {error}\n"
+            f"```yaml\n{circuit_yaml.strip()}\n```\n\n"
+            f"Answer with only a YAML mapping with the corrected {keys} "
+            "lists, consistent with the rest of the circuit."
+        )
@@ -0,0 +1,76 @@
+import json
+from collections.abc import AsyncIterator
+from typing import Any
+
+import httpx
+
+from app.circuits.engines.base import EngineError, TextAIEngine
+from app.circuits.usage import report_usage
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+DEFAULT_TIMEOUT = 60.0
+
+
+def _report(usage: dict[str, Any]) -> None:
+    details = usage.get("prompt_tokens_details") or {}
+    report_usage(
+        int(usage.get("prompt_tokens") or 0),
+        int(usage.get("completion_tokens") or 0),
+        int(details.get("cached_tokens") or 0),
+    )
+
+
+class OpenAIEngine(TextAIEngine):
+    """
+    OpenAI の Chat Completions API (と互換のAPI) で回路を生成するエンジン
+
+    応答はストリーミング (Server-Sent Events) で受け取り、届いた断片から順に返す。
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        base_url: str = DEFAULT_BASE_URL,
+        timeout: float = DEFAULT_TIMEOUT,
+        name: str = "openai",
+    ) -> None:
+        self.name = name
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    async def complete(self, prompt: str) -> AsyncIterator[str]:
+        body = {
+            "model": self.model,
+            "stream": True,
+            # 最後の断片でトークン数を受け取る
+            "stream_options": {"include_usage": True},
+            "messages": [{"role": "user", "content": prompt}],
+        }
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        try:
+            async with httpx.AsyncClient(timeout=self.timeout) as client:
+                async with client.stream(
+                    "POST",
+                    f"{self.base_url}/chat/completions",
+                    json=body,
+                    headers=headers,
+                ) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:") :].strip()
+                        if data == "[DONE]":
+                            break
+                        message = json.loads(data)
+                        if message.get("usage"):
+                            _report(message["usage"])
+                        for choice in message.get("choices") or []:
+                            content = (choice.get("delta") or {}).get("content")
+                            if content:
+                                yield content
+        except (httpx.HTTPError, json.JSONDecodeError) as e:
+            raise EngineError(f"{self.name} request failed: {e}") from e
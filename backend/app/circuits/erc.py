@@ -0,0 +1,310 @@
+"""
+電気的ルールチェック (ERC)
+
+ネットリストを「端子 x 役割」の表に変換し、ネットごとの役割の個数の行列に
+集計してから、ルールをその行列に対するベクトル演算として評価する。
+部品ごとのPythonループを回さないので、複数の回路をまとめて1回で評価できる
+(回路ごとにネットIDをずらして1つの行列に連結する)。
+
+結果は回路の定義ハッシュごとにキャッシュする。
+"""
+
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from enum import IntEnum
+
+import numpy as np
+
+from app.circuits.analysis import (
+    NEGATIVE_TERMINALS,
+    POSITIVE_TERMINALS,
+    VOLTAGE_SOURCE_TYPES,
+)
+from app.circuits.cache import LRUCache
+from app.circuits.compiler import VIRTUAL_TYPES, CompiledCircuit, PinRef
+
+ERC_CACHE_SIZE = 4096
+
+
+class Role(IntEnum):
+    """ERCで区別する端子の役割"""
+
+    POWER_POS = 0
+    POWER_NEG = 1
+    INPUT = 2
+    OUTPUT = 3
+    PASSIVE = 4
+    RESISTOR = 5
+    JUNCTION = 6
+
+
+@dataclass(frozen=True)
+class Violation:
+    code: str
+    severity: str
+    message: str
+    net: int | None = None
+    component_id: str | None = None
+
+
+@dataclass(frozen=True)
+class NetRule:
+    """ネットごとの役割の個数 (ネット数 x 役割数) から違反ネットを選ぶルール"""
+
+    code: str
+    severity: str
+    message: str
+    when: Callable[[np.ndarray], np.ndarray]
+
+
+@dataclass(frozen=True)
+class LEDRule:
+    """LEDのアノード側/カソード側のネットの役割の個数から違反LEDを選ぶルール"""
+
+    code: str
+    severity: str
+    message: str
+    when: Callable[[np.ndarray, np.ndarray], np.ndarray]
+
+
+@dataclass(frozen=True)
+class SourceRule:
+    """電源の正極と負極のネットから違反電源を選ぶルール"""
+
+    code: str
+    severity: str
+    message: str
+    when: Callable[[np.ndarray, np.ndarray], np.ndarray]
+
+
+# 入力を駆動できる役割 (入力とジャンクション以外)
+DRIVER_ROLES = [
+    Role.POWER_POS,
+    Role.POWER_NEG,
+    Role.OUTPUT,
+    Role.PASSIVE,
+    Role.RESISTOR,
+]
+
+
+NET_RULES: tuple[NetRule, ...] = (
+    NetRule(
+        "output_conflict",
+        "error",
+        "More than one output drives the same net.",
+        lambda c: c[:, Role.OUTPUT] > 1,
+    ),
+    NetRule(
+        "floating_input",
+        "error",
+        "Input is not driven by any output, supply or passive component.",
+        lambda c: (c[:, Role.INPUT] > 0) & (c[:, DRIVER_ROLES].sum(axis=1) == 0),
+    ),
+    NetRule(
+        "unconnected_pin",
+        "warning",
+        "Pin is not connected to anything.",
+        lambda c: c.sum(axis=1) - c[:, Role.JUNCTION] == 1,
+    ),
+)
+
+# 直列の電池や ±V の電源のように、別々の電源の正極と負極が同じネットにあるのは
+# 正常なので、同じ電源の両極が同じネットにある場合だけを短絡とみなす
+SOURCE_RULES: tuple[SourceRule, ...] = (
+    SourceRule(
+        "shorted_supply",
+        "error",
+        "Positive and negative terminals of the supply are connected to each other.",
+        lambda pos, neg: pos == neg,
+    ),
+)
+
+LED_RULES: tuple[LEDRule, ...] = (
+    LEDRule(
+        "led_without_resistor",
+        "error",
+        "LED has no series resistor.",
+        lambda anode, cathode: (anode[:, Role.RESISTOR] == 0)
+        & (cathode[:, Role.RESISTOR] == 0),
+    ),
+)
+
+
+@dataclass
+class _Netlist:
+    """複数の回路を連結した、ERC用の配列表現"""
+
+    counts: np.ndarray
+    net_circuit: np.ndarray
+    net_id: np.ndarray
+    led_circuit: np.ndarray
+    led_ids: list[str]
+    led_anode: np.ndarray
+    led_cathode: np.ndarray
+    source_circuit: np.ndarray
+    source_ids: list[str]
+    source_pos: np.ndarray
+    source_neg: np.ndarray
+
+
+def _pin_role(
+    circuit: CompiledCircuit, pin: PinRef, directions: dict[PinRef, str | None]
+) -> Role:
+    kind = circuit.components[pin.component_id].type.lower()
+    name = pin.name.lower()
+    if kind in VIRTUAL_TYPES:
+        # ジャンクションとモジュールのポートは信号を素通しするだけ
+        return Role.JUNCTION
+    if kind in VOLTAGE_SOURCE_TYPES and name in POSITIVE_TERMINALS:
+        return Role.POWER_POS
+    if kind in VOLTAGE_SOURCE_TYPES and name in NEGATIVE_TERMINALS:
+        return Role.POWER_NEG
+    if kind == "resistor":
+        return Role.RESISTOR
+    direction = (directions.get(pin) or "").lower()
+    if direction == "input":
+        return Role.INPUT
+    if direction == "output":
+        return Role.OUTPUT
+    return Role.PASSIVE
+
+
+def _netlist(circuits: Sequence[CompiledCircuit]) -> _Netlist:
+    pin_net: list[int] = []
+    pin_role: list[int] = []
+    net_circuit: list[int] = []
+    net_id: list[int] = []
+    led_circuit: list[int] = []
+    led_ids: list[str] = []
+    led_nets: list[tuple[int, int]] = []
+    source_circuit: list[int] = []
+    source_ids: list[str] = []
+    source_nets: list[tuple[int, int]] = []
+
+    offset = 0
+    for index, circuit in enumerate(circuits):
+        directions = {
+            PinRef(c.id, p.name): p.direction
+            for c in circuit.components.values()
+            for p in c.ports
+        }
+        pins_of: dict[str, list[PinRef]] = {}
+        for pin, net in circuit.net_of.items():
+            pin_net.append(offset + net)
+            pin_role.append(_pin_role(circuit, pin, directions))
+            pins_of.setdefault(pin.component_id, []).append(pin)
+        for c in circuit.components.values():
+            pins = pins_of.get(c.id, [])
+            if c.type.lower() in VOLTAGE_SOURCE_TYPES:
+                pos = next(
+                    (p for p in pins if p.name.lower() in POSITIVE_TERMINALS), None
+                )
+                neg = next(
+                    (p for p in pins if p.name.lower() in NEGATIVE_TERMINALS), None
+                )
+                if pos is not None and neg is not None:
+                    source_circuit.append(index)
+                    source_ids.append(c.id)
+                    source_nets.append(
+                        (offset + circuit.net_of[pos], offset + circuit.net_of[neg])
+                    )
+            if c.type.lower() != "led" or len(pins) < 2:
+                continue
+            by_name = {p.name.lower(): p for p in pins}
+            anode = by_name.get("anode", pins[0])
+            cathode = by_name.get("cathode", pins[-1])
+            led_circuit.append(index)
+            led_ids.append(c.id)
+            led_nets.append(
+                (offset + circuit.net_of[anode], offset + circuit.net_of[cathode])
+            )
+        net_circuit += [index] * len(circuit.nets)
+        net_id += [net.id for net in circuit.nets]
+        offset += len(circuit.nets)
+
+    counts = np.zeros((offset, len(Role)), dtype=np.int64)
+    np.add.at(counts, (np.array(pin_net, dtype=np.intp), np.array(pin_role)), 1)
+    nets = np.array(led_nets, dtype=np.intp).reshape(-1, 2)
+    sources = np.array(source_nets, dtype=np.intp).reshape(-1, 2)
+    return _Netlist(
+        counts=counts,
+        net_circuit=np.array(net_circuit, dtype=np.intp),
+        net_id=np.array(net_id, dtype=np.intp),
+        led_circuit=np.array(led_circuit, dtype=np.intp),
+        led_ids=led_ids,
+        led_anode=nets[:, 0],
+        led_cathode=nets[:, 1],
+        source_circuit=np.array(source_circuit, dtype=np.intp),
+        source_ids=source_ids,
+        source_pos=sources[:, 0],
+        source_neg=sources[:, 1],
+    )
+
+
+def _evaluate(circuits: Sequence[CompiledCircuit]) -> list[list[Violation]]:
+    results: list[list[Violation]] = [[] for _ in circuits]
+    if not circuits:
+        return results
+    netlist = _netlist(circuits)
+    for rule in NET_RULES:
+        for net in np.flatnonzero(rule.when(netlist.counts)):
+            results[netlist.net_circuit[net]].append(
+                Violation(
+                    rule.code, rule.severity, rule.message, net=int(netlist.net_id[net])
+                )
+            )
+    for source_rule in SOURCE_RULES:
+        hits = source_rule.when(netlist.source_pos, netlist.source_neg)
+        for source in np.flatnonzero(hits):
+            results[netlist.source_circuit[source]].append(
+                Violation(
+                    source_rule.code,
+                    source_rule.severity,
+                    source_rule.message,
+                    net=int(netlist.net_id[netlist.source_pos[source]]),
+                    component_id=netlist.source_ids[source],
+                )
+            )
+    for led_rule in LED_RULES:
+        hits = led_rule.when(
+            netlist.counts[netlist.led_anode], netlist.counts[netlist.led_cathode]
+        )
+        for led in np.flatnonzero(hits):
+            results[netlist.led_circuit[led]].append(
+                Violation(
+                    led_rule.code,
+                    led_rule.severity,
+                    led_rule.message,
+                    component_id=netlist.led_ids[led],
+                )
+            )
+    return results
+
+
+class ERCEngine:
+    def __init__(self, cache_size: int = ERC_CACHE_SIZE) -> None:
+        self.cache: LRUCache[str, tuple[Violation, ...]] = LRUCache(cache_size)
+
+    def check(self, circuit: CompiledCircuit) -> list[Violation]:
+        return self.check_many([circuit])[0]
+
+    def check_many(self, circuits: Sequence[CompiledCircuit]) -> list[list[Violation]]:
+        """
+        複数の回路をまとめてチェックする。キャッシュにない回路だけを1回で評価する
+        """
+        cached = [self.cache.get(c.definition_hash) for c in circuits]
+        pending: dict[str, CompiledCircuit] = {}
+        for circuit, hit in zip(circuits, cached, strict=True):
+            if hit is None:
+                pending.setdefault(circuit.definition_hash, circuit)
+        fresh = dict(zip(pending, _evaluate(list(pending.values())), strict=True))
+        for key, violations in fresh.items():
+            self.cache.put(key, tuple(violations))
+
+        return [
+            list(hit if hit is not None else fresh[c.definition_hash])
+            for c, hit in zip(circuits, cached, strict=True)
+        ]
+
+
+erc_engine = ERCEngine()
@@ -0,0 +1,170 @@
+"""
+回路の構造フィンガープリントと類似回路検索
+
+ネットリストを「部品ノード - ネットノード」の二部グラフとみなし、
+Weisfeiler-Lehman (WL) ハッシュで部品種別と接続構造をラベルの多重集合に変換する。
+その集合の MinHash シグネチャを LSH のバケットに登録しておくことで、
+全件とのグラフ比較をせずに類似回路の候補を引ける。
+"""
+
+import hashlib
+import threading
+from collections import Counter, defaultdict
+from collections.abc import Callable, Hashable, Sequence
+from typing import Generic, TypeVar
+
+import numpy as np
+
+from app.circuits.compiler import CompiledCircuit
+
+NUM_PERM = 64
+LSH_BANDS = 16
+WL_ITERATIONS = 3
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_CHUNK_SIZE = 4096
+
+K = TypeVar("K", bound=Hashable)
+
+# シグネチャは保存して比較するため、置換のパラメータは固定シードで決める
+_rng = np.random.RandomState(20240731)
+_PERM_A = _rng.randint(1, (1 << 61) - 1, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, (1 << 61) - 1, size=NUM_PERM, dtype=np.uint64)
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little"
+    )
+
+
+def wl_shingles(circuit: CompiledCircuit, iterations: int = WL_ITERATIONS) -> list[int]:
+    """
+    WLラベルの多重集合を、MinHashに渡せる整数の集合に変換する
+    """
+    labels: dict[str, int] = {}
+    adjacency: dict[str, list[str]] = defaultdict(list)
+    for component in circuit.components.values():
+        if not component.is_virtual:
+            labels[component.id] = _hash64(component.type.lower())
+    for net in circuit.nets:
+        members = {pin.component_id for pin in net.pins} & labels.keys()
+        if not members:
+            continue
+        net_node = f"#net{net.id}"
+        labels[net_node] = _hash64("#net")
+        for member in sorted(members):
+            adjacency[net_node].append(member)
+            adjacency[member].append(net_node)
+
+    counts: Counter[int] = Counter(labels.values())
+    for _ in range(iterations):
+        labels = {
+            node: _hash64(
+                f"{label}|{','.join(sorted(str(labels[n]) for n in adjacency[node]))}"
+            )
+            for node, label in labels.items()
+        }
+        counts.update(labels.values())
+
+    # 同じラベルの出現回数も区別したいので、(ラベル, 何番目か) を要素とする
+    return [_hash64(f"{label}:{i}") for label, n in counts.items() for i in range(n)]
+
+
+def minhash_signature(shingles: Sequence[int]) -> list[int]:
+    signature = np.full(NUM_PERM, _MAX_HASH, dtype=np.uint64)
+    values = np.array(shingles, dtype=np.uint64) & _MAX_HASH
+    # 大きな回路でも (要素数 x NUM_PERM) の行列を一度に作らないよう分割する
+    for start in range(0, len(values), _CHUNK_SIZE):
+        chunk = values[start : start + _CHUNK_SIZE, None]
+        hashed = ((chunk * _PERM_A + _PERM_B) % _MERSENNE_PRIME) & _MAX_HASH
+        signature = np.minimum(signature, hashed.min(axis=0))
+    return [int(v) for v in signature]
+
+
+def circuit_fingerprint(circuit: CompiledCircuit) -> list[int]:
+    return minhash_signature(wl_shingles(circuit))
+
+
+def estimate_similarity(a: Sequence[int], b: Sequence[int]) -> float:
+    """MinHashシグネチャから Jaccard 類似度を推定する"""
+    return float(np.mean(np.asarray(a) == np.asarray(b)))
+
+
+class MinHashLSHIndex(Generic[K]):
+    """
+    MinHashシグネチャをバンドに分割してハッシュバケットに登録するLSHインデックス
+
+    クエリはバンドが一致した候補だけをシグネチャで比較するので、
+    登録件数に対して準線形で上位k件を返せる。
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, bands: int = LSH_BANDS) -> None:
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.rows = num_perm // bands
+        self.bands = bands
+        self._buckets: list[dict[tuple[int, ...], set[K]]] = [
+            defaultdict(set) for _ in range(bands)
+        ]
+        self._signatures: dict[K, list[int]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._signatures
+
+    def _band_keys(self, signature: Sequence[int]) -> list[tuple[int, ...]]:
+        return [
+            tuple(signature[i * self.rows : (i + 1) * self.rows])
+            for i in range(self.bands)
+        ]
+
+    def insert(self, key: K, signature: Sequence[int]) -> None:
+        with self._lock:
+            if key in self._signatures:
+                self._remove(key)
+            self._signatures[key] = list(signature)
+            for band, band_key in zip(
+                self._buckets, self._band_keys(signature), strict=True
+            ):
+                band[band_key].add(key)
+
+    def remove(self, key: K) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key: K) -> None:
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        for band, band_key in zip(
+            self._buckets, self._band_keys(signature), strict=True
+        ):
+            band[band_key].discard(key)
+            if not band[band_key]:
+                del band[band_key]
+
+    def query(
+        self,
+        signature: Sequence[int],
+        k: int,
+        *,
+        accept: Callable[[K], bool] | None = None,
+    ) -> list[tuple[K, float]]:
+        with self._lock:
+            candidates: set[K] = set()
+            for band, band_key in zip(
+                self._buckets, self._band_keys(signature), strict=True
+            ):
+                candidates |= band.get(band_key, set())
+            scored = [
+                (key, estimate_similarity(signature, self._signatures[key]))
+                for key in candidates
+                if accept is None or accept(key)
+            ]
+        scored.sort(key=lambda item: (-item[1], str(item[0])))
+        return scored[:k]
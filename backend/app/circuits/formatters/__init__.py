@@ -0,0 +1,5 @@
+from .base import FileFormatter
+from .spice import SpiceFormatter
+from .svg import SvgPreviewFormatter
+
+__all__ = ["FileFormatter", "SpiceFormatter", "SvgPreviewFormatter"]
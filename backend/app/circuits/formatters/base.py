@@ -0,0 +1,31 @@
+from abc import ABC, abstractmethod
+from collections.abc import Iterable, Iterator
+
+from app.circuits.compiler import CompiledCircuit
+
+
+class FileFormatter(ABC):
+    """
+    回路データを特定のファイル形式に変換するフォーマッターの共通インターフェース
+
+    大きな回路でも全体を1つの文字列に組み立てずに済むよう、出力は文字列の断片を
+    順に返すイテレーターとする。
+    """
+
+    media_type: str
+    extension: str
+
+    @abstractmethod
+    def format(self, circuit: CompiledCircuit) -> Iterator[str]: ...
+
+
+def chunked(parts: Iterable[str], size: int) -> Iterator[str]:
+    """細かい断片を `size` 個ずつまとめて返す (StreamingResponse のチャンク数を抑える)"""
+    buffer: list[str] = []
+    for part in parts:
+        buffer.append(part)
+        if len(buffer) >= size:
+            yield "".join(buffer)
+            buffer.clear()
+    if buffer:
+        yield "".join(buffer)
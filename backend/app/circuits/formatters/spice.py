@@ -0,0 +1,210 @@
+"""
+SPICEネットリストのフォーマッター
+
+コンパイル済み回路のネット (Union-Find でまとめたもの) から `.cir` 形式の
+ネットリストを行単位で生成する。モジュールは `.SUBCKT` として定義し、
+インスタンスは `X` 行で参照する。中身が同じモジュールの定義は1回だけ出力するので、
+出力の大きさはインスタンス数ではなく、異なるモジュールの種類数に比例する。
+"""
+
+import re
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+
+from app.circuits.analysis import VOLTAGE_SOURCE_TYPES, oriented_pins
+from app.circuits.compiler import (
+    PATH_SEPARATOR,
+    CompiledCircuit,
+    Component,
+    Connection,
+    PinRef,
+    build_nets,
+)
+from app.circuits.formatters.base import FileFormatter, chunked
+from app.circuits.units import parse_quantity
+
+# StreamingResponse に渡す1チャンクあたりの行数
+LINES_PER_CHUNK = 256
+GROUND_NODE = "0"
+
+# 部品の種類 -> (SPICEの素子記号, 値のプロパティ, 単位)
+ELEMENTS: dict[str, tuple[str, str, str]] = {
+    "resistor": ("R", "resistance", "ohm"),
+    "capacitor": ("C", "capacitance", "F"),
+    "inductor": ("L", "inductance", "H"),
+    "current_source": ("I", "current", "A"),
+    **{kind: ("V", "voltage", "V") for kind in sorted(VOLTAGE_SOURCE_TYPES)},
+}
+# ダイオードのモデル (LEDは順方向電圧が約2Vになるパラメータ)
+DIODE_MODELS = {
+    "diode": "D(IS=1e-14 N=1 RS=0.1)",
+    "led": "D(IS=1e-22 N=1.5 RS=1)",
+}
+
+
+def _name(value: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_]", "_", value)
+
+
+def _comment(value: str) -> str:
+    return " ".join(value.split())
+
+
+def _number(value: float) -> str:
+    return f"{value:.6g}"
+
+
+@dataclass
+class _Scope:
+    """回路全体または1つのモジュールの中の、直下の部品と接続"""
+
+    components: list[Component] = field(default_factory=list)
+    connections: list[Connection] = field(default_factory=list)
+
+
+class SpiceFormatter(FileFormatter):
+    media_type = "text/plain"
+    extension = "cir"
+
+    def format(self, circuit: CompiledCircuit) -> Iterator[str]:
+        return chunked(_Writer(circuit).lines(), LINES_PER_CHUNK)
+
+
+class _Writer:
+    def __init__(self, circuit: CompiledCircuit) -> None:
+        self.circuit = circuit
+        self.scopes: dict[str | None, _Scope] = {}
+        for c in circuit.components.values():
+            self.scopes.setdefault(c.parent, _Scope()).components.append(c)
+        for conn in circuit.connections:
+            self.scopes.setdefault(conn.parent, _Scope()).connections.append(conn)
+        self.pins_of: dict[str, list[PinRef]] = {}
+        for pin in circuit.net_of:
+            self.pins_of.setdefault(pin.component_id, []).append(pin)
+        # モジュールID -> サブサーキット名
+        self.subckt_of: dict[str, str] = {}
+
+    def lines(self) -> Iterator[str]:
+        circuit = self.circuit
+        yield f"* {_comment(circuit.name or 'circuit')}\n"
+        if circuit.description:
+            yield f"* {_comment(circuit.description)}\n"
+        kinds = {c.type.lower() for c in circuit.components.values()}
+        for kind, model in DIODE_MODELS.items():
+            if kind in kinds:
+                yield f".model {kind.upper()} {model}\n"
+
+        # 入れ子のモジュールは、参照する側より先に定義する
+        definitions: dict[tuple[str, ...], str] = {}
+        names: set[str] = set()
+        modules = sorted(
+            (c for c in circuit.components.values() if c.type.lower() == "module"),
+            key=lambda c: -c.id.count(PATH_SEPARATOR),
+        )
+        for module in modules:
+            ports = [_name(pin.name) for pin in self.pins_of.get(module.id, [])]
+            body = list(self._subckt_body(module))
+            key = (*ports, "", *body)
+            subckt = definitions.get(key)
+            if subckt is None:
+                subckt = self._unique_name(module, names)
+                definitions[key] = subckt
+                yield f".SUBCKT {subckt} {' '.join(ports)}\n"
+                yield from body
+                yield ".ENDS\n"
+            self.subckt_of[module.id] = subckt
+
+        top = self.scopes.get(None, _Scope())
+        yield from self._elements(top.components, self._top_nodes(), "")
+        yield ".end\n"
+
+    def _is_ground(self, pin: PinRef) -> bool:
+        return self.circuit.components[pin.component_id].type.lower() == "ground"
+
+    def _unique_name(self, module: Component, names: set[str]) -> str:
+        label = module.properties.get("name") or module.id.rsplit(PATH_SEPARATOR)[-1]
+        base = _name(str(label)).upper()
+        name, n = base, 1
+        while name in names:
+            n += 1
+            name = f"{base}_{n}"
+        names.add(name)
+        return name
+
+    def _top_nodes(self) -> dict[PinRef, str]:
+        net_of = self.circuit.net_of
+        grounds = {net for pin, net in net_of.items() if self._is_ground(pin)}
+        if not grounds:
+            # グラウンド部品がなければ最初の電源の負側をグラウンドとする (DC解析と同じ)
+            for c in self.circuit.components.values():
+                pins = oriented_pins(self.pins_of.get(c.id, []))
+                if c.type.lower() in VOLTAGE_SOURCE_TYPES and len(pins) >= 2:
+                    grounds.add(net_of[pins[-1]])
+                    break
+        return {
+            pin: GROUND_NODE if net in grounds else f"N{net}"
+            for pin, net in net_of.items()
+        }
+
+    def _subckt_body(self, module: Component) -> Iterator[str]:
+        """
+        モジュール内のネットを、ポート名とモジュール内で振り直した番号で表す
+
+        インスタンスによらない表現にするため、部品IDはモジュールからの相対IDにする。
+        """
+        scope = self.scopes.get(module.id, _Scope())
+        pins = [
+            pin
+            for c in [module, *scope.components]
+            for pin in self.pins_of.get(c.id, [])
+        ]
+        nets, net_of = build_nets(pins, scope.connections)
+        node_of_net = {
+            net.id: GROUND_NODE
+            for net in nets
+            if any(self._is_ground(pin) for pin in net.pins)
+        }
+        for pin in self.pins_of.get(module.id, []):
+            port_net, port = net_of[pin], _name(pin.name)
+            if port_net in node_of_net:
+                # 同じネットに繋がった別のポートは0Vの電源で短絡する
+                yield f"V{port}_tie {node_of_net[port_net]} {port} DC 0\n"
+            else:
+                node_of_net[port_net] = port
+        for net in nets:
+            node_of_net.setdefault(net.id, f"N{len(node_of_net)}")
+        nodes = {pin: node_of_net[net] for pin, net in net_of.items()}
+        yield from self._elements(scope.components, nodes, module.id + PATH_SEPARATOR)
+
+    def _elements(
+        self, components: list[Component], nodes: dict[PinRef, str], prefix: str
+    ) -> Iterator[str]:
+        for c in components:
+            kind = c.type.lower()
+            id = _name(c.id.removeprefix(prefix))
+            if kind in ("junction", "ground"):
+                continue
+            if kind == "module":
+                terminals = [nodes[pin] for pin in self.pins_of.get(c.id, [])]
+                yield f"X{id} {' '.join([*terminals, self.subckt_of[c.id]])}\n"
+                continue
+            pins = oriented_pins(self.pins_of.get(c.id, []))
+            if len(pins) < 2:
+                yield f"* {id}: {_comment(c.type)} is not connected\n"
+                continue
+            pos, neg = nodes[pins[0]], nodes[pins[-1]]
+            if kind in DIODE_MODELS:
+                yield f"D{id} {pos} {neg} {kind.upper()}\n"
+                continue
+            if kind not in ELEMENTS:
+                yield f"* {id}: {_comment(c.type)} is not modeled\n"
+                continue
+            symbol, key, unit = ELEMENTS[kind]
+            try:
+                value = _number(parse_quantity(c.properties[key], unit))
+            except (KeyError, ValueError):
+                yield f"* {id}: missing or invalid {key}\n"
+                continue
+            if symbol in ("V", "I"):
+                value = f"DC {value}"
+            yield f"{symbol}{id} {pos} {neg} {value}\n"
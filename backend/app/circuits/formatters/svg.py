@@ -0,0 +1,373 @@
+"""
+SVGプレビューのフォーマッター
+
+表示範囲 (viewport) が指定された場合は、レイアウトの空間インデックスで
+範囲と交差する要素だけを出力する。ズーム倍率が小さいときはモジュールを
+枠だけに畳み、ラベルを省略する (Level of Detail)。
+色や線の太さは要素に直接書かず、CSSクラスで指定する。テーマはルート直下の
+`<style>` だけで決まるので、テーマを変えても図形の部分は同じ出力になる。
+座標は格子 (quantum) に丸めてから出力する。配線は一直線上の点を除き、
+同じネットの配線を1つのパスにまとめて相対コマンド (h/v/l) で書くので、
+同じ入力からは常に同じ (小さな) 出力になる。
+"""
+
+import math
+import re
+from collections.abc import Iterable, Iterator
+from decimal import Decimal
+from itertools import groupby
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+
+from app.circuits.compiler import CompiledCircuit
+from app.circuits.formatters.base import FileFormatter, chunked
+from app.circuits.layout import Box, Layout, PlacedComponent, Wire, compute_layout
+
+# この倍率未満ではモジュールの中身を描かず、枠だけにする
+MODULE_DETAIL_ZOOM = 0.5
+# この倍率未満ではラベルを描かない
+LABEL_ZOOM = 0.75
+# 回路全体を表示するときの余白
+MARGIN = 20.0
+# ラベルは部品の外接矩形の外側に描くので、その分だけ広く検索する
+LABEL_MARGIN = 16.0
+# StreamingResponse に渡す1チャンクあたりの要素数
+ELEMENTS_PER_CHUNK = 256
+# 座標を丸める格子の間隔の既定値と、指定できる範囲
+COORDINATE_QUANTUM = 0.5
+MIN_QUANTUM = 1e-4
+MAX_QUANTUM = 100.0
+
+# テーマ名 -> 配色
+THEMES: dict[str, dict[str, str]] = {
+    "light": {
+        "background": "#ffffff",
+        "ink": "#222222",
+        "wire": "#222222",
+        "module": "#888888",
+    },
+    "dark": {
+        "background": "#1e1e1e",
+        "ink": "#e0e0e0",
+        "wire": "#4fc3f7",
+        "module": "#9e9e9e",
+    },
+}
+STYLESHEET = (
+    ".background{{fill:{background};stroke:none}}"
+    ".component,.module,.wire{{fill:none;stroke:{ink};stroke-width:2}}"
+    ".wire{{stroke:{wire}}}"
+    ".module>rect{{stroke:{module};stroke-dasharray:6 3}}"
+    ".junction>circle{{fill:{ink}}}"
+    ".label{{fill:{ink};stroke:none;font-family:sans-serif;font-size:10px}}"
+    ".component>.label{{text-anchor:middle}}"
+)
+
+
+Point = tuple[float, float]
+
+
+class Quantizer:
+    """座標を `quantum` の倍数に丸めて、最短の十進表記にする ("-0.50" -> "-.5")"""
+
+    def __init__(self, quantum: float) -> None:
+        if not MIN_QUANTUM <= quantum <= MAX_QUANTUM:
+            raise ValueError(
+                f"quantum must be between {MIN_QUANTUM:g} and {MAX_QUANTUM:g}"
+            )
+        self.quantum = quantum
+        # 格子の間隔の最短の十進表記 (repr) の小数点以下の桁数
+        exponent = Decimal(repr(quantum)).normalize().as_tuple().exponent
+        self.decimals = max(0, -int(exponent))
+
+    def snap(self, value: float) -> float:
+        return round(value / self.quantum) * self.quantum
+
+    def __call__(self, value: float) -> str:
+        text = f"{self.snap(value):.{self.decimals}f}"
+        if "." in text:
+            text = text.rstrip("0").rstrip(".")
+        if text in ("", "-", "-0"):
+            return "0"
+        if text.startswith(("0.", "-0.")):
+            text = text.replace("0.", ".", 1)
+        return text
+
+
+def _pair(a: str, b: str) -> str:
+    """2つの数値を、区切りが不要なら詰めて並べる ("1.5 .5" -> "1.5.5")"""
+    if b.startswith("-") or (b.startswith(".") and "." in a):
+        return a + b
+    return f"{a} {b}"
+
+
+def _simplify(points: list[Point], tolerance: float) -> list[Point]:
+    """
+    Ramer-Douglas-Peucker 法で折れ線の点を間引く
+
+    元の折れ線からのずれが `tolerance` 以下の点を除くので、一直線上の点
+    (直交配線の余分な曲がり角など) は tolerance が0でも除かれる。
+    """
+    if len(points) < 3:
+        return points
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (ax, ay), (bx, by) = points[first], points[last]
+        dx, dy = bx - ax, by - ay
+        length = math.hypot(dx, dy)
+        farthest, distance = first, tolerance
+        for i in range(first + 1, last):
+            px, py = points[i]
+            if length:
+                d = abs(dx * (py - ay) - dy * (px - ax)) / length
+            else:
+                d = math.hypot(px - ax, py - ay)
+            if d > distance:
+                farthest, distance = i, d
+        if farthest != first:
+            keep[farthest] = True
+            stack += [(first, farthest), (farthest, last)]
+    return [p for p, k in zip(points, keep, strict=True) if k]
+
+
+def path_data(polylines: Iterable[list[Point]], num: Quantizer) -> str:
+    """
+    折れ線を格子に丸めて間引き、相対コマンドのパスデータにする
+
+    間引きの許容誤差は格子の半分 (丸めで既に生じうる誤差) にする。
+    差分は丸めた座標同士で取るので、相対コマンドでも誤差は積み重ならない。
+    """
+    d = []
+    current: Point | None = None
+    for polyline in polylines:
+        points: list[Point] = []
+        for x, y in polyline:
+            p = (num.snap(x), num.snap(y))
+            if not points or p != points[-1]:
+                points.append(p)
+        if len(points) < 2:
+            continue
+        (x, y), *rest = _simplify(points, num.quantum / 2)
+        # 前の折れ線の終点から続く場合は M を省く
+        if (x, y) != current:
+            d.append("M" + _pair(num(x), num(y)))
+        for nx, ny in rest:
+            if num(ny - y) == "0":
+                d.append("h" + num(nx - x))
+            elif num(nx - x) == "0":
+                d.append("v" + num(ny - y))
+            else:
+                d.append("l" + _pair(num(nx - x), num(ny - y)))
+            x, y = nx, ny
+        current = (x, y)
+    return "".join(d)
+
+
+def _symbol(c: PlacedComponent, num: Quantizer) -> str:
+    """部品の中心を原点としたシンボルの図形"""
+    w, h = c.width / 2, c.height / 2
+    if c.kind == "junction":
+        return f'<circle r="{num(w)}"/>'
+    if c.kind == "resistor":
+        leads = path_data([[(-w, 0), (-w + 10, 0)], [(w - 10, 0), (w, 0)]], num)
+        return (
+            f'<path d="{leads}"/><rect x="{num(-w + 10)}" y="{num(-h)}" '
+            f'width="{num(c.width - 20)}" height="{num(c.height)}"/>'
+        )
+    if c.kind == "capacitor":
+        d = path_data(
+            [
+                [(-w, 0), (-4, 0)],
+                [(4, 0), (w, 0)],
+                [(-4, -h), (-4, h)],
+                [(4, -h), (4, h)],
+            ],
+            num,
+        )
+        return f'<path d="{d}"/>'
+    if c.kind in ("led", "diode"):
+        d = path_data(
+            [
+                [(-w, 0), (w, 0)],
+                [(-8, -h), (-8, h), (8, 0), (-8, -h)],
+                [(8, -h), (8, h)],
+            ],
+            num,
+        )
+        return f'<path d="{d}"/>'
+    return (
+        f'<rect x="{num(-w)}" y="{num(-h)}" '
+        f'width="{num(c.width)}" height="{num(c.height)}"/>'
+    )
+
+
+def _definitions(
+    components: list[PlacedComponent], num: Quantizer
+) -> tuple[str, dict[tuple[str, float, float], str]]:
+    """
+    シンボルの図形を `<defs>` に1回だけ定義し、部品からは `<use>` で参照する
+
+    (種類, 幅, 高さ) -> 定義のID も返す。IDは種類の名前から作るので、
+    表示範囲や編集で他の部品が増減しても、同じ部品の出力は変わらない。
+    """
+    ids: dict[tuple[str, float, float], str] = {}
+    shapes = []
+    for c in components:
+        key = (c.kind, c.width, c.height)
+        if c.kind == "module" or key in ids:
+            continue
+        base = "s-" + re.sub(r"[^a-z0-9_-]", "_", c.kind)
+        id, n = base, 1
+        while id in ids.values():
+            n += 1
+            id = f"{base}-{n}"
+        ids[key] = id
+        shapes.append(
+            f"<g id={quoteattr(id)} class={quoteattr(c.kind)}>{_symbol(c, num)}</g>"
+        )
+    return (f"<defs>{''.join(shapes)}</defs>" if shapes else ""), ids
+
+
+def _component(c: PlacedComponent, symbol: str, label: bool, num: Quantizer) -> str:
+    transform = f"translate({num(c.x)} {num(c.y)})"
+    if c.rotation:
+        transform += f" rotate({num(c.rotation)})"
+    text = (
+        f'<text class="label" y="{num(-c.height / 2 - 4)}">{escape(c.label)}</text>'
+        if label and c.kind != "junction"
+        else ""
+    )
+    return (
+        f"<g class={quoteattr('component ' + c.kind)} data-id={quoteattr(c.id)} "
+        f'transform="{transform}"><use href="#{symbol}"/>{text}</g>'
+    )
+
+
+def _module(c: PlacedComponent, label: bool, num: Quantizer) -> str:
+    text = (
+        f'<text class="label" x="{num(c.box.x0 + 4)}" '
+        f'y="{num(c.box.y0 - 4)}">{escape(c.label)}</text>'
+        if label
+        else ""
+    )
+    return (
+        f'<g class="module" data-id={quoteattr(c.id)}><rect x="{num(c.box.x0)}" '
+        f'y="{num(c.box.y0)}" width="{num(c.box.width)}" '
+        f'height="{num(c.box.height)}"/>{text}</g>'
+    )
+
+
+def _wires(wires: list[Wire], num: Quantizer) -> Iterator[tuple[int, str]]:
+    """同じネットの (連続する) 配線を1つのパスにまとめる"""
+    for net_id, group in groupby(wires, key=lambda w: w.net_id):
+        d = path_data((w.points for w in group), num)
+        if d:
+            yield net_id, f'<path class="wire" d="{d}" data-net="{net_id}"/>'
+
+
+class SvgPreviewFormatter(FileFormatter):
+    media_type = "image/svg+xml"
+    extension = "svg"
+
+    def __init__(
+        self,
+        *,
+        viewport: Box | None = None,
+        zoom: float = 1.0,
+        placement: str = "grid",
+        minimize_crossings: bool = False,
+        theme: str = "light",
+        quantum: float = COORDINATE_QUANTUM,
+    ) -> None:
+        if theme not in THEMES:
+            raise ValueError(f"unknown theme {theme!r}")
+        self.theme = theme
+        self.num = Quantizer(quantum)
+        self.viewport = viewport
+        self.zoom = zoom
+        self.placement = placement
+        self.minimize_crossings = minimize_crossings
+
+    def format(self, circuit: CompiledCircuit) -> Iterator[str]:
+        return self.render(
+            compute_layout(
+                circuit, self.placement, minimize_crossings=self.minimize_crossings
+            )
+        )
+
+    def render(self, layout: Layout) -> Iterator[str]:
+        view = self.view(layout)
+        num = self.num
+        # レイアウトの品質の記録 (交差数など) は data 属性として残す
+        metadata = "".join(
+            f' data-{key.replace("_", "-")}="{value}"'
+            for key, value in layout.metadata.items()
+        )
+        yield (
+            '<svg xmlns="http://www.w3.org/2000/svg" '
+            f'viewBox="{self.view_box(view)}" '
+            f'width="{num(view.width * self.zoom)}" '
+            f'height="{num(view.height * self.zoom)}"{metadata}>'
+        )
+        yield self.stylesheet()
+        yield (
+            f'<rect class="background" x="{num(view.x0)}" y="{num(view.y0)}" '
+            f'width="{num(view.width)}" height="{num(view.height)}"/>'
+        )
+        yield from chunked(
+            (svg for _, svg in self._fragments(layout, view)), ELEMENTS_PER_CHUNK
+        )
+        yield "</svg>"
+
+    def view(self, layout: Layout) -> Box:
+        return self.viewport or layout.bounds.expand(MARGIN)
+
+    def view_box(self, view: Box) -> str:
+        num = self.num
+        return f"{num(view.x0)} {num(view.y0)} {num(view.width)} {num(view.height)}"
+
+    def stylesheet(self) -> str:
+        return f"<style>{STYLESHEET.format(**THEMES[self.theme])}</style>"
+
+    def fragments(self, layout: Layout) -> dict[str, str]:
+        """
+        描画する要素を キー -> SVG断片 の (描画順の) 辞書で返す
+
+        キーは "defs", "module:<ID>", "wire:<ネットID>", "component:<ID>" で、
+        2回の描画の差分 (変わった要素だけの更新) を求めるのに使う。
+        """
+        return dict(self._fragments(layout, self.view(layout)))
+
+    def _fragments(self, layout: Layout, view: Box) -> Iterator[tuple[str, str]]:
+        detail = self.zoom >= MODULE_DETAIL_ZOOM
+        label = self.zoom >= LABEL_ZOOM
+        # 出力の順序を表示範囲によらず一定にするため、レイアウト内の順に並べる
+        hits = np.sort(layout.index.query(view.expand(LABEL_MARGIN).as_tuple()))
+        n = len(layout.components)
+        components = [
+            c
+            for c in (layout.components[i] for i in hits[hits < n])
+            if detail or c.parent is None
+        ]
+        wires = [
+            w
+            for w in (layout.wires[i - n] for i in hits[hits >= n])
+            if detail or w.owner is None
+        ]
+
+        definitions, symbols = _definitions(components, self.num)
+        yield "defs", definitions
+        # モジュールの枠 -> ワイヤー -> 部品 の順に重ねる
+        for c in components:
+            if c.kind == "module":
+                yield f"module:{c.id}", _module(c, label, self.num)
+        for net_id, svg in _wires(wires, self.num):
+            yield f"wire:{net_id}", svg
+        for c in components:
+            if c.kind != "module":
+                symbol = symbols[c.kind, c.width, c.height]
+                yield f"component:{c.id}", _component(c, symbol, label, self.num)
@@ -0,0 +1,458 @@
+"""
+文章からの回路生成
+
+テキストエンジンの出力 (回路YAML) はストリーミングで受け取りながら検証し、
+構文エラーや id・type の無い部品のように局所的には直せない誤りが見つかった
+時点で生成を打ち切る (残りの出力を待たずに済む)。
+出力を最後まで受け取れたら、よくある小さな誤り (存在しない部品への接続、
+重複した部品ID) をその場で直す。それでもコンパイルできない場合や打ち切った
+場合は、壊れたセクション (`components` か `connections`) だけをエンジンに
+生成し直させる。
+"""
+
+import copy
+from collections.abc import AsyncGenerator, Callable, Sequence
+from dataclasses import dataclass, field
+from typing import Any
+
+import anyio
+
+from app.circuits.compiler import CompiledCircuit, compile_circuit
+from app.circuits.engines import CircuitExample, OpenAIEngine, TextAIEngine
+from app.circuits.live import dump_circuit_yaml
+from app.circuits.loader import CircuitYAMLError, YAMLLimits, load_circuit_yaml
+from app.circuits.timing import span
+from app.circuits.usage import usage_meter
+from app.core.config import settings
+
+# 回路定義のうち、生成し直させる単位
+SECTIONS = ("components", "connections")
+_FENCE = "```"
+# 出力がこの文字数を超えたら、読み込み直すのは前回読み込んだ長さからこの割合だけ
+# 伸びてから。読み込む長さが等比的に伸びるので、検証の手間は出力の長さに比例する
+RECHECK_MIN_CHARS = 1024
+RECHECK_GROWTH = 0.25
+
+
+class GenerationError(ValueError):
+    """有効な回路を生成できなかった場合の例外。`status_code` はそのままHTTP応答に使う"""
+
+    def __init__(self, message: str, status_code: int = 502) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _check_components(items: list[Any], where: str, closed: bool) -> str | None:
+    # リストの最後の要素は、まだ続きが届くかもしれないので `closed` でなければ見ない
+    for i, item in enumerate(items):
+        item_closed = closed or i < len(items) - 1
+        if item_closed:
+            if not isinstance(item, dict):
+                return f"'{where}[{i}]' must be a mapping."
+            if not isinstance(item.get("id"), str) or not item["id"]:
+                return f"'{where}[{i}].id' is required."
+            if not isinstance(item.get("type"), str) or not item["type"]:
+                return f"Component '{item['id']}' has no 'type'."
+        if isinstance(item, dict) and str(item.get("type", "")).lower() == "module":
+            internal = item.get("internal_components")
+            if isinstance(internal, list):
+                error = _check_components(
+                    internal, f"{where}[{i}].internal_components", item_closed
+                )
+                if error:
+                    return error
+    return None
+
+
+class StreamValidator:
+    """
+    エンジンの出力を断片ごとに受け取って検証する
+
+    新しいリスト要素 ("- ") の行が届くたびに、そこまでを読み込んで確かめる。
+    ただし出力が長くなると、前回読み込んだときから `RECHECK_GROWTH` の割合以上
+    伸びるまで読み込み直さない (毎回先頭から読み込むと2乗の手間になる)。
+    要素が閉じた (後ろに兄弟の要素が届き始めた) 部品から確かめるので、途中までしか
+    届いていない部品を誤りとはみなさない。出力がコードブロック (```) で
+    囲まれていれば、その外側の文章は無視する。
+    """
+
+    def __init__(self, limits: YAMLLimits | None = None) -> None:
+        self.limits = limits or YAMLLimits.from_settings()
+        self.lines: list[str] = []
+        # 最後に読み込めた部分 (打ち切った場合は誤りの手前まで)
+        self.document: dict[str, Any] | None = None
+        self.error: str | None = None
+        # 誤りが見つかったセクション (どのセクションか分からなければ None)
+        self.section: str | None = None
+        # 確かめ終わった (閉じた) トップレベルの部品の数
+        self.components = 0
+        self._tail = ""
+        self._checked = 0
+        self._fence = 0
+        # 受け取った文字数と、前回読み込んだときの文字数
+        self._chars = 0
+        self._checked_chars = 0
+        # `feed(defer=True)` で後回しにした確認 (そこまでの行数。無ければ 0)
+        self._pending = 0
+
+    @property
+    def text(self) -> str:
+        return "".join(self.lines)
+
+    @property
+    def pending(self) -> bool:
+        return self._pending > 0
+
+    def feed(self, chunk: str, defer: bool = False) -> bool:
+        """
+        断片を受け取る。生成を打ち切るべき誤りが見つかったら False を返す
+
+        `defer` を指定すると読み込んでの確認はせずに `pending` にしておくので、
+        `check_pending` を (イベントループの外で) 呼んで確かめる。
+        """
+        *lines, self._tail = (self._tail + chunk).split("\n")
+        for line in lines:
+            self._line(line, defer)
+            if self.error is not None:
+                return False
+        return True
+
+    def check_pending(self) -> bool:
+        """後回しにした確認をする。誤りが見つかったら False を返す"""
+        end, self._pending = self._pending, 0
+        if end:
+            self._check(end)
+        return self.error is None
+
+    def close(self) -> None:
+        """出力の終わり。最後の要素まで含めて確かめる"""
+        if self._tail:
+            self._line(self._tail)
+            self._tail = ""
+        self._pending = 0
+        if self.error is None:
+            self._check(len(self.lines), final=True)
+
+    def _line(self, line: str, defer: bool = False) -> None:
+        stripped = line.strip()
+        if stripped.startswith(_FENCE):
+            if self._fence == 0:
+                # コードブロックの前の文章 (前置き) は捨てる
+                self.lines.clear()
+                self._checked = self._pending = 0
+                self._chars = self._checked_chars = 0
+                self.document = None
+            self._fence += 1
+            return
+        if self._fence >= 2:
+            return
+        self.lines.append(line + "\n")
+        self._chars += len(line) + 1
+        if stripped != "-" and not stripped.startswith("- "):
+            return
+        grown = self._chars - self._checked_chars
+        if (
+            self._checked_chars > RECHECK_MIN_CHARS
+            and grown < RECHECK_GROWTH * self._checked_chars
+        ):
+            return
+        self._checked_chars = self._chars
+        if defer:
+            self._pending = len(self.lines)
+        else:
+            self._check(len(self.lines))
+
+    def _fail(self, error: str, line: int) -> None:
+        self.error = error
+        # 誤りの行より前で最後に始まったセクション
+        for text in reversed(self.lines[: line + 1]):
+            key = text.strip().split(":", 1)[0]
+            if key in SECTIONS:
+                self.section = key
+                return
+
+    def _check(self, end: int, final: bool = False) -> None:
+        if end <= self._checked and not final:
+            return
+        self._checked = end
+        text = "".join(self.lines[:end])
+        if not text.strip():
+            if final:
+                self._fail("The engine returned no circuit.", end)
+            return
+        try:
+            document = load_circuit_yaml(text, self.limits)
+        except CircuitYAMLError as e:
+            mark = getattr(e.__cause__, "problem_mark", None)
+            if final or mark is None or mark.line < end - 1:
+                self._fail(str(e), end if mark is None else mark.line)
+                return
+            # 最後の行の構文エラーは続きが届けば解消することがあるので、その手前までを見る
+            try:
+                document = load_circuit_yaml(
+                    "".join(self.lines[: end - 1]), self.limits
+                )
+            except CircuitYAMLError:
+                return
+
+        circuit = document.get("circuit")
+        if circuit is not None and not isinstance(circuit, dict):
+            self._fail("'circuit' must be a mapping.", end)
+            return
+        self.document = document
+        components = (circuit or {}).get("components")
+        if components is None:
+            return
+        if not isinstance(components, list):
+            error: str | None = "'circuit.components' must be a list."
+        else:
+            error = _check_components(components, "circuit.components", final)
+        if error:
+            self._fail(error, end)
+            self.section = "components"
+        elif isinstance(components, list):
+            self.components = len(components) - (0 if final else 1)
+
+
+def _unique_id(id: str, taken: set[str]) -> str:
+    n = 2
+    while f"{id}_{n}" in taken:
+        n += 1
+    return f"{id}_{n}"
+
+
+def _endpoint_id(end: Any) -> str | None:
+    if not isinstance(end, dict) or not isinstance(end.get("component_id"), str):
+        return None
+    return str(end["component_id"])
+
+
+def _repair_scope(
+    scope: dict[str, Any],
+    components_key: str,
+    connections_key: str,
+    module_id: str | None,
+    repairs: list[str],
+) -> None:
+    components = scope.get(components_key)
+    components = components if isinstance(components, list) else []
+    taken = {
+        c["id"]
+        for c in components
+        if isinstance(c, dict) and isinstance(c.get("id"), str)
+    }
+    seen: set[str] = set()
+    for component in components:
+        if not isinstance(component, dict) or not isinstance(component.get("id"), str):
+            continue
+        id = component["id"]
+        if id in seen:
+            component["id"] = _unique_id(id, taken)
+            taken.add(component["id"])
+            repairs.append(
+                f"Renamed duplicate component id '{id}' to '{component['id']}'."
+            )
+        seen.add(component["id"])
+        if str(component.get("type", "")).lower() == "module":
+            _repair_scope(
+                component,
+                "internal_components",
+                "internal_connections",
+                component["id"],
+                repairs,
+            )
+
+    connections = scope.get(connections_key)
+    if not isinstance(connections, list):
+        return
+    known = seen | ({module_id} if module_id else set())
+    kept = []
+    for connection in connections:
+        ends = (
+            [_endpoint_id(connection.get("from")), _endpoint_id(connection.get("to"))]
+            if isinstance(connection, dict)
+            else [None]
+        )
+        if all(end in known for end in ends):
+            kept.append(connection)
+        else:
+            dangling = ", ".join(f"'{end}'" for end in ends if end not in known)
+            repairs.append(f"Dropped connection with dangling endpoint {dangling}.")
+    scope[connections_key] = kept
+
+
+def repair_circuit(document: dict[str, Any]) -> list[str]:
+    """
+    回路定義の小さな誤りをその場で直し、直した内容の説明を返す
+
+    * 同じスコープで重複した部品IDは、2つ目以降を "<ID>_2" のように改名する
+    * 存在しない部品を指す接続や、端点の無い接続は取り除く
+    """
+    repairs: list[str] = []
+    circuit = document.get("circuit")
+    if isinstance(circuit, dict):
+        _repair_scope(circuit, "components", "connections", None, repairs)
+    return repairs
+
+
+def _broken_sections(document: dict[str, Any]) -> tuple[str, ...]:
+    # 接続を除いてもコンパイルできなければ、部品の定義が壊れている
+    circuit = document.get("circuit")
+    if not isinstance(circuit, dict):
+        return SECTIONS
+    try:
+        compile_circuit({"circuit": {**circuit, "connections": []}})
+    except CircuitYAMLError:
+        return ("components",)
+    return ("connections",)
+
+
+@dataclass
+class GeneratedCircuit:
+    circuit_yaml: str
+    document: dict[str, Any]
+    compiled: CompiledCircuit
+    # 生成したエンジンの名前
+    engine: str = ""
+    # その場で直した内容と、生成し直させた回数
+    repairs: list[str] = field(default_factory=list)
+    reprompts: int = 0
+
+
+# 出力の断片を受け取るたびに、検証の途中経過を渡して呼ぶ関数
+Progress = Callable[[StreamValidator], None]
+
+
+async def _stream(
+    engine: TextAIEngine,
+    prompt: str,
+    validator: StreamValidator,
+    on_progress: Progress | None = None,
+) -> None:
+    stream = engine.complete(prompt)
+    # 出力の検証と途中経過の処理はそれぞれのスパンに数え、残りをエンジンの待ち時間とする
+    with usage_meter.call(engine.name, prompt) as call, span("engine"):
+        try:
+            async for chunk in stream:
+                call.received(chunk)
+                ok = validator.feed(chunk, defer=True)
+                if ok and validator.pending:
+                    # 読み込み (YAMLの解析) はイベントループを止めないようにスレッドで
+                    ok = await anyio.to_thread.run_sync(validator.check_pending)
+                if on_progress is not None:
+                    on_progress(validator)
+                if not ok:
+                    # 打ち切り (ストリームを閉じればエンジンへのリクエストも閉じる)
+                    return
+            await anyio.to_thread.run_sync(validator.close)
+            if on_progress is not None:
+                on_progress(validator)
+        finally:
+            if isinstance(stream, AsyncGenerator):
+                await stream.aclose()
+
+
+async def _reprompt(
+    engine: TextAIEngine,
+    text: str,
+    document: dict[str, Any],
+    sections: Sequence[str],
+    error: str,
+) -> tuple[dict[str, Any], str | None]:
+    circuit = document.get("circuit")
+    circuit = dict(circuit) if isinstance(circuit, dict) else {}
+    rest = {"circuit": {k: v for k, v in circuit.items() if k not in sections}}
+    validator = StreamValidator()
+    prompt = engine.repair_prompt(text, dump_circuit_yaml(rest), sections, error)
+    await _stream(engine, prompt, validator)
+    if validator.error is not None or validator.document is None:
+        return document, validator.error or "The engine returned no sections."
+
+    answer = validator.document
+    if isinstance(answer.get("circuit"), dict):
+        answer = answer["circuit"]
+    received = {section: answer[section] for section in sections if section in answer}
+    if not received:
+        return document, f"The answer has no {', '.join(sections)} section."
+    circuit.update(received)
+    return {**document, "circuit": circuit}, None
+
+
+async def generate_from_text(
+    engine: TextAIEngine,
+    text: str,
+    examples: Sequence[CircuitExample] = (),
+    max_reprompts: int | None = None,
+    on_progress: Progress | None = None,
+) -> GeneratedCircuit:
+    """
+    文章から回路を生成し、検証してコンパイルした結果を返す
+
+    局所的な修復と、壊れたセクションの生成し直し (最大 `max_reprompts` 回) でも
+    有効な回路にならなければ `GenerationError` を送出する。
+    `on_progress` は最初の生成の出力を受け取るたびに呼ぶ (生成し直しでは呼ばない)。
+    """
+    if max_reprompts is None:
+        max_reprompts = settings.CIRCUIT_GENERATION_MAX_REPROMPTS
+    validator = StreamValidator()
+    await _stream(engine, engine.prompt(text, examples), validator, on_progress)
+
+    document = copy.deepcopy(validator.document) or {"circuit": {}}
+    error = validator.error
+    sections: tuple[str, ...] = SECTIONS
+    if validator.section is not None:
+        # 打ち切ったセクションと、まだ届いていなかった後ろのセクション
+        start = SECTIONS.index(validator.section)
+        circuit = document.get("circuit") or {}
+        sections = tuple(
+            s for s in SECTIONS[start:] if s == validator.section or s not in circuit
+        )
+
+    repairs: list[str] = []
+    for attempt in range(max_reprompts + 1):
+        if error is None:
+            repairs.extend(repair_circuit(document))
+            circuit_yaml = (
+                validator.text
+                if attempt == 0 and not repairs
+                else dump_circuit_yaml(document)
+            )
+            try:
+                document = load_circuit_yaml(circuit_yaml)
+                compiled = compile_circuit(document)
+            except CircuitYAMLError as e:
+                error, sections = str(e), _broken_sections(document)
+            else:
+                return GeneratedCircuit(
+                    circuit_yaml,
+                    document,
+                    compiled,
+                    engine.name,
+                    repairs,
+                    reprompts=attempt,
+                )
+        if attempt < max_reprompts:
+            document, error = await _reprompt(engine, text, document, sections, error)
+
+    raise GenerationError(f"The engine did not produce a valid circuit: {error}")
+
+
+def _configured_engines() -> dict[str, TextAIEngine]:
+    engines: dict[str, TextAIEngine] = {}
+    if settings.OPENAI_API_KEY:
+        engines["openai"] = OpenAIEngine(
+            settings.OPENAI_API_KEY, settings.OPENAI_MODEL, settings.OPENAI_BASE_URL
+        )
+    if settings.GEMINI_API_KEY:
+        # Gemini の OpenAI 互換API
+        engines["gemini"] = OpenAIEngine(
+            settings.GEMINI_API_KEY,
+            settings.GEMINI_MODEL,
+            settings.GEMINI_BASE_URL,
+            name="gemini",
+        )
+    return engines
+
+
+# 設定されたテキストエンジン (先頭のものを使い、2つ目はヘッジに使う)
+text_engines = _configured_engines()
@@ -0,0 +1,180 @@
+"""
+テキストエンジンのヘッジ (応答時間の裾の短縮)
+
+主エンジンに送ったリクエストが、その主エンジンの p90 の時間までに最初の部品を
+(検証を通る形で) 出力しなければ、同じリクエストを副エンジンにも送る。
+先に有効な回路を返した方を採用し、もう一方は取り消す (ストリームを閉じる)。
+ヘッジするリクエストの割合は `CIRCUIT_HEDGE_RATIO` までに抑えるので、
+コストを倍にせずに p99 を縮められる。
+"""
+
+import asyncio
+import time
+from collections import deque
+from collections.abc import Callable, Sequence
+
+from app.circuits.admission import admission_controller
+from app.circuits.engines import CircuitExample, TextAIEngine
+from app.circuits.generation import (
+    GeneratedCircuit,
+    Progress,
+    StreamValidator,
+    generate_from_text,
+)
+from app.core.config import settings
+
+# 最初の部品までの時間を記録する直近の件数と、分位数を使い始める件数
+LATENCY_SAMPLES = 512
+MIN_LATENCY_SAMPLES = 20
+HEDGE_QUANTILE = 0.9
+# ヘッジの予算として貯められる回数 (短時間に続けてヘッジできる回数)
+HEDGE_BURST = 5.0
+
+
+class LatencyTracker:
+    """エンジンごとの、最初の有効な部品が届くまでの時間 [秒]"""
+
+    def __init__(self, default: float) -> None:
+        self.default = default
+        self._samples: dict[str, deque[float]] = {}
+
+    def record(self, name: str, seconds: float) -> None:
+        self._samples.setdefault(name, deque(maxlen=LATENCY_SAMPLES)).append(seconds)
+
+    def quantile(self, name: str, q: float) -> float:
+        """記録が少ないうちは `default` を返す"""
+        samples = sorted(self._samples.get(name, ()))
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return self.default
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class HedgeBudget:
+    """
+    ヘッジしてよいリクエストの割合
+
+    リクエストごとに `ratio` ずつ貯まり (最大 `burst`)、ヘッジするたびに1減る。
+    """
+
+    def __init__(self, ratio: float, burst: float = HEDGE_BURST) -> None:
+        self.ratio = ratio
+        self.burst = burst
+        self.credit = 0.0
+        self.requests = 0
+        self.hedged = 0
+
+    def request(self) -> None:
+        self.requests += 1
+        self.credit = min(self.burst, self.credit + self.ratio)
+
+    def spend(self) -> bool:
+        if self.credit < 1:
+            return False
+        self.credit -= 1
+        self.hedged += 1
+        return True
+
+
+class HedgePolicy:
+    def __init__(
+        self,
+        ratio: float,
+        default_delay: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.budget = HedgeBudget(ratio)
+        self.latency = LatencyTracker(default_delay)
+        # 最初の部品までの時間を測る時計
+        self.clock = clock
+        # ヘッジした副エンジンが先に有効な回路を返した回数
+        self.won = 0
+
+    @classmethod
+    def from_settings(cls) -> "HedgePolicy":
+        return cls(settings.CIRCUIT_HEDGE_RATIO, settings.CIRCUIT_HEDGE_DEFAULT_DELAY)
+
+
+hedge_policy = HedgePolicy.from_settings()
+
+
+async def generate_hedged(
+    primary: TextAIEngine,
+    secondary: TextAIEngine | None,
+    text: str,
+    examples: Sequence[CircuitExample] = (),
+    policy: HedgePolicy | None = None,
+    on_progress: Progress | None = None,
+) -> GeneratedCircuit:
+    """
+    主エンジンで回路を生成し、遅ければ副エンジンにもヘッジする
+
+    どちらのエンジンも受け付けの制御 (`admission_controller`) を通す。
+    副エンジンに空きが無ければヘッジしない。両方失敗した場合は主エンジンの
+    例外を送出する。`on_progress` はどちらのエンジンの出力でも呼ぶ。
+    """
+    policy = policy or hedge_policy
+    policy.budget.request()
+    first_component = asyncio.Event()
+
+    def start(engine: TextAIEngine, wait: bool) -> asyncio.Task[GeneratedCircuit]:
+        started = policy.clock()
+        seen = False
+
+        def progress(validator: StreamValidator) -> None:
+            nonlocal seen
+            if not seen and validator.components:
+                seen = True
+                policy.latency.record(engine.name, policy.clock() - started)
+                if engine is primary:
+                    first_component.set()
+            if on_progress is not None:
+                on_progress(validator)
+
+        async def run() -> GeneratedCircuit:
+            async with admission_controller(engine.name).admit(wait=wait):
+                try:
+                    return await generate_from_text(
+                        engine, text, examples, on_progress=progress
+                    )
+                except asyncio.CancelledError:
+                    # 取り消した遅いリクエストも記録しないと p90 を低く見積もる
+                    if not seen:
+                        policy.latency.record(engine.name, policy.clock() - started)
+                    raise
+
+        return asyncio.create_task(run())
+
+    tasks = [start(primary, wait=True)]
+    try:
+        if secondary is not None and policy.budget.ratio > 0:
+            delay = policy.latency.quantile(primary.name, HEDGE_QUANTILE)
+            signal = asyncio.create_task(first_component.wait())
+            done, _ = await asyncio.wait(
+                {tasks[0], signal}, timeout=delay, return_when=asyncio.FIRST_COMPLETED
+            )
+            signal.cancel()
+            controller = admission_controller(secondary.name)
+            if (
+                not done
+                and controller.active < controller.max_concurrency
+                and policy.budget.spend()
+            ):
+                tasks.append(start(secondary, wait=False))
+
+        pending = set(tasks)
+        while pending:
+            finished, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in finished:
+                if task.exception() is None:
+                    if task is not tasks[0]:
+                        policy.won += 1
+                    return task.result()
+        error = tasks[0].exception()
+        assert error is not None
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
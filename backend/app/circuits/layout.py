@@ -0,0 +1,1118 @@
+"""
+回路図のレイアウト (部品の配置と配線)
+
+YAMLで位置が指定された部品はその位置に置き、指定のない部品は
+接続順 (電源からの幅優先探索) に並べて格子上に棚詰め (shelf packing) する。
+明示的に指定された場合だけ、力指向 (Fruchterman-Reingold) レイアウトを使う。
+配線はネットごとに端子をx座標順に並べ、隣り合う端子をL字の直交線で結ぶ。
+互いに接続のない部分回路 (島) は別々にレイアウトし (大きな回路ではプロセスプールで
+並列に)、位置指定のある島の右側に高さの順に棚詰めする。
+"""
+
+import math
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Any
+
+import numpy as np
+
+from app.circuits.analysis import VOLTAGE_SOURCE_TYPES
+from app.circuits.cache import LRUCache
+from app.circuits.compiler import CompiledCircuit, Component, Net, PinRef
+from app.circuits.crossings import count_crossings
+from app.circuits.spatial import SpatialIndex
+from app.circuits.timing import span
+from app.core.config import settings
+
+# 部品種別ごとのシンボルの大きさ (幅, 高さ)
+SYMBOL_SIZES: dict[str, tuple[float, float]] = {
+    "resistor": (60.0, 20.0),
+    "capacitor": (40.0, 30.0),
+    "led": (40.0, 30.0),
+    "diode": (40.0, 30.0),
+    "junction": (6.0, 6.0),
+    "battery": (40.0, 40.0),
+    "power_supply": (60.0, 60.0),
+}
+DEFAULT_SYMBOL_SIZE = (50.0, 40.0)
+# シンボルの左辺/右辺に置く端子名 (それ以外は左右の数が揃うように振り分ける)
+LEFT_TERMINALS = frozenset({"a", "anode", "positive", "in", "input", "vcc", "1"})
+RIGHT_TERMINALS = frozenset({"b", "cathode", "negative", "out", "output", "gnd", "2"})
+MODULE_PADDING = 20.0
+
+# 格子配置の格子の間隔と部品間の隙間
+GRID_STEP = 10.0
+GRID_GAP = 40.0
+# 格子配置で詰める棚の幅 (全部品の面積の平方根に対する比)
+GRID_ASPECT = 1.5
+# 島 (互いに接続のない部分回路) どうしの隙間
+ISLAND_GAP = 2 * GRID_GAP
+# 力指向レイアウトの部品間隔と反復回数
+FORCE_SPACING = 120.0
+FORCE_ITERATIONS = 50
+_FORCE_CHUNK = 256
+
+PLACEMENTS = ("grid", "force")
+
+# 交差削減の既定の時間予算 [秒] と、重心法による並べ替えの最大回数
+CROSSING_TIME_BUDGET = 0.5
+CROSSING_BARYCENTER_PASSES = 4
+# プロセス内に保持するレイアウトの数 (永続化したものはDBにもある)
+LAYOUT_CACHE_SIZE = 256
+# 配置や配線の方法を変えたら上げる (保存済みのレイアウトを使わなくなる)
+LAYOUT_VERSION = 2
+
+Point = tuple[float, float]
+
+
+@dataclass(frozen=True)
+class Box:
+    x0: float
+    y0: float
+    x1: float
+    y1: float
+
+    @property
+    def width(self) -> float:
+        return self.x1 - self.x0
+
+    @property
+    def height(self) -> float:
+        return self.y1 - self.y0
+
+    def as_tuple(self) -> tuple[float, float, float, float]:
+        return self.x0, self.y0, self.x1, self.y1
+
+    def intersects(self, other: "Box") -> bool:
+        return (
+            self.x0 <= other.x1
+            and other.x0 <= self.x1
+            and self.y0 <= other.y1
+            and other.y0 <= self.y1
+        )
+
+    def expand(self, margin: float) -> "Box":
+        return Box(
+            self.x0 - margin, self.y0 - margin, self.x1 + margin, self.y1 + margin
+        )
+
+    @classmethod
+    def around(cls, points: Iterable[Point]) -> "Box":
+        xs, ys = zip(*points, strict=True)
+        return cls(min(xs), min(ys), max(xs), max(ys))
+
+    @classmethod
+    def union(cls, boxes: Iterable["Box"]) -> "Box":
+        boxes = list(boxes)
+        return cls(
+            min(b.x0 for b in boxes),
+            min(b.y0 for b in boxes),
+            max(b.x1 for b in boxes),
+            max(b.y1 for b in boxes),
+        )
+
+
+@dataclass
+class PlacedComponent:
+    id: str
+    type: str
+    x: float
+    y: float
+    width: float
+    height: float
+    rotation: float
+    parent: str | None
+    box: Box
+
+    @property
+    def label(self) -> str:
+        return self.id.rsplit("/", 1)[-1]
+
+    @property
+    def kind(self) -> str:
+        return self.type.lower()
+
+
+@dataclass
+class Wire:
+    net_id: int
+    points: list[Point]
+    # 両端の部品を共に含む最も内側のモジュール (トップレベルなら None)
+    owner: str | None
+
+    @property
+    def box(self) -> Box:
+        return Box.around(self.points)
+
+
+@dataclass
+class Layout:
+    # モジュールの枠を先に描くため、モジュールが先頭に並ぶ
+    components: list[PlacedComponent]
+    wires: list[Wire]
+    pins: dict[PinRef, Point]
+    bounds: Box
+    # 交差数などの、レイアウトの品質の記録
+    metadata: dict[str, int] = field(default_factory=dict)
+
+    def crossings(self) -> int:
+        """異なるネットの配線同士の交差の数"""
+        return count_crossings(
+            (w.net_id, a, b)
+            for w in self.wires
+            for a, b in zip(w.points, w.points[1:], strict=False)
+        )
+
+    @cached_property
+    def index(self) -> SpatialIndex:
+        """部品とワイヤーをまとめた空間インデックス (部品が先、ワイヤーが後)"""
+        return SpatialIndex(
+            [c.box.as_tuple() for c in self.components]
+            + [w.box.as_tuple() for w in self.wires]
+        )
+
+    def to_dict(self) -> dict[str, Any]:
+        """JSON (Postgres JSONB) に保存できる形に変換する。描画のスタイルは含まない"""
+        return {
+            "components": [
+                {
+                    "id": c.id,
+                    "type": c.type,
+                    "x": c.x,
+                    "y": c.y,
+                    "width": c.width,
+                    "height": c.height,
+                    "rotation": c.rotation,
+                    "parent": c.parent,
+                    "box": list(c.box.as_tuple()),
+                }
+                for c in self.components
+            ],
+            "wires": [
+                {
+                    "net": w.net_id,
+                    "points": [list(p) for p in w.points],
+                    "owner": w.owner,
+                }
+                for w in self.wires
+            ],
+            "pins": [[p.component_id, p.name, x, y] for p, (x, y) in self.pins.items()],
+            "bounds": list(self.bounds.as_tuple()),
+            "metadata": self.metadata,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "Layout":
+        return cls(
+            components=[
+                PlacedComponent(
+                    id=c["id"],
+                    type=c["type"],
+                    x=c["x"],
+                    y=c["y"],
+                    width=c["width"],
+                    height=c["height"],
+                    rotation=c["rotation"],
+                    parent=c["parent"],
+                    box=Box(*c["box"]),
+                )
+                for c in data["components"]
+            ],
+            wires=[
+                Wire(
+                    net_id=w["net"],
+                    points=[(p[0], p[1]) for p in w["points"]],
+                    owner=w["owner"],
+                )
+                for w in data["wires"]
+            ],
+            pins={PinRef(id, name): (x, y) for id, name, x, y in data["pins"]},
+            bounds=Box(*data["bounds"]),
+            metadata=dict(data["metadata"]),
+        )
+
+
+def _rotate(dx: float, dy: float, degrees: float) -> Point:
+    rad = math.radians(degrees)
+    cos, sin = math.cos(rad), math.sin(rad)
+    return dx * cos - dy * sin, dx * sin + dy * cos
+
+
+def _rotated_box(x: float, y: float, w: float, h: float, degrees: float) -> Box:
+    corners = [
+        _rotate(dx, dy, degrees) for dx in (-w / 2, w / 2) for dy in (-h / 2, h / 2)
+    ]
+    return Box.around((x + dx, y + dy) for dx, dy in corners)
+
+
+def force_layout(
+    positions: np.ndarray,
+    free: np.ndarray,
+    edges: np.ndarray,
+    *,
+    spacing: float = FORCE_SPACING,
+    iterations: int = FORCE_ITERATIONS,
+) -> np.ndarray:
+    """
+    Fruchterman-Reingold 法で `free` の点だけを動かした座標を返す
+
+    斥力は全点対で計算するが、(点数 x 点数) の配列を一度に作らないよう行を分割する。
+    """
+    pos = positions.astype(np.float64, copy=True)
+    n = len(pos)
+    k2 = spacing * spacing
+    temperature = spacing * 2
+    cooling = temperature / max(iterations, 1)
+    for _ in range(iterations):
+        disp = np.zeros_like(pos)
+        for start in range(0, n, _FORCE_CHUNK):
+            rows = slice(start, start + _FORCE_CHUNK)
+            dx = pos[rows, 0, None] - pos[None, :, 0]
+            dy = pos[rows, 1, None] - pos[None, :, 1]
+            scale = k2 / np.maximum(dx * dx + dy * dy, 1e-2)
+            disp[rows, 0] += (dx * scale).sum(axis=1)
+            disp[rows, 1] += (dy * scale).sum(axis=1)
+        if len(edges):
+            src, dst = edges[:, 0], edges[:, 1]
+            d = pos[src] - pos[dst]
+            pull = d * (np.linalg.norm(d, axis=1) / spacing)[:, None]
+            np.add.at(disp, src, -pull)
+            np.add.at(disp, dst, pull)
+        length = np.maximum(np.linalg.norm(disp, axis=1), 1e-9)
+        disp *= (np.minimum(length, temperature) / length)[:, None]
+        pos[free] += disp[free]
+        temperature -= cooling
+    return pos
+
+
+def _force_place(circuit: CompiledCircuit) -> dict[str, Point]:
+    """部品の中心座標を力指向レイアウトで決める (子を持つモジュールは除く)"""
+    containers = {c.parent for c in circuit.components.values() if c.parent}
+    nodes = [c for c in circuit.components.values() if c.id not in containers]
+    fixed = [c.position is not None for c in nodes]
+    if all(fixed):
+        return {c.id: c.position for c in nodes if c.position is not None}
+
+    # 位置未指定の部品は、指定済み部品の右側に格子状に並べてから動かす
+    anchors = [c.position for c in nodes if c.position is not None]
+    origin_x = max((p[0] for p in anchors), default=-FORCE_SPACING) + FORCE_SPACING
+    origin_y = min((p[1] for p in anchors), default=0.0)
+    columns = math.ceil(math.sqrt(fixed.count(False)))
+    positions = np.zeros((len(nodes), 2))
+    slot = 0
+    for i, c in enumerate(nodes):
+        if c.position is not None:
+            positions[i] = c.position
+        else:
+            positions[i] = (
+                origin_x + (slot % columns) * FORCE_SPACING,
+                origin_y + (slot // columns) * FORCE_SPACING,
+            )
+            slot += 1
+
+    index = {c.id: i for i, c in enumerate(nodes)}
+    edges = []
+    for net in circuit.nets:
+        members = list(
+            dict.fromkeys(p.component_id for p in net.pins if p.component_id in index)
+        )
+        edges += [
+            (index[a], index[b]) for a, b in zip(members, members[1:], strict=False)
+        ]
+    positions = force_layout(
+        positions,
+        ~np.array(fixed),
+        np.array(edges, dtype=np.intp).reshape(-1, 2),
+    )
+    return {
+        c.id: (float(x), float(y)) for c, (x, y) in zip(nodes, positions, strict=True)
+    }
+
+
+def _connectivity_order(circuit: CompiledCircuit) -> dict[str, int]:
+    """
+    電源から幅優先探索で辿った部品の順位
+
+    電源がなければ (または電源から辿れない部品は) 定義順に次の起点にする。
+    各ネットは一度だけ展開するので、全体で端子数に比例する時間で済む。
+    """
+    nets_of: dict[str, list[int]] = {}
+    members: list[list[str]] = [[] for _ in circuit.nets]
+    for pin, net in circuit.net_of.items():
+        nets_of.setdefault(pin.component_id, []).append(net)
+        members[net].append(pin.component_id)
+    components = list(circuit.components.values())
+    roots = sorted(
+        range(len(components)),
+        key=lambda i: (components[i].type.lower() not in VOLTAGE_SOURCE_TYPES, i),
+    )
+    rank: dict[str, int] = {}
+    expanded = [False] * len(circuit.nets)
+    for root in roots:
+        if components[root].id in rank:
+            continue
+        queue = deque([components[root].id])
+        rank[components[root].id] = len(rank)
+        while queue:
+            for net in nets_of.get(queue.popleft(), []):
+                if expanded[net]:
+                    continue
+                expanded[net] = True
+                for member in members[net]:
+                    if member not in rank:
+                        rank[member] = len(rank)
+                        queue.append(member)
+    return rank
+
+
+def _snap(value: float) -> float:
+    return math.ceil(value / GRID_STEP) * GRID_STEP
+
+
+def _shelf_pack(
+    sizes: list[tuple[float, float]], origin: Point
+) -> tuple[list[Point], float, float, list[list[int]]]:
+    """
+    大きさ (幅, 高さ) の矩形を順に棚に詰め、各矩形の左上の座標と全体の幅・高さ、
+    棚ごとの (左から順の) 矩形の番号を返す
+
+    棚の幅は全体がおおよそ GRID_ASPECT:1 の横長になるように決める。
+    同じ棚の矩形は、中心の高さが揃うように (格子の範囲で) 上下方向に寄せる。
+    """
+    area = sum(w * h for w, h in sizes)
+    shelf_width = max(
+        max((w for w, _ in sizes), default=0.0), math.sqrt(area * GRID_ASPECT)
+    )
+    corners: list[Point] = []
+    shelves: list[list[int]] = []
+    shelf: list[tuple[float, float]] = []
+    y = shelf_height = width = 0.0
+
+    def close_shelf() -> None:
+        shelves.append(list(range(len(corners), len(corners) + len(shelf))))
+        for x, h in shelf:
+            offset = math.floor((shelf_height - h) / 2 / GRID_STEP) * GRID_STEP
+            corners.append((origin[0] + x, origin[1] + y + offset))
+        shelf.clear()
+
+    x = 0.0
+    for w, h in sizes:
+        if x > 0 and x + w > shelf_width:
+            close_shelf()
+            y += shelf_height
+            x = shelf_height = 0.0
+        shelf.append((x, h))
+        x += w
+        width = max(width, x)
+        shelf_height = max(shelf_height, h)
+    close_shelf()
+    return corners, width, y + shelf_height, shelves
+
+
+@dataclass
+class _ShelfItem:
+    """棚の中の1つの矩形。位置未指定のモジュールなら中の部品ごと動く"""
+
+    leaves: list[str]
+    width: float
+
+
+class _GridPlacer:
+    """
+    位置未指定の部品を、モジュールの階層ごとに格子上へ棚詰めする
+
+    モジュールの中身がすべて位置未指定なら、中身を詰めたブロックを1つの部品として
+    親の階層に詰める。位置指定のある部品を含む階層では、指定済みの部品の右側に詰める。
+    """
+
+    def __init__(self, circuit: CompiledCircuit) -> None:
+        self.children: dict[str | None, list[Component]] = {}
+        for c in circuit.components.values():
+            self.children.setdefault(c.parent, []).append(c)
+        self.rank = _connectivity_order(circuit)
+        self.centers: dict[str, Point] = {}
+        # 交差削減で並べ替えられる、棚ごとの矩形 (左から順)
+        self.shelves: list[list[_ShelfItem]] = []
+        self._fixed: dict[str, bool] = {}
+        self._blocks: dict[str, tuple[dict[str, Point], float, float]] = {}
+
+    def place(self) -> dict[str, Point]:
+        self._anchored(None)
+        return self.centers
+
+    def _is_module(self, component: Component) -> bool:
+        return component.id in self.children
+
+    def _fixed_of(self, component: Component) -> bool:
+        """位置が決まっている部品、または位置が決まった部品を含むモジュール"""
+        if component.id not in self._fixed:
+            if self._is_module(component):
+                self._fixed[component.id] = any(
+                    self._fixed_of(c) for c in self.children[component.id]
+                )
+            else:
+                self._fixed[component.id] = component.position is not None
+        return self._fixed[component.id]
+
+    def _first_rank(self, component: Component) -> int:
+        if self._is_module(component):
+            return min(self._first_rank(c) for c in self.children[component.id])
+        return self.rank.get(component.id, len(self.rank))
+
+    def _size(self, component: Component) -> tuple[float, float]:
+        if self._is_module(component):
+            _, width, height = self._block(component.id)
+            return width + 2 * MODULE_PADDING, height + 2 * MODULE_PADDING
+        w, h = SYMBOL_SIZES.get(component.type.lower(), DEFAULT_SYMBOL_SIZE)
+        return _snap(w + GRID_GAP), _snap(h + GRID_GAP)
+
+    def _block(self, parent: str) -> tuple[dict[str, Point], float, float]:
+        """位置未指定のモジュールの中身を、原点を左上として詰めた結果"""
+        if parent not in self._blocks:
+            centers: dict[str, Point] = {}
+            box = self._pack(self.children[parent], (0.0, 0.0), centers)
+            self._blocks[parent] = centers, box.width, box.height
+        return self._blocks[parent]
+
+    def _pack(
+        self, free: list[Component], origin: Point, centers: dict[str, Point]
+    ) -> Box:
+        free = sorted(free, key=self._first_rank)
+        sizes = [self._size(c) for c in free]
+        corners, width, height, shelves = _shelf_pack(sizes, origin)
+        items = []
+        for c, (x, y), (w, h) in zip(free, corners, sizes, strict=True):
+            if self._is_module(c):
+                inner, _, _ = self._block(c.id)
+                dx, dy = x + MODULE_PADDING, y + MODULE_PADDING
+                for id, (cx, cy) in inner.items():
+                    centers[id] = (cx + dx, cy + dy)
+                items.append(_ShelfItem(list(inner), w))
+            else:
+                centers[c.id] = (x + w / 2, y + h / 2)
+                items.append(_ShelfItem([c.id], w))
+        self.shelves += [
+            [items[i] for i in shelf] for shelf in shelves if len(shelf) > 1
+        ]
+        return Box(origin[0], origin[1], origin[0] + width, origin[1] + height)
+
+    def _anchored(self, parent: str | None) -> Box | None:
+        """位置指定のある階層を配置し、位置指定のある部品の外接矩形を返す"""
+        boxes = []
+        free = []
+        for c in self.children.get(parent, []):
+            if not self._fixed_of(c):
+                free.append(c)
+            elif self._is_module(c):
+                box = self._anchored(c.id)
+                if box is not None:
+                    boxes.append(box)
+            elif c.position is not None:
+                self.centers[c.id] = c.position
+                w, h = SYMBOL_SIZES.get(c.type.lower(), DEFAULT_SYMBOL_SIZE)
+                boxes.append(Box(*c.position, *c.position).expand(max(w, h) / 2))
+        if not boxes:
+            return self._pack(free, (0.0, 0.0), self.centers) if free else None
+        fixed = Box.union(boxes)
+        if free:
+            origin = (
+                _snap(fixed.x1 + GRID_GAP),
+                math.floor(fixed.y0 / GRID_STEP) * GRID_STEP,
+            )
+            fixed = Box.union([fixed, self._pack(free, origin, self.centers)])
+        return fixed
+
+
+def _neighbour_x(
+    circuit: CompiledCircuit, centers: dict[str, Point]
+) -> dict[PinRef, float]:
+    """端子ごとの、同じネットに繋がる他の部品の中心のx座標の平均"""
+    sums: dict[int, list[float]] = {}
+    for pin, net in circuit.net_of.items():
+        if pin.component_id in centers:
+            acc = sums.setdefault(net, [0.0, 0.0])
+            acc[0] += centers[pin.component_id][0]
+            acc[1] += 1
+    means = {}
+    for pin, net in circuit.net_of.items():
+        if pin.component_id in centers:
+            total, count = sums[net]
+            if count > 1:
+                own = centers[pin.component_id][0]
+                means[pin] = (total - own) / (count - 1)
+    return means
+
+
+def _mean(values: list[float]) -> float | None:
+    return sum(values) / len(values) if values else None
+
+
+def _grid_rotations(
+    circuit: CompiledCircuit, centers: dict[str, Point]
+) -> dict[str, float]:
+    """
+    位置未指定の部品の向きを決める
+
+    左辺の端子の接続先が右辺の端子の接続先より右にある部品は、180度回転させる。
+    """
+    means = _neighbour_x(circuit, centers)
+    pin_names: dict[str, list[str]] = {}
+    for pin in circuit.net_of:
+        pin_names.setdefault(pin.component_id, []).append(pin.name)
+
+    rotations = {}
+    for id in centers:
+        component = circuit.components[id]
+        if component.position is not None or component.rotation:
+            continue
+        left, right = _pin_sides(pin_names.get(id, []))
+        left_x = _mean([means[p] for n in left if (p := PinRef(id, n)) in means])
+        right_x = _mean([means[p] for n in right if (p := PinRef(id, n)) in means])
+        if left_x is not None and right_x is not None and left_x > right_x:
+            rotations[id] = 180.0
+    return rotations
+
+
+def _place(
+    circuit: CompiledCircuit, placement: str
+) -> tuple[dict[str, Point], dict[str, float], list[list[_ShelfItem]]]:
+    """部品の中心座標と、既定から変える向きと、並べ替えられる棚を決める"""
+    if placement == "force":
+        return _force_place(circuit), {}, []
+    placer = _GridPlacer(circuit)
+    centers = placer.place()
+    return centers, _grid_rotations(circuit, centers), placer.shelves
+
+
+def _barycenters(
+    circuit: CompiledCircuit, centers: dict[str, Point]
+) -> dict[str, float]:
+    """部品ごとの、接続先の部品のx座標の平均"""
+    xs: dict[str, list[float]] = {}
+    for pin, x in _neighbour_x(circuit, centers).items():
+        xs.setdefault(pin.component_id, []).append(x)
+    return {id: sum(v) / len(v) for id, v in xs.items()}
+
+
+def _reorder(
+    shelf: list[_ShelfItem], order: list[int], centers: dict[str, Point]
+) -> list[_ShelfItem]:
+    """棚の矩形を `order` の順に左から詰め直し、中の部品を動かす"""
+    old_left = 0.0
+    lefts = []
+    for item in shelf:
+        lefts.append(old_left)
+        old_left += item.width
+    new_left = 0.0
+    for i in order:
+        shift = new_left - lefts[i]
+        for id in shelf[i].leaves:
+            x, y = centers[id]
+            centers[id] = (x + shift, y)
+        new_left += shelf[i].width
+    return [shelf[i] for i in order]
+
+
+def _minimize_crossings(
+    circuit: CompiledCircuit,
+    centers: dict[str, Point],
+    shelves: list[list[_ShelfItem]],
+    deadline: float,
+) -> tuple[Layout, int]:
+    """
+    棚の中の並びを変えて配線の交差を減らし、最良のレイアウトと元の交差数を返す
+
+    まず棚ごとに接続先の重心の順に並べ替え (重心法)、次に隣り合う矩形の入れ替えを
+    試す。交差が減った変更だけを採用し、`deadline` を過ぎたら打ち切る。
+    """
+    best = _assemble(circuit, centers, _grid_rotations(circuit, centers))
+    before = best_count = best.crossings()
+
+    def attempt(candidate: dict[str, Point]) -> bool:
+        nonlocal best, best_count
+        layout = _assemble(circuit, candidate, _grid_rotations(circuit, candidate))
+        count = layout.crossings()
+        if count < best_count:
+            best, best_count = layout, count
+            return True
+        return False
+
+    for _ in range(CROSSING_BARYCENTER_PASSES):
+        if best_count == 0 or time.monotonic() >= deadline:
+            break
+        candidate = dict(centers)
+        reordered = []
+        for shelf in shelves:
+            means = _barycenters(circuit, candidate)
+            keys = []
+            for i, item in enumerate(shelf):
+                xs = [means[id] for id in item.leaves if id in means]
+                keys.append(sum(xs) / len(xs) if xs else float(i))
+            order = sorted(range(len(shelf)), key=lambda i: keys[i])
+            reordered.append(_reorder(shelf, order, candidate))
+        if not attempt(candidate):
+            break
+        centers, shelves = candidate, reordered
+
+    for shelf in shelves:
+        for i in range(len(shelf) - 1):
+            if best_count == 0 or time.monotonic() >= deadline:
+                return best, before
+            candidate = dict(centers)
+            order = [*range(i), i + 1, i, *range(i + 2, len(shelf))]
+            swapped = _reorder(shelf, order, candidate)
+            if attempt(candidate):
+                centers = candidate
+                shelf[:] = swapped
+    return best, before
+
+
+def _pin_sides(names: list[str]) -> tuple[list[str], list[str]]:
+    """端子をシンボルの左辺と右辺に振り分ける"""
+    left: list[str] = []
+    right: list[str] = []
+    for name in names:
+        if name.lower() in LEFT_TERMINALS:
+            left.append(name)
+        elif name.lower() in RIGHT_TERMINALS:
+            right.append(name)
+        else:
+            (left if len(left) <= len(right) else right).append(name)
+    return left, right
+
+
+def _pin_offsets(component: PlacedComponent, names: list[str]) -> dict[str, Point]:
+    """端子をシンボルの左右の辺に振り分けた、中心からの相対位置"""
+    if component.kind == "junction":
+        return {name: (0.0, 0.0) for name in names}
+    left, right = _pin_sides(names)
+    offsets = {}
+    for side, x in ((left, -component.width / 2), (right, component.width / 2)):
+        for i, name in enumerate(side):
+            y = component.height * ((i + 1) / (len(side) + 1) - 0.5)
+            offsets[name] = _rotate(x, y, component.rotation)
+    return offsets
+
+
+def _scopes(circuit: CompiledCircuit, pin: PinRef) -> list[str]:
+    """端子を囲むモジュールを内側から順に返す。モジュールのポートはそのモジュール自身も含む"""
+    component = circuit.components[pin.component_id]
+    chain = [component.id] if component.type.lower() == "module" else []
+    parent = component.parent
+    while parent is not None:
+        chain.append(parent)
+        parent = circuit.components[parent].parent
+    return chain
+
+
+def _route(circuit: CompiledCircuit, pins: dict[PinRef, Point]) -> list[Wire]:
+    with span("routing"):
+        wires = []
+        for net in circuit.nets:
+            ends = sorted(
+                ((pins[p], p) for p in net.pins if p in pins), key=lambda e: e[0]
+            )
+            for (a, pin_a), (b, pin_b) in zip(ends, ends[1:], strict=False):
+                if a == b:
+                    continue
+                scope_b = set(_scopes(circuit, pin_b))
+                owner = next((m for m in _scopes(circuit, pin_a) if m in scope_b), None)
+                points = (
+                    [a, (b[0], a[1]), b] if a[0] != b[0] and a[1] != b[1] else [a, b]
+                )
+                wires.append(Wire(net_id=net.id, points=points, owner=owner))
+        return wires
+
+
+def _module_box(children: list[PlacedComponent]) -> Box:
+    return Box.union(c.box for c in children).expand(MODULE_PADDING)
+
+
+def _placed(
+    component: Component, x: float, y: float, rotation: float
+) -> PlacedComponent:
+    width, height = SYMBOL_SIZES.get(component.type.lower(), DEFAULT_SYMBOL_SIZE)
+    return PlacedComponent(
+        id=component.id,
+        type=component.type,
+        x=x,
+        y=y,
+        width=width,
+        height=height,
+        rotation=rotation,
+        parent=component.parent,
+        box=_rotated_box(x, y, width, height, rotation),
+    )
+
+
+def _islands(circuit: CompiledCircuit) -> list[list[str]]:
+    """
+    互いに接続のない部分回路 (島) ごとの部品ID
+
+    トップレベルの部品 (モジュールは中身ごと) を、ネットで繋がっているものどうし
+    まとめる。島も島の中の部品も定義順に並べる。
+    """
+    top: dict[str, str] = {}
+    for c in circuit.components.values():
+        # モジュールの中身はモジュールの後に定義されている
+        top[c.id] = top[c.parent] if c.parent is not None else c.id
+    root = {id: id for id in top.values()}
+
+    def find(id: str) -> str:
+        while root[id] != id:
+            root[id] = root[root[id]]
+            id = root[id]
+        return id
+
+    for net in circuit.nets:
+        first = find(top[net.pins[0].component_id])
+        for pin in net.pins[1:]:
+            root[find(top[pin.component_id])] = first
+            first = find(first)
+    islands: dict[str, list[str]] = {}
+    for id in circuit.components:
+        islands.setdefault(find(top[id]), []).append(id)
+    return list(islands.values())
+
+
+def _island_circuit(
+    circuit: CompiledCircuit, ids: list[str]
+) -> tuple[CompiledCircuit, list[int]]:
+    """島だけの回路と、その回路のネットの番号 -> 元のネットの番号"""
+    members = set(ids)
+    nets = [net for net in circuit.nets if net.pins[0].component_id in members]
+    renumbered = [Net(id=i, pins=net.pins) for i, net in enumerate(nets)]
+    island = CompiledCircuit(
+        name=circuit.name,
+        description=circuit.description,
+        definition_hash=circuit.definition_hash,
+        components={id: circuit.components[id] for id in ids},
+        connections=[
+            conn for conn in circuit.connections if conn.source.component_id in members
+        ],
+        nets=renumbered,
+        net_of={pin: net.id for net in renumbered for pin in net.pins},
+    )
+    return island, [net.id for net in nets]
+
+
+def _layout_batch(
+    jobs: list[tuple[CompiledCircuit, float]], placement: str, minimize_crossings: bool
+) -> list[Layout]:
+    """プロセスプールで実行する、いくつかの島のレイアウト"""
+    return [
+        _layout_part(circuit, placement, minimize_crossings, budget)
+        for circuit, budget in jobs
+    ]
+
+
+class LayoutPool:
+    """
+    島を並列にレイアウトするプロセスプール (最初に使うときに起動する)
+
+    プロセス数は `CIRCUIT_LAYOUT_PROCESSES` (0 なら CPU 数)。1 以下なら使わない。
+    """
+
+    def __init__(self) -> None:
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def processes(self) -> int:
+        return settings.CIRCUIT_LAYOUT_PROCESSES or os.cpu_count() or 1
+
+    def executor(self) -> ProcessPoolExecutor | None:
+        if self.processes < 2:
+            return None
+        with self._lock:
+            if self._executor is None:
+                # スレッドを持つサーバープロセスを fork しないように spawn で起動する
+                self._executor = ProcessPoolExecutor(
+                    self.processes, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def layout(
+        self,
+        jobs: list[tuple[CompiledCircuit, float]],
+        placement: str,
+        minimize_crossings: bool,
+    ) -> list[Layout]:
+        """
+        島ごとのレイアウトを、部品数の合計が揃うように分けてプロセスで計算する
+
+        部品数が `CIRCUIT_LAYOUT_PARALLEL_MIN_COMPONENTS` 未満の場合や、プールが
+        使えない場合はこのプロセスで計算する。
+        """
+        total = sum(len(circuit.components) for circuit, _ in jobs)
+        executor = (
+            self.executor()
+            if total >= settings.CIRCUIT_LAYOUT_PARALLEL_MIN_COMPONENTS
+            else None
+        )
+        if executor is None:
+            return _layout_batch(jobs, placement, minimize_crossings)
+
+        # 大きい島から順に、部品数の合計が最も少ないプロセスに割り当てる
+        batches: list[list[int]] = [[] for _ in range(min(self.processes, len(jobs)))]
+        loads = [0] * len(batches)
+        for i in sorted(range(len(jobs)), key=lambda i: -len(jobs[i][0].components)):
+            lightest = loads.index(min(loads))
+            batches[lightest].append(i)
+            loads[lightest] += len(jobs[i][0].components)
+        try:
+            futures = [
+                executor.submit(
+                    _layout_batch,
+                    [jobs[i] for i in batch],
+                    placement,
+                    minimize_crossings,
+                )
+                for batch in batches
+            ]
+            results = [future.result() for future in futures]
+        except BrokenProcessPool:
+            self.shutdown()
+            return _layout_batch(jobs, placement, minimize_crossings)
+        layouts: dict[int, Layout] = {}
+        for batch, result in zip(batches, results, strict=True):
+            layouts.update(zip(batch, result, strict=True))
+        return [layouts[i] for i in range(len(jobs))]
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+layout_pool = LayoutPool()
+
+
+def _moved(layout: Layout, dx: float, dy: float, net_ids: list[int]) -> Layout:
+    """レイアウトを (dx, dy) だけ動かし、ネットの番号を元の回路の番号に戻す"""
+
+    def box(b: Box) -> Box:
+        return Box(b.x0 + dx, b.y0 + dy, b.x1 + dx, b.y1 + dy)
+
+    return Layout(
+        components=[
+            PlacedComponent(
+                id=c.id,
+                type=c.type,
+                x=c.x + dx,
+                y=c.y + dy,
+                width=c.width,
+                height=c.height,
+                rotation=c.rotation,
+                parent=c.parent,
+                box=box(c.box),
+            )
+            for c in layout.components
+        ],
+        wires=[
+            Wire(
+                net_id=net_ids[w.net_id],
+                points=[(x + dx, y + dy) for x, y in w.points],
+                owner=w.owner,
+            )
+            for w in layout.wires
+        ],
+        pins={pin: (x + dx, y + dy) for pin, (x, y) in layout.pins.items()},
+        bounds=box(layout.bounds),
+        metadata=layout.metadata,
+    )
+
+
+def _layout_islands(
+    circuit: CompiledCircuit,
+    islands: list[list[str]],
+    placement: str,
+    minimize_crossings: bool,
+    time_budget: float,
+) -> Layout:
+    """
+    島ごとにレイアウトして1つにまとめる
+
+    位置指定のある部品を含む島はまとめて1つとしてそのままの位置に置き、
+    ほかの島はその右側 (なければ原点) から、高い順に棚詰めする。
+    交差削減の時間予算は部品数に比例して島に分ける。
+    """
+    anchored = [
+        any(circuit.components[id].position is not None for id in ids)
+        for ids in islands
+    ]
+    fixed_ids = {
+        id for ids, a in zip(islands, anchored, strict=True) if a for id in ids
+    }
+    fixed = [id for id in circuit.components if id in fixed_ids]
+    free = [ids for ids, a in zip(islands, anchored, strict=True) if not a]
+    parts = ([fixed] if fixed else []) + free
+    if len(parts) < 2:
+        return _layout_part(circuit, placement, minimize_crossings, time_budget)
+
+    subcircuits = [_island_circuit(circuit, ids) for ids in parts]
+    total = len(circuit.components)
+    layouts = layout_pool.layout(
+        [(sub, time_budget * len(sub.components) / total) for sub, _ in subcircuits],
+        placement,
+        minimize_crossings,
+    )
+
+    moved = []
+    origin = (0.0, 0.0)
+    if fixed:
+        anchor = layouts[0].bounds
+        moved.append(_moved(layouts[0], 0.0, 0.0, subcircuits[0][1]))
+        origin = (
+            _snap(anchor.x1 + ISLAND_GAP),
+            math.floor(anchor.y0 / GRID_STEP) * GRID_STEP,
+        )
+    start = len(moved)
+    order = sorted(range(start, len(parts)), key=lambda i: -layouts[i].bounds.height)
+    # 格子に揃えたまま動かすよう、島の左上を格子の間隔に切り下げる
+    corners = [
+        (
+            math.floor(layouts[i].bounds.x0 / GRID_STEP) * GRID_STEP,
+            math.floor(layouts[i].bounds.y0 / GRID_STEP) * GRID_STEP,
+        )
+        for i in order
+    ]
+    sizes = [
+        (
+            _snap(layouts[i].bounds.x1 - x0 + ISLAND_GAP),
+            _snap(layouts[i].bounds.y1 - y0 + ISLAND_GAP),
+        )
+        for i, (x0, y0) in zip(order, corners, strict=True)
+    ]
+    targets, _, _, _ = _shelf_pack(sizes, origin)
+    for i, (x0, y0), (x, y) in zip(order, corners, targets, strict=True):
+        moved.append(_moved(layouts[i], x - x0, y - y0, subcircuits[i][1]))
+
+    layout = Layout(
+        components=sorted(
+            (c for m in moved for c in m.components), key=lambda c: c.kind != "module"
+        ),
+        wires=[w for m in moved for w in m.wires],
+        pins={pin: xy for m in moved for pin, xy in m.pins.items()},
+        bounds=Box.union(m.bounds for m in moved),
+    )
+    for m in moved:
+        for key, value in m.metadata.items():
+            layout.metadata[key] = layout.metadata.get(key, 0) + value
+    return layout
+
+
+def _layout_part(
+    circuit: CompiledCircuit,
+    placement: str,
+    minimize_crossings: bool,
+    time_budget: float,
+) -> Layout:
+    """1つの島 (または島に分けない回路) のレイアウト"""
+    centers, rotations, shelves = _place(circuit, placement)
+    if not minimize_crossings:
+        return _assemble(circuit, centers, rotations)
+    if shelves:
+        deadline = time.monotonic() + time_budget
+        layout, before = _minimize_crossings(circuit, centers, shelves, deadline)
+    else:
+        layout = _assemble(circuit, centers, rotations)
+        before = layout.crossings()
+    layout.metadata.update(crossings_before=before, crossings_after=layout.crossings())
+    return layout
+
+
+def compute_layout(
+    circuit: CompiledCircuit,
+    placement: str = "grid",
+    *,
+    minimize_crossings: bool = False,
+    time_budget: float = CROSSING_TIME_BUDGET,
+) -> Layout:
+    """
+    コンパイル済みの回路から、描画に必要な座標をすべて求める
+
+    `placement` は位置未指定の部品の配置方法で、"grid" (格子への棚詰め) か
+    "force" (力指向レイアウト)。`minimize_crossings` を指定すると、格子配置の
+    棚の中の並びを `time_budget` 秒まで入れ替えて配線の交差を減らし、
+    前後の交差数を `metadata` に記録する。
+    """
+    with span("layout"):
+        if placement not in PLACEMENTS:
+            raise ValueError(f"unknown placement {placement!r}")
+        islands = _islands(circuit)
+        if len(islands) < 2:
+            return _layout_part(circuit, placement, minimize_crossings, time_budget)
+        return _layout_islands(
+            circuit, islands, placement, minimize_crossings, time_budget
+        )
+
+
+def layout_variant(placement: str, minimize_crossings: bool) -> str:
+    """レイアウトの計算方法を表す文字列。定義ハッシュと組にしてキャッシュのキーにする"""
+    variant = f"{LAYOUT_VERSION}:{placement}"
+    return f"{variant}+crossings" if minimize_crossings else variant
+
+
+# (定義ハッシュ, layout_variant) -> レイアウト。描画のテーマはキーに含まないので、
+# テーマを変えてもレイアウトと配線は計算し直さない
+layout_cache: LRUCache[tuple[str, str], Layout] = LRUCache(LAYOUT_CACHE_SIZE)
+
+
+def _assemble(
+    circuit: CompiledCircuit, centers: dict[str, Point], rotations: dict[str, float]
+) -> Layout:
+    """部品の中心と向きから、モジュールの枠・端子・配線を求める"""
+    placed = {
+        id: _placed(
+            circuit.components[id],
+            x,
+            y,
+            rotations.get(id, circuit.components[id].rotation),
+        )
+        for id, (x, y) in centers.items()
+    }
+
+    # モジュールは内側から順に、子の外接矩形に余白を付けた枠にする
+    children_of: dict[str | None, list[PlacedComponent]] = {}
+    for component in placed.values():
+        children_of.setdefault(component.parent, []).append(component)
+    modules = [c for c in circuit.components.values() if c.id not in placed]
+    for module in sorted(modules, key=lambda m: -m.id.count("/")):
+        box = _module_box(children_of.get(module.id, []))
+        placed[module.id] = frame = PlacedComponent(
+            id=module.id,
+            type=module.type,
+            x=(box.x0 + box.x1) / 2,
+            y=(box.y0 + box.y1) / 2,
+            width=box.width,
+            height=box.height,
+            rotation=0.0,
+            parent=module.parent,
+            box=box,
+        )
+        children_of.setdefault(module.parent, []).append(frame)
+
+    pin_names: dict[str, list[str]] = {}
+    for pin in circuit.net_of:
+        pin_names.setdefault(pin.component_id, []).append(pin.name)
+    pins: dict[PinRef, Point] = {}
+    for component_id, names in pin_names.items():
+        component = placed[component_id]
+        for name, (dx, dy) in _pin_offsets(component, names).items():
+            pins[PinRef(component_id, name)] = (component.x + dx, component.y + dy)
+
+    wires = _route(circuit, pins)
+    components = sorted(placed.values(), key=lambda c: c.kind != "module")
+    boxes = [c.box for c in components] + [w.box for w in wires]
+    bounds = Box.union(boxes) if boxes else Box(0.0, 0.0, 0.0, 0.0)
+    return Layout(components=components, wires=wires, pins=pins, bounds=bounds)
@@ -0,0 +1,363 @@
+"""
+回路のライブ編集
+
+1つの回路を開いているクライアント (編集者と閲覧者) を `LiveSession` にまとめる。
+編集操作 (move, add, remove, set) はメモリ上の回路定義に適用してコンパイルし直し、
+描画した要素を前回の描画と比べて、変わった要素だけをパッチとして全員に送る。
+要素のキーは "defs", "module:<ID>", "wire:<ネットID>", "component:<ID>" で、
+新しい要素はキーの接頭辞が同じ要素の後ろ (同じ層の最前面) に描けばよい。
+回路定義の保存 (リビジョンの記録) は編集ごとではなく、`CHECKPOINT_EDITS` 回の編集か
+`CHECKPOINT_INTERVAL` 秒ごと、および最後のクライアントが切断したときにまとめて行う。
+コンパイル・配置・描画は大きな回路では時間がかかるので、イベントループを止めないよう
+スレッドで行う (セッションの構築もスレッドで行う)。
+保存は読み込んだときのリビジョンと比べて行い、その間に REST や別のワーカーの
+セッションで保存されていれば、未保存の編集を捨てて保存された定義を読み込み直す。
+"""
+
+import asyncio
+import copy
+import logging
+import math
+import time
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any, Protocol
+
+import anyio
+import yaml
+
+from app.circuits.compiler import (
+    MAX_COORDINATE,
+    PATH_SEPARATOR,
+    CompiledCircuit,
+    compile_circuit,
+)
+from app.circuits.formatters.svg import SvgPreviewFormatter
+from app.circuits.layout import Layout, compute_layout
+from app.circuits.loader import CircuitYAMLError, load_circuit_yaml
+from app.circuits.timing import span
+
+logger = logging.getLogger(__name__)
+
+# 保存をまとめる編集回数と間隔 [秒]
+CHECKPOINT_EDITS = 20
+CHECKPOINT_INTERVAL = 30.0
+OPERATIONS = ("move", "add", "remove", "set")
+
+
+class LiveEditError(ValueError):
+    """編集操作を適用できない場合の例外。送ったクライアントにだけエラーを返す"""
+
+
+class CheckpointConflict(Exception):
+    """保存しようとした回路定義が、セッションが読み込んだ後に別の所で更新されていた"""
+
+    def __init__(self, document: dict[str, Any], revision: int) -> None:
+        super().__init__(f"The circuit was updated to revision {revision}.")
+        self.document = document
+        self.revision = revision
+
+
+class Viewer(Protocol):
+    async def send_json(self, data: Any) -> None: ...
+
+
+# (YAML, 回路定義, コンパイル結果, 読み込んだリビジョン) を保存し、保存後の
+# リビジョンを返す関数。リビジョンが違えば CheckpointConflict を送出する
+Checkpoint = Callable[[str, dict[str, Any], CompiledCircuit, int], Awaitable[int]]
+
+
+def dump_circuit_yaml(document: dict[str, Any]) -> str:
+    return yaml.safe_dump(document, sort_keys=False, allow_unicode=True)
+
+
+def _require(operation: dict[str, Any], key: str) -> Any:
+    if key not in operation:
+        raise LiveEditError(f"'{operation['op']}' requires '{key}'.")
+    return operation[key]
+
+
+def _scope(document: dict[str, Any], id: str) -> tuple[list[dict[str, Any]], str, str]:
+    """
+    部品IDが属する部品の一覧と、その中での接続の一覧のキー、ローカルIDを返す
+
+    モジュール内部の部品は "モジュールID/部品ID" で指定する。
+    """
+    components: list[dict[str, Any]] = document["circuit"].setdefault("components", [])
+    connections = "connections"
+    *modules, local = id.split(PATH_SEPARATOR)
+    for module_id in modules:
+        module = next((c for c in components if c.get("id") == module_id), None)
+        if module is None or str(module.get("type", "")).lower() != "module":
+            raise LiveEditError(f"Module '{module_id}' not found.")
+        components = module.setdefault("internal_components", [])
+        connections = "internal_connections"
+    return components, connections, local
+
+
+def _find(document: dict[str, Any], id: str) -> dict[str, Any]:
+    components, _, local = _scope(document, id)
+    for component in components:
+        if component.get("id") == local:
+            return component
+    raise LiveEditError(f"Component '{id}' not found.")
+
+
+def apply_operation(document: dict[str, Any], operation: dict[str, Any]) -> None:
+    """
+    編集操作を回路定義 (YAMLを読み込んだ辞書) に適用する
+
+    * `{"op": "move", "id", "x", "y"}`: 位置を変える (モジュール内ならモジュールからの相対位置)
+    * `{"op": "add", "component", "connections"?}`: 部品と、その部品への接続を加える
+    * `{"op": "remove", "id"}`: 部品と、その部品への接続を取り除く
+    * `{"op": "set", "id", "property", "value"}`: プロパティを変える (`null` なら削除)
+    """
+    op = operation.get("op")
+    if op not in OPERATIONS:
+        raise LiveEditError(f"Unsupported operation: '{op}'.")
+    if not isinstance(document.get("circuit"), dict):
+        raise LiveEditError("Circuit definition has no 'circuit' mapping.")
+
+    if op == "add":
+        component = _require(operation, "component")
+        local_id = component.get("id") if isinstance(component, dict) else None
+        if not isinstance(local_id, str) or not local_id:
+            raise LiveEditError("'add' requires a component with an 'id'.")
+        if not isinstance(operation.get("connections") or [], list):
+            raise LiveEditError("'add' requires 'connections' to be a list.")
+        parent = str(operation.get("parent") or "")
+        id = f"{parent}{PATH_SEPARATOR}{component['id']}" if parent else component["id"]
+        components, connections, _ = _scope(document, id)
+        if any(c.get("id") == component["id"] for c in components):
+            raise LiveEditError(f"Component '{id}' already exists.")
+        components.append(component)
+        scope = _find(document, parent) if parent else document["circuit"]
+        scope.setdefault(connections, []).extend(operation.get("connections") or [])
+        return
+
+    id = str(_require(operation, "id"))
+    component = _find(document, id)
+    if op == "move":
+        try:
+            x, y = float(_require(operation, "x")), float(_require(operation, "y"))
+        except (TypeError, ValueError):
+            raise LiveEditError("'move' requires numeric 'x' and 'y'.")
+        if not all(math.isfinite(v) and abs(v) <= MAX_COORDINATE for v in (x, y)):
+            raise LiveEditError(
+                f"'move' requires 'x' and 'y' within ±{MAX_COORDINATE:g}."
+            )
+        component.setdefault("properties", {})["position"] = {"x": x, "y": y}
+    elif op == "set":
+        name = str(_require(operation, "property"))
+        properties = component.setdefault("properties", {})
+        if operation.get("value") is None:
+            properties.pop(name, None)
+        else:
+            properties[name] = operation["value"]
+    else:
+        components, connections, local = _scope(document, id)
+        components.remove(component)
+        *modules, _ = id.split(PATH_SEPARATOR)
+        scope = _find(document, PATH_SEPARATOR.join(modules)) if modules else None
+        owner = scope if scope is not None else document["circuit"]
+        owner[connections] = [
+            conn
+            for conn in owner.get(connections) or []
+            if local
+            not in (
+                (conn.get("from") or {}).get("component_id"),
+                (conn.get("to") or {}).get("component_id"),
+            )
+        ]
+
+
+# レイアウトと、その viewBox・要素ごとのSVG断片
+Rendered = tuple[Layout, str, dict[str, str]]
+
+
+class LiveSession:
+    """
+    1つの回路を開いているクライアントと、編集中の回路定義
+
+    構築時に回路をコンパイルして描画するので、イベントループからはスレッドで作る。
+    """
+
+    def __init__(
+        self,
+        document: dict[str, Any],
+        checkpoint: Checkpoint,
+        formatter: SvgPreviewFormatter | None = None,
+        revision: int = 1,
+    ) -> None:
+        self.document = document
+        self.revision = revision
+        self.compiled = compile_circuit(document)
+        self.checkpoint = checkpoint
+        self.formatter = formatter or SvgPreviewFormatter()
+        self.viewers: set[Viewer] = set()
+        self.version = 0
+        self.pending = 0
+        self.saved_at = time.monotonic()
+        self.lock = asyncio.Lock()
+        # 最後のクライアントが抜けて閉じた (もう参加できない) か
+        self.closed = False
+        self._render()
+
+    def _rendered(self, compiled: CompiledCircuit) -> Rendered:
+        layout = compute_layout(compiled)
+        with span("svg"):
+            view_box = self.formatter.view_box(self.formatter.view(layout))
+            return layout, view_box, self.formatter.fragments(layout)
+
+    def _render(self, rendered: Rendered | None = None) -> None:
+        self.layout, self.view_box, self.fragments = rendered or self._rendered(
+            self.compiled
+        )
+        self._svg: str | None = None
+
+    def svg(self) -> str:
+        """回路図全体 (接続したクライアントに最初に送る)。次の編集まで使い回す"""
+        if self._svg is None:
+            with span("svg"):
+                self._svg = "".join(self.formatter.render(self.layout))
+        return self._svg
+
+    def _apply(
+        self, operation: dict[str, Any]
+    ) -> tuple[dict[str, Any], CompiledCircuit, Rendered]:
+        document = copy.deepcopy(self.document)
+        apply_operation(document, operation)
+        # 保存できない大きさの回路にならないよう、YAMLの上限も確かめる
+        document = load_circuit_yaml(dump_circuit_yaml(document))
+        compiled = compile_circuit(document)
+        return document, compiled, self._rendered(compiled)
+
+    def _load(
+        self, document: dict[str, Any]
+    ) -> tuple[dict[str, Any], CompiledCircuit, Rendered]:
+        compiled = compile_circuit(document)
+        return document, compiled, self._rendered(compiled)
+
+    async def _reload(self, document: dict[str, Any], revision: int) -> None:
+        """保存された定義に置き換え、全員に回路図全体を送り直す"""
+        self.document, self.compiled, rendered = await anyio.to_thread.run_sync(
+            self._load, document
+        )
+        self._render(rendered)
+        self.revision = revision
+        self.version += 1
+        self.pending = 0
+        self.saved_at = time.monotonic()
+        svg = await anyio.to_thread.run_sync(self.svg)
+        await self._broadcast({"type": "snapshot", "version": self.version, "svg": svg})
+
+    async def sync(self, document: dict[str, Any], revision: int) -> None:
+        """
+        接続時に読んだ保存済みの定義が新しければ読み込み直す
+
+        未保存の編集があれば、次の保存で食い違いとして扱う。
+        """
+        async with self.lock:
+            if revision != self.revision and not self.pending:
+                await self._reload(document, revision)
+
+    async def join(self, viewer: Viewer) -> bool:
+        """
+        クライアントを加えて回路図全体を送る
+
+        閉じたセッションには加えずに False を返す (開き直してから参加する)。
+        """
+        async with self.lock:
+            if self.closed:
+                return False
+            self.viewers.add(viewer)
+            svg = await anyio.to_thread.run_sync(self.svg)
+            await viewer.send_json(
+                {"type": "snapshot", "version": self.version, "svg": svg}
+            )
+            return True
+
+    async def leave(self, viewer: Viewer) -> bool:
+        """クライアントを外す。最後の1人なら保存して閉じ、True を返す"""
+        async with self.lock:
+            self.viewers.discard(viewer)
+            if self.viewers or self.closed:
+                return False
+            self.closed = True
+            await self._checkpoint()
+            return True
+
+    async def edit(self, viewer: Viewer, operation: dict[str, Any]) -> None:
+        async with self.lock:
+            try:
+                document, compiled, rendered = await anyio.to_thread.run_sync(
+                    self._apply, operation
+                )
+            except (LiveEditError, CircuitYAMLError) as e:
+                await viewer.send_json({"type": "error", "message": str(e)})
+                return
+
+            before, view_box = self.fragments, self.view_box
+            self.document, self.compiled = document, compiled
+            self._render(rendered)
+            self.version += 1
+            self.pending += 1
+            patch: dict[str, Any] = {
+                "type": "patch",
+                "version": self.version,
+                "upsert": {
+                    key: svg
+                    for key, svg in self.fragments.items()
+                    if before.get(key) != svg
+                },
+                "remove": [key for key in before if key not in self.fragments],
+            }
+            if self.view_box != view_box:
+                patch["viewBox"] = self.view_box
+            await self._broadcast(patch)
+
+            due = time.monotonic() - self.saved_at >= CHECKPOINT_INTERVAL
+            if self.pending >= CHECKPOINT_EDITS or due:
+                await self._checkpoint()
+
+    async def _broadcast(self, message: dict[str, Any]) -> None:
+        for viewer in list(self.viewers):
+            try:
+                await viewer.send_json(message)
+            except Exception:
+                # 切断したクライアントは外す (leave は受信側のループが呼ぶ)
+                self.viewers.discard(viewer)
+
+    async def _checkpoint(self) -> None:
+        if not self.pending:
+            return
+        try:
+            self.revision = await self.checkpoint(
+                dump_circuit_yaml(self.document),
+                self.document,
+                self.compiled,
+                self.revision,
+            )
+        except CheckpointConflict as e:
+            await self._broadcast(
+                {
+                    "type": "error",
+                    "message": "The circuit was changed elsewhere; "
+                    "unsaved live edits were discarded.",
+                }
+            )
+            await self._reload(e.document, e.revision)
+            return
+        except Exception:
+            # 編集は残しておき、次の保存で (間隔を空けて) もう一度試す
+            logger.exception("Failed to save live edits")
+            self.saved_at = time.monotonic()
+            await self._broadcast(
+                {"type": "error", "message": "Failed to save the circuit."}
+            )
+            return
+        self.pending = 0
+        self.saved_at = time.monotonic()
+
+
+# 回路ごとの編集中のセッション
+live_sessions: dict[Hashable, LiveSession] = {}
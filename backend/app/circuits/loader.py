@@ -0,0 +1,131 @@
+"""
+回路YAMLの安全なローダー
+
+回路YAMLはユーザー入力やLLMの出力など信頼できない経路から届くため、
+`yaml.safe_load` をそのまま使うとエイリアス爆弾や深いネストでワーカーの
+メモリを食い潰される。ここではPythonオブジェクトを構築する前に
+イベントストリームだけを走査し、上限を超えた時点で打ち切る。
+"""
+
+from dataclasses import dataclass
+from typing import Any
+
+import yaml
+
+from app.circuits.timing import span
+from app.core.config import settings
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # libyaml が無い環境では純Python実装にフォールバック
+    from yaml import SafeLoader  # type: ignore[assignment]
+
+
+class CircuitYAMLError(ValueError):
+    """回路YAMLを受け付けられない場合の例外。`status_code` はそのままHTTP応答に使う"""
+
+    def __init__(self, message: str, status_code: int = 400) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass(frozen=True)
+class YAMLLimits:
+    max_bytes: int
+    max_nodes: int
+    max_depth: int
+    max_aliases: int
+
+    @classmethod
+    def from_settings(cls) -> "YAMLLimits":
+        return cls(
+            max_bytes=settings.CIRCUIT_YAML_MAX_BYTES,
+            max_nodes=settings.CIRCUIT_YAML_MAX_NODES,
+            max_depth=settings.CIRCUIT_YAML_MAX_DEPTH,
+            max_aliases=settings.CIRCUIT_YAML_MAX_ALIASES,
+        )
+
+
+def _check_events(text: str, limits: YAMLLimits) -> None:
+    # エイリアスは参照先を展開したものとして数える。アンカーごとに展開後の
+    # ノード数を記録しておけば、入れ子のエイリアスも指数的に膨らむ前に検出できる。
+    total = 0
+    aliases = 0
+    documents = 0
+    anchors: dict[str, int] = {}
+    stack: list[tuple[str | None, int]] = []
+
+    for event in yaml.parse(text, Loader=SafeLoader):
+        if isinstance(event, yaml.DocumentStartEvent):
+            documents += 1
+            if documents > 1:
+                raise CircuitYAMLError("Circuit YAML must contain a single document.")
+            continue
+
+        if isinstance(event, yaml.AliasEvent):
+            aliases += 1
+            if aliases > limits.max_aliases:
+                raise CircuitYAMLError(
+                    f"Circuit YAML uses more than {limits.max_aliases} aliases.",
+                    status_code=413,
+                )
+            if event.anchor not in anchors:
+                raise CircuitYAMLError(f"Undefined alias: '{event.anchor}'.")
+            total += anchors[event.anchor]
+        elif isinstance(event, yaml.ScalarEvent):
+            total += 1
+            if event.anchor is not None:
+                anchors[event.anchor] = 1
+        elif isinstance(event, yaml.CollectionStartEvent):
+            total += 1
+            stack.append((event.anchor, total - 1))
+            if len(stack) > limits.max_depth:
+                raise CircuitYAMLError(
+                    f"Circuit YAML is nested deeper than {limits.max_depth} levels."
+                )
+        elif isinstance(event, yaml.CollectionEndEvent):
+            anchor, start = stack.pop()
+            if anchor is not None:
+                anchors[anchor] = total - start
+        else:
+            continue
+
+        if total > limits.max_nodes:
+            raise CircuitYAMLError(
+                f"Circuit YAML expands to more than {limits.max_nodes} nodes.",
+                status_code=413,
+            )
+
+
+def load_circuit_yaml(
+    source: str | bytes, limits: YAMLLimits | None = None
+) -> dict[str, Any]:
+    """
+    回路YAMLを上限付きで読み込み、ルートのマッピングを返す
+    """
+    limits = limits or YAMLLimits.from_settings()
+
+    if isinstance(source, str):
+        size = len(source.encode("utf-8"))
+        text = source
+    else:
+        size = len(source)
+        try:
+            text = source.decode("utf-8")
+        except UnicodeDecodeError:
+            raise CircuitYAMLError("Circuit YAML must be UTF-8 encoded.")
+    if size > limits.max_bytes:
+        raise CircuitYAMLError(
+            f"Circuit YAML exceeds {limits.max_bytes} bytes.", status_code=413
+        )
+
+    with span("parse"):
+        try:
+            _check_events(text, limits)
+            data = yaml.load(text, Loader=SafeLoader)
+        except yaml.YAMLError as e:
+            raise CircuitYAMLError(f"YAML parsing error: {e}") from e
+
+    if not isinstance(data, dict):
+        raise CircuitYAMLError("Circuit YAML root must be a mapping.")
+    return data
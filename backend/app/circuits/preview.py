@@ -0,0 +1,267 @@
+"""
+生成中の回路の仮の描画 (プレビュー)
+
+テキストエンジンが回路YAMLを出力している間、届いた (閉じた) 部品と接続だけで
+回路をコンパイルし (`compile_partial`)、仮の回路図を描く。描画はイベントループを
+止めないようにスレッドで行い、リクエストごとに同時に1つまで、`FRAME_INTERVAL` 秒に
+1回までに間引く。さらにプロセス全体で、仮の描画に使う時間を直近 `BUDGET_WINDOW` 秒の
+`FRAME_LOAD` の割合までに抑える (同時に生成するリクエストが多くても、描画が
+ワーカーの時間を使い切らない)。
+前回の描画で置いた部品は同じ位置と向きに固定し、新しく届いた部品だけを
+その右側に詰めるので、図は崩れずに育っていく。
+クライアントには live.py と同じ形式の、前回から変わった要素だけのパッチを送る。
+生成が終わったら完成した回路を通常どおりレイアウトしてレイアウトのキャッシュに
+登録するので、保存した回路を最初に描画するときにはレイアウトを計算し直さない。
+"""
+
+import asyncio
+import copy
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from typing import Any
+
+import anyio
+
+from app.circuits.compiler import CompiledCircuit, compile_circuit
+from app.circuits.formatters.svg import SvgPreviewFormatter
+from app.circuits.generation import StreamValidator, repair_circuit
+from app.circuits.layout import Layout, compute_layout, layout_cache, layout_variant
+from app.circuits.loader import CircuitYAMLError
+from app.circuits.timing import span
+
+# 仮の描画の (リクエストごとの) 最短の間隔 [秒]
+FRAME_INTERVAL = 0.2
+# プロセス全体で仮の描画に使ってよい時間の割合と、それを数える期間 [秒]
+FRAME_LOAD = 0.25
+BUDGET_WINDOW = 2.0
+
+# 仮の描画の1フレームを作る関数 (スレッドで呼ぶ)
+FrameJob = Callable[[], dict[str, Any] | None]
+
+
+class FrameBudget:
+    """プロセス全体で仮の描画に使った時間を数え、使いすぎていれば描画を止める"""
+
+    def __init__(
+        self,
+        load: float = FRAME_LOAD,
+        window: float = BUDGET_WINDOW,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.load = load
+        self.window = window
+        self.clock = clock
+        # (描画が終わった時刻, 掛かった時間)
+        self._spent: deque[tuple[float, float]] = deque()
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        with self._lock:
+            since = self.clock() - self.window
+            while self._spent and self._spent[0][0] < since:
+                self._spent.popleft()
+            return sum(cost for _, cost in self._spent) < self.load * self.window
+
+    def spend(self, cost: float) -> None:
+        with self._lock:
+            self._spent.append((self.clock(), cost))
+
+
+frame_budget = FrameBudget()
+
+
+def compile_partial(
+    document: dict[str, Any], closed: int | None = None
+) -> CompiledCircuit | None:
+    """
+    途中までの回路定義を、描ける部分だけでコンパイルする
+
+    トップレベルの部品は先頭の `closed` 個 (閉じたもの) だけを使い、まだ届いていない
+    部品への接続は取り除く。接続が壊れていれば部品だけで、部品も壊れていれば None。
+    """
+    circuit = document.get("circuit")
+    if not isinstance(circuit, dict) or not isinstance(circuit.get("components"), list):
+        return None
+    components = circuit["components"][:closed]
+    partial = copy.deepcopy({"circuit": {**circuit, "components": components}})
+    repair_circuit(partial)
+    try:
+        return compile_circuit(partial)
+    except CircuitYAMLError:
+        pass
+    partial["circuit"]["connections"] = []
+    try:
+        return compile_circuit(partial)
+    except CircuitYAMLError:
+        return None
+
+
+def _shape(validator: StreamValidator) -> tuple[int, int]:
+    """描画の内容が変わったかを見るための (閉じた部品の数, 接続の数)"""
+    circuit = (validator.document or {}).get("circuit")
+    connections = circuit.get("connections") if isinstance(circuit, dict) else None
+    if not isinstance(connections, list):
+        return validator.components, 0
+    return validator.components, len(connections)
+
+
+class PreviewRenderer:
+    """
+    生成の途中経過から仮の回路図を描き、フレーム (パッチ) を作る
+
+    最初のフレームは回路図全体 (`{"type": "snapshot", "svg"}`)、以降は
+    `{"type": "patch", "upsert", "remove", "viewBox"?}`。ヘッジで複数のエンジンが
+    同時に出力している場合は、閉じた部品が最も多いエンジンの出力を描く。
+    """
+
+    def __init__(
+        self,
+        formatter: SvgPreviewFormatter | None = None,
+        frame_interval: float = FRAME_INTERVAL,
+        clock: Callable[[], float] = time.monotonic,
+        budget: FrameBudget | None = None,
+    ) -> None:
+        self.formatter = formatter or SvgPreviewFormatter()
+        self.frame_interval = frame_interval
+        self.clock = clock
+        self.budget = budget or frame_budget
+        self.layout: Layout | None = None
+        self.fragments: dict[str, str] = {}
+        self.view_box = ""
+        self.frames = 0
+        # 間引いたフレームの数
+        self.skipped = 0
+        self._source: StreamValidator | None = None
+        self._shape: tuple[int, int] | None = None
+        self._next_at = 0.0
+        self._rendering: asyncio.Task[None] | None = None
+
+    def update(self, validator: StreamValidator) -> dict[str, Any] | None:
+        """
+        途中経過を受け取り、仮の描画のフレームをその場で作って返す
+
+        描ける内容が前回から変わっていない場合と、間引いた場合は None を返す。
+        """
+        job = self.prepare(validator)
+        return job() if job is not None else None
+
+    def submit(
+        self, validator: StreamValidator, send: Callable[[dict[str, Any]], None]
+    ) -> None:
+        """
+        途中経過を受け取り、フレームをスレッドで作って `send` に渡す
+
+        前のフレームをまだ作っている間は間引く。イベントループから呼ぶ。
+        """
+        if self._rendering is not None:
+            self.skipped += 1
+            return
+        job = self.prepare(validator)
+        if job is not None:
+            self._rendering = asyncio.create_task(self._render(job, send))
+
+    async def _render(
+        self, job: FrameJob, send: Callable[[dict[str, Any]], None]
+    ) -> None:
+        try:
+            frame = await anyio.to_thread.run_sync(job)
+            if frame is not None:
+                send(frame)
+        finally:
+            self._rendering = None
+
+    async def drain(self) -> None:
+        """作っている途中のフレームを待つ (最後のフレームより前に送るため)"""
+        if self._rendering is not None:
+            await asyncio.gather(self._rendering, return_exceptions=True)
+
+    def prepare(self, validator: StreamValidator) -> FrameJob | None:
+        """
+        フレームを作るかを決め、作るならその関数を返す
+
+        描くのは呼んだ時点の途中経過なので、関数はスレッドで後から呼んでよい。
+        """
+        source = self._source
+        if (
+            source is not None
+            and validator is not source
+            and validator.components <= source.components
+        ):
+            return None
+        shape = _shape(validator)
+        if validator.document is None or shape == self._shape:
+            return None
+        now = self.clock()
+        if now < self._next_at or not self.budget.available():
+            self.skipped += 1
+            return None
+        self._source, self._shape = validator, shape
+        self._next_at = now + self.frame_interval
+        document, closed = validator.document, validator.components
+
+        def job() -> dict[str, Any] | None:
+            started = self.clock()
+            try:
+                compiled = compile_partial(document, closed)
+                if compiled is None:
+                    return None
+                return self._frame(self._incremental_layout(compiled))
+            finally:
+                self.budget.spend(self.clock() - started)
+
+        return job
+
+    def finish(self, compiled: CompiledCircuit) -> dict[str, Any]:
+        """完成した回路を通常どおりレイアウトし (キャッシュに登録する)、最後のフレームを返す"""
+        formatter = self.formatter
+        layout = layout_cache.get_or_create(
+            (
+                compiled.definition_hash,
+                layout_variant(formatter.placement, formatter.minimize_crossings),
+            ),
+            lambda: compute_layout(
+                compiled,
+                formatter.placement,
+                minimize_crossings=formatter.minimize_crossings,
+            ),
+        )
+        return self._frame(layout)
+
+    def _incremental_layout(self, compiled: CompiledCircuit) -> Layout:
+        # 前回置いた部品は位置指定のある部品として扱い、動かさない
+        if self.layout is not None:
+            for placed in self.layout.components:
+                component = compiled.components.get(placed.id)
+                if (
+                    component is not None
+                    and placed.kind != "module"
+                    and component.position is None
+                ):
+                    component.position = (placed.x, placed.y)
+                    component.rotation = placed.rotation
+        return compute_layout(compiled, self.formatter.placement)
+
+    def _frame(self, layout: Layout) -> dict[str, Any]:
+        before, view_box = self.fragments, self.view_box
+        self.layout = layout
+        with span("svg"):
+            self.fragments = self.formatter.fragments(layout)
+            self.view_box = self.formatter.view_box(self.formatter.view(layout))
+            self.frames += 1
+            if self.frames == 1:
+                svg = "".join(self.formatter.render(layout))
+                return {"type": "snapshot", "svg": svg}
+        frame: dict[str, Any] = {
+            "type": "patch",
+            "upsert": {
+                key: svg
+                for key, svg in self.fragments.items()
+                if before.get(key) != svg
+            },
+            "remove": [key for key in before if key not in self.fragments],
+        }
+        if self.view_box != view_box:
+            frame["viewBox"] = self.view_box
+        return frame
@@ -0,0 +1,137 @@
+"""
+描画結果のキャッシュ
+
+回路図の描画結果を、定義ハッシュと描画の指定をキーに保持する。
+gzip と brotli で圧縮した版は登録時に1回だけ作っておき、リクエストの
+`Accept-Encoding` に合わせてそのまま返すので、キャッシュに当たった
+リクエストでは圧縮の計算をしない。brotli はオプションの依存関係で、
+入っていなければ gzip の版だけを作る。
+"""
+
+import gzip
+import importlib
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+from app.circuits.cache import LRUCache
+from app.circuits.formatters.svg import COORDINATE_QUANTUM
+from app.circuits.layout import Layout
+
+RENDER_CACHE_SIZE = 256
+# これより小さい応答は圧縮しない
+MIN_COMPRESS_SIZE = 256
+# 登録時の1回だけとはいえ最初のリクエストを待たせるので、最大圧縮は使わない
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 9
+# 圧縮する (テキストの) メディアタイプ。PNG と PDF は圧縮済み
+COMPRESSIBLE_MEDIA_TYPES = frozenset({"image/svg+xml", "text/plain", "text/csv"})
+
+
+def _brotli_compress() -> Callable[[bytes], bytes] | None:
+    try:
+        brotli: Any = importlib.import_module("brotli")
+    except ImportError:
+        return None
+    return lambda data: bytes(brotli.compress(data, quality=BROTLI_QUALITY))
+
+
+# エンコーディング -> 圧縮関数 (同じ品質なら先にあるものを優先する)
+COMPRESSORS: dict[str, Callable[[bytes], bytes]] = {
+    name: compress
+    for name, compress in (
+        ("br", _brotli_compress()),
+        ("gzip", lambda data: gzip.compress(data, GZIP_LEVEL, mtime=0)),
+    )
+    if compress is not None
+}
+
+
+def parse_accept_encoding(header: str | None) -> dict[str, float]:
+    """`Accept-Encoding` を エンコーディング -> q値 にする ("gzip;q=0.5, br")"""
+    accepted: dict[str, float] = {}
+    for item in (header or "").split(","):
+        name, *params = (part.strip() for part in item.split(";"))
+        if not name:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name.lower()] = q
+    return accepted
+
+
+@dataclass(frozen=True)
+class RenderedEntry:
+    media_type: str
+    body: bytes
+    headers: dict[str, str] = field(default_factory=dict)
+    # エンコーディング -> 圧縮した本体 (元より小さくなったものだけ)
+    encoded: dict[str, bytes] = field(default_factory=dict)
+
+    @classmethod
+    def create(
+        cls, media_type: str, body: bytes, headers: dict[str, str] | None = None
+    ) -> "RenderedEntry":
+        encoded: dict[str, bytes] = {}
+        if media_type in COMPRESSIBLE_MEDIA_TYPES and len(body) >= MIN_COMPRESS_SIZE:
+            for name, compress in COMPRESSORS.items():
+                data = compress(body)
+                if len(data) < len(body):
+                    encoded[name] = data
+        return cls(media_type, body, dict(headers or {}), encoded)
+
+    def negotiate(self, accept_encoding: str | None) -> tuple[str | None, bytes]:
+        """`Accept-Encoding` で受け付けられる版のうち、q値が最大のものを選ぶ"""
+        accepted = parse_accept_encoding(accept_encoding)
+        best: tuple[str | None, bytes] = (None, self.body)
+        best_q = 0.0
+        for name, data in self.encoded.items():
+            q = accepted.get(name, accepted.get("*", 0.0))
+            if q > best_q:
+                best, best_q = (name, data), q
+        return best
+
+
+RenderKey = tuple[Any, ...]
+
+
+def render_key(
+    definition_hash: str,
+    variant: str,
+    format: str = "svg",
+    width: int | None = None,
+    height: int | None = None,
+    viewport: tuple[float, float, float, float] | None = None,
+    zoom: float = 1.0,
+    theme: str = "light",
+    quantum: float = COORDINATE_QUANTUM,
+) -> RenderKey:
+    """描画結果のキー。`variant` はレイアウトの計算方法 (`layout_variant`)"""
+    return (
+        definition_hash,
+        variant,
+        format,
+        width,
+        height,
+        viewport,
+        zoom,
+        theme,
+        quantum,
+    )
+
+
+def layout_headers(layout: Layout) -> dict[str, str]:
+    """レイアウトのメタデータを `X-Layout-*` ヘッダーにする"""
+    return {
+        f"X-Layout-{key.replace('_', '-').title()}": str(value)
+        for key, value in layout.metadata.items()
+    }
+
+
+render_cache: LRUCache[RenderKey, RenderedEntry] = LRUCache(RENDER_CACHE_SIZE)
@@ -0,0 +1,253 @@
+"""
+保存済み回路の検索インデックス (生成プロンプトの例示用)
+
+回路の名前・説明の単語と部品種別の集まりを、ハッシュで次元を固定した
+bag-of-words のベクトル (L2正規化) にして、1つの NumPy 行列に並べておく。
+検索は行列とクエリベクトルの内積で全件のコサイン類似度を一度に計算し、
+`argpartition` で上位k件だけを並べ替えるので、10万件 (128次元の float32 で約50MB)
+でも数ミリ秒で済む。
+外部の埋め込みモデルは使わないので、ネットワークには出ない。
+"""
+
+import math
+import re
+import threading
+import uuid
+import zlib
+from collections.abc import Callable, Hashable, Iterable, Iterator
+from datetime import datetime, timedelta
+from typing import Generic, TypeVar
+
+import numpy as np
+from sqlalchemy import select
+from sqlmodel import Session, col
+
+from app.models import CircuitDefinition
+
+# 行列を読む時間がほぼ検索時間になるので、次元は衝突が目立たない程度に小さくする
+EMBEDDING_DIM = 128
+# 部品種別は名前や説明の単語より回路の中身をよく表すので重くする
+TYPE_WEIGHT = 2.0
+INITIAL_CAPACITY = 1024
+# 別ワーカーのコミットが updated_at の順に届くとは限らないため、少し遡って取り込む
+SYNC_OVERLAP = timedelta(minutes=1)
+
+_WORD = re.compile(r"\w+")
+_SIGN_BIT = 1 << 16
+
+K = TypeVar("K", bound=Hashable)
+
+
+def _tokens(text: str) -> Iterator[str]:
+    for word in _WORD.findall(text.lower()):
+        if word.isascii() or len(word) < 2:
+            yield word
+        else:
+            # 日本語は分かち書きされていないので文字 bigram にする
+            yield from (word[i : i + 2] for i in range(len(word) - 1))
+
+
+def embed(terms: dict[str, float]) -> np.ndarray:
+    """単語 -> 重み を `EMBEDDING_DIM` 次元の単位ベクトルにする (符号付き feature hashing)"""
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    for term, weight in terms.items():
+        h = zlib.crc32(term.encode())
+        vector[h % EMBEDDING_DIM] += weight if h & _SIGN_BIT else -weight
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+def _weigh(counts: dict[str, float]) -> dict[str, float]:
+    # 同じ単語の繰り返しで類似度が偏らないよう、頻度は対数で効かせる
+    return {term: 1.0 + math.log(count) for term, count in counts.items()}
+
+
+def circuit_terms(
+    name: str, description: str | None, component_types: Iterable[str] | None
+) -> dict[str, float]:
+    counts: dict[str, float] = {}
+    for token in _tokens(f"{name} {description or ''}"):
+        counts[token] = counts.get(token, 0) + 1
+    terms = _weigh(counts)
+    for component_type in component_types or ():
+        terms[f"type:{component_type.lower()}"] = TYPE_WEIGHT
+    return terms
+
+
+def query_terms(text: str) -> dict[str, float]:
+    """
+    生成の指示文の単語。部品種別の名前 ("LED を光らせる" の "led") にも当たるよう、
+    各単語を部品種別としても数える
+    """
+    counts: dict[str, float] = {}
+    for token in _tokens(text):
+        counts[token] = counts.get(token, 0) + 1
+    terms = _weigh(counts)
+    terms.update({f"type:{token}": TYPE_WEIGHT for token in counts})
+    return terms
+
+
+class VectorIndex(Generic[K]):
+    """
+    単位ベクトルを行として並べた行列と、内積 (コサイン類似度) による上位k件の検索
+
+    行列の容量は倍々に確保し、削除は最後の行を空いた行に移して詰める。
+    """
+
+    def __init__(
+        self, dim: int = EMBEDDING_DIM, capacity: int = INITIAL_CAPACITY
+    ) -> None:
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self._keys: list[K] = []
+        self._rows: dict[K, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._rows
+
+    def insert(self, key: K, vector: np.ndarray) -> None:
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                row = len(self._keys)
+                if row == len(self._matrix):
+                    grown = np.zeros(
+                        (2 * len(self._matrix), self._matrix.shape[1]),
+                        dtype=np.float32,
+                    )
+                    grown[:row] = self._matrix
+                    self._matrix = grown
+                self._keys.append(key)
+                self._rows[key] = row
+            self._matrix[row] = vector
+
+    def remove(self, key: K) -> None:
+        with self._lock:
+            row = self._rows.pop(key, None)
+            if row is None:
+                return
+            last = self._keys.pop()
+            if last != key:
+                self._matrix[row] = self._matrix[len(self._keys)]
+                self._keys[row] = last
+                self._rows[last] = row
+
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int,
+        accept: Callable[[K], bool] | None = None,
+    ) -> list[list[tuple[K, float]]]:
+        """
+        クエリ (1行1ベクトルの行列) ごとに、類似度の高い順に最大k件を返す
+
+        `accept` で除外されたぶんは候補を広げて取り直すので、除外が少なければ
+        上位k件の近くだけを見れば済む。
+        """
+        with self._lock:
+            n = len(self._keys)
+            if not n or k <= 0:
+                return [[] for _ in range(len(queries))]
+            scores = self._matrix[:n] @ np.atleast_2d(queries).astype(np.float32).T
+            return [self._top(column, k, accept) for column in scores.T]
+
+    def _top(
+        self, scores: np.ndarray, k: int, accept: Callable[[K], bool] | None
+    ) -> list[tuple[K, float]]:
+        n = len(scores)
+        limit = k if accept is None else 4 * k
+        while True:
+            limit = min(limit, n)
+            candidates = (
+                np.argpartition(scores, n - limit)[n - limit :]
+                if limit < n
+                else np.arange(n)
+            )
+            order = candidates[np.argsort(-scores[candidates], kind="stable")]
+            matches = [
+                (self._keys[i], float(scores[i]))
+                for i in order
+                if accept is None or accept(self._keys[i])
+            ][:k]
+            if len(matches) >= k or limit == n:
+                return matches
+            limit *= 4
+
+
+class CircuitRetrievalIndex:
+    """
+    保存済み回路の検索インデックス
+
+    インデックスはプロセスごとのメモリ上にあるため、検索のたびに
+    前回以降に保存・更新された回路だけをDBから取り込んで追従する。
+    """
+
+    def __init__(self) -> None:
+        self.index: VectorIndex[uuid.UUID] = VectorIndex()
+        self._owners: dict[uuid.UUID, uuid.UUID] = {}
+        self._versions: dict[uuid.UUID, datetime] = {}
+        self._synced_at: datetime | None = None
+        self._lock = threading.Lock()
+
+    def sync(self, session: Session) -> None:
+        with self._lock:
+            statement = select(
+                col(CircuitDefinition.id),
+                col(CircuitDefinition.owner_id),
+                col(CircuitDefinition.name),
+                col(CircuitDefinition.description),
+                col(CircuitDefinition.component_types),
+                col(CircuitDefinition.updated_at),
+            )
+            if self._synced_at is not None:
+                statement = statement.where(
+                    col(CircuitDefinition.updated_at) >= self._synced_at - SYNC_OVERLAP
+                )
+            for (
+                id,
+                owner_id,
+                name,
+                description,
+                component_types,
+                updated_at,
+            ) in session.execute(statement):
+                if self._versions.get(id) != updated_at:
+                    terms = circuit_terms(name, description, component_types)
+                    self.index.insert(id, embed(terms))
+                    self._owners[id] = owner_id
+                    self._versions[id] = updated_at
+                if self._synced_at is None or updated_at > self._synced_at:
+                    self._synced_at = updated_at
+
+    def discard(self, id: uuid.UUID) -> None:
+        self.index.remove(id)
+        self._owners.pop(id, None)
+        self._versions.pop(id, None)
+
+    def search(
+        self,
+        session: Session,
+        text: str,
+        k: int,
+        owner_id: uuid.UUID | None = None,
+    ) -> list[tuple[uuid.UUID, float]]:
+        """
+        指示文 `text` に近い回路を類似度の高い順に最大k件返す
+
+        `owner_id` を指定すると、そのユーザーが所有する回路に限定する。
+        """
+        self.sync(session)
+        accept = None
+        if owner_id is not None:
+
+            def accept(key: uuid.UUID) -> bool:
+                return self._owners.get(key) == owner_id
+
+        query = embed(query_terms(text))
+        return self.index.search(query[np.newaxis], k, accept=accept)[0]
+
+
+retrieval_index = CircuitRetrievalIndex()
@@ -0,0 +1,267 @@
+"""
+回路定義の差分 (デルタ) による版管理
+
+回路定義を「circuit直下のメタ情報」「IDをキーにしたコンポーネント」
+「接続」の3つに分け、それぞれをパス -> 値の平坦なマップとして扱う。
+デルタは変更のあったパスごとに `{"old": 変更前, "new": 変更後}` を持つだけなので
+(キーが無ければ値が存在しないことを表す)、
+
+* 適用: 変更後の値をセットする ("new" が無ければ削除)
+* 逆適用: old と new を入れ替える
+* 合成: 最初の old と最後の new を残す
+
+がすべて同じ規則で書ける。コンポーネントの追加・削除は、全パスが
+存在しない状態から/への変更として表す。
+"""
+
+import json
+from collections.abc import Iterable
+from typing import Any
+
+COMPONENTS = "components"
+CONNECTIONS = "connections"
+
+Change = dict[str, Any]
+Delta = dict[str, Any]
+
+
+def _flatten_component(component: dict[str, Any]) -> dict[str, Any]:
+    flat: dict[str, Any] = {}
+    for key, value in component.items():
+        if key == "id":
+            continue
+        if key == "properties" and isinstance(value, dict) and value:
+            for prop, prop_value in value.items():
+                flat[f"properties.{prop}"] = prop_value
+        else:
+            flat[key] = value
+    return flat
+
+
+def _unflatten_component(id: str, flat: dict[str, Any]) -> dict[str, Any]:
+    component: dict[str, Any] = {"id": id}
+    properties: dict[str, Any] = {}
+    for path, value in flat.items():
+        if path.startswith("properties."):
+            properties[path.removeprefix("properties.")] = value
+        else:
+            component[path] = value
+    if properties:
+        component["properties"] = properties
+    return component
+
+
+def _connection_keys(connections: Iterable[Any]) -> list[str]:
+    # 同じ内容の接続が複数あっても区別できるよう、出現番号を付ける
+    seen: dict[str, int] = {}
+    keys = []
+    for conn in connections:
+        canonical = json.dumps(conn, sort_keys=True, ensure_ascii=False, default=str)
+        n = seen.get(canonical, 0)
+        seen[canonical] = n + 1
+        keys.append(f"{canonical}#{n}")
+    return keys
+
+
+def _apply_changes(target: dict[str, Any], changes: dict[str, Change]) -> None:
+    for key, change in changes.items():
+        if "new" in change:
+            target[key] = change["new"]
+        else:
+            target.pop(key, None)
+
+
+def _reorder(target: dict[str, Any], order: list[str]) -> dict[str, Any]:
+    ordered = {key: target[key] for key in order if key in target}
+    ordered.update((key, value) for key, value in target.items() if key not in ordered)
+    return ordered
+
+
+class CircuitState:
+    """デルタを適用するための、回路定義の平坦な表現"""
+
+    def __init__(self, document: dict[str, Any]) -> None:
+        circuit = dict(document.get("circuit") or {})
+        self.meta: dict[str, Any] = {
+            k: v for k, v in circuit.items() if k not in (COMPONENTS, CONNECTIONS)
+        }
+        self.components: dict[str, dict[str, Any]] = {
+            c["id"]: _flatten_component(c) for c in circuit.get(COMPONENTS) or []
+        }
+        connections = circuit.get(CONNECTIONS) or []
+        self.connections: dict[str, Any] = dict(
+            zip(_connection_keys(connections), connections, strict=True)
+        )
+
+    def to_document(self) -> dict[str, Any]:
+        circuit = dict(self.meta)
+        circuit[COMPONENTS] = [
+            _unflatten_component(id, flat) for id, flat in self.components.items()
+        ]
+        circuit[CONNECTIONS] = list(self.connections.values())
+        return {"circuit": circuit}
+
+    def apply(self, delta: Delta) -> None:
+        _apply_changes(self.meta, delta.get("circuit", {}))
+        for id, changes in delta.get(COMPONENTS, {}).items():
+            flat = self.components.setdefault(id, {})
+            _apply_changes(flat, changes)
+            if not flat:
+                del self.components[id]
+        _apply_changes(self.connections, delta.get(CONNECTIONS, {}))
+
+        order = delta.get("order", {})
+        if COMPONENTS in order:
+            self.components = _reorder(self.components, order[COMPONENTS]["new"])
+        if CONNECTIONS in order:
+            self.connections = _reorder(self.connections, order[CONNECTIONS]["new"])
+
+
+def _diff_maps(old: dict[str, Any], new: dict[str, Any]) -> dict[str, Change]:
+    # 追加分は新しい側の順に並ぶようにする (適用時に末尾へ追加されるため)
+    changes: dict[str, Change] = {}
+    for key in [*old, *(key for key in new if key not in old)]:
+        change = {}
+        if key in old:
+            change["old"] = old[key]
+        if key in new:
+            change["new"] = new[key]
+        if change.get("old") != change.get("new") or len(change) == 1:
+            changes[key] = change
+    return changes
+
+
+def diff_documents(old: dict[str, Any], new: dict[str, Any]) -> Delta:
+    """2つの回路定義の構造的な差分を返す"""
+    before, after = CircuitState(old), CircuitState(new)
+    delta: Delta = {}
+
+    if meta := _diff_maps(before.meta, after.meta):
+        delta["circuit"] = meta
+
+    components = {}
+    for id in [*before.components, *after.components]:
+        if id in components:
+            continue
+        changes = _diff_maps(
+            before.components.get(id, {}), after.components.get(id, {})
+        )
+        if changes:
+            components[id] = changes
+    if components:
+        delta[COMPONENTS] = components
+
+    if connections := _diff_maps(before.connections, after.connections):
+        delta[CONNECTIONS] = connections
+
+    # 削除と末尾への追加だけでは (どちら向きの適用でも) 再現できない並びの場合だけ、
+    # 前後の順序を記録する
+    order = {}
+    for name in (COMPONENTS, CONNECTIONS):
+        old_keys: list[str] = list(getattr(before, name))
+        new_keys: list[str] = list(getattr(after, name))
+        old_set, new_set = set(old_keys), set(new_keys)
+        kept = [key for key in old_keys if key in new_set]
+        forward = kept + [key for key in new_keys if key not in old_set]
+        backward = [key for key in new_keys if key in old_set]
+        backward += [key for key in old_keys if key not in new_set]
+        if forward != new_keys or backward != old_keys:
+            order[name] = {"old": old_keys, "new": new_keys}
+    if order:
+        delta["order"] = order
+    return delta
+
+
+def _compose_maps(
+    first: dict[str, Change], second: dict[str, Change]
+) -> dict[str, Change]:
+    result = {key: dict(change) for key, change in first.items()}
+    for key, change in second.items():
+        if key not in result:
+            result[key] = dict(change)
+            continue
+        merged = result[key]
+        merged.pop("new", None)
+        if "new" in change:
+            merged["new"] = change["new"]
+    return {
+        key: change
+        for key, change in result.items()
+        if change and (change.get("old") != change.get("new") or len(change) == 1)
+    }
+
+
+def compose_deltas(deltas: Iterable[Delta]) -> Delta:
+    """連続するデルタを、最初から最後までの1つのデルタにまとめる"""
+    result: Delta = {}
+    for delta in deltas:
+        if "circuit" in delta:
+            result["circuit"] = _compose_maps(
+                result.get("circuit", {}), delta["circuit"]
+            )
+        if COMPONENTS in delta:
+            components = result.setdefault(COMPONENTS, {})
+            for id, changes in delta[COMPONENTS].items():
+                components[id] = _compose_maps(components.get(id, {}), changes)
+        if CONNECTIONS in delta:
+            result[CONNECTIONS] = _compose_maps(
+                result.get(CONNECTIONS, {}), delta[CONNECTIONS]
+            )
+        if "order" in delta:
+            result["order"] = _compose_maps(result.get("order", {}), delta["order"])
+
+    if COMPONENTS in result:
+        result[COMPONENTS] = {id: c for id, c in result[COMPONENTS].items() if c}
+    return {key: value for key, value in result.items() if value}
+
+
+def invert_delta(delta: Delta) -> Delta:
+    """デルタを逆向き (新 -> 旧) にする"""
+
+    def swap(changes: dict[str, Change]) -> dict[str, Change]:
+        inverted = {}
+        for key, change in changes.items():
+            swapped = {}
+            if "new" in change:
+                swapped["old"] = change["new"]
+            if "old" in change:
+                swapped["new"] = change["old"]
+            inverted[key] = swapped
+        return inverted
+
+    result: Delta = {}
+    if "circuit" in delta:
+        result["circuit"] = swap(delta["circuit"])
+    if COMPONENTS in delta:
+        result[COMPONENTS] = {
+            id: swap(changes) for id, changes in delta[COMPONENTS].items()
+        }
+    if CONNECTIONS in delta:
+        result[CONNECTIONS] = swap(delta[CONNECTIONS])
+    if "order" in delta:
+        result["order"] = swap(delta["order"])
+    return result
+
+
+def summarize_delta(delta: Delta) -> dict[str, Any]:
+    """API応答用に、デルタを追加・削除・変更の一覧に整理する"""
+    added, removed, changed = [], [], {}
+    for id, changes in sorted(delta.get(COMPONENTS, {}).items()):
+        type_change = changes.get("type", {})
+        if type_change and "old" not in type_change:
+            added.append(id)
+        elif type_change and "new" not in type_change:
+            removed.append(id)
+        else:
+            changed[id] = changes
+
+    connections = delta.get(CONNECTIONS, {}).values()
+    return {
+        "circuit": delta.get("circuit", {}),
+        "components": {"added": added, "removed": removed, "changed": changed},
+        "connections": {
+            "added": [c["new"] for c in connections if "old" not in c],
+            "removed": [c["old"] for c in connections if "new" not in c],
+        },
+        "reordered": sorted(delta.get("order", {})),
+    }
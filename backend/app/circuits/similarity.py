@@ -0,0 +1,94 @@
+"""
+保存済み回路の類似検索インデックス
+
+LSHインデックスはプロセスごとのメモリ上にあるため、検索のたびに
+前回以降に保存・更新された回路だけをDBから取り込んで追従する。
+"""
+
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from sqlmodel import Session, col, select
+
+from app.circuits.compiler import CompiledCircuit
+from app.circuits.fingerprint import MinHashLSHIndex, circuit_fingerprint
+from app.models import CircuitDefinition
+
+# 別ワーカーのコミットが updated_at の順に届くとは限らないため、少し遡って取り込む
+SYNC_OVERLAP = timedelta(minutes=1)
+
+
+class CircuitSimilarityIndex:
+    def __init__(self) -> None:
+        self.index: MinHashLSHIndex[uuid.UUID] = MinHashLSHIndex()
+        self._owners: dict[uuid.UUID, uuid.UUID] = {}
+        self._signatures: dict[uuid.UUID, list[int]] = {}
+        self._synced_at: datetime | None = None
+        self._lock = threading.Lock()
+
+    def _backfill(self, session: Session) -> None:
+        # フィンガープリント導入前に保存された回路は compiled から計算して保存する
+        statement = select(CircuitDefinition).where(
+            col(CircuitDefinition.fingerprint).is_(None)
+        )
+        for definition in session.exec(statement):
+            compiled = CompiledCircuit.from_dict(definition.compiled)
+            definition.fingerprint = circuit_fingerprint(compiled)
+            session.add(definition)
+        session.commit()
+
+    def sync(self, session: Session) -> None:
+        with self._lock:
+            if self._synced_at is None:
+                self._backfill(session)
+            statement = select(
+                CircuitDefinition.id,
+                CircuitDefinition.owner_id,
+                CircuitDefinition.fingerprint,
+                CircuitDefinition.updated_at,
+            )
+            if self._synced_at is not None:
+                statement = statement.where(
+                    col(CircuitDefinition.updated_at) >= self._synced_at - SYNC_OVERLAP
+                )
+            for id, owner_id, fingerprint, updated_at in session.exec(statement):
+                if fingerprint is None:
+                    continue
+                if self._signatures.get(id) != fingerprint:
+                    self.index.insert(id, fingerprint)
+                    self._signatures[id] = list(fingerprint)
+                    self._owners[id] = owner_id
+                if self._synced_at is None or updated_at > self._synced_at:
+                    self._synced_at = updated_at
+
+    def discard(self, id: uuid.UUID) -> None:
+        self.index.remove(id)
+        self._owners.pop(id, None)
+        self._signatures.pop(id, None)
+
+    def similar(
+        self,
+        session: Session,
+        definition: CircuitDefinition,
+        k: int,
+        owner_id: uuid.UUID | None = None,
+    ) -> list[tuple[uuid.UUID, float]]:
+        """
+        `definition` に構造が近い回路を類似度の高い順に最大k件返す
+
+        `owner_id` を指定すると、そのユーザーが所有する回路に限定する。
+        """
+        self.sync(session)
+        if definition.fingerprint is None:
+            return []
+
+        def accept(key: uuid.UUID) -> bool:
+            return key != definition.id and (
+                owner_id is None or self._owners.get(key) == owner_id
+            )
+
+        return self.index.query(definition.fingerprint, k, accept=accept)
+
+
+similarity_index = CircuitSimilarityIndex()
@@ -0,0 +1,81 @@
+"""
+レイアウト済み要素の空間インデックス
+
+STR (Sort-Tile-Recursive) 法で一括構築する静的なR-treeを、NumPy配列の階層として持つ。
+子ノードは常に `[i * fanout, (i + 1) * fanout)` の範囲に並ぶため、ポインタを持たずに
+各階層の交差判定をベクトル演算で行える。
+"""
+
+import math
+from collections.abc import Sequence
+
+import numpy as np
+
+FANOUT = 16
+
+
+class SpatialIndex:
+    """矩形 (x0, y0, x1, y1) の集合に対して、指定範囲と交差する要素を返す"""
+
+    def __init__(
+        self, boxes: Sequence[tuple[float, float, float, float]], fanout: int = FANOUT
+    ) -> None:
+        self.fanout = fanout
+        leaves = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self._order = self._str_order(leaves)
+        # levels[0] は葉 (要素の矩形)、最後が根
+        self._levels = [leaves[self._order]]
+        while len(self._levels[-1]) > 1:
+            self._levels.append(self._parents(self._levels[-1]))
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def _str_order(self, boxes: np.ndarray) -> np.ndarray:
+        n = len(boxes)
+        if n == 0:
+            return np.zeros(0, dtype=np.intp)
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        # x方向で縦長のスライスに分け、各スライス内をyで並べる
+        slice_size = self.fanout * math.ceil(math.sqrt(math.ceil(n / self.fanout)))
+        by_x = np.argsort(centers[:, 0], kind="stable")
+        parts = [
+            chunk[np.argsort(centers[chunk, 1], kind="stable")]
+            for chunk in np.split(by_x, range(slice_size, n, slice_size))
+        ]
+        return np.concatenate(parts)
+
+    def _parents(self, boxes: np.ndarray) -> np.ndarray:
+        n = len(boxes)
+        groups = math.ceil(n / self.fanout)
+        padded = np.empty((groups * self.fanout, 4))
+        padded[:n] = boxes
+        # 端数の枠は最初の子の矩形で埋めて min/max に影響させない
+        if len(padded) > n:
+            padded[n:] = boxes[(n // self.fanout) * self.fanout]
+        grouped = padded.reshape(groups, self.fanout, 4)
+        return np.concatenate(
+            [grouped[:, :, :2].min(axis=1), grouped[:, :, 2:].max(axis=1)], axis=1
+        )
+
+    def query(self, box: tuple[float, float, float, float]) -> np.ndarray:
+        """`box` と交差する要素のインデックスを、登録順に並べて返す"""
+        if not len(self._order):
+            return np.zeros(0, dtype=np.intp)
+        x0, y0, x1, y1 = box
+        candidates = np.zeros(1, dtype=np.intp)
+        for level in reversed(self._levels):
+            candidates = candidates[candidates < len(level)]
+            nodes = level[candidates]
+            hit = (
+                (nodes[:, 0] <= x1)
+                & (nodes[:, 2] >= x0)
+                & (nodes[:, 1] <= y1)
+                & (nodes[:, 3] >= y0)
+            )
+            candidates = candidates[hit]
+            if level is not self._levels[0]:
+                candidates = (
+                    candidates[:, None] * self.fanout + np.arange(self.fanout)
+                ).ravel()
+        return np.sort(self._order[candidates])
@@ -0,0 +1,166 @@
+"""
+回路の処理段階ごとの所要時間 (スパン)
+
+処理段階を `with span("layout"):` のように囲むと、その時間を段階ごとの
+ヒストグラム (`histograms`) と、`record_timings()` で始めたリクエストごとの記録
+(`Timings`) に加える。スパンが入れ子になった場合は内側のスパンの時間を外側から
+除いた自分の時間だけを数えるので、段階ごとの時間を足すと全体の時間になる。
+段階は `STAGES` の順に、エンジンの出力待ち・YAMLの読み込み・検証 (コンパイル)・
+部品の配置・配線・SVGの出力・ラスタライズ。
+`CIRCUIT_TIMINGS` を無効にすると `span` は何もしない共有のコンテキストを返す。
+"""
+
+import bisect
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from contextvars import ContextVar
+from types import TracebackType
+from typing import Any
+
+from app.core.config import settings
+
+STAGES = ("engine", "parse", "validate", "layout", "routing", "svg", "rasterize")
+# ヒストグラムの区間の上端 [秒] (0.1ms から倍々に約13秒まで)
+BUCKETS = tuple(0.0001 * 2**i for i in range(18))
+QUANTILES = (0.5, 0.95, 0.99)
+
+# 無効にするとスパンを記録しない (テストや計測のために実行中にも切り替えられる)
+enabled = settings.CIRCUIT_TIMINGS
+_NOOP: AbstractContextManager[None] = nullcontext()
+
+
+class Histogram:
+    """所要時間の分布。区間ごとの件数だけを持つので、分位数は区間の上端で近似する"""
+
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS) -> None:
+        self.buckets = buckets
+        # 最後の要素は最大の区間を超えた件数
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.buckets[min(i, len(self.buckets) - 1)]
+        return self.buckets[-1]
+
+
+class HistogramRegistry:
+    """段階の名前 -> 所要時間のヒストグラム (ワーカープロセスごと)"""
+
+    def __init__(self) -> None:
+        self._histograms: dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def metrics(self) -> list[dict[str, Any]]:
+        """段階ごとの件数・合計時間と分位数 [秒]。STAGES の順に、ほかの名前はその後ろに並べる"""
+        with self._lock:
+            names = sorted(
+                self._histograms,
+                key=lambda n: (STAGES.index(n) if n in STAGES else len(STAGES), n),
+            )
+            metrics = []
+            for name in names:
+                h = self._histograms[name]
+                quantiles = {f"p{round(q * 100)}": h.quantile(q) for q in QUANTILES}
+                metrics.append(
+                    {"name": name, "count": h.count, "total": h.total, **quantiles}
+                )
+            return metrics
+
+    def clear(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+
+
+histograms = HistogramRegistry()
+
+
+class Timings:
+    """1つのリクエストの、段階ごとの合計時間 [秒]"""
+
+    def __init__(self) -> None:
+        self.durations: dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def milliseconds(self) -> dict[str, float]:
+        return {name: round(s * 1000, 3) for name, s in self.durations.items()}
+
+    def server_timing(self) -> str:
+        """`Server-Timing` ヘッダーの値 ("layout;dur=1.2, svg;dur=0.4")"""
+        return ", ".join(
+            f"{name};dur={ms:.1f}" for name, ms in self.milliseconds().items()
+        )
+
+
+_timings: ContextVar[Timings | None] = ContextVar("circuit_timings", default=None)
+_active: ContextVar["_Span | None"] = ContextVar("circuit_span", default=None)
+
+
+class _Span:
+    __slots__ = ("name", "timings", "parent", "started", "children", "_token")
+
+    def __init__(self, name: str, timings: Timings | None) -> None:
+        self.name = name
+        self.timings = timings
+        self.children = 0.0
+
+    def __enter__(self) -> None:
+        self.parent = _active.get()
+        self._token = _active.set(self)
+        self.started = time.perf_counter()
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        elapsed = time.perf_counter() - self.started
+        _active.reset(self._token)
+        if self.parent is not None:
+            self.parent.children += elapsed
+        own = elapsed - self.children
+        histograms.observe(self.name, own)
+        if self.timings is not None:
+            self.timings.add(self.name, own)
+
+
+def span(name: str) -> AbstractContextManager[None]:
+    """処理段階 `name` の区間を計る。無効なら何もしない"""
+    if not enabled:
+        return _NOOP
+    return _Span(name, _timings.get())
+
+
+@contextmanager
+def record_timings() -> Iterator[Timings]:
+    """この中 (と、ここから始めたタスク) のスパンの時間を1つの `Timings` に集める"""
+    timings = Timings()
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
@@ -0,0 +1,77 @@
+"""
+部品の値 (`"220ohm"`, `"4.7kΩ"`, `"5V"`, `"10mA"` など) の解析
+"""
+
+import re
+from typing import Any
+
+SI_PREFIXES = {
+    "p": 1e-12,
+    "n": 1e-9,
+    "u": 1e-6,
+    "µ": 1e-6,
+    "μ": 1e-6,
+    "m": 1e-3,
+    "": 1.0,
+    "k": 1e3,
+    "K": 1e3,
+    "meg": 1e6,
+    "M": 1e6,
+    "G": 1e9,
+}
+
+# 単位記号の別名 (大文字・小文字は区別しない)
+UNIT_ALIASES = {
+    "ohm": ("ohm", "ohms", "Ω", "r"),
+    "V": ("v", "volt", "volts"),
+    "A": ("a", "amp", "amps"),
+    "F": ("f", "farad"),
+    "H": ("h", "henry"),
+}
+
+# 表示用の接頭辞 (大きい順)
+ENGINEERING_PREFIXES = (
+    (1e9, "G"),
+    (1e6, "M"),
+    (1e3, "k"),
+    (1.0, ""),
+    (1e-3, "m"),
+    (1e-6, "µ"),
+    (1e-9, "n"),
+    (1e-12, "p"),
+)
+UNIT_SYMBOLS = {"ohm": "Ω"}
+
+_QUANTITY = re.compile(
+    r"^\s*([+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)\s*(meg|[pnuµμmkKMG]?)\s*([^\s\d]*)\s*$"
+)
+
+
+def parse_quantity(value: Any, unit: str) -> float:
+    """
+    SI接頭辞付きの値を基本単位の数値に変換する
+
+    単位記号は省略できるが、別の単位が付いている場合は ValueError とする。
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"invalid value {value!r}")
+    if isinstance(value, int | float):
+        return float(value)
+    match = _QUANTITY.match(str(value))
+    if match is None:
+        raise ValueError(f"invalid value {value!r}")
+    number, prefix, suffix = match.groups()
+    aliases = UNIT_ALIASES.get(unit, (unit,))
+    if suffix and suffix.casefold() not in {a.casefold() for a in aliases}:
+        # 抵抗値に "5V" と書かれているような、別の量の単位は受け付けない
+        raise ValueError(f"invalid unit in {value!r}, expected {unit}")
+    return float(number) * SI_PREFIXES[prefix]
+
+
+def format_quantity(value: float, unit: str) -> str:
+    """基本単位の数値を `"4.7kΩ"` のような接頭辞付きの表記にする"""
+    symbol = UNIT_SYMBOLS.get(unit, unit)
+    for scale, prefix in ENGINEERING_PREFIXES:
+        if abs(value) >= scale * (1 - 1e-9):
+            return f"{value / scale:.4g}{prefix}{symbol}"
+    return f"{value:.4g}{symbol}"
@@ -0,0 +1,328 @@
+"""
+AIエンジンの使用量の集計と、ユーザーごとの1日の上限
+
+エンジンの呼び出しごとに、トークン数 (プロンプト・出力・プロバイダーのキャッシュから
+読んだ分)、所要時間、失敗したかを記録する。トークン数はエンジンが応答で報告した値
+(`report_usage`) を使い、報告が無ければ文字数から見積もる。
+記録はメモリ上で (ユーザー, エンジン, 1分の区間) ごとに足し合わせておき、
+`CIRCUIT_USAGE_FLUSH_INTERVAL` 秒ごとにまとめて1回の upsert で Postgres に書く。
+ユーザーごとの1日 (UTC) の生成回数とトークン数の上限は、その日の使用量をメモリ上に
+持って確かめる。DB から読むのはユーザーごとに1日1回 (ほかのワーカーの分を含めるため)
+だけなので、上限はワーカーの数だけ超えることがある。
+"""
+
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, fields
+from datetime import datetime, timedelta, timezone
+
+from sqlmodel import Session
+
+from app import crud
+from app.circuits.admission import AdmissionRejected
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 集計する区間の長さ [秒] (DB の行の単位)
+BUCKET_SECONDS = 60
+# トークン数を報告しないエンジンの見積もりに使う、1トークンあたりの文字数
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class EngineCall:
+    """エンジンの1回の呼び出し"""
+
+    engine: str
+    prompt: str
+    completion_chars: int = 0
+    # エンジンが報告したトークン数 (報告が無ければ None)
+    prompt_tokens: int | None = None
+    completion_tokens: int | None = None
+    cached_tokens: int = 0
+    started: float = field(default_factory=time.monotonic)
+    latency: float = 0.0
+    failed: bool = False
+
+    def received(self, chunk: str) -> None:
+        self.completion_chars += len(chunk)
+
+    @property
+    def estimated(self) -> bool:
+        return self.prompt_tokens is None or self.completion_tokens is None
+
+    def tokens(self) -> tuple[int, int]:
+        """(プロンプト, 出力) のトークン数"""
+        prompt = self.prompt_tokens
+        completion = self.completion_tokens
+        if prompt is None:
+            prompt = -(-len(self.prompt) // CHARS_PER_TOKEN)
+        if completion is None:
+            completion = -(-self.completion_chars // CHARS_PER_TOKEN)
+        return prompt, completion
+
+
+_call: ContextVar[EngineCall | None] = ContextVar("engine_call", default=None)
+_user: ContextVar[uuid.UUID | None] = ContextVar("usage_user", default=None)
+
+
+def report_usage(
+    prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0
+) -> None:
+    """エンジンの `complete` の中から、応答に含まれていたトークン数を報告する"""
+    call = _call.get()
+    if call is not None:
+        call.prompt_tokens = prompt_tokens
+        call.completion_tokens = completion_tokens
+        call.cached_tokens = cached_tokens
+
+
+@contextmanager
+def attribute_usage(user_id: uuid.UUID) -> Iterator[None]:
+    """この中 (と、ここから始めたタスク) のエンジンの呼び出しをユーザーの使用量に数える"""
+    token = _user.set(user_id)
+    try:
+        yield
+    finally:
+        _user.reset(token)
+
+
+@dataclass
+class UsageTotals:
+    generations: int = 0
+    calls: int = 0
+    errors: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    cache_hits: int = 0
+    estimated: int = 0
+    latency_total: float = 0.0
+    latency_max: float = 0.0
+
+    def add_call(self, call: EngineCall) -> None:
+        prompt, completion = call.tokens()
+        self.calls += 1
+        self.errors += call.failed
+        self.prompt_tokens += prompt
+        self.completion_tokens += completion
+        self.cached_tokens += call.cached_tokens
+        self.cache_hits += call.cached_tokens > 0
+        self.estimated += call.estimated
+        self.latency_total += call.latency
+        self.latency_max = max(self.latency_max, call.latency)
+
+    def merge(self, other: "UsageTotals") -> None:
+        for f in fields(self):
+            if f.name == "latency_max":
+                self.latency_max = max(self.latency_max, other.latency_max)
+            else:
+                setattr(self, f.name, getattr(self, f.name) + getattr(other, f.name))
+
+    @property
+    def tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+class QuotaExceeded(AdmissionRejected):
+    """ユーザーの1日の上限に達した場合の例外 (429、Retry-After は翌日まで)"""
+
+    def __init__(self, message: str, retry_after: float) -> None:
+        super().__init__(message, 429, retry_after)
+
+
+@dataclass
+class _DailyUsage:
+    day: datetime
+    generations: int
+    tokens: int
+
+
+# ユーザーID と日の始まり -> その日の (生成回数, トークン数) を DB から読む関数
+DailyLoader = Callable[[uuid.UUID, datetime], tuple[int, int]]
+UsageKey = tuple[uuid.UUID, str, datetime]
+
+
+def _bucket(now: datetime) -> datetime:
+    seconds = now.timestamp()
+    return datetime.fromtimestamp(seconds - seconds % BUCKET_SECONDS, timezone.utc)
+
+
+def _day(now: datetime) -> datetime:
+    return now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class UsageMeter:
+    """
+    エンジンの使用量を (ユーザー, エンジン, 区間) ごとに集計し、まとめて書き出す
+
+    呼び出しはイベントループから、書き出しはスレッドから行うのでロックで守る。
+    """
+
+    def __init__(
+        self,
+        daily_generations: int = 0,
+        daily_tokens: int = 0,
+        clock: Callable[[], datetime] = lambda: datetime.now(timezone.utc),
+    ) -> None:
+        # 0 なら上限なし
+        self.daily_generations = daily_generations
+        self.daily_tokens = daily_tokens
+        self.clock = clock
+        self._pending: dict[UsageKey, UsageTotals] = {}
+        self._daily: dict[uuid.UUID, _DailyUsage] = {}
+        self._lock = threading.Lock()
+        self.flushed_rows = 0
+
+    @classmethod
+    def from_settings(cls) -> "UsageMeter":
+        return cls(
+            settings.CIRCUIT_USER_DAILY_GENERATIONS, settings.CIRCUIT_USER_DAILY_TOKENS
+        )
+
+    @contextmanager
+    def call(self, engine: str, prompt: str) -> Iterator[EngineCall]:
+        """エンジンの1回の呼び出しを計り、終わったら (失敗・取り消しでも) 記録する"""
+        call = EngineCall(engine, prompt)
+        token = _call.set(call)
+        try:
+            yield call
+        except Exception:
+            call.failed = True
+            raise
+        finally:
+            _call.reset(token)
+            call.latency = time.monotonic() - call.started
+            user_id = _user.get()
+            if user_id is not None:
+                self.record(user_id, call)
+
+    def record(self, user_id: uuid.UUID, call: EngineCall) -> None:
+        now = self.clock()
+        with self._lock:
+            key = (user_id, call.engine, _bucket(now))
+            self._pending.setdefault(key, UsageTotals()).add_call(call)
+            daily = self._daily.get(user_id)
+            if daily is not None and daily.day == _day(now):
+                daily.tokens += sum(call.tokens())
+
+    def admit(
+        self,
+        user_id: uuid.UUID,
+        engine: str,
+        load: DailyLoader,
+        limited: bool = True,
+    ) -> UsageKey:
+        """
+        生成のリクエストを1回数える。`limited` でその日の上限に達していれば `QuotaExceeded`
+
+        その日の使用量を初めて確かめるときだけ `load` で DB から読む。
+        数えた行のキーを返す (`refund` に渡す)。
+        """
+        now = self.clock()
+        day = _day(now)
+        with self._lock:
+            daily = self._daily.get(user_id)
+        if daily is None or daily.day != day:
+            generations, tokens = load(user_id, day)
+            with self._lock:
+                # まだ書き出していない分を足す
+                for (user, _, start), totals in self._pending.items():
+                    if user == user_id and start >= day:
+                        generations += totals.generations
+                        tokens += totals.tokens
+                daily = self._daily[user_id] = _DailyUsage(day, generations, tokens)
+
+        retry_after = (day + timedelta(days=1) - now).total_seconds()
+        with self._lock:
+            if limited:
+                if (
+                    self.daily_generations
+                    and daily.generations >= self.daily_generations
+                ):
+                    raise QuotaExceeded("Daily generation quota exceeded.", retry_after)
+                if self.daily_tokens and daily.tokens >= self.daily_tokens:
+                    raise QuotaExceeded("Daily token quota exceeded.", retry_after)
+            daily.generations += 1
+            key = (user_id, engine, _bucket(now))
+            self._pending.setdefault(key, UsageTotals()).generations += 1
+        return key
+
+    def refund(self, key: UsageKey) -> None:
+        """
+        `admit` で数えた生成を取り消す (エンジンが受け付けなかった・失敗した場合)
+
+        書き出し済みの行なら -1 を書き出して足し合わせる。
+        """
+        user_id, _, start = key
+        with self._lock:
+            daily = self._daily.get(user_id)
+            if daily is not None and daily.day == _day(start):
+                daily.generations = max(0, daily.generations - 1)
+            self._pending.setdefault(key, UsageTotals()).generations -= 1
+
+    def take_pending(self) -> dict[UsageKey, UsageTotals]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def restore(self, pending: dict[UsageKey, UsageTotals]) -> None:
+        """書き出せなかった分を戻す (次の書き出しでまとめて書く)"""
+        with self._lock:
+            for key, totals in pending.items():
+                self._pending.setdefault(key, UsageTotals()).merge(totals)
+
+    def flush(self, session: Session) -> int:
+        """集計した使用量を1回の upsert で書き出し、書いた行数を返す"""
+        pending = self.take_pending()
+        if not pending:
+            return 0
+        rows = [
+            {
+                "user_id": user_id,
+                "engine": engine,
+                "window_start": start,
+                **vars(totals),
+            }
+            for (user_id, engine, start), totals in pending.items()
+        ]
+        try:
+            crud.add_circuit_engine_usage(session=session, rows=rows)
+        except Exception:
+            self.restore(pending)
+            raise
+        self.flushed_rows += len(rows)
+        return len(rows)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._pending.clear()
+            self._daily.clear()
+
+
+usage_meter = UsageMeter.from_settings()
+
+
+async def flush_periodically(
+    meter: UsageMeter, open_session: Callable[[], Session], interval: float
+) -> None:
+    """`interval` 秒ごとに使用量を書き出す (取り消されるまで続ける)"""
+
+    def flush() -> None:
+        with open_session() as session:
+            meter.flush(session)
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(flush)
+        except Exception:
+            # 書き出せなかった分はメモリに残っているので、次の回に書く
+            logger.exception("Failed to flush AI engine usage")
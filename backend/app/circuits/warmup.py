@@ -0,0 +1,159 @@
+"""
+起動時のキャッシュの温め
+
+デプロイ直後に例の回路を開いた最初のユーザーが、配置・描画と遅延 import の
+時間を払わなくて済むように、起動時にバックグラウンドのスレッドで次を行う。
+
+- 描画で使うモジュール (フォーマッタと、オプションの CairoSVG) を import しておく
+- 例の回路 (`examples/` の回路YAML) を読み込んでコンパイルし、既定の配置の
+  レイアウトをレイアウトのキャッシュと DB に、既定の指定で描いた SVG を
+  テーマごとに描画結果のキャッシュに入れる
+
+どちらのキャッシュも定義ハッシュで引くので、ユーザーが例から保存した回路定義の
+描画にもそのまま当たる。進み具合は `/utils/ready/` で返し、終わるまでは 503 に
+するので、ロードバランサーは温まったワーカーにだけリクエストを振り向けられる。
+読めない・描けない例は記録して次に進み、準備完了を妨げない。
+"""
+
+import functools
+import importlib
+import logging
+import threading
+import time
+from collections.abc import Callable, Sequence
+from pathlib import Path
+
+from sqlmodel import Session
+
+from app import crud
+from app.circuits.compiler import compile_circuit
+from app.circuits.formatters import SvgPreviewFormatter
+from app.circuits.layout import Layout, layout_cache, layout_variant
+from app.circuits.loader import load_circuit_yaml
+from app.circuits.render_cache import (
+    RenderedEntry,
+    layout_headers,
+    render_cache,
+    render_key,
+)
+
+logger = logging.getLogger(__name__)
+
+EXAMPLES_DIR = Path(__file__).parent / "examples"
+# 描画のリクエストで初めて import されるモジュール (無ければ飛ばす)
+PRELOAD_MODULES = (
+    "app.circuits.formatters.svg",
+    "app.circuits.formatters.spice",
+    "cairosvg",
+)
+# 温める配置 (描画エンドポイントの既定値)
+PLACEMENT = "grid"
+MINIMIZE_CROSSINGS = False
+
+
+def example_paths(names: Sequence[str]) -> list[Path]:
+    """例の名前 ("*" はすべて) または回路YAMLのパスから、温めるファイルを返す"""
+    paths: list[Path] = []
+    for name in names:
+        if name == "*":
+            paths.extend(sorted(EXAMPLES_DIR.glob("*.yaml")))
+        elif name.endswith((".yaml", ".yml")):
+            paths.append(Path(name))
+        else:
+            paths.append(EXAMPLES_DIR / f"{name}.yaml")
+    return list(dict.fromkeys(paths))
+
+
+def preload_modules(modules: Sequence[str] = PRELOAD_MODULES) -> list[str]:
+    """モジュールを import しておき、import できたものを返す"""
+    loaded = []
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except (ImportError, OSError):
+            continue
+        loaded.append(module)
+    return loaded
+
+
+def _render_svg(layout: Layout, theme: str) -> RenderedEntry:
+    svg = "".join(SvgPreviewFormatter(theme=theme).render(layout))
+    return RenderedEntry.create(
+        "image/svg+xml", svg.encode("utf-8"), layout_headers(layout)
+    )
+
+
+class Warmup:
+    """例の回路でキャッシュを温め、その進み具合を持つ"""
+
+    def __init__(self) -> None:
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.started: float | None = None
+        self.finished: float | None = None
+        self._stop = threading.Event()
+
+    @property
+    def ready(self) -> bool:
+        return self.finished is not None
+
+    @property
+    def seconds(self) -> float | None:
+        """温めにかかった (終わっていなければ、これまでの) 時間"""
+        if self.started is None:
+            return None
+        return (self.finished or time.monotonic()) - self.started
+
+    def stop(self) -> None:
+        """まだ温めていない例を飛ばして終わらせる (シャットダウン時)"""
+        self._stop.set()
+
+    def run(
+        self,
+        names: Sequence[str],
+        themes: Sequence[str],
+        session_factory: Callable[[], Session],
+    ) -> None:
+        self.total = self.done = self.failed = 0
+        self.finished = None
+        self.started = time.monotonic()
+        self._stop.clear()
+        try:
+            preload_modules()
+            paths = example_paths(names)
+            self.total = len(paths)
+            for path in paths:
+                if self._stop.is_set():
+                    break
+                try:
+                    with session_factory() as session:
+                        self._warm(session, path, themes)
+                except Exception:
+                    self.failed += 1
+                    logger.exception("Failed to warm up example circuit %s", path)
+                else:
+                    self.done += 1
+        finally:
+            self.finished = time.monotonic()
+
+    def _warm(self, session: Session, path: Path, themes: Sequence[str]) -> None:
+        compiled = compile_circuit(load_circuit_yaml(path.read_text(encoding="utf-8")))
+        variant = layout_variant(PLACEMENT, MINIMIZE_CROSSINGS)
+        layout = layout_cache.get_or_create(
+            (compiled.definition_hash, variant),
+            lambda: crud.get_or_create_circuit_layout(
+                session=session,
+                compiled=compiled,
+                placement=PLACEMENT,
+                minimize_crossings=MINIMIZE_CROSSINGS,
+            ),
+        )
+        for theme in themes:
+            render_cache.get_or_create(
+                render_key(compiled.definition_hash, variant, theme=theme),
+                functools.partial(_render_svg, layout, theme),
+            )
+
+
+warmup = Warmup()
@@ -94,6 +94,51 @@ class Settings(BaseSettings):
     FIRST_SUPERUSER: EmailStr
     FIRST_SUPERUSER_PASSWORD: str
 
+    # Limits for untrusted circuit YAML (user input and AI engine output)
+    CIRCUIT_YAML_MAX_BYTES: int = 2 * 1024 * 1024
+    CIRCUIT_YAML_MAX_NODES: int = 500_000
+    CIRCUIT_YAML_MAX_DEPTH: int = 64
+    CIRCUIT_YAML_MAX_ALIASES: int = 10_000
+    # Store a full circuit snapshot every N revisions, deltas in between
+    CIRCUIT_REVISION_SNAPSHOT_INTERVAL: int = 20
+
+    # Text AI engine for /circuits/generate (disabled without an API key)
+    OPENAI_API_KEY: str | None = None
+    OPENAI_MODEL: str = "gpt-4o-mini"
+    OPENAI_BASE_URL: str = "https://api.openai.com/v1"
+    # Secondary engine, used for hedged requests when both are configured
+    GEMINI_API_KEY: str | None = None
+    GEMINI_MODEL: str = "gemini-2.0-flash"
+    GEMINI_BASE_URL: str = "https://generativelanguage.googleapis.com/v1beta/openai"
+    # Constrained re-prompts for broken sections after local repairs fail
+    CIRCUIT_GENERATION_MAX_REPROMPTS: int = 1
+    # Admission control per AI engine and worker process
+    CIRCUIT_ENGINE_MAX_CONCURRENCY: int = 8
+    CIRCUIT_ENGINE_MAX_QUEUE: int = 32
+    CIRCUIT_ENGINE_QUEUE_TIMEOUT: float = 10.0
+    CIRCUIT_ENGINE_RATE: float = 5.0
+    CIRCUIT_ENGINE_BURST: int = 10
+    # Share of generate requests that may be hedged to the secondary engine
+    # once the primary is slower than its p90 (0 disables hedging)
+    CIRCUIT_HEDGE_RATIO: float = 0.05
+    # Hedge delay until enough latency samples are recorded [s]
+    CIRCUIT_HEDGE_DEFAULT_DELAY: float = 3.0
+    # Per-stage timing spans (histograms and Server-Timing headers)
+    CIRCUIT_TIMINGS: bool = True
+    # Per-user daily (UTC) limits on generate requests and engine tokens (0: none)
+    CIRCUIT_USER_DAILY_GENERATIONS: int = 0
+    CIRCUIT_USER_DAILY_TOKENS: int = 0
+    # Seconds between batched writes of AI engine usage to the database
+    CIRCUIT_USAGE_FLUSH_INTERVAL: float = 10.0
+    # Processes laying out disconnected subcircuits in parallel (0: CPU count,
+    # 1: in the worker) for circuits with at least this many components
+    CIRCUIT_LAYOUT_PROCESSES: int = 0
+    CIRCUIT_LAYOUT_PARALLEL_MIN_COMPONENTS: int = 2000
+    # Example circuits warmed into the layout and render caches at startup: names
+    # in app/circuits/examples ("*": all of them) or circuit YAML paths
+    CIRCUIT_WARMUP_EXAMPLES: list[str] = ["*"]
+    CIRCUIT_WARMUP_THEMES: list[str] = ["light", "dark"]
+
     def _check_default_secret(self, var_name: str, value: str | None) -> None:
         if value == "changethis":
             message = (
@@ -1,10 +1,36 @@
 import uuid
+from datetime import datetime, timezone
 from typing import Any
 
-from sqlmodel import Session, select
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import defer
+from sqlmodel import Session, col, func, select
 
+from app.circuits.compiler import CompiledCircuit
+from app.circuits.fingerprint import circuit_fingerprint
+from app.circuits.layout import Layout, compute_layout, layout_variant
+from app.circuits.loader import load_circuit_yaml
+from app.circuits.revisions import (
+    CircuitState,
+    Delta,
+    compose_deltas,
+    diff_documents,
+    invert_delta,
+)
+from app.core.config import settings
 from app.core.security import get_password_hash, verify_password
-from app.models import Item, ItemCreate, User, UserCreate, UserUpdate
+from app.models import (
+    CircuitDefinition,
+    CircuitEngineUsage,
+    CircuitLayout,
+    CircuitRevision,
+    Item,
+    ItemCreate,
+    User,
+    UserCreate,
+    UserUpdate,
+)
 
 
 def create_user(*, session: Session, user_create: UserCreate) -> User:
@@ -52,3 +78,288 @@ def create_item(*, session: Session, item_in: ItemCreate, owner_id: uuid.UUID) -
     session.commit()
     session.refresh(db_item)
     return db_item
+
+
+def create_circuit_definition(
+    *,
+    session: Session,
+    circuit_yaml: str,
+    document: dict[str, Any],
+    compiled: CompiledCircuit,
+    owner_id: uuid.UUID,
+) -> CircuitDefinition:
+    db_obj = CircuitDefinition(
+        owner_id=owner_id,
+        name=compiled.name[:255],
+        description=compiled.description or None,
+        circuit_yaml=circuit_yaml,
+        definition_hash=compiled.definition_hash,
+        compiled=compiled.to_dict(),
+        fingerprint=circuit_fingerprint(compiled),
+    )
+    session.add(db_obj)
+    session.add(
+        CircuitRevision(
+            definition_id=db_obj.id,
+            number=1,
+            definition_hash=compiled.definition_hash,
+            snapshot=document,
+        )
+    )
+    session.commit()
+    session.refresh(db_obj)
+    return db_obj
+
+
+def update_circuit_definition(
+    *,
+    session: Session,
+    db_definition: CircuitDefinition,
+    circuit_yaml: str,
+    document: dict[str, Any],
+    compiled: CompiledCircuit,
+) -> CircuitDefinition:
+    # Re-read the row under a lock so that concurrent updates (REST and live
+    # checkpoints) take revision numbers one after another
+    session.refresh(db_definition, with_for_update=True)
+    if compiled.definition_hash == db_definition.definition_hash:
+        session.commit()
+        return db_definition
+
+    previous = load_circuit_yaml(db_definition.circuit_yaml)
+    has_history = session.exec(
+        select(CircuitRevision.id).where(
+            CircuitRevision.definition_id == db_definition.id
+        )
+    ).first()
+    if has_history is None:
+        # Definitions saved before revisions existed start their history here
+        session.add(
+            CircuitRevision(
+                definition_id=db_definition.id,
+                number=db_definition.revision,
+                definition_hash=db_definition.definition_hash,
+                snapshot=previous,
+            )
+        )
+
+    number = db_definition.revision + 1
+    is_snapshot = (number - 1) % settings.CIRCUIT_REVISION_SNAPSHOT_INTERVAL == 0
+    session.add(
+        CircuitRevision(
+            definition_id=db_definition.id,
+            number=number,
+            definition_hash=compiled.definition_hash,
+            snapshot=document if is_snapshot else None,
+            delta=diff_documents(previous, document),
+        )
+    )
+    db_definition.sqlmodel_update(
+        {
+            "name": compiled.name[:255],
+            "description": compiled.description or None,
+            "circuit_yaml": circuit_yaml,
+            "definition_hash": compiled.definition_hash,
+            "compiled": compiled.to_dict(),
+            "fingerprint": circuit_fingerprint(compiled),
+            "revision": number,
+            "updated_at": datetime.now(timezone.utc),
+        }
+    )
+    session.add(db_definition)
+    session.commit()
+    session.refresh(db_definition)
+    return db_definition
+
+
+def get_circuit_revision_document(
+    *, session: Session, definition_id: uuid.UUID, number: int
+) -> dict[str, Any] | None:
+    """Rebuild a revision from the nearest snapshot and the deltas after it."""
+    base = session.exec(
+        select(CircuitRevision)
+        .where(
+            CircuitRevision.definition_id == definition_id,
+            CircuitRevision.number <= number,
+            col(CircuitRevision.snapshot).is_not(None),
+        )
+        .order_by(col(CircuitRevision.number).desc())
+        .limit(1)
+    ).first()
+    if base is None or base.snapshot is None:
+        return None
+    revisions = session.exec(
+        select(CircuitRevision)
+        .options(defer(CircuitRevision.snapshot))  # type: ignore[arg-type]
+        .where(
+            CircuitRevision.definition_id == definition_id,
+            CircuitRevision.number > base.number,
+            CircuitRevision.number <= number,
+        )
+        .order_by(col(CircuitRevision.number))
+    ).all()
+    if len(revisions) != number - base.number:
+        return None
+
+    state = CircuitState(base.snapshot)
+    for revision in revisions:
+        state.apply(revision.delta or {})
+    return state.to_document()
+
+
+def get_circuit_revision_delta(
+    *,
+    session: Session,
+    definition_id: uuid.UUID,
+    from_revision: int,
+    to_revision: int,
+) -> Delta:
+    """Compose the stored deltas between two revisions (either direction)."""
+    low, high = sorted((from_revision, to_revision))
+    revisions = session.exec(
+        select(CircuitRevision)
+        .options(defer(CircuitRevision.snapshot))  # type: ignore[arg-type]
+        .where(
+            CircuitRevision.definition_id == definition_id,
+            CircuitRevision.number > low,
+            CircuitRevision.number <= high,
+        )
+        .order_by(col(CircuitRevision.number))
+    ).all()
+    delta = compose_deltas(r.delta or {} for r in revisions)
+    return invert_delta(delta) if from_revision > to_revision else delta
+
+
+def get_or_create_circuit_layout(
+    *,
+    session: Session,
+    compiled: CompiledCircuit,
+    placement: str,
+    minimize_crossings: bool,
+) -> Layout:
+    """Load the stored layout for the circuit's hash, computing and storing it once."""
+    variant = layout_variant(placement, minimize_crossings)
+    stored = session.exec(
+        select(CircuitLayout).where(
+            CircuitLayout.definition_hash == compiled.definition_hash,
+            CircuitLayout.variant == variant,
+        )
+    ).first()
+    if stored is not None:
+        return Layout.from_dict(stored.layout)
+
+    layout = compute_layout(compiled, placement, minimize_crossings=minimize_crossings)
+    # Concurrent requests may compute the same layout; the first one stored wins
+    session.execute(
+        insert(CircuitLayout)
+        .values(
+            id=uuid.uuid4(),
+            definition_hash=compiled.definition_hash,
+            variant=variant,
+            layout=layout.to_dict(),
+            created_at=datetime.now(timezone.utc),
+        )
+        .on_conflict_do_nothing(index_elements=["definition_hash", "variant"])
+    )
+    session.commit()
+    return layout
+
+
+# Counters added up when a batch hits the row of the same user, engine and window
+USAGE_COUNTERS = (
+    "generations",
+    "calls",
+    "errors",
+    "prompt_tokens",
+    "completion_tokens",
+    "cached_tokens",
+    "cache_hits",
+    "estimated",
+    "latency_total",
+)
+
+
+def add_circuit_engine_usage(*, session: Session, rows: list[dict[str, Any]]) -> None:
+    """Add a batch of aggregated usage rows with a single upsert."""
+    statement = insert(CircuitEngineUsage).values(
+        [{"id": uuid.uuid4(), **row} for row in rows]
+    )
+    table = CircuitEngineUsage.__table__.c  # type: ignore[attr-defined]
+    session.execute(
+        statement.on_conflict_do_update(
+            index_elements=["user_id", "engine", "window_start"],
+            set_={
+                **{
+                    name: table[name] + statement.excluded[name]
+                    for name in USAGE_COUNTERS
+                },
+                "latency_max": func.greatest(
+                    table.latency_max, statement.excluded.latency_max
+                ),
+            },
+        )
+    )
+    session.commit()
+
+
+def get_user_usage_since(
+    *, session: Session, user_id: uuid.UUID, since: datetime
+) -> tuple[int, int]:
+    """Generations and tokens (prompt + completion) of the user since `since`."""
+    generations, tokens = session.execute(
+        sa.select(
+            func.coalesce(func.sum(col(CircuitEngineUsage.generations)), 0),
+            func.coalesce(
+                func.sum(
+                    col(CircuitEngineUsage.prompt_tokens)
+                    + col(CircuitEngineUsage.completion_tokens)
+                ),
+                0,
+            ),
+        ).where(
+            col(CircuitEngineUsage.user_id) == user_id,
+            col(CircuitEngineUsage.window_start) >= since,
+        )
+    ).one()
+    return int(generations), int(tokens)
+
+
+def get_circuit_engine_usage(
+    *,
+    session: Session,
+    start: datetime,
+    end: datetime,
+    window: str,
+    user_id: uuid.UUID | None = None,
+    engine: str | None = None,
+) -> list[dict[str, Any]]:
+    """Usage between `start` and `end`, summed per window ("hour", ...), user and engine."""
+    window_start = func.date_trunc(window, col(CircuitEngineUsage.window_start))
+    sums = [
+        func.sum(col(getattr(CircuitEngineUsage, name))).label(name)
+        for name in USAGE_COUNTERS
+    ]
+    statement = (
+        sa.select(
+            window_start.label("window_start"),
+            col(CircuitEngineUsage.user_id),
+            col(CircuitEngineUsage.engine),
+            *sums,
+            func.max(col(CircuitEngineUsage.latency_max)).label("latency_max"),
+        )
+        .where(
+            col(CircuitEngineUsage.window_start) >= start,
+            col(CircuitEngineUsage.window_start) < end,
+        )
+        .group_by(
+            window_start,
+            col(CircuitEngineUsage.user_id),
+            col(CircuitEngineUsage.engine),
+        )
+        .order_by(window_start, col(CircuitEngineUsage.engine))
+    )
+    if user_id is not None:
+        statement = statement.where(col(CircuitEngineUsage.user_id) == user_id)
+    if engine is not None:
+        statement = statement.where(col(CircuitEngineUsage.engine) == engine)
+    return [dict(row._mapping) for row in session.execute(statement)]
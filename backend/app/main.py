@@ -1,10 +1,19 @@
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
 import sentry_sdk
 from fastapi import FastAPI
 from fastapi.routing import APIRoute
+from sqlmodel import Session
 from starlette.middleware.cors import CORSMiddleware
 
 from app.api.main import api_router
+from app.circuits.layout import layout_pool
+from app.circuits.usage import flush_periodically, usage_meter
+from app.circuits.warmup import warmup
 from app.core.config import settings
+from app.core.db import engine
 
 
 def custom_generate_unique_id(route: APIRoute) -> str:
@@ -14,10 +23,41 @@ def custom_generate_unique_id(route: APIRoute) -> str:
 if settings.SENTRY_DSN and settings.ENVIRONMENT != "local":
     sentry_sdk.init(dsn=str(settings.SENTRY_DSN), enable_tracing=True)
 
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+    # AI engine usage is aggregated in memory and written in batches
+    flusher = asyncio.create_task(
+        flush_periodically(
+            usage_meter,
+            lambda: Session(engine),
+            settings.CIRCUIT_USAGE_FLUSH_INTERVAL,
+        )
+    )
+    # Example circuits are laid out and rendered into the caches in the
+    # background; /utils/ready/ reports 503 until that is done
+    warming = asyncio.create_task(
+        asyncio.to_thread(
+            warmup.run,
+            settings.CIRCUIT_WARMUP_EXAMPLES,
+            settings.CIRCUIT_WARMUP_THEMES,
+            lambda: Session(engine),
+        )
+    )
+    yield
+    warmup.stop()
+    flusher.cancel()
+    await asyncio.gather(warming, flusher, return_exceptions=True)
+    with Session(engine) as session:
+        usage_meter.flush(session)
+    layout_pool.shutdown()
+
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     generate_unique_id_function=custom_generate_unique_id,
+    lifespan=lifespan,
 )
 
 # Set all CORS enabled origins
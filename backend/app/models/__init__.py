@@ -1,6 +1,46 @@
 from sqlmodel import SQLModel
 
-from .circuit import CircuitGenerationRequest, CircuitGenerationResponse
+from .circuit import (
+    CircuitBOMItem,
+    CircuitBOMRequest,
+    CircuitComponentChanges,
+    CircuitConnectionChanges,
+    CircuitDefinition,
+    CircuitDefinitionCreate,
+    CircuitDefinitionCreated,
+    CircuitDefinitionDetail,
+    CircuitDefinitionPublic,
+    CircuitDefinitionsPublic,
+    CircuitDiff,
+    CircuitEngineStats,
+    CircuitEngineStatsPublic,
+    CircuitEngineUsage,
+    CircuitERCBatchRequest,
+    CircuitERCBatchResponse,
+    CircuitERCResult,
+    CircuitGenerationRequest,
+    CircuitGenerationResponse,
+    CircuitLayout,
+    CircuitRevision,
+    CircuitRevisionDetail,
+    CircuitRevisionPublic,
+    CircuitRevisionsPublic,
+    CircuitSimilaritiesPublic,
+    CircuitSimilarity,
+    CircuitStageTiming,
+    CircuitStageTimingsPublic,
+    CircuitUsage,
+    CircuitUsagePublic,
+    CircuitValidationRequest,
+    CircuitValidationResponse,
+    CircuitWarmupStatus,
+    DCNodeVoltage,
+    DCOperatingPoint,
+    DCSweep,
+    DCSweepPoint,
+    DCSweepRequest,
+    ERCViolation,
+)
 from .item import Item, ItemBase, ItemCreate, ItemPublic, ItemsPublic, ItemUpdate
 from .msg import Message
 from .token import NewPassword, Token, TokenPayload
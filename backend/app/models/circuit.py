@@ -1,14 +1,393 @@
+import uuid
+from datetime import datetime, timezone
+from typing import Any
+
 from pydantic import BaseModel
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Computed,
+    DateTime,
+    Index,
+    Integer,
+    Text,
+    UniqueConstraint,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from sqlmodel import Field, SQLModel
 
 
 class CircuitGenerationRequest(BaseModel):
     """回路生成リクエストのデータモデル"""
 
     prompt: str
+    # 処理段階ごとの所要時間をレスポンスの `timings` に含める
+    timings: bool = False
 
 
 class CircuitGenerationResponse(BaseModel):
-    """回路生成レスポンスのデータモデル（今はダミー）"""
+    """回路生成レスポンスのデータモデル"""
 
     message: str
     yaml_data: str
+    # エンジンの出力をその場で直した内容 (重複IDの改名、存在しない部品への接続の削除)
+    repairs: list[str] = []
+    # 処理段階 -> 所要時間 [ミリ秒] (リクエストで `timings` を指定した場合)
+    timings: dict[str, float] | None = None
+
+
+class CircuitValidationRequest(BaseModel):
+    """回路定義バリデーションリクエストのデータモデル"""
+
+    circuit_yaml: str
+    # 電気的ルールチェック (ERC) も行う
+    erc: bool = False
+
+
+class ERCViolation(BaseModel):
+    """電気的ルールチェックの違反"""
+
+    code: str
+    severity: str
+    message: str
+    net: int | None = None
+    component_id: str | None = None
+
+
+class CircuitValidationResponse(BaseModel):
+    """回路定義バリデーションレスポンスのデータモデル"""
+
+    status: str
+    message: str
+    violations: list[ERCViolation] = []
+
+
+class CircuitERCBatchRequest(BaseModel):
+    """保存済み回路の一括ERCリクエスト。省略時は参照できる回路を区切って評価"""
+
+    circuit_ids: list[uuid.UUID] | None = None
+
+
+class CircuitERCResult(BaseModel):
+    circuit_id: uuid.UUID
+    status: str
+    violations: list[ERCViolation]
+
+
+class CircuitERCBatchResponse(BaseModel):
+    data: list[CircuitERCResult]
+    count: int
+
+
+# Properties to receive on circuit definition creation
+class CircuitDefinitionCreate(SQLModel):
+    circuit_yaml: str
+
+
+# Database model. The compiled circuit is stored as JSONB next to the raw YAML
+# so that structural queries (component types, part counts) run inside Postgres.
+class CircuitDefinition(SQLModel, table=True):
+    __table_args__ = (
+        Index(
+            "ix_circuitdefinition_compiled",
+            "compiled",
+            postgresql_using="gin",
+            postgresql_ops={"compiled": "jsonb_path_ops"},
+        ),
+        Index(
+            "ix_circuitdefinition_component_types",
+            "component_types",
+            postgresql_using="gin",
+        ),
+    )
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    owner_id: uuid.UUID = Field(
+        foreign_key="user.id", nullable=False, ondelete="CASCADE"
+    )
+    name: str = Field(default="", max_length=255)
+    description: str | None = Field(default=None)
+    circuit_yaml: str = Field(sa_column=Column(Text, nullable=False))
+    definition_hash: str = Field(max_length=64, index=True)
+    compiled: dict[str, Any] = Field(sa_column=Column(JSONB, nullable=False))
+    component_count: int | None = Field(
+        default=None,
+        sa_column=Column(
+            Integer,
+            Computed("(compiled ->> 'component_count')::integer", persisted=True),
+            index=True,
+        ),
+    )
+    component_types: list[str] | None = Field(
+        default=None,
+        sa_column=Column(
+            JSONB(none_as_null=True),  # type: ignore[no-untyped-call]
+            Computed("compiled -> 'component_types'", persisted=True),
+        ),
+    )
+    # MinHash signature of the netlist structure, used for similar-circuit lookup
+    fingerprint: list[int] | None = Field(
+        default=None, sa_column=Column(ARRAY(BigInteger))
+    )
+    revision: int = Field(default=1)
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc),
+        sa_type=DateTime(timezone=True),  # type: ignore[call-overload]
+    )
+    updated_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc),
+        sa_type=DateTime(timezone=True),  # type: ignore[call-overload]
+        index=True,
+    )
+
+
+# Revision history of a circuit definition. Every revision after the first stores
+# the structural delta from its predecessor; a full snapshot of the document is
+# kept every CIRCUIT_REVISION_SNAPSHOT_INTERVAL revisions to bound reconstruction.
+class CircuitRevision(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("definition_id", "number"),)
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    definition_id: uuid.UUID = Field(
+        foreign_key="circuitdefinition.id", nullable=False, ondelete="CASCADE"
+    )
+    number: int
+    definition_hash: str = Field(max_length=64)
+    snapshot: dict[str, Any] | None = Field(
+        default=None,
+        sa_column=Column(JSONB(none_as_null=True)),  # type: ignore[no-untyped-call]
+    )
+    delta: dict[str, Any] | None = Field(
+        default=None,
+        sa_column=Column(JSONB(none_as_null=True)),  # type: ignore[no-untyped-call]
+    )
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc),
+        sa_type=DateTime(timezone=True),  # type: ignore[call-overload]
+    )
+
+
+# Computed layout (positions, rotations, routed wires) of a compiled circuit.
+# Keyed by definition hash rather than definition id, so identical circuits share
+# one row. Styling is not part of the layout: themes are applied when rendering.
+class CircuitLayout(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("definition_hash", "variant"),)
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    definition_hash: str = Field(max_length=64)
+    # Layout version and options, e.g. "1:grid" or "1:grid+crossings"
+    variant: str = Field(max_length=64)
+    layout: dict[str, Any] = Field(sa_column=Column(JSONB, nullable=False))
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc),
+        sa_type=DateTime(timezone=True),  # type: ignore[call-overload]
+    )
+
+
+# AI engine usage per user, engine and minute. Calls are aggregated in memory and
+# flushed in batches, adding to the row of the same minute with an upsert.
+class CircuitEngineUsage(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("user_id", "engine", "window_start"),)
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    user_id: uuid.UUID = Field(
+        foreign_key="user.id", nullable=False, ondelete="CASCADE"
+    )
+    engine: str = Field(max_length=64)
+    window_start: datetime = Field(
+        sa_type=DateTime(timezone=True),  # type: ignore[call-overload]
+        index=True,
+    )
+    # Generate requests admitted against the user's quota
+    generations: int = 0
+    calls: int = 0
+    errors: int = 0
+    prompt_tokens: int = Field(default=0, sa_type=BigInteger)
+    completion_tokens: int = Field(default=0, sa_type=BigInteger)
+    # Prompt tokens served from the provider's prompt cache
+    cached_tokens: int = Field(default=0, sa_type=BigInteger)
+    cache_hits: int = 0
+    # Calls whose token counts were estimated from the text length
+    estimated: int = 0
+    # Seconds from the request to the last chunk
+    latency_total: float = 0.0
+    latency_max: float = 0.0
+
+
+class CircuitUsage(SQLModel):
+    window_start: datetime
+    user_id: uuid.UUID
+    engine: str
+    generations: int
+    calls: int
+    errors: int
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int
+    cache_hits: int
+    estimated: int
+    latency_avg: float
+    latency_max: float
+
+
+class CircuitUsagePublic(SQLModel):
+    data: list[CircuitUsage]
+    count: int
+
+
+class CircuitDefinitionCreated(SQLModel):
+    circuit_id: uuid.UUID
+
+
+# Properties to return via API, id is always required
+class CircuitDefinitionPublic(SQLModel):
+    id: uuid.UUID
+    owner_id: uuid.UUID
+    name: str
+    description: str | None
+    definition_hash: str
+    component_count: int | None
+    component_types: list[str] | None
+    revision: int
+    created_at: datetime
+    updated_at: datetime
+
+
+class CircuitDefinitionDetail(CircuitDefinitionPublic):
+    circuit_yaml: str
+
+
+class CircuitDefinitionsPublic(SQLModel):
+    data: list[CircuitDefinitionPublic]
+    count: int
+
+
+class CircuitSimilarity(SQLModel):
+    circuit_id: uuid.UUID
+    name: str
+    similarity: float
+
+
+class CircuitSimilaritiesPublic(SQLModel):
+    data: list[CircuitSimilarity]
+
+
+class CircuitEngineStats(SQLModel):
+    name: str
+    active: int
+    queued: int
+    max_concurrency: int
+    max_queue: int
+    admitted: int
+    rejected: int
+    timed_out: int
+    # Seconds spent waiting for a slot (recent requests)
+    wait_p50: float
+    wait_p95: float
+    wait_max: float
+
+
+class CircuitEngineStatsPublic(SQLModel):
+    data: list[CircuitEngineStats]
+
+
+class CircuitStageTiming(SQLModel):
+    name: str
+    count: int
+    # Seconds spent in the stage, excluding nested stages
+    total: float
+    p50: float
+    p95: float
+    p99: float
+
+
+class CircuitStageTimingsPublic(SQLModel):
+    data: list[CircuitStageTiming]
+
+
+class CircuitWarmupStatus(SQLModel):
+    ready: bool
+    # Example circuits to warm up, warmed and failed so far
+    total: int
+    done: int
+    failed: int
+    seconds: float | None
+
+
+class CircuitRevisionPublic(SQLModel):
+    number: int
+    definition_hash: str
+    is_snapshot: bool
+    created_at: datetime
+
+
+class CircuitRevisionsPublic(SQLModel):
+    data: list[CircuitRevisionPublic]
+    count: int
+
+
+class CircuitRevisionDetail(SQLModel):
+    number: int
+    definition_hash: str
+    circuit_yaml: str
+
+
+class CircuitComponentChanges(SQLModel):
+    added: list[str]
+    removed: list[str]
+    changed: dict[str, dict[str, Any]]
+
+
+class CircuitConnectionChanges(SQLModel):
+    added: list[Any]
+    removed: list[Any]
+
+
+class CircuitDiff(SQLModel):
+    from_revision: int
+    to_revision: int
+    circuit: dict[str, Any]
+    components: CircuitComponentChanges
+    connections: CircuitConnectionChanges
+    reordered: list[str]
+
+
+class DCNodeVoltage(SQLModel):
+    net: int
+    pins: list[str]
+    voltage: float
+
+
+class DCOperatingPoint(SQLModel):
+    ground_net: int
+    node_voltages: list[DCNodeVoltage]
+    branch_currents: dict[str, float]
+    warnings: list[str]
+
+
+class DCSweepRequest(SQLModel):
+    component_id: str
+    values: list[float] = Field(min_length=1, max_length=1000)
+
+
+class DCSweepPoint(SQLModel):
+    value: float
+    node_voltages: dict[int, float]
+    branch_currents: dict[str, float]
+
+
+class DCSweep(SQLModel):
+    component_id: str
+    ground_net: int
+    points: list[DCSweepPoint]
+    warnings: list[str]
+
+
+class CircuitBOMItem(SQLModel):
+    circuit_id: uuid.UUID
+    # 基板の枚数。部品の個数に掛けられる
+    quantity: int = Field(default=1, ge=1)
+
+
+class CircuitBOMRequest(SQLModel):
+    items: list[CircuitBOMItem] = Field(min_length=1, max_length=1000)
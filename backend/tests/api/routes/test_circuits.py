@@ -0,0 +1,846 @@
+import json
+import time
+import uuid
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+from starlette.websockets import WebSocketDisconnect
+
+from app import crud
+from app.circuits.admission import AdmissionController, admission_controllers
+from app.circuits.generation import text_engines
+from app.circuits.layout import layout_cache, layout_variant
+from app.circuits.live import live_sessions
+from app.circuits.render_cache import render_cache
+from app.circuits.usage import usage_meter
+from app.circuits.warmup import EXAMPLES_DIR, warmup
+from app.core.config import settings
+from app.core.db import engine
+from app.models import CircuitDefinition, CircuitLayout
+from tests.utils.circuit import (
+    LED_CIRCUIT_YAML,
+    create_random_circuit_definition,
+    grid_circuit_yaml,
+)
+from tests.utils.engines import LatencyEngine, ScriptedEngine
+from tests.utils.user import authentication_token_from_email
+from tests.utils.utils import random_email
+
+CIRCUIT_YAML = """
+circuit:
+  name: "Simple LED Circuit"
+  components:
+    - id: "battery_1"
+      type: "battery"
+      properties:
+        voltage: "1.5V"
+        position: { x: 10, y: 10 }
+  connections:
+    - from: { component_id: "battery_1", terminal: "positive" }
+      to: { component_id: "battery_1", terminal: "negative" }
+"""
+
+
+def test_generate_circuit(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    engine = ScriptedEngine(
+        "circuit:\n  components:\n    - {id: r1, type: resistor}\n"
+        "    - {id: r1, type: resistor}\n"
+    )
+    with patch.dict(text_engines, {"scripted": engine}, clear=True):
+        response = client.post(
+            f"{settings.API_V1_STR}/circuits/generate",
+            headers=normal_user_token_headers,
+            json={"prompt": "two resistors"},
+        )
+    assert response.status_code == 200
+    content = response.json()
+    assert "id: r1_2" in content["yaml_data"]
+    assert content["repairs"] == ["Renamed duplicate component id 'r1' to 'r1_2'."]
+    assert content["timings"] is None
+    assert "engine;dur=" in response.headers["Server-Timing"]
+
+
+def test_generate_circuit_stream(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    engine = ScriptedEngine(
+        "circuit:\n  components:\n    - {id: r1, type: resistor}\n"
+        "    - {id: r2, type: resistor}\n    - {id: r3, type: resistor}\n"
+    )
+    with patch.dict(text_engines, {"scripted": engine}, clear=True):
+        response = client.post(
+            f"{settings.API_V1_STR}/circuits/generate/stream",
+            headers=normal_user_token_headers,
+            json={"prompt": "three resistors", "timings": True},
+        )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert events[0]["type"] == "snapshot" and "<svg" in events[0]["svg"]
+    assert events[-2]["type"] == "patch"
+    assert events[-1]["type"] == "result" and "id: r3" in events[-1]["yaml_data"]
+    assert {"engine", "parse", "validate", "svg"} <= set(events[-1]["timings"])
+
+    engine = ScriptedEngine("not yaml: [", "not yaml: [")
+    with patch.dict(text_engines, {"scripted": engine}, clear=True):
+        response = client.post(
+            f"{settings.API_V1_STR}/circuits/generate/stream",
+            headers=normal_user_token_headers,
+            json={"prompt": "three resistors"},
+        )
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert events[-1]["type"] == "error" and events[-1]["status_code"] == 502
+
+
+def test_generate_circuit_daily_quota(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    email = random_email()
+    headers = authentication_token_from_email(client=client, email=email, db=db)
+    user = crud.get_user_by_email(session=db, email=email)
+    assert user is not None
+    engine = ScriptedEngine("circuit:\n  components:\n    - {id: r1, type: resistor}\n")
+    failing = LatencyEngine("scripted", "", lambda: 0.0, fail=True)
+    with patch.object(usage_meter, "daily_generations", 1):
+        # エンジンが失敗した生成は数えない
+        with patch.dict(text_engines, {"scripted": failing}, clear=True):
+            response = client.post(
+                f"{settings.API_V1_STR}/circuits/generate",
+                headers=headers,
+                json={"prompt": "one resistor"},
+            )
+        assert response.status_code == 502
+    with (
+        patch.dict(text_engines, {"scripted": engine}, clear=True),
+        patch.object(usage_meter, "daily_generations", 1),
+    ):
+        responses = [
+            client.post(
+                f"{settings.API_V1_STR}/circuits/generate",
+                headers=headers,
+                json={"prompt": "one resistor"},
+            )
+            for _ in range(2)
+        ]
+    assert responses[0].status_code == 200
+    assert responses[1].status_code == 429
+    assert int(responses[1].headers["Retry-After"]) >= 1
+    assert len(engine.prompts) == 1
+
+    response = client.get(
+        f"{settings.API_V1_STR}/circuits/usage",
+        headers=superuser_token_headers,
+        params={"window": "day", "user_id": str(user.id)},
+    )
+    assert response.status_code == 200
+    (usage,) = response.json()["data"]
+    assert usage["generations"] == 1 and usage["calls"] == 2 and usage["errors"] == 1
+    assert usage["prompt_tokens"] > 0 and usage["latency_avg"] > 0
+
+    response = client.get(f"{settings.API_V1_STR}/circuits/usage", headers=headers)
+    assert response.status_code == 403
+
+
+def test_generate_circuit_without_engine(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    with patch.dict(text_engines, clear=True):
+        response = client.post(
+            f"{settings.API_V1_STR}/circuits/generate",
+            headers=normal_user_token_headers,
+            json={"prompt": "two resistors"},
+        )
+    assert response.status_code == 503
+
+
+def test_generate_circuit_rate_limited(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    superuser_token_headers: dict[str, str],
+) -> None:
+    engine = ScriptedEngine("circuit:\n  components:\n    - {id: r1, type: resistor}\n")
+    controller = AdmissionController(1, 0, 1.0, rate=0.01, burst=1)
+    with (
+        patch.dict(text_engines, {"scripted": engine}, clear=True),
+        patch.dict(admission_controllers, {"scripted": controller}),
+    ):
+        for status_code in (200, 429):
+            response = client.post(
+                f"{settings.API_V1_STR}/circuits/generate",
+                headers=normal_user_token_headers,
+                json={"prompt": "a resistor"},
+            )
+            assert response.status_code == status_code
+        assert int(response.headers["Retry-After"]) >= 1
+
+        response = client.get(
+            f"{settings.API_V1_STR}/circuits/engines", headers=superuser_token_headers
+        )
+        assert response.status_code == 200
+        stats = response.json()["data"]
+        assert stats[0]["name"] == "scripted"
+        assert (stats[0]["admitted"], stats[0]["rejected"]) == (1, 1)
+
+        response = client.get(
+            f"{settings.API_V1_STR}/circuits/engines", headers=normal_user_token_headers
+        )
+        assert response.status_code == 403
+
+
+def test_validate_circuit(client: TestClient) -> None:
+    response = client.post(
+        f"{settings.API_V1_STR}/circuits/validate",
+        json={"circuit_yaml": CIRCUIT_YAML},
+    )
+    assert response.status_code == 200
+    assert response.json()["status"] == "valid"
+
+
+def test_validate_circuit_invalid_yaml(client: TestClient) -> None:
+    response = client.post(
+        f"{settings.API_V1_STR}/circuits/validate",
+        json={"circuit_yaml": "circuit: [1, 2"},
+    )
+    assert response.status_code == 400
+
+
+def test_validate_circuit_too_large(client: TestClient) -> None:
+    circuit_yaml = "circuit: " + "x" * (settings.CIRCUIT_YAML_MAX_BYTES + 1)
+    response = client.post(
+        f"{settings.API_V1_STR}/circuits/validate",
+        json={"circuit_yaml": circuit_yaml},
+    )
+    assert response.status_code == 413
+
+
+def test_validate_circuit_unknown_component(client: TestClient) -> None:
+    circuit_yaml = CIRCUIT_YAML.replace('"battery_1", terminal: "negative"', '"x"')
+    response = client.post(
+        f"{settings.API_V1_STR}/circuits/validate",
+        json={"circuit_yaml": circuit_yaml},
+    )
+    assert response.status_code == 400
+    assert "unknown component" in response.json()["detail"]
+
+
+def test_validate_circuit_erc(client: TestClient) -> None:
+    response = client.post(
+        f"{settings.API_V1_STR}/circuits/validate",
+        json={"circuit_yaml": CIRCUIT_YAML, "erc": True},
+    )
+    assert response.status_code == 200
+    content = response.json()
+    assert content["status"] == "invalid"
+    assert [v["code"] for v in content["violations"]] == ["shorted_supply"]
+
+
+def test_validate_circuit_definitions_batch(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    clean = create_random_circuit_definition(db)
+    shorted = create_random_circuit_definition(db, CIRCUIT_YAML)
+    response = client.post(
+        f"{settings.API_V1_STR}/circuits/validate/batch",
+        headers=superuser_token_headers,
+        json={"circuit_ids": [str(clean.id), str(shorted.id)]},
+    )
+    assert response.status_code == 200
+    content = response.json()
+    assert content["count"] == 2
+    statuses = {r["circuit_id"]: r["status"] for r in content["data"]}
+    assert statuses == {str(clean.id): "valid", str(shorted.id): "invalid"}
+
+
+def test_validate_circuit_definitions_batch_is_paginated(
+    client: TestClient, db: Session
+) -> None:
+    headers = authentication_token_from_email(
+        client=client, email=random_email(), db=db
+    )
+    for _ in range(3):
+        response = client.post(
+            f"{settings.API_V1_STR}/circuits/definitions",
+            headers=headers,
+            json={"circuit_yaml": CIRCUIT_YAML},
+        )
+        assert response.status_code == 201
+    url = f"{settings.API_V1_STR}/circuits/validate/batch"
+    response = client.post(url, headers=headers, json={}, params={"limit": 2})
+    assert response.status_code == 200
+    content = response.json()
+    assert content["count"] == 3 and len(content["data"]) == 2
+    response = client.post(url, headers=headers, json={}, params={"skip": 2})
+    assert len(response.json()["data"]) == 1
+    response = client.post(url, headers=headers, json={}, params={"limit": 5000})
+    assert response.status_code == 422
+
+
+def test_validate_circuit_definitions_batch_not_found(
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
+) -> None:
+    other = create_random_circuit_definition(db)
+    response = client.post(
+        f"{settings.API_V1_STR}/circuits/validate/batch",
+        headers=normal_user_token_headers,
+        json={"circuit_ids": [str(other.id)]},
+    )
+    assert response.status_code == 404
+
+
+def test_create_circuit_definition_rejects_unbounded_position(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    response = client.post(
+        f"{settings.API_V1_STR}/circuits/definitions",
+        headers=superuser_token_headers,
+        json={"circuit_yaml": LED_CIRCUIT_YAML.replace("x: 350", "x: 1e308")},
+    )
+    assert response.status_code == 400
+
+
+def test_create_circuit_definition(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    response = client.post(
+        f"{settings.API_V1_STR}/circuits/definitions",
+        headers=superuser_token_headers,
+        json={"circuit_yaml": LED_CIRCUIT_YAML},
+    )
+    assert response.status_code == 201
+    circuit_id = response.json()["circuit_id"]
+
+    response = client.get(
+        f"{settings.API_V1_STR}/circuits/definitions/{circuit_id}",
+        headers=superuser_token_headers,
+    )
+    assert response.status_code == 200
+    content = response.json()
+    assert content["circuit_yaml"] == LED_CIRCUIT_YAML
+    assert content["component_count"] == 3
+    assert "resistor" in content["component_types"]
+
+
+def test_create_circuit_definition_invalid(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    response = client.post(
+        f"{settings.API_V1_STR}/circuits/definitions",
+        headers=superuser_token_headers,
+        json={"circuit_yaml": "circuit: [1, 2"},
+    )
+    assert response.status_code == 400
+
+
+def test_read_circuit_definitions_filters(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    definition = create_random_circuit_definition(db)
+    response = client.get(
+        f"{settings.API_V1_STR}/circuits/definitions",
+        headers=superuser_token_headers,
+        params={"component_type": "power_supply", "min_components": 3, "limit": 1000},
+    )
+    assert response.status_code == 200
+    ids = [d["id"] for d in response.json()["data"]]
+    assert str(definition.id) in ids
+
+    response = client.get(
+        f"{settings.API_V1_STR}/circuits/definitions",
+        headers=superuser_token_headers,
+        params={"component_type": "LM7805", "limit": 1000},
+    )
+    assert str(definition.id) not in [d["id"] for d in response.json()["data"]]
+
+    response = client.get(
+        f"{settings.API_V1_STR}/circuits/definitions",
+        headers=superuser_token_headers,
+        params={"min_components": 4, "limit": 1000},
+    )
+    assert str(definition.id) not in [d["id"] for d in response.json()["data"]]
+
+
+def test_read_circuit_definition_not_found(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    response = client.get(
+        f"{settings.API_V1_STR}/circuits/definitions/{uuid.uuid4()}",
+        headers=superuser_token_headers,
+    )
+    assert response.status_code == 404
+
+
+def test_read_circuit_definition_not_enough_permissions(
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
+) -> None:
+    definition = create_random_circuit_definition(db)
+    response = client.get(
+        f"{settings.API_V1_STR}/circuits/definitions/{definition.id}",
+        headers=normal_user_token_headers,
+    )
+    assert response.status_code == 400
+
+
+def test_read_similar_circuit_definitions(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    definition = create_random_circuit_definition(db)
+    twin = create_random_circuit_definition(
+        db, LED_CIRCUIT_YAML.replace("x: 350", "x: 400")
+    )
+    response = client.get(
+        f"{settings.API_V1_STR}/circuits/definitions/{definition.id}/similar",
+        headers=superuser_token_headers,
+        params={"k": 50},
+    )
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert str(definition.id) not in [d["circuit_id"] for d in data]
+    match = next(d for d in data if d["circuit_id"] == str(twin.id))
+    assert match["similarity"] == 1.0
+
+    for k in (0, 101):
+        response = client.get(
+            f"{settings.API_V1_STR}/circuits/definitions/{definition.id}/similar",
+            headers=superuser_token_headers,
+            params={"k": k},
+        )
+        assert response.status_code == 422
+
+
+def test_read_similar_circuit_definitions_only_own(
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
+) -> None:
+    other = create_random_circuit_definition(db)
+    response = client.post(
+        f"{settings.API_V1_STR}/circuits/definitions",
+        headers=normal_user_token_headers,
+        json={"circuit_yaml": LED_CIRCUIT_YAML},
+    )
+    circuit_id = response.json()["circuit_id"]
+    response = client.get(
+        f"{settings.API_V1_STR}/circuits/definitions/{circuit_id}/similar",
+        headers=normal_user_token_headers,
+        params={"k": 50},
+    )
+    assert response.status_code == 200
+    assert str(other.id) not in [d["circuit_id"] for d in response.json()["data"]]
+
+
+def test_update_circuit_definition_revisions(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    definition = create_random_circuit_definition(db)
+    url = f"{settings.API_V1_STR}/circuits/definitions/{definition.id}"
+    edited = LED_CIRCUIT_YAML.replace('color: "blue"', 'color: "green"')
+    for circuit_yaml in (edited, edited, LED_CIRCUIT_YAML):
+        response = client.put(
+            url, headers=superuser_token_headers, json={"circuit_yaml": circuit_yaml}
+        )
+        assert response.status_code == 200
+    # 内容が変わらない更新はリビジョンを増やさない
+    assert response.json()["revision"] == 3
+
+    response = client.get(f"{url}/revisions", headers=superuser_token_headers)
+    assert [r["number"] for r in response.json()["data"]] == [3, 2, 1]
+    assert response.json()["data"][-1]["is_snapshot"]
+
+    response = client.get(f"{url}/revisions/2", headers=superuser_token_headers)
+    assert response.status_code == 200
+    assert "color: green" in response.json()["circuit_yaml"]
+
+    response = client.get(
+        f"{url}/diff",
+        headers=superuser_token_headers,
+        params={"from_revision": 1, "to_revision": 2},
+    )
+    assert response.status_code == 200
+    assert response.json()["components"]["changed"] == {
+        "external_led_1": {"properties.color": {"old": "blue", "new": "green"}}
+    }
+
+    response = client.get(
+        f"{url}/diff", headers=superuser_token_headers, params={"from_revision": 1}
+    )
+    assert response.json()["components"]["changed"] == {}
+
+    response = client.get(f"{url}/revisions/9", headers=superuser_token_headers)
+    assert response.status_code == 404
+
+
+def test_update_circuit_definition_invalid(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    definition = create_random_circuit_definition(db)
+    response = client.put(
+        f"{settings.API_V1_STR}/circuits/definitions/{definition.id}",
+        headers=superuser_token_headers,
+        json={"circuit_yaml": "circuit: [1, 2"},
+    )
+    assert response.status_code == 400
+
+
+def test_render_circuit(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    definition = create_random_circuit_definition(db, grid_circuit_yaml(20, 20))
+    url = f"{settings.API_V1_STR}/circuits/{definition.id}/render"
+    response = client.get(url, headers=superuser_token_headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/svg+xml"
+    assert response.text.count("data-id=") == 400
+
+    response = client.get(
+        url,
+        headers=superuser_token_headers,
+        params={"viewport": "-50,-50,300,200", "zoom": 2},
+    )
+    assert response.status_code == 200
+    assert response.text.count("data-id=") == 6
+    assert 'width="600"' in response.text
+
+
+def test_render_circuit_minimize_crossings(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    definition = create_random_circuit_definition(db)
+    response = client.get(
+        f"{settings.API_V1_STR}/circuits/{definition.id}/render",
+        headers=superuser_token_headers,
+        params={"minimize_crossings": True},
+    )
+    assert response.status_code == 200
+    before = int(response.headers["x-layout-crossings-before"])
+    after = int(response.headers["x-layout-crossings-after"])
+    assert after <= before
+    assert f'data-crossings-after="{after}"' in response.text
+
+
+def test_render_circuit_reuses_layout_across_themes(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    definition = create_random_circuit_definition(db, grid_circuit_yaml(7, 3))
+    url = f"{settings.API_V1_STR}/circuits/{definition.id}/render"
+    layout_cache.clear()
+    light = client.get(url, headers=superuser_token_headers)
+    dark = client.get(url, headers=superuser_token_headers, params={"theme": "dark"})
+    assert light.status_code == dark.status_code == 200
+    assert (layout_cache.misses, layout_cache.hits) == (1, 1)
+    assert light.text != dark.text
+    assert light.text.split("</style>")[1] == dark.text.split("</style>")[1]
+
+    stored = db.exec(
+        select(CircuitLayout).where(
+            CircuitLayout.definition_hash == definition.definition_hash,
+            CircuitLayout.variant == layout_variant("grid", False),
+        )
+    ).one()
+    assert len(stored.layout["components"]) == 21
+
+
+def test_render_circuit_serves_precompressed_variants(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    definition = create_random_circuit_definition(db, grid_circuit_yaml(9, 4))
+    url = f"{settings.API_V1_STR}/circuits/{definition.id}/render"
+    render_cache.clear()
+    plain = client.get(
+        url, headers={**superuser_token_headers, "Accept-Encoding": "identity"}
+    )
+    assert plain.status_code == 200
+    assert "content-encoding" not in plain.headers
+    assert plain.headers["vary"] == "Accept-Encoding"
+
+    compressed = client.get(
+        url, headers={**superuser_token_headers, "Accept-Encoding": "gzip"}
+    )
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert int(compressed.headers["content-length"]) < len(plain.content)
+    assert compressed.text == plain.text
+    assert (render_cache.misses, render_cache.hits) == (1, 1)
+    # キャッシュに当たったリクエストでは、どの段階も計算しない
+    assert "svg;dur=" in plain.headers["Server-Timing"]
+    assert "server-timing" not in compressed.headers
+
+
+def test_render_example_circuit_hits_warmed_cache(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    path = EXAMPLES_DIR / "voltage_divider.yaml"
+    definition = create_random_circuit_definition(db, path.read_text())
+    warmup.run([str(path)], ["dark"], lambda: Session(engine))
+    response = client.get(
+        f"{settings.API_V1_STR}/circuits/{definition.id}/render",
+        headers=superuser_token_headers,
+        params={"theme": "dark"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/svg+xml"
+    # 起動時に描いた結果をそのまま返すので、どの段階も計算しない
+    assert "server-timing" not in response.headers
+
+
+def test_read_stage_timings(
+    client: TestClient,
+    superuser_token_headers: dict[str, str],
+    normal_user_token_headers: dict[str, str],
+    db: Session,
+) -> None:
+    definition = create_random_circuit_definition(db, grid_circuit_yaml(3, 3))
+    client.get(
+        f"{settings.API_V1_STR}/circuits/{definition.id}/render",
+        headers=superuser_token_headers,
+        params={"theme": "dark", "zoom": 3},
+    )
+    response = client.get(
+        f"{settings.API_V1_STR}/circuits/timings", headers=superuser_token_headers
+    )
+    assert response.status_code == 200
+    stages = {stage["name"]: stage for stage in response.json()["data"]}
+    assert stages["svg"]["count"] >= 1
+    assert stages["svg"]["p50"] <= stages["svg"]["p99"]
+
+    response = client.get(
+        f"{settings.API_V1_STR}/circuits/timings", headers=normal_user_token_headers
+    )
+    assert response.status_code == 403
+
+
+def test_render_circuit_invalid_params(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    definition = create_random_circuit_definition(db)
+    url = f"{settings.API_V1_STR}/circuits/{definition.id}/render"
+    for params in (
+        {"format": "jpeg"},
+        {"viewport": "0,0,10"},
+        {"viewport": "0,0,0,10"},
+        {"viewport": "nan,0,10,10"},
+        {"viewport": "0,0,inf,10"},
+        {"zoom": 0},
+        {"zoom": "nan"},
+        {"zoom": "inf"},
+        {"placement": "random"},
+        {"theme": "neon"},
+    ):
+        response = client.get(url, headers=superuser_token_headers, params=params)
+        assert response.status_code == 400
+    for quantum in ("0", "1e-306", "101", "nan", "inf"):
+        response = client.get(
+            url, headers=superuser_token_headers, params={"quantum": quantum}
+        )
+        assert response.status_code == 422
+
+    response = client.get(
+        f"{settings.API_V1_STR}/circuits/{uuid.uuid4()}/render",
+        headers=superuser_token_headers,
+    )
+    assert response.status_code == 404
+
+
+def test_live_edit_circuit(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    definition = create_random_circuit_definition(db)
+    token = superuser_token_headers["Authorization"].removeprefix("Bearer ")
+    url = f"{settings.API_V1_STR}/circuits/{definition.id}/live?token={token}"
+    with (
+        client.websocket_connect(url) as editor,
+        client.websocket_connect(url) as viewer,
+    ):
+        assert editor.receive_json()["type"] == "snapshot"
+        assert viewer.receive_json()["svg"].startswith("<svg")
+        editor.send_json({"op": "move", "id": "external_led_1", "x": 400, "y": 150})
+        patch = viewer.receive_json()
+        assert patch["type"] == "patch"
+        assert "component:external_led_1" in patch["upsert"]
+        assert editor.receive_json() == patch
+
+        editor.send_text("not json")
+        assert editor.receive_json()["type"] == "error"
+    # 最後のクライアントが切断したときに保存される (切断の処理はサーバー側で非同期に進む)
+    deadline = time.monotonic() + 5
+    while definition.id in live_sessions and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert definition.id not in live_sessions
+    db.refresh(definition)
+    assert definition.revision == 2
+    assert "x: 400" in definition.circuit_yaml
+    db.delete(db.get(CircuitDefinition, definition.id))
+    db.commit()
+
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect(url.replace(token, "invalid")) as ws:
+            ws.receive_json()
+
+
+def test_live_edit_does_not_overwrite_rest_update(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    definition = create_random_circuit_definition(db)
+    token = superuser_token_headers["Authorization"].removeprefix("Bearer ")
+    url = f"{settings.API_V1_STR}/circuits/{definition.id}/live?token={token}"
+    with client.websocket_connect(url) as editor:
+        assert editor.receive_json()["type"] == "snapshot"
+        editor.send_json({"op": "move", "id": "external_led_1", "x": 400, "y": 150})
+        assert editor.receive_json()["type"] == "patch"
+        response = client.put(
+            f"{settings.API_V1_STR}/circuits/definitions/{definition.id}",
+            headers=superuser_token_headers,
+            json={
+                "circuit_yaml": LED_CIRCUIT_YAML.replace(
+                    'color: "blue"', 'color: "green"'
+                )
+            },
+        )
+        assert response.json()["revision"] == 2
+    deadline = time.monotonic() + 5
+    while definition.id in live_sessions and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # 保存の前にリビジョンを比べ、REST の更新を上書きしない
+    db.refresh(definition)
+    assert definition.revision == 2
+    assert 'color: "green"' in definition.circuit_yaml
+    assert "x: 400" not in definition.circuit_yaml
+
+
+def test_export_circuit_spice(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    definition = create_random_circuit_definition(db)
+    url = f"{settings.API_V1_STR}/circuits/{definition.id}/export"
+    response = client.get(url, headers=superuser_token_headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert f"{definition.id}.cir" in response.headers["content-disposition"]
+    lines = response.text.splitlines()
+    assert ".SUBCKT LED_DRIVER_MODULE input_power output_led_anode" in lines
+    assert lines[-1] == ".end"
+
+    response = client.get(
+        url, headers=superuser_token_headers, params={"format": "gerber"}
+    )
+    assert response.status_code == 400
+
+
+def test_bill_of_materials(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    definition = create_random_circuit_definition(db)
+    url = f"{settings.API_V1_STR}/circuits/{definition.id}/bom"
+    response = client.get(url, headers=superuser_token_headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.text.splitlines()[-1] == "resistor,220Ω,,1"
+
+    response = client.get(
+        url, headers=superuser_token_headers, params={"format": "xml"}
+    )
+    assert response.status_code == 400
+
+
+def test_bulk_bill_of_materials(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    first = create_random_circuit_definition(db)
+    second = create_random_circuit_definition(db)
+    response = client.post(
+        f"{settings.API_V1_STR}/circuits/bom",
+        headers=superuser_token_headers,
+        params={"format": "json"},
+        json={
+            "items": [
+                {"circuit_id": str(first.id), "quantity": 10},
+                {"circuit_id": str(second.id)},
+            ]
+        },
+    )
+    assert response.status_code == 200
+    content = response.json()
+    assert content["count"] == 3
+    assert {row["type"]: row["quantity"] for row in content["data"]} == {
+        "led": 11,
+        "power_supply": 11,
+        "resistor": 11,
+    }
+
+    response = client.post(
+        f"{settings.API_V1_STR}/circuits/bom",
+        headers=superuser_token_headers,
+        json={"items": [{"circuit_id": str(uuid.uuid4())}]},
+    )
+    assert response.status_code == 404
+
+
+def test_dc_operating_point(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    definition = create_random_circuit_definition(db)
+    response = client.get(
+        f"{settings.API_V1_STR}/circuits/{definition.id}/dc",
+        headers=superuser_token_headers,
+    )
+    assert response.status_code == 200
+    content = response.json()
+    voltages = {
+        pin: node["voltage"]
+        for node in content["node_voltages"]
+        for pin in node["pins"]
+    }
+    assert voltages["power_supply_1.VCC"] == pytest.approx(5.0)
+    assert voltages["power_supply_1.GND"] == 0.0
+    assert content["branch_currents"]["external_led_1"] == pytest.approx(3.0 / 221.0)
+
+    response = client.post(
+        f"{settings.API_V1_STR}/circuits/{definition.id}/dc/sweep",
+        headers=superuser_token_headers,
+        json={"component_id": "power_supply_1", "values": [3.0, 5.0, 9.0]},
+    )
+    assert response.status_code == 200
+    currents = [
+        p["branch_currents"]["external_led_1"] for p in response.json()["points"]
+    ]
+    assert currents == pytest.approx([1.0 / 221.0, 3.0 / 221.0, 7.0 / 221.0])
+
+    response = client.post(
+        f"{settings.API_V1_STR}/circuits/{definition.id}/dc/sweep",
+        headers=superuser_token_headers,
+        json={"component_id": "missing", "values": [1.0]},
+    )
+    assert response.status_code == 400
+
+    # JSON の Infinity・NaN も float として受け付けてしまうので、解析で弾く
+    for value in ("Infinity", "NaN"):
+        response = client.post(
+            f"{settings.API_V1_STR}/circuits/{definition.id}/dc/sweep",
+            headers={**superuser_token_headers, "Content-Type": "application/json"},
+            content=f'{{"component_id": "power_supply_1", "values": [{value}]}}',
+        )
+        assert response.status_code == 400
+
+
+def test_dc_operating_point_invalid_value(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    definition = create_random_circuit_definition(
+        db, LED_CIRCUIT_YAML.replace('"220ohm"', '"lots"')
+    )
+    response = client.get(
+        f"{settings.API_V1_STR}/circuits/{definition.id}/dc",
+        headers=superuser_token_headers,
+    )
+    assert response.status_code == 400
+    assert "invalid resistance" in response.json()["detail"]
+
+    definition = create_random_circuit_definition(
+        db, LED_CIRCUIT_YAML.replace('"220ohm"', '"1e400ohm"')
+    )
+    response = client.get(
+        f"{settings.API_V1_STR}/circuits/{definition.id}/dc",
+        headers=superuser_token_headers,
+    )
+    assert response.status_code == 400
+    assert "invalid resistance" in response.json()["detail"]
@@ -0,0 +1,28 @@
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from app.circuits.warmup import Warmup, example_paths
+from app.core.config import settings
+
+
+def test_readiness_reports_warm_up_progress(client: TestClient) -> None:
+    response = client.get(f"{settings.API_V1_STR}/utils/ready/")
+    assert response.status_code == 200
+    status = response.json()
+    assert status["ready"] is True
+    assert status["total"] == len(example_paths(settings.CIRCUIT_WARMUP_EXAMPLES))
+    assert status["done"] + status["failed"] == status["total"]
+
+    pending = Warmup()
+    pending.total = 3
+    with patch("app.api.routes.utils.warmup", pending):
+        response = client.get(f"{settings.API_V1_STR}/utils/ready/")
+    assert response.status_code == 503
+    assert response.json() == {
+        "ready": False,
+        "total": 3,
+        "done": 0,
+        "failed": 0,
+        "seconds": None,
+    }
@@ -0,0 +1,262 @@
+"""
+回路の処理段階ごとのベンチマーク
+
+`tests/utils/synthetic.py` で作った部品数 100 から 10万の回路について、
+YAMLの読み込み・検証 (コンパイル)・ネットリストの出力・部品の配置・配線・
+SVGの出力・ラスタライズの時間とピークメモリを計り、JSON に記録する。
+
+    python -m tests.benchmarks.run --output tests/benchmarks/baseline.json
+    python -m tests.benchmarks.run --sizes 100 1000 --compare tests/benchmarks/baseline.json
+
+時間は `--repeat` 回のうち最も速かったもの、ピークメモリは tracemalloc を有効に
+した別の1回で計る (tracemalloc は処理を遅くするため)。配置と配線は1回の
+`compute_layout` の中でスパン (`app.circuits.timing`) ごとに分けて計るので、
+配線のピークメモリは配置 (`layout`) に含める。CairoSVG が無い環境では
+ラスタライズを飛ばす。`--compare` で記録と比べ、許容幅を超えて遅く (大きく)
+なった段階があれば終了コード 1 で終わる。
+"""
+
+import argparse
+import importlib
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable, Sequence
+from dataclasses import asdict
+from datetime import datetime, timezone
+from typing import Any
+
+from app.circuits import timing
+from app.circuits.compiler import CompiledCircuit, compile_circuit
+from app.circuits.formatters import SpiceFormatter, SvgPreviewFormatter
+from app.circuits.layout import Layout, compute_layout
+from app.circuits.loader import YAMLLimits, load_circuit_yaml
+from tests.utils.synthetic import SyntheticSpec, synthetic_circuit_yaml
+
+SIZES = (100, 1_000, 10_000, 100_000)
+STAGES = ("load", "validate", "netlist", "layout", "routing", "svg", "rasterize")
+# 大きな回路も読めるように、YAMLの上限はベンチマークでは緩める
+LIMITS = YAMLLimits(
+    max_bytes=1 << 34, max_nodes=1 << 34, max_depth=64, max_aliases=10_000
+)
+# 記録と比べるときの許容幅 (割合) と、比べない短い時間 [秒]
+TOLERANCE = 0.5
+MIN_SECONDS = 0.01
+BASELINE_VERSION = 1
+
+
+def _rasterizer() -> Callable[[str], bytes] | None:
+    # CairoSVG (と cairo) はオプションの依存関係
+    try:
+        cairosvg = importlib.import_module("cairosvg")
+    except (ImportError, OSError):
+        return None
+    return lambda svg: cairosvg.svg2png(bytestring=svg.encode("utf-8"))
+
+
+class _Stages:
+    """1つの回路について段階を順に実行し、段階ごとの時間とピークメモリを記録する"""
+
+    def __init__(self, source: str, memory: bool) -> None:
+        self.source = source
+        self.memory = memory
+        self.seconds: dict[str, float] = {}
+        self.peak_bytes: dict[str, int] = {}
+
+    def measure(self, stage: str, func: Callable[[], Any]) -> Any:
+        if self.memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            result = func()
+            self.peak_bytes[stage] = tracemalloc.get_traced_memory()[1] - before
+            return result
+        started = time.perf_counter()
+        result = func()
+        self.seconds[stage] = time.perf_counter() - started
+        return result
+
+    def run(self, rasterize: Callable[[str], bytes] | None) -> CompiledCircuit:
+        document = self.measure("load", lambda: load_circuit_yaml(self.source, LIMITS))
+        compiled: CompiledCircuit = self.measure(
+            "validate", lambda: compile_circuit(document)
+        )
+        self.measure("netlist", lambda: "".join(SpiceFormatter().format(compiled)))
+        with timing.record_timings() as timings:
+            layout: Layout = self.measure("layout", lambda: compute_layout(compiled))
+        if not self.memory:
+            # 配線は compute_layout の中のスパンで分ける
+            self.seconds["routing"] = timings.durations.get("routing", 0.0)
+            self.seconds["layout"] -= self.seconds["routing"]
+        formatter = SvgPreviewFormatter()
+        svg: str = self.measure("svg", lambda: "".join(formatter.render(layout)))
+        if rasterize is not None:
+            self.measure("rasterize", lambda: rasterize(svg))
+        return compiled
+
+
+def run_benchmark(
+    spec: SyntheticSpec, repeat: int = 1, memory: bool = True
+) -> dict[str, Any]:
+    """1つの大きさの回路について段階ごとの時間 [秒] とピークメモリ [バイト] を計る"""
+    source = synthetic_circuit_yaml(spec)
+    rasterize = _rasterizer()
+    saved, timing.enabled = timing.enabled, True
+    try:
+        seconds: dict[str, float] = {}
+        for _ in range(repeat):
+            stages = _Stages(source, memory=False)
+            compiled = stages.run(rasterize)
+            for stage, value in stages.seconds.items():
+                seconds[stage] = min(seconds.get(stage, value), value)
+        peak_bytes: dict[str, int] = {}
+        if memory:
+            stages = _Stages(source, memory=True)
+            tracemalloc.start()
+            try:
+                stages.run(rasterize)
+            finally:
+                tracemalloc.stop()
+            peak_bytes = stages.peak_bytes
+    finally:
+        timing.enabled = saved
+
+    return {
+        "spec": asdict(spec),
+        "yaml_bytes": len(source.encode("utf-8")),
+        "components": compiled.component_count,
+        "nets": len(compiled.nets),
+        "stages": {
+            stage: {
+                "seconds": round(seconds[stage], 6),
+                "peak_bytes": peak_bytes.get(stage),
+            }
+            for stage in STAGES
+            if stage in seconds
+        },
+    }
+
+
+def run_benchmarks(
+    sizes: Sequence[int] = SIZES,
+    module_depth: int = 2,
+    repeat: int = 1,
+    memory: bool = True,
+    on_result: Callable[[dict[str, Any]], None] | None = None,
+) -> dict[str, Any]:
+    """大きさごとにベンチマークを実行し、記録 (ベースライン) の形で返す"""
+    results = []
+    for parts in sizes:
+        result = run_benchmark(
+            SyntheticSpec(parts, module_depth=module_depth), repeat, memory
+        )
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+    return {
+        "version": BASELINE_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "rasterize": _rasterizer() is not None,
+        "results": results,
+    }
+
+
+def compare(
+    baseline: dict[str, Any],
+    current: dict[str, Any],
+    tolerance: float = TOLERANCE,
+    min_seconds: float = MIN_SECONDS,
+) -> list[str]:
+    """
+    記録 `baseline` と比べて、許容幅 `tolerance` を超えて遅く・大きくなった段階を返す
+
+    回路の大きさ (`spec`) が同じ結果どうしだけを比べる。`min_seconds` より短い
+    時間は計測の揺らぎが大きいので比べない。
+    """
+    before = {
+        json.dumps(r["spec"], sort_keys=True): r["stages"] for r in baseline["results"]
+    }
+    regressions = []
+    for result in current["results"]:
+        stages = before.get(json.dumps(result["spec"], sort_keys=True))
+        if stages is None:
+            continue
+        parts = result["spec"]["parts"]
+        for stage, now in result["stages"].items():
+            then = stages.get(stage)
+            if then is None:
+                continue
+            longest = max(now["seconds"], then["seconds"])
+            limit = then["seconds"] * (1 + tolerance)
+            if longest >= min_seconds and now["seconds"] > limit:
+                regressions.append(
+                    f"{stage} ({parts} parts): "
+                    f"{then['seconds']:.3f}s -> {now['seconds']:.3f}s"
+                )
+            if (
+                now["peak_bytes"] is not None
+                and then["peak_bytes"] is not None
+                and now["peak_bytes"] > then["peak_bytes"] * (1 + tolerance)
+            ):
+                regressions.append(
+                    f"{stage} ({parts} parts): "
+                    f"{then['peak_bytes']} -> {now['peak_bytes']} bytes"
+                )
+    return regressions
+
+
+def _summary(result: dict[str, Any]) -> str:
+    cells = [
+        f"{stage} {value['seconds'] * 1000:.1f}ms"
+        + (
+            f"/{value['peak_bytes'] / 2**20:.1f}MiB"
+            if value["peak_bytes"] is not None
+            else ""
+        )
+        for stage, value in result["stages"].items()
+    ]
+    return f"{result['spec']['parts']:>7} parts: " + ", ".join(cells) + "\n"
+
+
+def _report(result: dict[str, Any]) -> None:
+    sys.stdout.write(_summary(result))
+    sys.stdout.flush()
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--module-depth", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--no-memory", action="store_true")
+    parser.add_argument("--output", help="結果を書き出す JSON ファイル")
+    parser.add_argument("--compare", help="比べる記録 (JSON ファイル)")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+
+    current = run_benchmarks(
+        args.sizes,
+        module_depth=args.module_depth,
+        repeat=args.repeat,
+        memory=not args.no_memory,
+        on_result=_report,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+            f.write("\n")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), current, args.tolerance)
+        for regression in regressions:
+            sys.stdout.write(f"REGRESSION {regression}\n")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+import copy
+import json
+from pathlib import Path
+
+import pytest
+
+from app.circuits.compiler import compile_circuit
+from app.circuits.loader import load_circuit_yaml
+from tests.benchmarks.run import STAGES, compare, main, run_benchmarks
+from tests.utils.synthetic import (
+    SyntheticSpec,
+    synthetic_circuit,
+    synthetic_circuit_yaml,
+)
+
+
+def test_synthetic_circuit_is_deterministic() -> None:
+    spec = SyntheticSpec(200, module_depth=2, seed=3)
+    assert synthetic_circuit_yaml(spec) == synthetic_circuit_yaml(spec)
+    assert synthetic_circuit(spec) != synthetic_circuit(SyntheticSpec(200, seed=4))
+
+
+def test_synthetic_circuit_size() -> None:
+    compiled = compile_circuit(synthetic_circuit(SyntheticSpec(300, nets=120)))
+    assert compiled.component_count == 300
+    assert len(compiled.nets) == 120
+    assert max(len(net.pins) for net in compiled.nets) <= 6
+
+    source = synthetic_circuit_yaml(SyntheticSpec(300, module_depth=2))
+    compiled = compile_circuit(load_circuit_yaml(source))
+    assert compiled.component_count == 300
+    depth = max(c.id.count("/") for c in compiled.components.values())
+    assert depth == 2
+
+    with pytest.raises(ValueError):
+        synthetic_circuit(SyntheticSpec(100, nets=20, fanout=4))
+
+
+def test_benchmark_records_every_stage(tmp_path: Path) -> None:
+    baseline = run_benchmarks([100])
+    (result,) = baseline["results"]
+    assert result["components"] == 100
+    expected = [s for s in STAGES if s != "rasterize" or baseline["rasterize"]]
+    assert list(result["stages"]) == expected
+    assert result["stages"]["layout"]["peak_bytes"] > 0
+    assert result["stages"]["routing"]["peak_bytes"] is None
+    assert compare(baseline, baseline) == []
+
+    slower = copy.deepcopy(baseline)
+    slower["results"][0]["stages"]["load"]["seconds"] += 1.0
+    (regression,) = compare(baseline, slower)
+    assert regression.startswith("load (100 parts)")
+
+    path = tmp_path / "baseline.json"
+    path.write_text(json.dumps(slower))
+    assert main(["--sizes", "100", "--no-memory", "--compare", str(path)]) == 0
@@ -0,0 +1,102 @@
+from app.circuits.compiler import compile_circuit
+from app.circuits.formatters import SpiceFormatter
+from app.circuits.loader import load_circuit_yaml
+from tests.utils.circuit import LED_CIRCUIT_YAML
+
+
+def _netlist(circuit_yaml: str) -> list[str]:
+    circuit = compile_circuit(load_circuit_yaml(circuit_yaml))
+    return "".join(SpiceFormatter().format(circuit)).splitlines()
+
+
+def _stage(id: str, resistance: str, x: int) -> str:
+    return f"""
+    - id: {id}
+      type: module
+      properties:
+        name: stage
+        position: {{x: {x}, y: 0}}
+        ports: [{{name: in}}, {{name: out}}]
+      internal_components:
+        - {{id: r, type: resistor, properties: {{resistance: {resistance}}}}}
+        - {{id: c, type: capacitor, properties: {{capacitance: 100n}}}}
+      internal_connections:
+        - {{from: {{component_id: {id}, port: in}}, to: {{component_id: r, terminal: a}}}}
+        - {{from: {{component_id: r, terminal: b}}, to: {{component_id: {id}, port: out}}}}
+        - {{from: {{component_id: {id}, port: out}}, to: {{component_id: c, terminal: a}}}}
+        - {{from: {{component_id: c, terminal: b}}, to: {{component_id: gnd}}}}
+        - {{from: {{component_id: gnd}}, to: {{component_id: gnd}}}}
+"""
+
+
+def test_led_circuit() -> None:
+    assert _netlist(LED_CIRCUIT_YAML) == [
+        "* Complex Circuit with Modules and Branching",
+        "* モジュールと分岐配線を含む回路の例",
+        ".model LED D(IS=1e-22 N=1.5 RS=1)",
+        ".SUBCKT LED_DRIVER_MODULE input_power output_led_anode",
+        "Rresistor_internal_1 input_power output_led_anode 220",
+        ".ENDS",
+        "Vpower_supply_1 N0 0 DC 5",
+        "Xled_driver_module_1 N0 N2 LED_DRIVER_MODULE",
+        "Dexternal_led_1 N2 0 LED",
+        ".end",
+    ]
+
+
+def test_identical_modules_share_subcircuit() -> None:
+    stages = "".join(
+        _stage(id, resistance, x)
+        for id, resistance, x in [
+            ("s1", "1k", 0),
+            ("s2", "1k", 100),
+            ("s3", "2.2k", 200),
+            ("s4", "1k", 300),
+        ]
+    )
+    circuit_yaml = f"""
+circuit:
+  components:
+    - {{id: v1, type: voltage_source, properties: {{voltage: 1V}}}}
+{stages}
+  connections:
+    - {{from: {{component_id: v1, terminal: positive}}, to: {{component_id: s1, port: in}}}}
+    - {{from: {{component_id: s1, port: out}}, to: {{component_id: s2, port: in}}}}
+    - {{from: {{component_id: s2, port: out}}, to: {{component_id: s3, port: in}}}}
+    - {{from: {{component_id: s3, port: out}}, to: {{component_id: s4, port: in}}}}
+"""
+    circuit_yaml = circuit_yaml.replace(
+        "        - {id: c, type: capacitor",
+        "        - {id: gnd, type: ground}\n        - {id: c, type: capacitor",
+    )
+    lines = _netlist(circuit_yaml)
+    assert [line for line in lines if line.startswith(".SUBCKT")] == [
+        ".SUBCKT STAGE in out",
+        ".SUBCKT STAGE_2 in out",
+    ]
+    assert "Rr in out 1000" in lines
+    assert "Rr in out 2200" in lines
+    # モジュール内のグラウンドはグローバルなノード 0
+    assert "Cc out 0 1e-07" in lines
+    assert [line for line in lines if line.startswith("X")] == [
+        "Xs1 N0 N1 STAGE",
+        "Xs2 N1 N2 STAGE",
+        "Xs3 N2 N3 STAGE_2",
+        "Xs4 N3 N4 STAGE",
+    ]
+
+
+def test_unmodeled_components_are_comments() -> None:
+    lines = _netlist(
+        """
+circuit:
+  components:
+    - {id: u1, type: opamp}
+    - {id: r1, type: resistor}
+  connections:
+    - {from: {component_id: u1, terminal: out}, to: {component_id: r1, terminal: a}}
+    - {from: {component_id: u1, terminal: in}, to: {component_id: r1, terminal: b}}
+"""
+    )
+    assert "* u1: opamp is not modeled" in lines
+    assert "* r1: missing or invalid resistance" in lines
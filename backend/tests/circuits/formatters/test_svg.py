@@ -0,0 +1,115 @@
+import math
+from xml.etree import ElementTree
+
+import pytest
+
+from app.circuits.compiler import compile_circuit
+from app.circuits.formatters import SvgPreviewFormatter
+from app.circuits.formatters.svg import Quantizer, path_data
+from app.circuits.layout import Box, compute_layout
+from app.circuits.loader import load_circuit_yaml
+from tests.utils.circuit import LED_CIRCUIT_YAML, grid_circuit_yaml
+
+SVG_NS = "{http://www.w3.org/2000/svg}"
+
+
+def _render(circuit_yaml: str, **kwargs: object) -> ElementTree.Element:
+    circuit = compile_circuit(load_circuit_yaml(circuit_yaml))
+    svg = "".join(SvgPreviewFormatter(**kwargs).format(circuit))  # type: ignore[arg-type]
+    return ElementTree.fromstring(svg)
+
+
+def _ids(root: ElementTree.Element) -> set[str]:
+    return {
+        g.attrib["data-id"] for g in root.iter(f"{SVG_NS}g") if "data-id" in g.attrib
+    }
+
+
+def test_svg_full_render() -> None:
+    root = _render(LED_CIRCUIT_YAML)
+    assert _ids(root) == {
+        "power_supply_1",
+        "junction_A",
+        "led_driver_module_1",
+        "led_driver_module_1/resistor_internal_1",
+        "external_led_1",
+    }
+    assert root.find(f".//{SVG_NS}text") is not None
+
+
+def test_svg_viewport_emits_only_visible_elements() -> None:
+    circuit_yaml = grid_circuit_yaml(30, 30)
+    full = _render(circuit_yaml)
+    clipped = _render(circuit_yaml, viewport=Box(-50, -50, 250, 150))
+    assert len(_ids(full)) == 900
+    assert _ids(clipped) == {f"r{x}_{y}" for x in range(3) for y in range(2)}
+    assert clipped.attrib["viewBox"] == "-50 -50 300 200"
+    assert len(list(clipped.iter(f"{SVG_NS}path"))) < 50
+
+
+def test_svg_low_zoom_collapses_modules_and_drops_labels() -> None:
+    root = _render(LED_CIRCUIT_YAML, zoom=0.25)
+    assert "led_driver_module_1" in _ids(root)
+    assert "led_driver_module_1/resistor_internal_1" not in _ids(root)
+    assert root.find(f".//{SVG_NS}text") is None
+
+    root = _render(LED_CIRCUIT_YAML, zoom=0.6)
+    assert "led_driver_module_1/resistor_internal_1" in _ids(root)
+    assert root.find(f".//{SVG_NS}text") is None
+
+
+def test_svg_theme_only_changes_stylesheet() -> None:
+    layout = compute_layout(compile_circuit(load_circuit_yaml(LED_CIRCUIT_YAML)))
+    light = list(SvgPreviewFormatter().render(layout))
+    dark = list(SvgPreviewFormatter(theme="dark").render(layout))
+    assert light[1].startswith("<style>")
+    assert light[1] != dark[1]
+    assert light[:1] + light[2:] == dark[:1] + dark[2:]
+    assert "currentColor" not in "".join(light)
+
+    with pytest.raises(ValueError):
+        SvgPreviewFormatter(theme="neon")
+
+
+def test_quantizer_emits_shortest_decimal() -> None:
+    num = Quantizer(0.5)
+    assert [num(v) for v in (1.26, -0.4, 0.2, -0.1, 12.0, 3.75)] == [
+        "1.5",
+        "-.5",
+        "0",
+        "0",
+        "12",
+        "4",
+    ]
+    assert Quantizer(0.125)(0.13) == ".125"
+    assert Quantizer(10)(14.9) == "10"
+    assert Quantizer(1e-4)(1.23456) == "1.2346"
+    assert Quantizer(100)(-1e6) == "-1000000"
+    for quantum in (0, 1e-306, 1e-5, 101, math.inf, math.nan):
+        with pytest.raises(ValueError):
+            Quantizer(quantum)
+
+
+def test_path_data_merges_collinear_points_and_uses_relative_commands() -> None:
+    num = Quantizer(0.5)
+    assert path_data([[(0, 0), (10, 0), (20.1, 0), (20, 5.2)]], num) == "M0 0h20v5"
+    assert path_data([[(0, 0), (10, -10)], [(10, -10), (10, 0)]], num) == (
+        "M0 0l10-10v10"
+    )
+    assert path_data([[(0.5, 0.5), (1.5, 0.5)], [(5, 5), (5, 5.1)]], num) == ("M.5.5h1")
+    # 格子の半分以下のずれは Ramer-Douglas-Peucker 法で間引く
+    curve = [(x, 0.2 * (x % 2)) for x in range(11)]
+    assert path_data([curve], num) == "M0 0h10"
+    assert path_data([[(0, 0), (5, 3), (10, 0)]], num) == "M0 0l5 3l5-3"
+
+
+def test_svg_output_is_identical_for_identical_layouts() -> None:
+    circuit = compile_circuit(load_circuit_yaml(grid_circuit_yaml(10, 10)))
+    layout = compute_layout(circuit)
+    first = "".join(SvgPreviewFormatter().render(layout))
+    for c in layout.components:
+        c.x += 1e-9
+    assert "".join(SvgPreviewFormatter().render(layout)) == first
+    # シンボルの図形は1回だけ定義して参照する
+    assert first.count("<defs>") == 1
+    assert first.count('<use href="#s-resistor"/>') == 100
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from app.circuits.admission import AdmissionController, AdmissionRejected, TokenBucket
+
+
+def _controller(**kwargs: float) -> AdmissionController:
+    options: dict[str, float] = {
+        "max_concurrency": 2,
+        "max_queue": 1,
+        "queue_timeout": 1.0,
+        "rate": 1000.0,
+        "burst": 1000,
+    }
+    options.update(kwargs)
+    return AdmissionController(**options)  # type: ignore[arg-type]
+
+
+def test_token_bucket() -> None:
+    bucket = TokenBucket(rate=2.0, burst=2)
+    now = bucket.updated_at
+    assert bucket.take(now) == 0 and bucket.take(now) == 0
+    assert bucket.take(now) == pytest.approx(0.5)
+    assert bucket.take(now + 0.5) == 0
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0, burst=1)
+
+
+def test_concurrency_cap_and_queue() -> None:
+    controller = _controller()
+    order: list[str] = []
+
+    async def hold(name: str, release: asyncio.Event) -> None:
+        async with controller.admit():
+            order.append(name)
+            await release.wait()
+
+    async def main() -> None:
+        release = asyncio.Event()
+        holders = [asyncio.create_task(hold(n, release)) for n in ("a", "b", "c")]
+        await asyncio.sleep(0.01)
+        assert (controller.active, controller.queued) == (2, 1)
+        assert order == ["a", "b"]
+
+        # 待ち行列が一杯なら待たずに断る
+        with pytest.raises(AdmissionRejected) as e:
+            await controller.acquire()
+        assert e.value.status_code == 503 and "Retry-After" in e.value.headers
+        with pytest.raises(AdmissionRejected):
+            await controller.acquire(wait=False)
+
+        release.set()
+        await asyncio.gather(*holders)
+        assert order == ["a", "b", "c"]
+        assert (controller.active, controller.queued) == (0, 0)
+
+    asyncio.run(main())
+    metrics = controller.metrics()
+    assert metrics["admitted"] == 3 and metrics["rejected"] == 2
+    assert metrics["wait_max"] > 0
+
+
+def test_queue_timeout_and_cancel() -> None:
+    controller = _controller(max_concurrency=1, max_queue=2, queue_timeout=0.05)
+
+    async def main() -> None:
+        await controller.acquire()
+        with pytest.raises(AdmissionRejected) as e:
+            await controller.acquire()
+        assert e.value.status_code == 503
+
+        waiter = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert controller.queued == 0
+
+        controller.release()
+        assert controller.active == 0
+
+    asyncio.run(main())
+    assert controller.timed_out == 1
+
+
+def test_rate_limit() -> None:
+    controller = _controller(rate=0.5, burst=1)
+
+    async def main() -> None:
+        async with controller.admit():
+            pass
+        with pytest.raises(AdmissionRejected) as e:
+            await controller.acquire()
+        assert e.value.status_code == 429
+        assert e.value.headers == {"Retry-After": "2"}
+
+    asyncio.run(main())
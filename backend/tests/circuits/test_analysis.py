@@ -0,0 +1,103 @@
+import pytest
+
+from app.circuits.analysis import (
+    CircuitAnalysisError,
+    DCAnalysis,
+    FactorizationCache,
+)
+from app.circuits.compiler import CompiledCircuit, PinRef, compile_circuit
+from app.circuits.loader import load_circuit_yaml
+from tests.utils.circuit import LED_CIRCUIT_YAML
+
+DIVIDER_YAML = """
+circuit:
+  components:
+    - {id: bat, type: battery, properties: {voltage: 10V}}
+    - {id: r1, type: resistor, properties: {resistance: 1k}}
+    - {id: r2, type: resistor, properties: {resistance: 1kohm}}
+  connections:
+    - from: {component_id: bat, terminal: positive}
+      to: {component_id: r1, terminal: a}
+    - from: {component_id: r1, terminal: b}
+      to: {component_id: r2, terminal: a}
+    - from: {component_id: r2, terminal: b}
+      to: {component_id: bat, terminal: negative}
+"""
+
+
+def _compile(circuit_yaml: str) -> CompiledCircuit:
+    return compile_circuit(load_circuit_yaml(circuit_yaml))
+
+
+def test_voltage_divider() -> None:
+    circuit = _compile(DIVIDER_YAML)
+    point = DCAnalysis(circuit, cache=FactorizationCache()).solve()
+    mid = circuit.net_of[PinRef("r1", "b")]
+    assert point.node_voltages[mid] == pytest.approx(5.0)
+    assert point.node_voltages[point.ground_net] == 0.0
+    assert point.branch_currents["r1"] == pytest.approx(5e-3)
+    # 電源からは電流が流れ出す (正側端子から流れ込む向きが正)
+    assert point.branch_currents["bat"] == pytest.approx(-5e-3)
+
+
+def test_led_with_series_resistor() -> None:
+    point = DCAnalysis(_compile(LED_CIRCUIT_YAML), cache=FactorizationCache()).solve()
+    current = point.branch_currents["external_led_1"]
+    assert current == pytest.approx((5.0 - 2.0) / 221.0, rel=1e-6)
+    assert point.branch_currents[
+        "led_driver_module_1/resistor_internal_1"
+    ] == pytest.approx(current)
+
+
+def test_reverse_biased_led_is_off() -> None:
+    circuit_yaml = LED_CIRCUIT_YAML.replace('terminal: "anode"', 'terminal: "x"')
+    circuit_yaml = circuit_yaml.replace('terminal: "cathode"', 'terminal: "anode"')
+    point = DCAnalysis(_compile(circuit_yaml), cache=FactorizationCache()).solve()
+    assert abs(point.branch_currents["external_led_1"]) < 1e-6
+
+
+def test_sweep_reuses_factorization() -> None:
+    circuit = _compile(DIVIDER_YAML)
+    cache = FactorizationCache()
+    analysis = DCAnalysis(circuit, cache=cache)
+    mid = circuit.net_of[PinRef("r1", "b")]
+
+    points = analysis.sweep("bat", [1.0, 2.0, 4.0])
+    assert [p.node_voltages[mid] for p in points] == pytest.approx([0.5, 1.0, 2.0])
+    points = analysis.sweep("r2", [1000.0, 3000.0, 9000.0])
+    assert [p.node_voltages[mid] for p in points] == pytest.approx([5.0, 7.5, 9.0])
+    assert [p.branch_currents["r2"] for p in points] == pytest.approx(
+        [5e-3, 2.5e-3, 1e-3]
+    )
+    assert cache.misses == 1
+    assert cache.hits == 5
+
+
+def test_analysis_errors() -> None:
+    with pytest.raises(CircuitAnalysisError, match="invalid resistance"):
+        DCAnalysis(_compile(DIVIDER_YAML.replace("1kohm", "1kV")))
+    analysis = DCAnalysis(_compile(DIVIDER_YAML))
+    with pytest.raises(CircuitAnalysisError, match="positive resistance"):
+        analysis.solve({"r1": 0.0})
+    with pytest.raises(CircuitAnalysisError, match="no value"):
+        analysis.solve({"missing": 1.0})
+    for value in (float("inf"), float("nan")):
+        with pytest.raises(CircuitAnalysisError, match="finite value"):
+            analysis.solve({"bat": value})
+    with pytest.raises(CircuitAnalysisError, match="invalid voltage"):
+        DCAnalysis(_compile(DIVIDER_YAML.replace("10V", "1e400V")))
+    huge = (
+        DIVIDER_YAML.replace("10V", "1e308V")
+        .replace("1kohm", "1e-300ohm")
+        .replace("1k}", "1e-300}")
+    )
+    with pytest.raises(CircuitAnalysisError, match="no finite DC solution"):
+        DCAnalysis(_compile(huge), cache=FactorizationCache()).solve()
+    with pytest.raises(CircuitAnalysisError, match="no unique DC solution"):
+        analysis.solve({"bat": 1e308, "r1": 1e-300, "r2": 1e-300})
+    # グラウンドも電圧源も無ければ電圧の基準が無い
+    no_source = DIVIDER_YAML.replace("type: battery", "type: resistor").replace(
+        "voltage: 10V", "resistance: 1k"
+    )
+    with pytest.raises(CircuitAnalysisError, match="no ground reference"):
+        DCAnalysis(_compile(no_source))
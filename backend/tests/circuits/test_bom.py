@@ -0,0 +1,73 @@
+import json
+
+from app.circuits.bom import BOMCounter, bom_key, write_csv, write_json
+from app.circuits.compiler import compile_circuit
+from app.circuits.loader import load_circuit_yaml
+from tests.utils.circuit import LED_CIRCUIT_YAML
+
+
+def _compiled(circuit_yaml: str) -> dict:  # type: ignore[type-arg]
+    return compile_circuit(load_circuit_yaml(circuit_yaml)).to_dict()
+
+
+def test_bom_key_normalizes_values() -> None:
+    assert bom_key("Resistor", {"resistance": "4.7k"}) == ("resistor", "4.7kΩ", "")
+    assert bom_key("resistor", {"resistance": "4700ohm", "package": "0603"}) == (
+        "resistor",
+        "4.7kΩ",
+        "0603",
+    )
+    assert bom_key("capacitor", {"capacitance": "0.1u"}) == ("capacitor", "100nF", "")
+    assert bom_key("resistor", {"resistance": "?"}) == ("resistor", "?", "")
+    assert bom_key("ic", {"part_number": "NE555", "footprint": "DIP-8"}) == (
+        "ic",
+        "NE555",
+        "DIP-8",
+    )
+
+
+def test_counts_module_instances() -> None:
+    circuit_yaml = """
+circuit:
+  components:
+    - {id: r0, type: resistor, properties: {resistance: 1000}}
+    - id: m1
+      type: module
+      internal_components:
+        - {id: r, type: resistor, properties: {resistance: 1k}}
+        - id: inner
+          type: module
+          internal_components:
+            - {id: c, type: capacitor, properties: {capacitance: 10u}}
+    - id: m2
+      type: module
+      internal_components:
+        - {id: r, type: resistor, properties: {resistance: 1kohm}}
+"""
+    counter = BOMCounter()
+    counter.add(_compiled(circuit_yaml), multiplicity=3)
+    assert counter.rows() == [
+        ("capacitor", "10µF", "", 3),
+        ("resistor", "1kΩ", "", 9),
+    ]
+
+
+def test_write_csv_and_json() -> None:
+    counter = BOMCounter()
+    counter.add(_compiled(LED_CIRCUIT_YAML))
+    rows = counter.rows()
+    assert "".join(write_csv(rows)).splitlines() == [
+        "type,value,package,quantity",
+        "led,blue,,1",
+        "power_supply,5V,,1",
+        "resistor,220Ω,,1",
+    ]
+    content = json.loads("".join(write_json(rows)))
+    assert content["count"] == 3
+    assert content["data"][2] == {
+        "type": "resistor",
+        "value": "220Ω",
+        "package": "",
+        "quantity": 1,
+    }
+    assert json.loads("".join(write_json([]))) == {"data": [], "count": 0}
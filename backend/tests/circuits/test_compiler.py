@@ -0,0 +1,84 @@
+import pytest
+
+from app.circuits.compiler import CompiledCircuit, PinRef, compile_circuit
+from app.circuits.loader import CircuitYAMLError, load_circuit_yaml
+from tests.utils.circuit import LED_CIRCUIT_YAML
+
+
+def test_compile_circuit() -> None:
+    compiled = compile_circuit(load_circuit_yaml(LED_CIRCUIT_YAML))
+    assert compiled.name == "Complex Circuit with Modules and Branching"
+    assert "led_driver_module_1/resistor_internal_1" in compiled.components
+    # junction と module は部品数に含めない
+    assert compiled.component_count == 3
+    assert compiled.component_types == [
+        "junction",
+        "led",
+        "module",
+        "power_supply",
+        "resistor",
+    ]
+
+
+def test_compile_circuit_module_position_is_absolute() -> None:
+    compiled = compile_circuit(load_circuit_yaml(LED_CIRCUIT_YAML))
+    resistor = compiled.components["led_driver_module_1/resistor_internal_1"]
+    assert resistor.position == (280.0, 120.0)
+    assert resistor.parent == "led_driver_module_1"
+
+
+def test_compile_circuit_nets() -> None:
+    compiled = compile_circuit(load_circuit_yaml(LED_CIRCUIT_YAML))
+    vcc = compiled.net_of[PinRef("power_supply_1", "VCC")]
+    assert compiled.net_of[PinRef("junction_A")] == vcc
+    assert compiled.net_of[PinRef("led_driver_module_1", "input_power")] == vcc
+    assert (
+        compiled.net_of[PinRef("led_driver_module_1/resistor_internal_1", "any")] == vcc
+    )
+    anode = compiled.net_of[PinRef("external_led_1", "anode")]
+    assert anode != vcc
+    assert (
+        compiled.net_of[PinRef("led_driver_module_1/resistor_internal_1", "other")]
+        == anode
+    )
+
+
+def test_compiled_circuit_round_trip() -> None:
+    compiled = compile_circuit(load_circuit_yaml(LED_CIRCUIT_YAML))
+    restored = CompiledCircuit.from_dict(compiled.to_dict())
+    assert restored.to_dict() == compiled.to_dict()
+    assert restored.net_of == compiled.net_of
+
+
+def test_definition_hash_ignores_formatting() -> None:
+    a = compile_circuit(load_circuit_yaml(LED_CIRCUIT_YAML))
+    b = compile_circuit(load_circuit_yaml(LED_CIRCUIT_YAML.replace('"', "")))
+    assert a.definition_hash == b.definition_hash
+
+
+@pytest.mark.parametrize(
+    "circuit_yaml",
+    [
+        "components: []",
+        "circuit:\n  components:\n    - type: resistor\n",
+        "circuit:\n  components:\n    - {id: r1, type: resistor}\n    - {id: r1, type: led}\n",
+        "circuit:\n  components:\n    - {id: r1, type: resistor}\n  connections:\n"
+        "    - from: {component_id: r1}\n      to: {component_id: r2}\n",
+        "circuit:\n  components:\n    - id: r1\n      type: resistor\n"
+        "      properties: {position: {x: a, y: 1}}\n",
+        "circuit:\n  components:\n    - id: r1\n      type: resistor\n"
+        "      properties: {position: {x: .inf, y: 1}}\n",
+        "circuit:\n  components:\n    - id: r1\n      type: resistor\n"
+        "      properties: {position: {x: 0, y: .nan}}\n",
+        "circuit:\n  components:\n    - id: r1\n      type: resistor\n"
+        "      properties: {position: {x: 1e308, y: 0}}\n",
+        "circuit:\n  components:\n    - id: r1\n      type: resistor\n"
+        "      properties: {rotation: .inf}\n",
+        "circuit:\n  components:\n    - id: r1\n      type: resistor\n"
+        "      properties: {rotation: 1e308}\n",
+    ],
+)
+def test_compile_circuit_invalid(circuit_yaml: str) -> None:
+    with pytest.raises(CircuitYAMLError) as exc_info:
+        compile_circuit(load_circuit_yaml(circuit_yaml))
+    assert exc_info.value.status_code == 400
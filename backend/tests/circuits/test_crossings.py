@@ -0,0 +1,40 @@
+import random
+
+from app.circuits.crossings import count_crossings
+
+
+def _brute_force(segments: list) -> int:  # type: ignore[type-arg]
+    total = 0
+    for net_h, (ax, ay), (bx, by) in segments:
+        if ay != by:
+            continue
+        for net_v, (cx, cy), (dx, dy) in segments:
+            if net_h == net_v or cx != dx:
+                continue
+            if min(ax, bx) < cx < max(ax, bx) and min(cy, dy) < ay < max(cy, dy):
+                total += 1
+    return total
+
+
+def test_simple_cases() -> None:
+    cross = [(0, (0, 5), (10, 5)), (1, (5, 0), (5, 10))]
+    assert count_crossings(cross) == 1
+    # 同じネット同士は交差に数えない
+    assert count_crossings([(0, (0, 5), (10, 5)), (0, (5, 0), (5, 10))]) == 0
+    # 端点で接するだけ (T字) は数えない
+    touch = [(0, (0, 5), (10, 5)), (1, (10, 0), (10, 10)), (2, (5, 5), (5, 10))]
+    assert count_crossings(touch) == 0
+    assert count_crossings([]) == 0
+
+
+def test_matches_brute_force() -> None:
+    rnd = random.Random(1)
+    segments = []
+    for i in range(300):
+        a, b = sorted(rnd.sample(range(40), 2))
+        c = rnd.randrange(40)
+        if i % 2:
+            segments.append((i % 5, (c, a), (c, b)))
+        else:
+            segments.append((i % 5, (b, c), (a, c)))
+    assert count_crossings(segments) == _brute_force(segments)
@@ -0,0 +1,117 @@
+from app.circuits.compiler import CompiledCircuit, compile_circuit
+from app.circuits.erc import ERCEngine
+from app.circuits.loader import load_circuit_yaml
+from tests.utils.circuit import LED_CIRCUIT_YAML
+
+BARE_LED_YAML = """
+circuit:
+  components:
+    - {id: bat, type: battery, properties: {voltage: 5V}}
+    - {id: led, type: led}
+  connections:
+    - from: {component_id: bat, terminal: positive}
+      to: {component_id: led, terminal: anode}
+    - from: {component_id: led, terminal: cathode}
+      to: {component_id: bat, terminal: negative}
+"""
+
+# B1- と B2+ が同じネットにある (電源の短絡ではない)
+SERIES_BATTERIES_YAML = """
+circuit:
+  components:
+    - {id: b1, type: battery, properties: {voltage: 1.5V}}
+    - {id: b2, type: battery, properties: {voltage: 1.5V}}
+    - {id: r1, type: resistor}
+  connections:
+    - from: {component_id: b1, terminal: negative}
+      to: {component_id: b2, terminal: positive}
+    - from: {component_id: b1, terminal: positive}
+      to: {component_id: r1, terminal: a}
+    - from: {component_id: r1, terminal: b}
+      to: {component_id: b2, terminal: negative}
+"""
+
+LOGIC_YAML = """
+circuit:
+  components:
+    - id: u1
+      type: ic
+      properties:
+        ports:
+          - {name: out, direction: output}
+          - {name: in, direction: input}
+          - {name: nc}
+    - id: u2
+      type: ic
+      properties:
+        ports: [{name: out, direction: output}, {name: in, direction: input}]
+    - {id: r1, type: resistor}
+  connections:
+    - from: {component_id: u1, terminal: out}
+      to: {component_id: u2, terminal: out}
+    - from: {component_id: u1, terminal: in}
+      to: {component_id: u2, terminal: in}
+    - from: {component_id: r1, terminal: a}
+      to: {component_id: u1, terminal: out}
+"""
+
+
+def _compile(circuit_yaml: str) -> CompiledCircuit:
+    return compile_circuit(load_circuit_yaml(circuit_yaml))
+
+
+def _codes(violations: list) -> list[str]:  # type: ignore[type-arg]
+    return sorted(v.code for v in violations)
+
+
+def test_led_circuit_is_clean() -> None:
+    assert ERCEngine().check(_compile(LED_CIRCUIT_YAML)) == []
+
+
+def test_led_without_resistor() -> None:
+    violations = ERCEngine().check(_compile(BARE_LED_YAML))
+    assert [(v.code, v.component_id) for v in violations] == [
+        ("led_without_resistor", "led")
+    ]
+
+
+def test_shorted_supply() -> None:
+    circuit = _compile(BARE_LED_YAML.replace("terminal: cathode", "terminal: anode"))
+    violations = ERCEngine().check(circuit)
+    assert [(v.code, v.component_id) for v in violations if v.severity == "error"] == [
+        ("shorted_supply", "bat")
+    ]
+
+
+def test_batteries_in_series_are_not_shorted() -> None:
+    circuit = _compile(SERIES_BATTERIES_YAML)
+    assert ERCEngine().check(circuit) == []
+
+
+def test_net_rules() -> None:
+    circuit = _compile(LOGIC_YAML)
+    violations = ERCEngine().check(circuit)
+    assert _codes(violations) == [
+        "floating_input",
+        "output_conflict",
+        "unconnected_pin",
+    ]
+    by_code = {v.code: v for v in violations}
+    assert (
+        by_code["floating_input"].net
+        == circuit.net_of[
+            next(p for p in circuit.net_of if p.component_id == "u1" and p.name == "in")
+        ]
+    )
+
+
+def test_batch_matches_single_checks_and_caches() -> None:
+    circuits = [_compile(y) for y in (LED_CIRCUIT_YAML, BARE_LED_YAML, LOGIC_YAML)]
+    expected = [ERCEngine().check(c) for c in circuits]
+
+    engine = ERCEngine()
+    assert engine.check_many(circuits + circuits[:1]) == expected + expected[:1]
+    assert engine.cache.misses == 4
+    assert len(engine.cache) == 3
+    assert engine.check_many(circuits) == expected
+    assert engine.cache.hits == 3
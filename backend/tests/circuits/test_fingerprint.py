@@ -0,0 +1,59 @@
+from app.circuits.compiler import CompiledCircuit, compile_circuit
+from app.circuits.fingerprint import (
+    MinHashLSHIndex,
+    circuit_fingerprint,
+    estimate_similarity,
+)
+from app.circuits.loader import load_circuit_yaml
+from tests.utils.circuit import LED_CIRCUIT_YAML
+
+
+def _ladder(n: int, part: str = "resistor") -> CompiledCircuit:
+    components = "\n".join(f"    - {{id: r{i}, type: {part}}}" for i in range(n))
+    connections = "\n".join(
+        f"    - from: {{component_id: r{i}, terminal: b}}\n"
+        f"      to: {{component_id: r{i + 1}, terminal: a}}"
+        for i in range(n - 1)
+    )
+    return compile_circuit(
+        load_circuit_yaml(
+            f"circuit:\n  components:\n{components}\n  connections:\n{connections}\n"
+        )
+    )
+
+
+def test_fingerprint_ignores_ids_and_positions() -> None:
+    a = compile_circuit(load_circuit_yaml(LED_CIRCUIT_YAML))
+    renamed = LED_CIRCUIT_YAML.replace("external_led_1", "led_a").replace(
+        "x: 350", "x: 10"
+    )
+    b = compile_circuit(load_circuit_yaml(renamed))
+    assert circuit_fingerprint(a) == circuit_fingerprint(b)
+
+
+def test_fingerprint_similarity_tracks_structure() -> None:
+    base = circuit_fingerprint(_ladder(40))
+    near = circuit_fingerprint(_ladder(41))
+    other = circuit_fingerprint(_ladder(40, part="capacitor"))
+    assert estimate_similarity(base, near) > 0.8
+    assert estimate_similarity(base, other) < 0.2
+
+
+def test_lsh_index_query() -> None:
+    index: MinHashLSHIndex[str] = MinHashLSHIndex()
+    index.insert("ladder40", circuit_fingerprint(_ladder(40)))
+    index.insert("ladder41", circuit_fingerprint(_ladder(41)))
+    index.insert("caps", circuit_fingerprint(_ladder(40, part="capacitor")))
+
+    results = index.query(circuit_fingerprint(_ladder(40)), k=2)
+    assert [key for key, _ in results] == ["ladder40", "ladder41"]
+    assert results[0][1] == 1.0
+
+    results = index.query(
+        circuit_fingerprint(_ladder(40)), k=2, accept=lambda key: key != "ladder40"
+    )
+    assert [key for key, _ in results] == ["ladder41"]
+
+    index.remove("ladder41")
+    assert "ladder41" not in index
+    assert len(index) == 2
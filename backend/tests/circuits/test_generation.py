@@ -0,0 +1,161 @@
+import asyncio
+
+import pytest
+
+from app.circuits import generation
+from app.circuits.engines import TextAIEngine
+from app.circuits.generation import (
+    GeneratedCircuit,
+    GenerationError,
+    StreamValidator,
+    generate_from_text,
+    repair_circuit,
+)
+from app.circuits.loader import load_circuit_yaml
+from tests.utils.engines import ScriptedEngine
+
+VALID = """\
+circuit:
+  name: divider
+  components:
+    - id: r1
+      type: resistor
+    - id: r2
+      type: resistor
+  connections:
+    - from: { component_id: r1, terminal: b }
+      to: { component_id: r2, terminal: a }
+"""
+
+
+def _generate(engine: TextAIEngine, max_reprompts: int = 1) -> GeneratedCircuit:
+    return asyncio.run(
+        generate_from_text(engine, "voltage divider", max_reprompts=max_reprompts)
+    )
+
+
+def test_stream_validator_checks_closed_items_only() -> None:
+    validator = StreamValidator()
+    assert validator.feed("circuit:\n  components:\n    - id: r1\n")
+    # type がまだ届いていない最後の部品は誤りにしない
+    assert validator.feed("      properties: {}\n")
+    assert validator.feed("      type: resistor\n    - id: r2\n")
+    assert not validator.feed("    - id: r3\n      type: led\n")
+    assert validator.error == "Component 'r2' has no 'type'."
+    assert validator.section == "components"
+
+
+def test_stream_validator_aborts_on_syntax_error() -> None:
+    validator = StreamValidator()
+    text = VALID.replace("    - id: r2", "    - id: [r2\n    - id: r3")
+    ok = True
+    for line in text.splitlines(keepends=True):
+        ok = validator.feed(line)
+        if not ok:
+            break
+    assert not ok and validator.error and "YAML parsing error" in validator.error
+    assert validator.document is not None
+
+
+def test_stream_validator_ignores_text_around_code_block() -> None:
+    validator = StreamValidator()
+    validator.feed(f"Here is the circuit:\n```yaml\n{VALID}```\nEnjoy!")
+    validator.close()
+    assert validator.error is None
+    assert validator.text == VALID
+
+
+def test_stream_validator_cost_is_linear_in_output(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    parsed: list[int] = []
+
+    def counting_load(text: str, *args: object) -> dict[str, object]:
+        parsed.append(len(text))
+        return load_circuit_yaml(text, *args)  # type: ignore[arg-type]
+
+    monkeypatch.setattr(generation, "load_circuit_yaml", counting_load)
+    text = "circuit:\n  components:\n" + "".join(
+        f"    - id: r{i}\n      type: resistor\n" for i in range(2000)
+    )
+    validator = StreamValidator()
+    for line in text.splitlines(keepends=True):
+        assert validator.feed(line)
+    validator.close()
+    assert validator.error is None and validator.components == 2000
+    # 毎回先頭から読み込むと出力の長さの2乗 (ここでは約1000倍) になる
+    assert sum(parsed) < 8 * len(text)
+
+
+def test_repair_circuit() -> None:
+    document = load_circuit_yaml(
+        VALID.replace("id: r2", "id: r1").replace(
+            "  connections:\n",
+            "  connections:\n"
+            "    - from: { component_id: r1 }\n"
+            "      to: { component_id: ghost }\n",
+        )
+    )
+    assert repair_circuit(document) == [
+        "Renamed duplicate component id 'r1' to 'r1_2'.",
+        "Dropped connection with dangling endpoint 'ghost'.",
+    ]
+    assert [c["id"] for c in document["circuit"]["components"]] == ["r1", "r1_2"]
+    assert len(document["circuit"]["connections"]) == 1
+
+
+def test_generate_valid_output() -> None:
+    engine = ScriptedEngine(f"```yaml\n{VALID}```\n")
+    generated = _generate(engine)
+    assert generated.circuit_yaml == VALID
+    assert generated.repairs == [] and generated.reprompts == 0
+    assert len(engine.prompts) == 1 and "Request: voltage divider" in engine.prompts[0]
+
+
+def test_generate_repairs_without_reprompt() -> None:
+    engine = ScriptedEngine(
+        VALID
+        + "    - from: { component_id: r2, terminal: b }\n"
+        + "      to: { component_id: r9, terminal: a }\n"
+    )
+    generated = _generate(engine)
+    assert generated.repairs == ["Dropped connection with dangling endpoint 'r9'."]
+    assert len(generated.compiled.connections) == 1
+    assert len(engine.prompts) == 1
+
+
+def test_generate_aborts_early_and_reprompts_broken_section() -> None:
+    broken = VALID.replace("      type: resistor\n    - id: r2", "    - id: r2") + (
+        "    - from: { component_id: r1, terminal: a }\n" * 50
+    )
+    engine = ScriptedEngine(
+        broken,
+        "components:\n  - {id: r1, type: resistor}\n  - {id: r2, type: resistor}\n",
+    )
+    generated = _generate(engine)
+    # 2つ目の部品の行で打ち切り、残りの出力は受け取らない
+    assert engine.sent < 10 and engine.closed == 2
+    assert "`components`, `connections`" in engine.prompts[1]
+    assert "Component 'r1' has no 'type'." in engine.prompts[1]
+    assert generated.reprompts == 1
+    assert sorted(generated.compiled.components) == ["r1", "r2"]
+
+
+def test_generate_reprompts_connections_only() -> None:
+    engine = ScriptedEngine(
+        VALID.replace("terminal: b }", "terminal: b, extra: [ }"),
+        "connections:\n"
+        "  - from: {component_id: r1, terminal: b}\n"
+        "    to: {component_id: r2, terminal: a}\n",
+    )
+    generated = _generate(engine)
+    assert "`connections` lists" in engine.prompts[1]
+    assert "id: r2" in engine.prompts[1]
+    assert len(generated.compiled.connections) == 1
+
+
+def test_generate_gives_up() -> None:
+    engine = ScriptedEngine("circuit: [1, 2]\n", "nothing useful\n")
+    with pytest.raises(GenerationError):
+        _generate(engine)
+    assert len(engine.prompts) == 2
@@ -0,0 +1,109 @@
+import asyncio
+import math
+from collections.abc import Iterator
+
+import pytest
+
+from app.circuits.admission import AdmissionController, admission_controllers
+from app.circuits.engines import EngineError
+from app.circuits.hedging import HedgeBudget, HedgePolicy, generate_hedged
+from tests.utils.engines import FakeClock, LatencyEngine, lognormal
+
+CIRCUIT = """\
+circuit:
+  components:
+    - {id: r1, type: resistor}
+    - {id: r2, type: resistor}
+  connections:
+    - from: {component_id: r1, terminal: b}
+      to: {component_id: r2, terminal: a}
+"""
+
+
+@pytest.fixture(autouse=True)
+def _admission() -> Iterator[None]:
+    for name in ("primary", "secondary"):
+        admission_controllers[name] = AdmissionController(8, 8, 1.0, 1000.0, 1000)
+    yield
+    for name in ("primary", "secondary"):
+        del admission_controllers[name]
+
+
+def _run(primary: LatencyEngine, secondary: LatencyEngine, policy: HedgePolicy) -> str:
+    async def main() -> str:
+        generated = await asyncio.wait_for(
+            generate_hedged(primary, secondary, "divider", policy=policy), timeout=10
+        )
+        return generated.engine
+
+    return asyncio.run(main())
+
+
+def test_hedge_budget() -> None:
+    budget = HedgeBudget(0.25, burst=1.0)
+    spent = 0
+    for _ in range(20):
+        budget.request()
+        spent += budget.spend()
+    assert spent == 5 and budget.hedged == 5
+
+
+def test_fast_primary_is_not_hedged() -> None:
+    primary = LatencyEngine("primary", CIRCUIT, lambda: 0.0)
+    secondary = LatencyEngine("secondary", CIRCUIT, lambda: 0.0)
+    policy = HedgePolicy(ratio=1.0, default_delay=10.0)
+    assert _run(primary, secondary, policy) == "primary"
+    assert secondary.calls == 0 and policy.budget.hedged == 0
+
+
+def test_slow_primary_is_hedged_and_cancelled() -> None:
+    # 主エンジンは取り消されるまで応答しない
+    primary = LatencyEngine("primary", CIRCUIT, lambda: math.inf)
+    secondary = LatencyEngine("secondary", CIRCUIT, lambda: 0.0)
+    policy = HedgePolicy(ratio=1.0, default_delay=0.02)
+    assert _run(primary, secondary, policy) == "secondary"
+    assert primary.cancelled == 1 and primary.completed == 0
+    assert policy.won == 1
+
+
+def test_no_hedge_without_budget() -> None:
+    # 予算が無ければ、遅い主エンジンでも副エンジンに送らない
+    primary = LatencyEngine("primary", CIRCUIT, lambda: 0.05)
+    secondary = LatencyEngine("secondary", CIRCUIT, lambda: 0.0)
+    policy = HedgePolicy(ratio=0.5, default_delay=0.0)
+    assert _run(primary, secondary, policy) == "primary"
+    assert secondary.calls == 0
+
+
+def test_secondary_wins_when_primary_fails() -> None:
+    # 主エンジンは副エンジンにヘッジしてから失敗する
+    secondary = LatencyEngine("secondary", CIRCUIT, lambda: 0.0)
+    primary = LatencyEngine(
+        "primary", CIRCUIT, lambda: 0.0, fail=True, gate=secondary.called
+    )
+    policy = HedgePolicy(ratio=1.0, default_delay=0.01)
+    assert _run(primary, secondary, policy) == "secondary"
+
+    primary = LatencyEngine("primary", CIRCUIT, lambda: 0.0, fail=True)
+    with pytest.raises(EngineError):
+        _run(primary, secondary, policy)
+
+
+def test_hedging_cuts_tail_latency_within_budget() -> None:
+    # 最初の部品までの時間は仮の時計で測る。主エンジンは1割のリクエストで
+    # 取り消されるまで応答せず、それ以外はすぐに応答する
+    clock = FakeClock()
+    fast = lognormal(0.1, 0.3, seed=1)
+    slow = [i % 10 == 9 for i in range(40)]
+    draws = iter([math.inf if s else fast() for s in slow])
+    primary = LatencyEngine("primary", CIRCUIT, lambda: next(draws), clock=clock)
+    secondary = LatencyEngine(
+        "secondary", CIRCUIT, lognormal(0.2, 0.3, seed=2), clock=clock
+    )
+    policy = HedgePolicy(ratio=0.2, default_delay=0.1, clock=clock)
+
+    engines = [_run(primary, secondary, policy) for _ in range(40)]
+    assert policy.budget.hedged <= 0.2 * 40 + 1
+    # 遅いリクエストはすべて副エンジンにヘッジされて、副エンジンが返す
+    assert all(e == "secondary" for e, s in zip(engines, slow, strict=True) if s)
+    assert policy.won >= 4 and primary.cancelled >= 4
@@ -0,0 +1,223 @@
+import json
+import random
+import re
+from unittest.mock import patch
+
+from app.circuits.compiler import PinRef, compile_circuit
+from app.circuits.layout import (
+    Box,
+    Layout,
+    compute_layout,
+    layout_pool,
+    layout_variant,
+)
+from app.circuits.loader import load_circuit_yaml
+from app.core.config import settings
+from tests.utils.circuit import LED_CIRCUIT_YAML, grid_circuit_yaml
+
+
+def test_layout_uses_positions_and_wraps_modules() -> None:
+    layout = compute_layout(compile_circuit(load_circuit_yaml(LED_CIRCUIT_YAML)))
+    components = {c.id: c for c in layout.components}
+    assert (components["external_led_1"].x, components["external_led_1"].y) == (
+        350.0,
+        150.0,
+    )
+    # モジュールの枠は内部部品を囲む
+    module = components["led_driver_module_1"].box
+    inner = components["led_driver_module_1/resistor_internal_1"].box
+    assert module.x0 < inner.x0 and inner.x1 < module.x1
+    assert layout.components[0].kind == "module"
+    # モジュール内部の接続は、そのモジュールに属するワイヤーになる
+    assert {w.owner for w in layout.wires} == {None, "led_driver_module_1"}
+    assert all(len(w.points) >= 2 for w in layout.wires)
+
+
+def test_layout_places_unpositioned_components() -> None:
+    circuit_yaml = grid_circuit_yaml(4, 1).replace(
+        ", properties: {position: {x: 300, y: 0}}", ""
+    )
+    layout = compute_layout(compile_circuit(load_circuit_yaml(circuit_yaml)))
+    components = {c.id: c for c in layout.components}
+    assert (components["r0_0"].x, components["r0_0"].y) == (0.0, 0.0)
+    moved = components["r3_0"]
+    assert all(
+        not moved.box.intersects(c.box) for id, c in components.items() if id != "r3_0"
+    )
+    assert PinRef("r3_0", "a") in layout.pins
+
+
+def _chain_yaml(n: int) -> str:
+    """電源から抵抗を直列に繋いだ回路。部品は逆順に定義し、奇数番目は端子を逆に繋ぐ"""
+    components = [f"    - {{id: r{i}, type: resistor}}" for i in reversed(range(n))]
+    components.append("    - {id: bat, type: battery}")
+    ends = [("bat", "positive")]
+    for i in range(n):
+        a, b = ("b", "a") if i % 2 else ("a", "b")
+        ends += [(f"r{i}", a), (f"r{i}", b)]
+    ends.append(("bat", "negative"))
+    connections = [
+        f"    - {{from: {{component_id: {s}, terminal: {st}}}, "
+        f"to: {{component_id: {t}, terminal: {tt}}}}}"
+        for (s, st), (t, tt) in zip(ends[::2], ends[1::2], strict=True)
+    ]
+    return (
+        "circuit:\n  components:\n"
+        + "\n".join(components)
+        + "\n  connections:\n"
+        + "\n".join(connections)
+        + "\n"
+    )
+
+
+def test_grid_placement_is_deterministic_and_packed() -> None:
+    circuit = compile_circuit(load_circuit_yaml(_chain_yaml(30)))
+    layout = compute_layout(circuit)
+    assert layout == compute_layout(circuit)
+    components = layout.components
+    for i, a in enumerate(components):
+        assert all(not a.box.intersects(b.box) for b in components[i + 1 :])
+    # 電源から接続順に、左上から詰める
+    by_id = {c.id: c for c in components}
+    assert (by_id["bat"].x, by_id["bat"].y) == min((c.x, c.y) for c in components)
+    assert by_id["r0"].y == by_id["bat"].y and by_id["r0"].x > by_id["bat"].x
+    assert layout.bounds.width < 3 * layout.bounds.height
+
+
+def test_grid_placement_faces_connected_pins() -> None:
+    circuit = compile_circuit(load_circuit_yaml(_chain_yaml(30)))
+    layout = compute_layout(circuit)
+    rotated = {c.id for c in layout.components if c.rotation == 180}
+    assert rotated
+    for component in layout.components:
+        if component.kind != "resistor":
+            continue
+        a, b = (layout.pins[PinRef(component.id, name)] for name in ("a", "b"))
+        # 回転後の端子の位置が、向きを表す
+        left, right = ("a", "b") if a[0] < b[0] else ("b", "a")
+        assert (left == "a") == (component.id not in rotated)
+
+
+def test_grid_placement_packs_modules_as_blocks() -> None:
+    circuit_yaml = LED_CIRCUIT_YAML
+    for position in ("{ x: 50, y: 50 }", "{ x: 150, y: 70 }", "{ x: 250, y: 100 }"):
+        circuit_yaml = circuit_yaml.replace(f"position: {position}", "")
+    circuit_yaml = circuit_yaml.replace("position: { x: 30, y: 20 }", "")
+    layout = compute_layout(compile_circuit(load_circuit_yaml(circuit_yaml)))
+    components = {c.id: c for c in layout.components}
+    module = components["led_driver_module_1"].box
+    for id, c in components.items():
+        if id.startswith("led_driver_module_1/"):
+            assert module.x0 < c.box.x0 and c.box.x1 < module.x1
+        elif id != "led_driver_module_1":
+            assert not module.intersects(c.box)
+
+
+def test_force_placement() -> None:
+    circuit = compile_circuit(load_circuit_yaml(_chain_yaml(5)))
+    layout = compute_layout(circuit, "force")
+    assert all(c.rotation == 0 for c in layout.components)
+    assert len(layout.components) == 6
+
+
+def _islands_yaml(rows: int, columns: int) -> str:
+    """位置指定のない、互いに接続のない抵抗の列を `rows` 本並べた回路"""
+    return re.sub(
+        r", properties: \{position: [^}]*\}\}", "", grid_circuit_yaml(columns, rows)
+    )
+
+
+def _assert_islands_apart(layout: Layout) -> None:
+    rows: dict[str, list[Box]] = {}
+    for c in layout.components:
+        rows.setdefault(c.id.split("_")[1], []).append(c.box)
+    boxes = [Box.union(b) for b in rows.values()]
+    for i, a in enumerate(boxes):
+        assert all(not a.intersects(b) for b in boxes[i + 1 :])
+
+
+def test_islands_are_laid_out_separately_and_packed() -> None:
+    circuit = compile_circuit(load_circuit_yaml(_islands_yaml(6, 4)))
+    layout = compute_layout(circuit)
+    assert len(layout.components) == 24
+    _assert_islands_apart(layout)
+    # ワイヤーは元の回路のネットの番号を持つ
+    for wire in layout.wires:
+        net = circuit.nets[wire.net_id]
+        assert wire.points[0] in {layout.pins[p] for p in net.pins}
+
+    # 位置指定のある島はそのままの位置に置き、ほかの島はその右側に詰める
+    circuit_yaml = _islands_yaml(3, 4).replace(
+        "{id: r0_0, type: resistor}",
+        "{id: r0_0, type: resistor, properties: {position: {x: 0, y: 500}}}",
+    )
+    layout = compute_layout(compile_circuit(load_circuit_yaml(circuit_yaml)))
+    components = {c.id: c for c in layout.components}
+    assert (components["r0_0"].x, components["r0_0"].y) == (0.0, 500.0)
+    anchored = Box.union(c.box for id, c in components.items() if id.endswith("_0"))
+    assert all(c.box.x0 > anchored.x1 for id, c in components.items() if "_0" not in id)
+
+
+def test_islands_in_processes_match_serial_layout() -> None:
+    circuit = compile_circuit(load_circuit_yaml(_islands_yaml(5, 6)))
+    serial = compute_layout(circuit, minimize_crossings=True)
+    with (
+        patch.object(settings, "CIRCUIT_LAYOUT_PROCESSES", 2),
+        patch.object(settings, "CIRCUIT_LAYOUT_PARALLEL_MIN_COMPONENTS", 0),
+    ):
+        try:
+            parallel = compute_layout(circuit, minimize_crossings=True)
+            assert layout_pool.executor() is not None
+        finally:
+            layout_pool.shutdown()
+    assert parallel.to_dict() == serial.to_dict()
+
+
+def _random_yaml(n: int, m: int, seed: int = 0) -> str:
+    rnd = random.Random(seed)
+    components = [f"    - {{id: r{i}, type: resistor}}" for i in range(n)]
+    connections = []
+    for _ in range(m):
+        a, b = rnd.sample(range(n), 2)
+        connections.append(
+            f"    - {{from: {{component_id: r{a}, terminal: {rnd.choice('ab')}}}, "
+            f"to: {{component_id: r{b}, terminal: {rnd.choice('ab')}}}}}"
+        )
+    return (
+        "circuit:\n  components:\n"
+        + "\n".join(components)
+        + "\n  connections:\n"
+        + "\n".join(connections)
+        + "\n"
+    )
+
+
+def test_minimize_crossings() -> None:
+    circuit = compile_circuit(load_circuit_yaml(_random_yaml(40, 30)))
+    plain = compute_layout(circuit)
+    assert plain.metadata == {}
+    layout = compute_layout(circuit, minimize_crossings=True)
+    assert layout.metadata["crossings_before"] == plain.crossings()
+    assert layout.metadata["crossings_after"] == layout.crossings()
+    assert layout.crossings() < plain.crossings()
+    components = layout.components
+    for i, a in enumerate(components):
+        assert all(not a.box.intersects(b.box) for b in components[i + 1 :])
+
+
+def test_minimize_crossings_respects_time_budget() -> None:
+    circuit = compile_circuit(load_circuit_yaml(_random_yaml(40, 30)))
+    layout = compute_layout(circuit, minimize_crossings=True, time_budget=0)
+    assert layout.crossings() == compute_layout(circuit).crossings()
+
+
+def test_layout_round_trips_through_json() -> None:
+    circuit = compile_circuit(load_circuit_yaml(LED_CIRCUIT_YAML))
+    layout = compute_layout(circuit, minimize_crossings=True)
+    restored = Layout.from_dict(json.loads(json.dumps(layout.to_dict())))
+    assert restored.components == layout.components
+    assert restored.wires == layout.wires
+    assert restored.pins == layout.pins
+    assert restored.bounds == layout.bounds
+    assert restored.metadata == layout.metadata
+    assert layout_variant("grid", False) != layout_variant("grid", True)
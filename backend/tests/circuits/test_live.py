@@ -0,0 +1,199 @@
+import asyncio
+from typing import Any
+
+import pytest
+
+from app.circuits import live
+from app.circuits.compiler import CompiledCircuit
+from app.circuits.live import (
+    CheckpointConflict,
+    LiveEditError,
+    LiveSession,
+    apply_operation,
+)
+from app.circuits.loader import load_circuit_yaml
+from tests.utils.circuit import LED_CIRCUIT_YAML
+
+
+class FakeViewer:
+    def __init__(self) -> None:
+        self.messages: list[dict[str, Any]] = []
+
+    async def send_json(self, data: Any) -> None:
+        self.messages.append(data)
+
+
+def test_apply_operation() -> None:
+    document = load_circuit_yaml(LED_CIRCUIT_YAML)
+    apply_operation(
+        document, {"op": "move", "id": "external_led_1", "x": 400, "y": 160}
+    )
+    apply_operation(
+        document,
+        {
+            "op": "set",
+            "id": "led_driver_module_1/resistor_internal_1",
+            "property": "resistance",
+            "value": "330ohm",
+        },
+    )
+    apply_operation(
+        document,
+        {
+            "op": "add",
+            "component": {"id": "r2", "type": "resistor"},
+            "connections": [
+                {
+                    "from": {"component_id": "r2", "terminal": "a"},
+                    "to": {"component_id": "junction_A", "terminal": "any"},
+                }
+            ],
+        },
+    )
+    apply_operation(document, {"op": "remove", "id": "junction_A"})
+
+    circuit = document["circuit"]
+    ids = [c["id"] for c in circuit["components"]]
+    assert ids == ["power_supply_1", "led_driver_module_1", "external_led_1", "r2"]
+    assert circuit["components"][2]["properties"]["position"] == {"x": 400, "y": 160}
+    module = circuit["components"][1]
+    assert module["internal_components"][0]["properties"]["resistance"] == "330ohm"
+    assert all(
+        "junction_A" not in (conn["from"]["component_id"], conn["to"]["component_id"])
+        for conn in circuit["connections"]
+    )
+
+    for operation in (
+        {"op": "rotate", "id": "r2"},
+        {"op": "move", "id": "missing", "x": 0, "y": 0},
+        {"op": "move", "id": "r2", "x": "left", "y": 0},
+        {"op": "set", "id": "r2"},
+        {"op": "move", "id": "r2", "x": "inf", "y": 0},
+        {"op": "move", "id": "r2", "x": 0, "y": float("nan")},
+        {"op": "add", "component": {"id": "r2", "type": "resistor"}},
+        {"op": "add", "component": {"id": 5, "type": "resistor"}},
+        {"op": "add", "component": {"id": "r9", "type": "resistor"}, "connections": 5},
+    ):
+        with pytest.raises(LiveEditError):
+            apply_operation(document, operation)
+
+
+def test_live_session_broadcasts_patches_and_batches_checkpoints(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(live, "CHECKPOINT_EDITS", 2)
+    saved: list[tuple[str, dict[str, Any], CompiledCircuit]] = []
+
+    async def checkpoint(
+        circuit_yaml: str,
+        document: dict[str, Any],
+        compiled: CompiledCircuit,
+        revision: int,
+    ) -> int:
+        saved.append((circuit_yaml, document, compiled))
+        return revision + 1
+
+    async def scenario() -> tuple[FakeViewer, FakeViewer]:
+        session = LiveSession(load_circuit_yaml(LED_CIRCUIT_YAML), checkpoint)
+        editor, viewer = FakeViewer(), FakeViewer()
+        await session.join(editor)
+        await session.join(viewer)
+        move = {"op": "move", "id": "external_led_1", "x": 400, "y": 150}
+        await session.edit(editor, move)
+        await session.edit(editor, {"op": "remove", "id": "missing"})
+        assert saved == []
+        await session.edit(editor, {**move, "x": 420})
+        assert len(saved) == 1
+        await session.edit(editor, {**move, "x": 440})
+        assert not await session.leave(editor)
+        assert await session.leave(viewer)
+        assert len(saved) == 2
+        return editor, viewer
+
+    editor, viewer = asyncio.run(scenario())
+    assert [m["type"] for m in viewer.messages] == ["snapshot", *["patch"] * 3]
+    assert [m["type"] for m in editor.messages] == [
+        "snapshot",
+        "patch",
+        "error",
+        "patch",
+        "patch",
+    ]
+    patch = viewer.messages[1]
+    assert patch["version"] == 1
+    # 動かした部品とその配線だけが変わる
+    assert "component:external_led_1" in patch["upsert"]
+    assert "component:power_supply_1" not in patch["upsert"]
+    assert all(key.startswith(("component:", "wire:")) for key in patch["upsert"])
+    assert patch["remove"] == []
+    assert "viewBox" in patch
+
+
+def test_live_session_reloads_on_conflict_and_survives_failed_saves(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(live, "CHECKPOINT_EDITS", 1)
+    stored = load_circuit_yaml(LED_CIRCUIT_YAML)
+    stored["circuit"]["components"][-1]["properties"]["color"] = "green"
+    failures: list[Exception] = [
+        RuntimeError("database is down"),
+        CheckpointConflict(stored, 5),
+    ]
+
+    async def checkpoint(
+        _circuit_yaml: str,
+        _document: dict[str, Any],
+        _compiled: CompiledCircuit,
+        _revision: int,
+    ) -> int:
+        raise failures.pop(0)
+
+    async def scenario() -> FakeViewer:
+        session = LiveSession(load_circuit_yaml(LED_CIRCUIT_YAML), checkpoint)
+        viewer = FakeViewer()
+        await session.join(viewer)
+        move = {"op": "move", "id": "external_led_1", "x": 400, "y": 150}
+        # 保存に失敗しても編集は残り、次の保存でもう一度試す
+        await session.edit(viewer, move)
+        assert session.pending == 1
+        # 別の所で保存されていれば、未保存の編集を捨てて読み込み直す
+        await session.edit(viewer, {**move, "x": 420})
+        assert (session.revision, session.pending) == (5, 0)
+        assert session.document == stored
+        assert await session.leave(viewer)
+        return viewer
+
+    viewer = asyncio.run(scenario())
+    assert [m["type"] for m in viewer.messages] == [
+        "snapshot",
+        "patch",
+        "error",
+        "patch",
+        "error",
+        "snapshot",
+    ]
+    assert viewer.messages[-1]["version"] == 3
+
+
+def test_closed_live_session_rejects_joiners() -> None:
+    async def checkpoint(
+        _circuit_yaml: str,
+        _document: dict[str, Any],
+        _compiled: CompiledCircuit,
+        revision: int,
+    ) -> int:
+        return revision
+
+    async def scenario() -> tuple[bool, bool, LiveSession, FakeViewer]:
+        session = LiveSession(load_circuit_yaml(LED_CIRCUIT_YAML), checkpoint)
+        leaving, joining = FakeViewer(), FakeViewer()
+        await session.join(leaving)
+        # 最後のクライアントが抜ける間に、セッションを取得済みのクライアントが参加する
+        left, joined = await asyncio.gather(
+            session.leave(leaving), session.join(joining)
+        )
+        return left, joined, session, joining
+
+    left, joined, session, joining = asyncio.run(scenario())
+    assert left and not joined
+    assert session.closed and not session.viewers and not joining.messages
@@ -0,0 +1,77 @@
+import pytest
+
+from app.circuits.loader import CircuitYAMLError, YAMLLimits, load_circuit_yaml
+
+LIMITS = YAMLLimits(max_bytes=4096, max_nodes=200, max_depth=8, max_aliases=10)
+
+SIMPLE_YAML = """
+circuit:
+  name: "Simple LED Circuit"
+  components:
+    - id: "battery_1"
+      type: "battery"
+      properties:
+        voltage: "1.5V"
+"""
+
+
+def test_load_circuit_yaml() -> None:
+    data = load_circuit_yaml(SIMPLE_YAML, LIMITS)
+    assert data["circuit"]["components"][0]["id"] == "battery_1"
+
+
+def test_load_circuit_yaml_accepts_bytes() -> None:
+    data = load_circuit_yaml(SIMPLE_YAML.encode(), LIMITS)
+    assert data["circuit"]["name"] == "Simple LED Circuit"
+
+
+def test_load_circuit_yaml_too_large() -> None:
+    with pytest.raises(CircuitYAMLError) as exc_info:
+        load_circuit_yaml("a: " + "x" * 5000, LIMITS)
+    assert exc_info.value.status_code == 413
+
+
+def test_load_circuit_yaml_alias_bomb() -> None:
+    bomb = "a: &a [x, x, x, x, x, x, x, x, x]\n"
+    for i in range(1, 9):
+        prev = chr(ord("a") + i - 1)
+        name = chr(ord("a") + i)
+        bomb += f"{name}: &{name} [*{prev}, *{prev}, *{prev}, *{prev}, *{prev}]\n"
+    with pytest.raises(CircuitYAMLError) as exc_info:
+        load_circuit_yaml(bomb, YAMLLimits(4096, 200, 8, 100))
+    assert exc_info.value.status_code == 413
+
+
+def test_load_circuit_yaml_too_many_aliases() -> None:
+    doc = "a: &a x\nb: [" + ", ".join(["*a"] * 11) + "]\n"
+    with pytest.raises(CircuitYAMLError) as exc_info:
+        load_circuit_yaml(doc, LIMITS)
+    assert exc_info.value.status_code == 413
+
+
+def test_load_circuit_yaml_too_deep() -> None:
+    with pytest.raises(CircuitYAMLError) as exc_info:
+        load_circuit_yaml("a: " + "[" * 20 + "]" * 20, LIMITS)
+    assert exc_info.value.status_code == 400
+
+
+def test_load_circuit_yaml_invalid_syntax() -> None:
+    with pytest.raises(CircuitYAMLError) as exc_info:
+        load_circuit_yaml("a: [1, 2", LIMITS)
+    assert exc_info.value.status_code == 400
+    assert "YAML parsing error" in str(exc_info.value)
+
+
+def test_load_circuit_yaml_rejects_non_mapping_root() -> None:
+    with pytest.raises(CircuitYAMLError):
+        load_circuit_yaml("- a\n- b\n", LIMITS)
+
+
+def test_load_circuit_yaml_rejects_multiple_documents() -> None:
+    with pytest.raises(CircuitYAMLError):
+        load_circuit_yaml("a: 1\n---\nb: 2\n", LIMITS)
+
+
+def test_load_circuit_yaml_rejects_unsafe_tags() -> None:
+    with pytest.raises(CircuitYAMLError):
+        load_circuit_yaml("a: !!python/object/apply:os.system ['true']\n", LIMITS)
@@ -0,0 +1,152 @@
+import asyncio
+import threading
+
+from app.circuits.compiler import compile_circuit
+from app.circuits.generation import StreamValidator
+from app.circuits.layout import layout_cache
+from app.circuits.loader import load_circuit_yaml
+from app.circuits.preview import FrameBudget, PreviewRenderer, compile_partial
+
+LINES = [
+    "circuit:\n",
+    "  components:\n",
+    "    - {id: r1, type: resistor}\n",
+    "    - {id: r2, type: resistor}\n",
+    "    - {id: r3, type: resistor}\n",
+    "    - {id: r4, type: resistor}\n",
+    "  connections:\n",
+    "    - from: {component_id: r1, terminal: b}\n",
+    "      to: {component_id: r2, terminal: a}\n",
+    "    - from: {component_id: r2, terminal: b}\n",
+    "      to: {component_id: r4, terminal: a}\n",
+]
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_compile_partial() -> None:
+    document = load_circuit_yaml("".join(LINES))
+    compiled = compile_partial(document, closed=2)
+    assert compiled is not None
+    assert list(compiled.components) == ["r1", "r2"]
+    # まだ届いていない r4 への接続は描かない
+    assert len(compiled.connections) == 1
+
+    broken = {"circuit": {**document["circuit"], "connections": [{"from": 1}]}}
+    compiled = compile_partial(broken)
+    assert compiled is not None and not compiled.connections
+    assert compile_partial({"circuit": {"components": [{"id": "x"}]}}) is None
+    assert compile_partial({"circuit": {}}) is None
+
+
+def test_preview_frames_are_incremental_and_throttled() -> None:
+    clock = FakeClock()
+    renderer = PreviewRenderer(frame_interval=1.0, clock=clock)
+    validator = StreamValidator()
+    frames = []
+    for line in LINES:
+        validator.feed(line)
+        frame = renderer.update(validator)
+        if frame is not None:
+            frames.append(frame)
+        clock.now += 0.6
+
+    assert frames[0]["type"] == "snapshot" and "<svg" in frames[0]["svg"]
+    assert all(f["type"] == "patch" for f in frames[1:])
+    assert renderer.skipped > 0 and renderer.frames == len(frames)
+
+
+def _positions(renderer: PreviewRenderer) -> dict[str, tuple[float, float]]:
+    assert renderer.layout is not None
+    return {c.id: (c.x, c.y) for c in renderer.layout.components}
+
+
+def test_preview_keeps_placed_components() -> None:
+    renderer = PreviewRenderer(frame_interval=0.0)
+    validator = StreamValidator()
+    for line in LINES[:4]:
+        validator.feed(line)
+    renderer.update(validator)
+    placed = _positions(renderer)
+    for line in LINES[4:]:
+        validator.feed(line)
+    frame = renderer.update(validator)
+    assert frame is not None and frame["type"] == "patch"
+    assert "component:r3" in frame["upsert"] and "component:r1" not in frame["upsert"]
+    after = _positions(renderer)
+    assert all(after[id] == xy for id, xy in placed.items())
+
+
+def test_preview_ignores_unchanged_and_slower_source() -> None:
+    renderer = PreviewRenderer(frame_interval=0.0)
+    leader, follower = StreamValidator(), StreamValidator()
+    for line in LINES[:5]:
+        leader.feed(line)
+    for line in LINES[:4]:
+        follower.feed(line)
+    assert renderer.update(leader) is not None
+    assert renderer.update(leader) is None
+    assert renderer.update(follower) is None
+
+
+def test_preview_finish_fills_layout_cache() -> None:
+    layout_cache.clear()
+    renderer = PreviewRenderer(frame_interval=0.0)
+    validator = StreamValidator()
+    for line in LINES:
+        validator.feed(line)
+        renderer.update(validator)
+    validator.close()
+    compiled = compile_circuit(load_circuit_yaml("".join(LINES)))
+    frame = renderer.finish(compiled)
+    assert frame["type"] == "patch"
+    assert len(layout_cache) == 1
+
+
+def test_preview_budget_is_shared_across_renderers() -> None:
+    clock = FakeClock()
+    budget = FrameBudget(load=0.5, window=1.0, clock=clock)
+    budget.spend(0.6)
+    validator = StreamValidator()
+    for line in LINES:
+        validator.feed(line)
+    # 別のリクエストの描画で使い切っていれば描かない
+    renderer = PreviewRenderer(frame_interval=0.0, clock=clock, budget=budget)
+    assert renderer.update(validator) is None and renderer.skipped == 1
+    clock.now += 1.5
+    assert renderer.update(validator) is not None
+
+
+def test_preview_submit_renders_in_thread_and_skips_while_in_flight() -> None:
+    renderer = PreviewRenderer(frame_interval=0.0)
+    gate = threading.Event()
+    render_threads = []
+    frame = renderer._frame
+
+    def slow_frame(layout):  # type: ignore[no-untyped-def]
+        render_threads.append(threading.current_thread())
+        gate.wait(5)
+        return frame(layout)
+
+    renderer._frame = slow_frame  # type: ignore[method-assign]
+    validator = StreamValidator()
+    sent: list[dict] = []
+
+    async def main() -> None:
+        for line in LINES:
+            validator.feed(line)
+            renderer.submit(validator, sent.append)
+            await asyncio.sleep(0)
+        gate.set()
+        await renderer.drain()
+
+    asyncio.run(main())
+    assert len(sent) == 1 and sent[0]["type"] == "snapshot"
+    assert render_threads and threading.main_thread() not in render_threads
+    assert renderer.skipped > 0
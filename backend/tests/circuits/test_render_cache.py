@@ -0,0 +1,43 @@
+import gzip
+
+from app.circuits.render_cache import (
+    COMPRESSORS,
+    RenderedEntry,
+    parse_accept_encoding,
+)
+
+SVG = ("<svg>" + '<path class="wire" d="M0 0h10"/>' * 200 + "</svg>").encode()
+
+
+def test_parse_accept_encoding() -> None:
+    assert parse_accept_encoding("gzip, deflate, br;q=0.5, *;q=0") == {
+        "gzip": 1.0,
+        "deflate": 1.0,
+        "br": 0.5,
+        "*": 0.0,
+    }
+    assert parse_accept_encoding(None) == {}
+    assert parse_accept_encoding("gzip;q=x") == {"gzip": 0.0}
+
+
+def test_entry_stores_compressed_variants_once() -> None:
+    entry = RenderedEntry.create("image/svg+xml", SVG, {"X-Test": "1"})
+    assert set(entry.encoded) == set(COMPRESSORS)
+    assert gzip.decompress(entry.encoded["gzip"]) == SVG
+    assert all(len(data) < len(SVG) for data in entry.encoded.values())
+
+    # 圧縮済みの形式と小さい応答は圧縮しない
+    assert RenderedEntry.create("image/png", SVG).encoded == {}
+    assert RenderedEntry.create("image/svg+xml", b"<svg/>").encoded == {}
+
+
+def test_entry_negotiates_encoding() -> None:
+    entry = RenderedEntry.create("image/svg+xml", SVG)
+    assert entry.negotiate(None) == (None, SVG)
+    assert entry.negotiate("identity") == (None, SVG)
+    assert entry.negotiate("gzip") == ("gzip", entry.encoded["gzip"])
+    assert entry.negotiate("gzip;q=0, deflate") == (None, SVG)
+    if "br" in entry.encoded:
+        assert entry.negotiate("gzip, br") == ("br", entry.encoded["br"])
+        assert entry.negotiate("gzip, br;q=0.5") == ("gzip", entry.encoded["gzip"])
+        assert entry.negotiate("*") == ("br", entry.encoded["br"])
@@ -0,0 +1,100 @@
+import time
+from collections.abc import AsyncIterator
+
+import numpy as np
+from sqlmodel import Session
+
+from app.circuits.engines import TextAIEngine
+from app.circuits.retrieval import (
+    EMBEDDING_DIM,
+    VectorIndex,
+    circuit_terms,
+    embed,
+    query_terms,
+    retrieval_index,
+)
+from tests.utils.circuit import (
+    LED_CIRCUIT_YAML,
+    create_random_circuit_definition,
+    grid_circuit_yaml,
+)
+
+
+class _EchoEngine(TextAIEngine):
+    name = "echo"
+
+    async def complete(self, prompt: str) -> AsyncIterator[str]:
+        yield prompt
+
+
+def _unit_vectors(n: int) -> np.ndarray:
+    vectors = np.random.default_rng(0).standard_normal((n, EMBEDDING_DIM))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def test_embed_is_normalized_and_ranks_related_text() -> None:
+    led = embed(circuit_terms("LED blinker", "LEDを点滅させる", ["led", "resistor"]))
+    motor = embed(circuit_terms("Motor driver", "DCモーターの駆動", ["motor"]))
+    query = embed(query_terms("LEDを点滅させる回路"))
+    assert np.isclose(np.linalg.norm(led), 1.0)
+    assert float(query @ led) > float(query @ motor)
+    assert not embed({}).any()
+
+
+def test_vector_index_matches_brute_force() -> None:
+    vectors = _unit_vectors(3000)
+    index: VectorIndex[int] = VectorIndex(capacity=16)
+    for i, vector in enumerate(vectors):
+        index.insert(i, vector)
+    for i in range(0, 3000, 2):
+        index.remove(i)
+    assert len(index) == 1500 and 1 in index and 0 not in index
+
+    queries = _unit_vectors(4)
+    results = index.search(queries, 5)
+    for query, result in zip(queries, results, strict=True):
+        scores = vectors[1::2] @ query
+        expected = [2 * int(i) + 1 for i in np.argsort(-scores)[:5]]
+        assert [key for key, _ in result] == expected
+
+    accepted = index.search(queries[:1], 5, accept=lambda key: key % 3 == 0)[0]
+    assert len(accepted) == 5 and all(key % 3 == 0 for key, _ in accepted)
+    assert index.search(queries[:1], 5, accept=lambda _: False) == [[]]
+
+
+def test_vector_index_search_is_fast_at_100k() -> None:
+    vectors = _unit_vectors(100_000)
+    index: VectorIndex[int] = VectorIndex(capacity=len(vectors))
+    for i, vector in enumerate(vectors):
+        index.insert(i, vector)
+    query = embed(query_terms("LED and resistor"))[np.newaxis]
+    index.search(query, 5)
+    start = time.perf_counter()
+    for _ in range(10):
+        index.search(query, 5)
+    # 目標は数ミリ秒。CI の揺らぎを見込んで余裕を持たせる
+    assert (time.perf_counter() - start) / 10 < 0.05
+
+
+def test_text_engine_picks_examples(db: Session) -> None:
+    led = create_random_circuit_definition(db)
+    grid = create_random_circuit_definition(db, grid_circuit_yaml(3, 2))
+    engine = _EchoEngine()
+
+    examples = engine.examples(
+        db, "モジュールと分岐配線を含む回路", owner_id=led.owner_id
+    )
+    assert [example.circuit_yaml for example in examples] == [LED_CIRCUIT_YAML]
+    assert engine.examples(db, "grid", owner_id=led.owner_id) == []
+    assert engine.examples(db, "grid", owner_id=grid.owner_id)[0].name == ("grid")
+
+    prompt = engine.prompt("LEDを光らせる", examples)
+    assert "Example: " in prompt and prompt.endswith("Request: LEDを光らせる")
+
+    db.delete(led)
+    db.commit()
+    assert (
+        engine.examples(db, "モジュールと分岐配線を含む回路", owner_id=led.owner_id)
+        == []
+    )
+    assert led.id not in retrieval_index.index
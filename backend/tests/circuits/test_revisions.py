@@ -0,0 +1,90 @@
+import random
+
+from app.circuits.loader import load_circuit_yaml
+from app.circuits.revisions import (
+    CircuitState,
+    compose_deltas,
+    diff_documents,
+    invert_delta,
+    summarize_delta,
+)
+from tests.utils.circuit import LED_CIRCUIT_YAML
+
+
+def _apply(document: dict, *deltas: dict) -> dict:
+    state = CircuitState(document)
+    for delta in deltas:
+        state.apply(delta)
+    return state.to_document()
+
+
+def _edited() -> dict:
+    document = load_circuit_yaml(LED_CIRCUIT_YAML)
+    circuit = document["circuit"]
+    circuit["name"] = "Edited"
+    circuit["components"][-1]["properties"]["color"] = "green"
+    circuit["components"].append({"id": "c1", "type": "capacitor"})
+    circuit["connections"].pop(0)
+    circuit["connections"].append(
+        {"from": {"component_id": "c1"}, "to": {"component_id": "junction_A"}}
+    )
+    return document
+
+
+def test_diff_and_apply_round_trip() -> None:
+    old, new = load_circuit_yaml(LED_CIRCUIT_YAML), _edited()
+    delta = diff_documents(old, new)
+    assert _apply(old, delta) == new
+    assert _apply(new, invert_delta(delta)) == old
+    assert diff_documents(new, new) == {}
+
+
+def test_diff_keeps_null_values_and_order() -> None:
+    old = {
+        "circuit": {"components": [{"id": "a", "type": "r"}, {"id": "b", "type": "r"}]}
+    }
+    new = {
+        "circuit": {
+            "description": None,
+            "components": [{"id": "b", "type": "r", "properties": {"value": None}}]
+            + [{"id": "a", "type": "r"}],
+        }
+    }
+    delta = diff_documents(old, new)
+    assert delta["order"]["components"]["new"] == ["b", "a"]
+    assert _apply(old, delta)["circuit"]["components"] == new["circuit"]["components"]
+    assert _apply(old, delta)["circuit"]["description"] is None
+
+
+def test_compose_deltas() -> None:
+    rng = random.Random(0)
+    documents = [load_circuit_yaml(LED_CIRCUIT_YAML)]
+    for i in range(10):
+        document = load_circuit_yaml(LED_CIRCUIT_YAML)
+        components = document["circuit"]["components"]
+        components[-1]["properties"]["color"] = rng.choice(["red", "green", "blue"])
+        if i % 3:
+            components.append({"id": f"r{i}", "type": "resistor"})
+        documents.append(document)
+    deltas = [
+        diff_documents(a, b) for a, b in zip(documents, documents[1:], strict=False)
+    ]
+
+    composed = compose_deltas(deltas)
+    assert _apply(documents[0], composed) == documents[-1]
+    assert _apply(documents[0], *deltas) == documents[-1]
+    assert _apply(documents[-1], invert_delta(composed)) == documents[0]
+
+
+def test_summarize_delta() -> None:
+    summary = summarize_delta(
+        diff_documents(load_circuit_yaml(LED_CIRCUIT_YAML), _edited())
+    )
+    assert summary["circuit"]["name"]["new"] == "Edited"
+    assert summary["components"]["added"] == ["c1"]
+    assert summary["components"]["removed"] == []
+    assert summary["components"]["changed"] == {
+        "external_led_1": {"properties.color": {"old": "blue", "new": "green"}}
+    }
+    assert len(summary["connections"]["added"]) == 1
+    assert len(summary["connections"]["removed"]) == 1
@@ -0,0 +1,29 @@
+import numpy as np
+
+from app.circuits.spatial import SpatialIndex
+
+
+def test_spatial_index_matches_brute_force() -> None:
+    rng = np.random.default_rng(0)
+    origins = rng.uniform(0, 1000, size=(2000, 2))
+    sizes = rng.uniform(1, 50, size=(2000, 2))
+    boxes = np.concatenate([origins, origins + sizes], axis=1)
+    index = SpatialIndex([tuple(b) for b in boxes])
+    assert len(index) == 2000
+
+    for x0, y0 in rng.uniform(-100, 1000, size=(20, 2)):
+        query = (x0, y0, x0 + 150, y0 + 80)
+        expected = np.flatnonzero(
+            (boxes[:, 0] <= query[2])
+            & (boxes[:, 2] >= query[0])
+            & (boxes[:, 1] <= query[3])
+            & (boxes[:, 3] >= query[1])
+        )
+        assert index.query(query).tolist() == expected.tolist()
+
+
+def test_spatial_index_small() -> None:
+    assert SpatialIndex([]).query((0, 0, 1, 1)).tolist() == []
+    index = SpatialIndex([(0, 0, 1, 1)])
+    assert index.query((0.5, 0.5, 2, 2)).tolist() == [0]
+    assert index.query((2, 2, 3, 3)).tolist() == []
@@ -0,0 +1,69 @@
+import asyncio
+from collections.abc import Iterator
+
+import pytest
+
+from app.circuits import timing
+from app.circuits.compiler import compile_circuit
+from app.circuits.layout import compute_layout
+from app.circuits.loader import load_circuit_yaml
+from app.circuits.timing import Histogram, histograms, record_timings, span
+from tests.utils.circuit import LED_CIRCUIT_YAML
+
+
+@pytest.fixture(autouse=True)
+def _histograms() -> Iterator[None]:
+    histograms.clear()
+    yield
+    histograms.clear()
+
+
+def test_histogram_quantiles() -> None:
+    histogram = Histogram(buckets=(0.001, 0.01, 0.1))
+    for seconds in [0.0005] * 90 + [0.05] * 9 + [1.0]:
+        histogram.observe(seconds)
+    assert histogram.count == 100
+    assert histogram.quantile(0.5) == 0.001
+    assert histogram.quantile(0.95) == 0.1
+    assert histogram.quantile(1.0) == 0.1
+    assert Histogram().quantile(0.5) == 0.0
+
+
+def test_nested_spans_count_own_time() -> None:
+    with record_timings() as timings:
+        compute_layout(compile_circuit(load_circuit_yaml(LED_CIRCUIT_YAML)))
+    assert list(timings.durations) == ["parse", "validate", "routing", "layout"]
+    assert all(seconds > 0 for seconds in timings.durations.values())
+    assert "routing;dur=" in timings.server_timing()
+
+    # 外側のスパンからは内側のスパンの時間を除く
+    with record_timings() as timings:
+        with span("outer"):
+            with span("inner"):
+                sum(range(100_000))
+    assert timings.durations["outer"] < timings.durations["inner"]
+
+    names = [m["name"] for m in histograms.metrics()]
+    assert names[:4] == ["parse", "validate", "layout", "routing"]
+
+
+def test_spans_in_tasks_share_the_request_timings() -> None:
+    async def stage(name: str) -> None:
+        with span(name):
+            await asyncio.sleep(0.01)
+
+    async def main() -> dict[str, float]:
+        with record_timings() as timings:
+            await asyncio.gather(stage("engine"), stage("engine"))
+        return timings.durations
+
+    assert asyncio.run(main())["engine"] >= 0.02
+
+
+def test_disabled_spans_record_nothing(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(timing, "enabled", False)
+    with record_timings() as timings:
+        with span("layout"):
+            pass
+    assert not timings.durations and not histograms.metrics()
+    assert span("a") is span("b")
@@ -0,0 +1,29 @@
+import pytest
+
+from app.circuits.units import parse_quantity
+
+
+@pytest.mark.parametrize(
+    ("raw", "unit", "expected"),
+    [
+        ("220ohm", "ohm", 220.0),
+        ("4.7kΩ", "ohm", 4700.0),
+        ("1M", "ohm", 1e6),
+        ("1meg", "ohm", 1e6),
+        ("5V", "V", 5.0),
+        ("3.3 V", "V", 3.3),
+        ("10mA", "A", 0.01),
+        ("2.2uF", "F", 2.2e-6),
+        ("100nF", "F", 1e-7),
+        (12, "V", 12.0),
+        ("1e3", "ohm", 1000.0),
+    ],
+)
+def test_parse_quantity(raw: object, unit: str, expected: float) -> None:
+    assert parse_quantity(raw, unit) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("raw", ["", "abc", "5V", "1kHz", True])
+def test_parse_quantity_invalid(raw: object) -> None:
+    with pytest.raises(ValueError):
+        parse_quantity(raw, "ohm")
@@ -0,0 +1,153 @@
+import asyncio
+import uuid
+from collections.abc import AsyncIterator
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlmodel import Session
+
+from app import crud
+from app.circuits.generation import generate_from_text
+from app.circuits.usage import (
+    QuotaExceeded,
+    UsageMeter,
+    attribute_usage,
+    report_usage,
+)
+from tests.utils.engines import ScriptedEngine
+from tests.utils.user import create_random_user
+
+NOW = datetime(2026, 5, 1, 12, 30, 15, tzinfo=timezone.utc)
+TWO_RESISTORS = (
+    "circuit:\n  components:\n    - {id: r1, type: resistor}\n"
+    "    - {id: r2, type: resistor}\n"
+)
+
+
+def _no_usage(_user_id: uuid.UUID, _since: datetime) -> tuple[int, int]:
+    return 0, 0
+
+
+class ReportingEngine(ScriptedEngine):
+    async def complete(self, prompt: str) -> AsyncIterator[str]:
+        async for chunk in super().complete(prompt):
+            yield chunk
+        report_usage(100, 20, cached_tokens=64)
+
+
+def test_meter_aggregates_calls_per_user_engine_and_window() -> None:
+    meter = UsageMeter(clock=lambda: NOW)
+    user_id = uuid.uuid4()
+    engine = ReportingEngine(TWO_RESISTORS, TWO_RESISTORS)
+
+    async def main() -> None:
+        with attribute_usage(user_id):
+            await generate_from_text(engine, "two resistors")
+        # ユーザーに数えない呼び出しは記録しない
+        await generate_from_text(ScriptedEngine(TWO_RESISTORS), "two resistors")
+
+    with pytest.MonkeyPatch.context() as m:
+        m.setattr("app.circuits.generation.usage_meter", meter)
+        asyncio.run(main())
+
+    pending = meter.take_pending()
+    assert list(pending) == [(user_id, "scripted", NOW.replace(second=0))]
+    totals = pending[(user_id, "scripted", NOW.replace(second=0))]
+    assert totals.calls == 1 and totals.errors == 0
+    assert (totals.prompt_tokens, totals.completion_tokens) == (100, 20)
+    assert totals.cache_hits == 1 and totals.cached_tokens == 64
+    assert totals.estimated == 0 and totals.latency_max > 0
+
+
+def test_meter_estimates_unreported_tokens() -> None:
+    meter = UsageMeter(clock=lambda: NOW)
+    user_id = uuid.uuid4()
+    with attribute_usage(user_id):
+        with meter.call("plain", "x" * 10) as call:
+            call.received("y" * 7)
+        with pytest.raises(RuntimeError):
+            with meter.call("plain", "") as call:
+                raise RuntimeError
+    (totals,) = meter.take_pending().values()
+    assert (totals.prompt_tokens, totals.completion_tokens) == (3, 2)
+    assert totals.calls == 2 and totals.errors == 1 and totals.estimated == 2
+
+
+def test_daily_quota() -> None:
+    loads = []
+
+    def load(_user_id: uuid.UUID, since: datetime) -> tuple[int, int]:
+        loads.append(since)
+        return 1, 0
+
+    meter = UsageMeter(daily_generations=2, clock=lambda: NOW)
+    user_id = uuid.uuid4()
+    meter.admit(user_id, "scripted", load)
+    with pytest.raises(QuotaExceeded) as exc_info:
+        meter.admit(user_id, "scripted", load)
+    assert exc_info.value.status_code == 429
+    assert exc_info.value.headers == {"Retry-After": str(11 * 3600 + 29 * 60 + 45)}
+    # スーパーユーザーなどは上限なしで数える
+    meter.admit(user_id, "scripted", load, limited=False)
+    assert loads == [NOW.replace(hour=0, minute=0, second=0)]
+
+    meter = UsageMeter(daily_tokens=50, clock=lambda: NOW)
+    meter.admit(user_id, "scripted", _no_usage)
+    with attribute_usage(user_id):
+        with meter.call("scripted", "x" * 200):
+            pass
+    with pytest.raises(QuotaExceeded):
+        meter.admit(user_id, "scripted", _no_usage)
+
+
+def test_refund_does_not_count_the_generation(db: Session) -> None:
+    meter = UsageMeter(daily_generations=1, clock=lambda: NOW)
+    user = create_random_user(db)
+    admitted = meter.admit(user.id, "scripted", _no_usage)
+    meter.refund(admitted)
+    admitted = meter.admit(user.id, "scripted", _no_usage)
+    with pytest.raises(QuotaExceeded):
+        meter.admit(user.id, "scripted", _no_usage)
+
+    # 書き出した後の取り消しは -1 として足し合わせる
+    assert meter.flush(db) == 1
+    meter.refund(admitted)
+    assert meter.flush(db) == 1
+    assert crud.get_user_usage_since(
+        session=db, user_id=user.id, since=NOW - timedelta(days=1)
+    ) == (0, 0)
+
+
+def test_flush_restores_pending_on_failure(db: Session) -> None:
+    meter = UsageMeter(clock=lambda: NOW)
+    user = create_random_user(db)
+    meter.admit(user.id, "scripted", _no_usage)
+
+    with pytest.MonkeyPatch.context() as m:
+
+        def fail(**_: object) -> None:
+            raise RuntimeError("database is down")
+
+        m.setattr(crud, "add_circuit_engine_usage", fail)
+        with pytest.raises(RuntimeError):
+            meter.flush(db)
+    assert meter.flushed_rows == 0
+
+    # 同じ区間の行には足し合わせる
+    meter.admit(user.id, "scripted", _no_usage, limited=False)
+    assert meter.flush(db) == 1
+    meter.admit(user.id, "scripted", _no_usage, limited=False)
+    assert meter.flush(db) == 1
+    assert meter.flush(db) == 0
+    assert crud.get_user_usage_since(
+        session=db, user_id=user.id, since=NOW - timedelta(days=1)
+    ) == (3, 0)
+    (row,) = crud.get_circuit_engine_usage(
+        session=db,
+        start=NOW - timedelta(hours=1),
+        end=NOW + timedelta(hours=1),
+        window="hour",
+        user_id=user.id,
+    )
+    assert row["generations"] == 3
+    assert row["window_start"] == NOW.replace(minute=0, second=0)
@@ -0,0 +1,56 @@
+from pathlib import Path
+
+from sqlmodel import Session
+
+from app.circuits.compiler import compile_circuit
+from app.circuits.layout import layout_cache, layout_variant
+from app.circuits.loader import load_circuit_yaml
+from app.circuits.render_cache import render_cache, render_key
+from app.circuits.warmup import EXAMPLES_DIR, Warmup, example_paths, preload_modules
+from app.core.db import engine
+
+
+def test_example_paths(tmp_path: Path) -> None:
+    bundled = example_paths(["*"])
+    assert bundled and all(p.parent == EXAMPLES_DIR for p in bundled)
+    custom = tmp_path / "gallery.yaml"
+    assert example_paths(["voltage_divider", str(custom), "*"])[:2] == [
+        EXAMPLES_DIR / "voltage_divider.yaml",
+        custom,
+    ]
+    assert len(example_paths(["*", "voltage_divider"])) == len(bundled)
+    assert preload_modules(["app.circuits.formatters.svg", "no_such_module"]) == [
+        "app.circuits.formatters.svg"
+    ]
+
+
+def test_warm_up_fills_caches_and_skips_broken_examples(tmp_path: Path) -> None:
+    broken = tmp_path / "broken.yaml"
+    broken.write_text("circuit: [")
+    path = EXAMPLES_DIR / "rc_lowpass.yaml"
+    compiled = compile_circuit(load_circuit_yaml(path.read_text()))
+    variant = layout_variant("grid", False)
+    layout_cache.clear()
+    render_cache.clear()
+
+    warmup = Warmup()
+    assert not warmup.ready and warmup.seconds is None
+    warmup.run([str(broken), str(path)], ["light", "dark"], lambda: Session(engine))
+    assert warmup.ready
+    assert (warmup.total, warmup.done, warmup.failed) == (2, 1, 1)
+    assert (compiled.definition_hash, variant) in layout_cache
+    for theme in ("light", "dark"):
+        entry = render_cache.get(
+            render_key(compiled.definition_hash, variant, theme=theme)
+        )
+        assert entry is not None and entry.media_type == "image/svg+xml"
+
+    # 途中で止めると残りの例を飛ばす
+    def stopping_session() -> Session:
+        warmup.stop()
+        return Session(engine)
+
+    warmup.run(["*"], ["light"], stopping_session)
+    assert warmup.ready
+    assert warmup.total == len(example_paths(["*"]))
+    assert (warmup.done, warmup.failed) == (1, 0)
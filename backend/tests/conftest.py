@@ -1,3 +1,4 @@
+import time
 from collections.abc import Generator
 
 import pytest
@@ -27,6 +28,10 @@ def db() -> Generator[Session, None, None]:
 @pytest.fixture(scope="module")
 def client() -> Generator[TestClient, None, None]:
     with TestClient(app) as c:
+        # Wait for the start-up warm-up, as a load balancer would, so that it
+        # does not race tests that count cache hits
+        while c.get(f"{settings.API_V1_STR}/utils/ready/").status_code == 503:
+            time.sleep(0.01)
         yield c
 
 
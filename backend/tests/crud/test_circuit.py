@@ -0,0 +1,31 @@
+from sqlmodel import Session
+
+from app import crud
+from app.circuits.compiler import compile_circuit
+from app.circuits.loader import load_circuit_yaml
+from app.core.db import engine
+from app.models import CircuitDefinition
+from tests.utils.circuit import LED_CIRCUIT_YAML, create_random_circuit_definition
+
+
+def _update(session: Session, definition: CircuitDefinition, color: str) -> int:
+    circuit_yaml = LED_CIRCUIT_YAML.replace('color: "blue"', f'color: "{color}"')
+    document = load_circuit_yaml(circuit_yaml)
+    return crud.update_circuit_definition(
+        session=session,
+        db_definition=definition,
+        circuit_yaml=circuit_yaml,
+        document=document,
+        compiled=compile_circuit(document),
+    ).revision
+
+
+def test_update_circuit_definition_with_stale_row(db: Session) -> None:
+    definition_id = create_random_circuit_definition(db).id
+    with Session(engine) as first, Session(engine) as second:
+        stale = first.get(CircuitDefinition, definition_id)
+        current = second.get(CircuitDefinition, definition_id)
+        assert stale is not None and current is not None
+        assert _update(second, current, "green") == 2
+        # 先に読んだ行の revision は古いが、番号は重ならない
+        assert _update(first, stale, "red") == 3
@@ -0,0 +1,97 @@
+from sqlmodel import Session
+
+from app import crud
+from app.circuits.compiler import compile_circuit
+from app.circuits.loader import load_circuit_yaml
+from app.models import CircuitDefinition
+from tests.utils.user import create_random_user
+
+LED_CIRCUIT_YAML = """
+circuit:
+  name: "Complex Circuit with Modules and Branching"
+  description: "モジュールと分岐配線を含む回路の例"
+  components:
+    - id: "power_supply_1"
+      type: "power_supply"
+      properties:
+        voltage: "5V"
+        position: { x: 50, y: 50 }
+        ports:
+          - name: "VCC"
+            direction: "output"
+          - name: "GND"
+            direction: "output"
+    - id: "junction_A"
+      type: "junction"
+      properties:
+        position: { x: 150, y: 70 }
+    - id: "led_driver_module_1"
+      type: "module"
+      properties:
+        name: "LED Driver Module"
+        position: { x: 250, y: 100 }
+        ports:
+          - name: "input_power"
+            direction: "input"
+          - name: "output_led_anode"
+            direction: "output"
+      internal_components:
+        - id: "resistor_internal_1"
+          type: "resistor"
+          properties:
+            resistance: "220ohm"
+            position: { x: 30, y: 20 }
+      internal_connections:
+        - from: { component_id: "led_driver_module_1", port: "input_power" }
+          to: { component_id: "resistor_internal_1", terminal: "any" }
+        - from: { component_id: "resistor_internal_1", terminal: "other" }
+          to: { component_id: "led_driver_module_1", port: "output_led_anode" }
+    - id: "external_led_1"
+      type: "led"
+      properties:
+        color: "blue"
+        position: { x: 350, y: 150 }
+  connections:
+    - from: { component_id: "power_supply_1", port: "VCC" }
+      to: { component_id: "junction_A", terminal: "any" }
+    - from: { component_id: "junction_A", terminal: "any" }
+      to: { component_id: "led_driver_module_1", port: "input_power" }
+    - from: { component_id: "led_driver_module_1", port: "output_led_anode" }
+      to: { component_id: "external_led_1", terminal: "anode" }
+    - from: { component_id: "external_led_1", terminal: "cathode" }
+      to: { component_id: "power_supply_1", port: "GND" }
+"""
+
+
+def grid_circuit_yaml(columns: int, rows: int, spacing: int = 100) -> str:
+    """抵抗を格子状に並べ、行ごとに直列につないだ回路"""
+    components = "\n".join(
+        f"    - {{id: r{x}_{y}, type: resistor, "
+        f"properties: {{position: {{x: {x * spacing}, y: {y * spacing}}}}}}}"
+        for y in range(rows)
+        for x in range(columns)
+    )
+    connections = "\n".join(
+        f"    - from: {{component_id: r{x}_{y}, terminal: b}}\n"
+        f"      to: {{component_id: r{x + 1}_{y}, terminal: a}}"
+        for y in range(rows)
+        for x in range(columns - 1)
+    )
+    return (
+        f"circuit:\n  name: grid\n  components:\n{components}\n"
+        f"  connections:\n{connections}\n"
+    )
+
+
+def create_random_circuit_definition(
+    db: Session, circuit_yaml: str = LED_CIRCUIT_YAML
+) -> CircuitDefinition:
+    user = create_random_user(db)
+    document = load_circuit_yaml(circuit_yaml)
+    return crud.create_circuit_definition(
+        session=db,
+        circuit_yaml=circuit_yaml,
+        document=document,
+        compiled=compile_circuit(document),
+        owner_id=user.id,
+    )
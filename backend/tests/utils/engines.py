@@ -0,0 +1,100 @@
+import asyncio
+import math
+import random
+from collections.abc import AsyncIterator, Callable
+
+from app.circuits.engines import EngineError, TextAIEngine
+
+
+class ScriptedEngine(TextAIEngine):
+    """呼び出しごとに決まった応答を1行ずつ返すエンジン"""
+
+    name = "scripted"
+
+    def __init__(self, *responses: str) -> None:
+        self.responses = list(responses)
+        self.prompts: list[str] = []
+        self.sent = 0
+        self.closed = 0
+
+    async def complete(self, prompt: str) -> AsyncIterator[str]:
+        self.prompts.append(prompt)
+        try:
+            for line in self.responses.pop(0).splitlines(keepends=True):
+                self.sent += 1
+                yield line
+        finally:
+            self.closed += 1
+
+
+def lognormal(median: float, sigma: float, seed: int = 0) -> Callable[[], float]:
+    """中央値 `median` 秒の対数正規分布に従う待ち時間"""
+    rng = random.Random(seed)
+    return lambda: median * rng.lognormvariate(0.0, sigma)
+
+
+class FakeClock:
+    """テストで進める時計"""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class LatencyEngine(TextAIEngine):
+    """
+    最初の断片までの待ち時間を分布から引いて、同じ応答を1行ずつ返すエンジン
+
+    `clock` を渡すと待つ代わりにその時計を進める。待ち時間が `math.inf` なら
+    取り消されるまで応答しない。`gate` を渡すとそれが立つまで応答しない。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        response: str,
+        first_chunk: Callable[[], float],
+        chunk_delay: float = 0.0,
+        fail: bool = False,
+        clock: FakeClock | None = None,
+        gate: asyncio.Event | None = None,
+    ) -> None:
+        self.name = name
+        self.response = response
+        self.first_chunk = first_chunk
+        self.chunk_delay = chunk_delay
+        self.fail = fail
+        self.clock = clock
+        self.gate = gate
+        self.called = asyncio.Event()
+        self.calls = 0
+        self.completed = 0
+        self.cancelled = 0
+
+    async def _wait(self, delay: float) -> None:
+        if math.isinf(delay):
+            await asyncio.get_running_loop().create_future()
+        if self.clock is not None:
+            self.clock.now += delay
+            await asyncio.sleep(0)
+        else:
+            await asyncio.sleep(delay)
+
+    async def complete(self, prompt: str) -> AsyncIterator[str]:
+        self.calls += 1
+        self.called.set()
+        try:
+            if self.gate is not None:
+                await self.gate.wait()
+            await self._wait(self.first_chunk())
+            if self.fail:
+                raise EngineError(f"{self.name} failed")
+            for line in self.response.splitlines(keepends=True):
+                yield line
+                await self._wait(self.chunk_delay)
+            self.completed += 1
+        except (asyncio.CancelledError, GeneratorExit):
+            self.cancelled += 1
+            raise
@@ -0,0 +1,196 @@
+"""
+ベンチマーク用の大きな回路を決まった手順で作る
+
+部品はネット (接続点) の間に置く2端子の素子として作る。最初の部品は電池で、
+部品を順にネットの輪に並べて全体を1つにつなぎ、残りの部品は近くのネットの間に
+置く。どのネットにも `fanout` 個より多くの端子はつながない。`module_depth` を
+指定すると部品を `module_branching` 個ずつのモジュールに入れ子にして分け、
+モジュールをまたぐネットはモジュールのポートを通してつなぐ。
+同じ `SyntheticSpec` (シード) からは常に同じ回路定義ができる。
+"""
+
+import random
+from dataclasses import dataclass
+from typing import Any
+
+import yaml
+
+try:
+    from yaml import CSafeDumper as SafeDumper
+except ImportError:  # libyaml が無い環境では純Python実装にフォールバック
+    from yaml import SafeDumper  # type: ignore[assignment]
+
+# 部品の種類 -> (IDの接頭辞, 端子名, 値のプロパティ, 値の候補)
+PART_KINDS: list[tuple[str, str, tuple[str, str], str, tuple[str, ...]]] = [
+    ("resistor", "r", ("a", "b"), "resistance", ("220ohm", "1kohm", "10kohm")),
+    ("capacitor", "c", ("a", "b"), "capacitance", ("100nF", "1uF", "10uF")),
+    ("inductor", "l", ("a", "b"), "inductance", ("1mH", "10mH")),
+    ("diode", "d", ("anode", "cathode"), "model", ("1N4148",)),
+    ("led", "led", ("anode", "cathode"), "color", ("red", "green", "blue")),
+]
+# 部品の両端をつなぐネットを選ぶ範囲 (近くのネットどうしをつなぐ)
+NET_WINDOW = 4
+
+
+@dataclass(frozen=True)
+class SyntheticSpec:
+    """作る回路の大きさ。`nets` を省略すると部品数の半分"""
+
+    parts: int
+    nets: int | None = None
+    module_depth: int = 0
+    module_branching: int = 4
+    fanout: int = 6
+    seed: int = 0
+
+    @property
+    def net_count(self) -> int:
+        return self.nets if self.nets is not None else max(2, self.parts // 2)
+
+
+Scope = tuple[int, ...]
+
+
+def _scope_of(index: int, spec: SyntheticSpec) -> Scope:
+    # 電池 (0番) はトップレベルに置き、残りの部品を連続した範囲ごとにモジュールへ分ける
+    if index == 0 or not spec.module_depth:
+        return ()
+    scope: list[int] = []
+    lo, hi = 1, spec.parts
+    for _ in range(spec.module_depth):
+        step = -(-(hi - lo) // spec.module_branching)
+        child = (index - lo) // step
+        scope.append(child)
+        lo, hi = lo + child * step, min(hi, lo + (child + 1) * step)
+    return tuple(scope)
+
+
+def _module_id(scope: Scope) -> str:
+    return "m" + "_".join(map(str, scope))
+
+
+def _assign_nets(spec: SyntheticSpec, rng: random.Random) -> list[tuple[int, int]]:
+    """部品ごとに、両端をつなぐ2つのネットを選ぶ"""
+    nets = spec.net_count
+    if nets < 2 or nets > spec.parts:
+        raise ValueError("need at least 2 nets and no more nets than parts")
+    if spec.fanout < 2 or 2 * spec.parts > nets * spec.fanout:
+        raise ValueError(f"{spec.parts} parts do not fit {nets} nets of {spec.fanout}")
+    degree = [0] * nets
+    ends: list[tuple[int, int]] = []
+    for i in range(spec.parts):
+        if i < nets:
+            # 部品の輪で全部のネットをつなぐ (どのネットにも2つ以上の端子がある)
+            u, v = i, (i + 1) % nets
+        else:
+            center = (i * nets) // spec.parts
+            candidates = [
+                n
+                for n in range(center - NET_WINDOW, center + NET_WINDOW + 1)
+                if 0 <= n < nets and degree[n] < spec.fanout
+            ]
+            if len(candidates) < 2:
+                candidates = [n for n in range(nets) if degree[n] < spec.fanout]
+            u, v = rng.sample(candidates, 2)
+        degree[u] += 1
+        degree[v] += 1
+        ends.append((u, v))
+    return ends
+
+
+def synthetic_circuit(spec: SyntheticSpec) -> dict[str, Any]:
+    """`spec` の大きさの回路定義 (`load_circuit_yaml` の戻り値と同じ形) を作る"""
+    rng = random.Random(spec.seed)
+    ends = _assign_nets(spec, rng)
+
+    # スコープ (モジュールのパス) -> そのスコープの部品と接続
+    components: dict[Scope, list[dict[str, Any]]] = {(): []}
+    connections: dict[Scope, list[dict[str, Any]]] = {(): []}
+    ports: dict[Scope, list[dict[str, str]]] = {}
+
+    def scope(path: Scope) -> None:
+        if path in components:
+            return
+        scope(path[:-1])
+        components[path], connections[path], ports[path] = [], [], []
+        components[path[:-1]].append(
+            {
+                "id": _module_id(path),
+                "type": "module",
+                "properties": {
+                    "name": f"Block {_module_id(path)}",
+                    "ports": ports[path],
+                },
+                "internal_components": components[path],
+                "internal_connections": connections[path],
+            }
+        )
+
+    net_pins: list[list[tuple[Scope, dict[str, str]]]] = [
+        [] for _ in range(spec.net_count)
+    ]
+    for i, (u, v) in enumerate(ends):
+        path = _scope_of(i, spec)
+        scope(path)
+        if i == 0:
+            kind, prefix, terminals = "battery", "bat", ("positive", "negative")
+            properties: dict[str, Any] = {"voltage": "9V"}
+        else:
+            kind, prefix, terminals, key, values = rng.choice(PART_KINDS)
+            properties = {key: rng.choice(values)}
+        part_id = f"{prefix}{i}"
+        components[path].append({"id": part_id, "type": kind, "properties": properties})
+        for net, terminal in zip((u, v), terminals, strict=True):
+            net_pins[net].append(
+                (path, {"component_id": part_id, "terminal": terminal})
+            )
+
+    exported: set[tuple[Scope, int]] = set()
+    for net, pins in enumerate(net_pins):
+        # ネットの端子をすべて含む最も内側のスコープでつなぎ、内側の端子は
+        # モジュールのポート n<ネット番号> を通して引き出す
+        common = min(len(p) for p, _ in pins)
+        while any(p[:common] != pins[0][0][:common] for p, _ in pins):
+            common -= 1
+        outer = pins[0][0][:common]
+        endpoints: list[dict[str, str]] = []
+        for path, end in pins:
+            while len(path) > common:
+                port = f"n{net}"
+                connections[path].append(
+                    {
+                        "from": {"component_id": _module_id(path), "port": port},
+                        "to": end,
+                    }
+                )
+                end = {"component_id": _module_id(path), "port": port}
+                if (path, net) in exported:
+                    break
+                exported.add((path, net))
+                ports[path].append({"name": port, "direction": "inout"})
+                path = path[:-1]
+            else:
+                endpoints.append(end)
+        connections[outer].extend(
+            {"from": dict(a), "to": dict(b)}
+            for a, b in zip(endpoints, endpoints[1:], strict=False)
+        )
+
+    return {
+        "circuit": {
+            "name": f"Synthetic circuit ({spec.parts} parts)",
+            "description": (
+                f"nets={spec.net_count}, module_depth={spec.module_depth}, "
+                f"fanout={spec.fanout}, seed={spec.seed}"
+            ),
+            "components": components[()],
+            "connections": connections[()],
+        }
+    }
+
+
+def synthetic_circuit_yaml(spec: SyntheticSpec) -> str:
+    """`synthetic_circuit` の回路定義を回路YAMLとして書き出す"""
+    return yaml.dump(
+        synthetic_circuit(spec), Dumper=SafeDumper, sort_keys=False, allow_unicode=True
+    )
@@ -20,6 +20,7 @@ export default function HomePage() {
           method: "POST",
           headers: {
             "Content-Type": "application/json",
+            Authorization: `Bearer ${localStorage.getItem("access_token")}`,
           },
           body: JSON.stringify({ prompt: prompt }),
         },